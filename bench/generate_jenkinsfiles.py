@@ -0,0 +1,202 @@
+"""
+Synthetic Jenkinsfile corpus for benchmarks.
+
+Leaf stages are cut out of the seed Jenkinsfiles (jenkins_files/ by default) and
+reassembled into declarative pipelines of the requested sizes. Stage names and quoted
+literals are varied per file, the way shared-library stages differ between real
+projects, and a share of the stages is grouped into parallel blocks. Some files can be
+exact copies of earlier ones:
+
+    python bench/generate_jenkinsfiles.py --count 200 --min-stages 3 --max-stages 30 /tmp/corpus
+"""
+import os
+import re
+import sys
+import random
+import argparse
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_SEED_DIR = os.path.join(PROJECT_ROOT, 'jenkins_files')
+SEED_EXTENSIONS = ('.jenkinsfile', '.jenkins', '.groovy')
+_STAGE_RE = re.compile(r"""\bstage\s*\(\s*(['"])(.*?)\1\s*\)\s*\{""")
+_QUOTED_RE = re.compile(r"'([A-Za-z][\w.\-/]*)'")
+INDENT = "        "
+
+
+def _block_end(text, start):
+    """Index just past the brace that closes the block opened at text[start]."""
+    depth = 0
+    quote = None
+    index = start
+    while index < len(text):
+        char = text[index]
+        if quote:
+            if char == '\\':
+                index += 1
+            elif char == quote:
+                quote = None
+        elif text.startswith('//', index):
+            newline = text.find('\n', index)
+            index = len(text) if newline < 0 else newline
+            continue
+        elif char in ('"', "'"):
+            quote = char
+        elif char == '{':
+            depth += 1
+        elif char == '}':
+            depth -= 1
+            if depth == 0:
+                return index + 1
+        index += 1
+    return None
+
+
+def _dedent(block):
+    lines = block.splitlines()
+    indents = [len(line) - len(line.lstrip()) for line in lines[1:] if line.strip()]
+    strip = min(indents) if indents else 0
+    return "\n".join([lines[0].strip()] + [line[strip:] if line.strip() else "" for line in lines[1:]])
+
+
+def extract_stages(text):
+    """
+    Cut the leaf stages (stages with a steps block) out of a declarative Jenkinsfile.
+
+    :param text: Jenkinsfile content
+    :return: List of (name, body) where body is the text between the stage's braces
+    """
+    stages = []
+    for match in _STAGE_RE.finditer(text):
+        end = _block_end(text, match.end() - 1)
+        if end is None:
+            continue
+        body = text[match.end():end - 1]
+        if re.search(r'\bsteps\s*\{', body) and not re.search(r'\b(stages|parallel)\s*\{', body):
+            stages.append((match.group(2), _dedent("\n" + body.strip("\n")).strip("\n")))
+    return stages
+
+
+def load_seed_stages(seed_dir=DEFAULT_SEED_DIR):
+    """Leaf stages of every seed Jenkinsfile in a directory."""
+    stages = []
+    for entry in sorted(os.scandir(seed_dir), key=lambda e: e.name):
+        if entry.is_file() and entry.name.endswith(SEED_EXTENSIONS):
+            with open(entry.path, 'r') as seed_file:
+                stages.extend(extract_stages(seed_file.read()))
+    if not stages:
+        raise ValueError(f"No declarative stages found in {seed_dir}")
+    return stages
+
+
+def _indent(text, level):
+    return "\n".join(INDENT[:4 * level] + line if line.strip() else "" for line in text.splitlines())
+
+
+def _vary(body, rng, project):
+    """Change some quoted literals so equal stages differ the way they do between projects."""
+    def replace(match):
+        return f"'{match.group(1)}-{project}'" if rng.random() < 0.3 else match.group(0)
+    return _QUOTED_RE.sub(replace, body)
+
+
+def _stage(name, body, level):
+    return _indent(f"stage('{name}') {{\n{_indent(body, 1)}\n}}", level)
+
+
+def generate_jenkinsfile(stages, stage_count, rng, project, parallel_rate=0.2):
+    """
+    Assemble one declarative pipeline from seed stages.
+
+    :param stages: Seed stages from load_seed_stages
+    :param stage_count: Number of leaf stages in the pipeline
+    :param rng: random.Random instance
+    :param project: Short project name used to vary names and literals
+    :param parallel_rate: Probability that a position holds a parallel block of 2-3 stages
+    :return: Jenkinsfile text
+    """
+    blocks = []
+    remaining = stage_count
+    used = set()
+
+    def pick():
+        name, body = rng.choice(stages)
+        unique = f"{name} {project}"
+        suffix = 2
+        while unique in used:
+            unique = f"{name} {project} {suffix}"
+            suffix += 1
+        used.add(unique)
+        return unique, _vary(body, rng, project)
+
+    while remaining > 0:
+        if remaining >= 2 and rng.random() < parallel_rate:
+            width = min(remaining, rng.choice((2, 3)))
+            branches = "\n".join(_stage(*pick(), level=2) for _ in range(width))
+            blocks.append(_indent(f"stage('Parallel {len(blocks) + 1}') {{\n    parallel {{\n{branches}\n    }}\n}}", 2))
+            remaining -= width
+        else:
+            blocks.append(_stage(*pick(), level=2))
+            remaining -= 1
+    return ("pipeline {\n"
+            "    agent any\n"
+            "    options {\n"
+            "        timeout(time: 30, unit: 'MINUTES')\n"
+            "    }\n"
+            "    stages {\n"
+            + "\n".join(blocks) + "\n"
+            "    }\n"
+            "}\n")
+
+
+def generate_corpus(output_dir, count, min_stages=3, max_stages=12, seed_dir=DEFAULT_SEED_DIR,
+                    parallel_rate=0.2, duplicate_rate=0.0, seed=0):
+    """
+    Write a synthetic corpus of Jenkinsfiles.
+
+    :param output_dir: Directory to write <n>.jenkinsfile files to
+    :param count: Number of files
+    :param min_stages: Smallest number of leaf stages per file
+    :param max_stages: Largest number of leaf stages per file
+    :param seed_dir: Directory of seed Jenkinsfiles
+    :param parallel_rate: Probability of a parallel block at each position
+    :param duplicate_rate: Fraction of files that are exact copies of an earlier file
+    :param seed: Random seed; the same arguments always produce the same corpus
+    :return: List of written paths
+    """
+    rng = random.Random(seed)
+    stages = load_seed_stages(seed_dir)
+    os.makedirs(output_dir, exist_ok=True)
+    paths = []
+    contents = []
+    for index in range(count):
+        if contents and rng.random() < duplicate_rate:
+            content = rng.choice(contents)
+        else:
+            content = generate_jenkinsfile(stages, rng.randint(min_stages, max_stages), rng,
+                                           project=f"p{index}", parallel_rate=parallel_rate)
+            contents.append(content)
+        path = os.path.join(output_dir, f"synthetic-{index:05d}.jenkinsfile")
+        with open(path, 'w') as output_file:
+            output_file.write(content)
+        paths.append(path)
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic Jenkinsfile corpus from seed Jenkinsfiles")
+    parser.add_argument('output_dir')
+    parser.add_argument('--count', type=int, default=50)
+    parser.add_argument('--min-stages', type=int, default=3)
+    parser.add_argument('--max-stages', type=int, default=12)
+    parser.add_argument('--seed-dir', default=DEFAULT_SEED_DIR)
+    parser.add_argument('--parallel-rate', type=float, default=0.2)
+    parser.add_argument('--duplicate-rate', type=float, default=0.0)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    paths = generate_corpus(args.output_dir, args.count, args.min_stages, args.max_stages, args.seed_dir,
+                            args.parallel_rate, args.duplicate_rate, args.seed)
+    print(f"Wrote {len(paths)} Jenkinsfiles to {args.output_dir}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,340 @@
+"""
+Local stand-in for the OpenAI endpoints the converter uses.
+
+Serves chat completions with canned answers chosen from the system prompt and tagged
+with a hash of the user message, so different files get different answers and their
+later stages are real requests rather than shared ones, plus the
+file and batch endpoints (upload, create, retrieve, download) so batch mode can be
+exercised without an account:
+
+    python bench/mock_openai_server.py --port 18080 --batch-delay 2
+    export OPENAI_API_KEY=test OPENAI_BASE_URL=http://127.0.0.1:18080/v1
+    python src/converter.py --batch
+
+--rate-limit-rate and --error-rate make that fraction of chat completions fail with a
+429 (carrying Retry-After) or a 500, to exercise retries. Requests with "stream": true
+are answered as server-sent events, a few characters per chunk (--chunk-delay between
+chunks); --prose-rate prefixes that fraction of answers with chatty prose, to exercise
+early aborts. Answers of the models listed with --weak-models are always prefixed with
+prose, to exercise model escalation. GET /stats returns request counters.
+"""
+import re
+import sys
+import hashlib
+import random
+import json
+import time
+import uuid
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+CANNED_PIPELINE_JSON = {
+    "pipeline_type": "Declarative",
+    "agent": {"type": "any"},
+    "stages": [{"name": "Build {tag}", "steps": [{"type": "sh", "script_content": "make"}]}],
+}
+CANNED_TEKTON_YAML = """apiVersion: tekton.dev/v1
+kind: Pipeline
+metadata:
+  name: generated-{tag}
+spec:
+  tasks:
+    - name: build
+      taskSpec:
+        steps:
+          - name: run
+            image: alpine:3.19
+            script: make
+"""
+CANNED_STEP_YAML = """- name: converted-step-{tag}
+  image: alpine:3.19
+  script: |
+    echo "converted step"
+"""
+CANNED_STAGE_YAML = """task:
+  spec:
+    steps:
+      - name: converted-stage-{tag}
+        image: alpine:3.19
+        script: |
+          echo "converted stage"
+when: []
+"""
+_YAML_BLOCK_RE = re.compile(r'```yaml\n(.*?)\n```', re.DOTALL)
+
+
+def canned_answer(body):
+    """Pick a plausible answer for a chat completion request from its system prompt."""
+    messages = body.get('messages') or []
+    system = messages[0].get('content', '') if messages else ''
+    user = messages[-1].get('content', '') if messages else ''
+    tag = hashlib.sha256(user.encode('utf-8')).hexdigest()[:8]
+    if 'Jenkins pipeline files to JSON' in system:
+        return json.dumps(CANNED_PIPELINE_JSON).replace('{tag}', tag)
+    if 'converting Jenkins pipeline steps' in system:
+        return CANNED_STEP_YAML.replace('{tag}', tag)
+    if 'converting Jenkins pipeline stages' in system:
+        return CANNED_STAGE_YAML.replace('{tag}', tag)
+    if 'JSON pipeline configurations to Tekton' in system:
+        return CANNED_TEKTON_YAML.replace('{tag}', tag)
+    if 'JSON Patch' in system:
+        # Validation passes in patch mode: nothing to change
+        return json.dumps({"validation_report": "Mock validation: no changes.", "patch": []})
+    if (body.get('response_format') or {}).get('type') == 'json_object':
+        # Validation passes: echo the YAML back as the "fixed" version
+        match = _YAML_BLOCK_RE.search(user)
+        return json.dumps({"validation_report": "Mock validation: no changes.",
+                           "fixed_tekton_yaml": match.group(1) if match else CANNED_TEKTON_YAML.replace('{tag}', tag)})
+    return "Mock response"
+
+
+PROSE_PREFIX = "Sure! Here is the converted output:\n\n"
+STREAM_CHUNK_CHARS = 16
+
+
+def chat_completion(body, content=None):
+    content = canned_answer(body) if content is None else content
+    prompt_tokens = sum(len(str(m.get('content', ''))) for m in body.get('messages') or []) // 4
+    completion_tokens = len(content) // 4
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex[:12]}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get('model', 'gpt-3.5-turbo'),
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+        "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                  "total_tokens": prompt_tokens + completion_tokens},
+    }
+
+
+class MockState:
+    def __init__(self, latency, batch_delay, rate_limit_rate=0.0, error_rate=0.0, retry_after=1.0,
+                 prose_rate=0.0, chunk_delay=0.0, weak_models=(), slow_rate=0.0, slow_latency=0.0):
+        self.latency = latency
+        self.slow_rate = slow_rate
+        self.slow_latency = slow_latency
+        self.weak_models = set(weak_models)
+        self.prose_rate = prose_rate
+        self.chunk_delay = chunk_delay
+        self.batch_delay = batch_delay
+        self.rate_limit_rate = rate_limit_rate
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.lock = threading.RLock()
+        self.files = {}
+        self.batches = {}
+        self.stats = {'chat_completions': 0, 'rate_limited': 0, 'server_errors': 0, 'streams': 0,
+                      'streams_closed_early': 0, 'prose_answers': 0, 'weak_model_answers': 0, 'slow_answers': 0,
+                      'files': 0, 'batches': 0, 'batch_requests': 0}
+
+    def add_file(self, content, purpose):
+        file_id = f"file-{uuid.uuid4().hex[:16]}"
+        with self.lock:
+            self.files[file_id] = {'id': file_id, 'object': 'file', 'bytes': len(content), 'created_at': int(time.time()),
+                                   'filename': f"{file_id}.jsonl", 'purpose': purpose, 'content': content}
+            self.stats['files'] += 1
+        return file_id
+
+    def create_batch(self, body):
+        batch_id = f"batch_{uuid.uuid4().hex[:16]}"
+        batch = {
+            'id': batch_id, 'object': 'batch', 'endpoint': body.get('endpoint'),
+            'input_file_id': body.get('input_file_id'), 'completion_window': body.get('completion_window', '24h'),
+            'status': 'validating', 'created_at': int(time.time()), 'output_file_id': None, 'error_file_id': None,
+            'request_counts': {'total': 0, 'completed': 0, 'failed': 0}, 'metadata': body.get('metadata'),
+            '_ready_at': time.time() + self.batch_delay,
+        }
+        with self.lock:
+            self.batches[batch_id] = batch
+            self.stats['batches'] += 1
+        return batch
+
+    def refresh_batch(self, batch):
+        """Complete a batch once its delay has passed."""
+        if batch['status'] in ('completed', 'failed') or time.time() < batch['_ready_at']:
+            if batch['status'] == 'validating':
+                batch['status'] = 'in_progress'
+            return
+        input_file = self.files.get(batch['input_file_id'])
+        if input_file is None:
+            batch['status'] = 'failed'
+            batch['errors'] = {'data': [{'code': 'invalid_file', 'message': 'input file not found'}]}
+            return
+        lines = []
+        for line in input_file['content'].decode('utf-8').splitlines():
+            if not line.strip():
+                continue
+            request = json.loads(line)
+            lines.append(json.dumps({
+                'id': f"batch_req_{uuid.uuid4().hex[:12]}",
+                'custom_id': request['custom_id'],
+                'response': {'status_code': 200, 'request_id': uuid.uuid4().hex, 'body': chat_completion(request['body'])},
+                'error': None,
+            }))
+        batch['output_file_id'] = self.add_file(("\n".join(lines) + "\n").encode('utf-8'), 'batch_output')
+        batch['request_counts'] = {'total': len(lines), 'completed': len(lines), 'failed': 0}
+        batch['status'] = 'completed'
+        batch['completed_at'] = int(time.time())
+        self.stats['batch_requests'] += len(lines)
+
+
+def _parse_multipart(body, content_type):
+    boundary = re.search(r'boundary="?([^";]+)"?', content_type).group(1).encode('utf-8')
+    fields = {}
+    for part in body.split(b'--' + boundary):
+        if b'\r\n\r\n' not in part:
+            continue
+        headers, value = part.split(b'\r\n\r\n', 1)
+        name = re.search(rb'name="([^"]+)"', headers)
+        if name:
+            fields[name.group(1).decode('utf-8')] = value[:-2] if value.endswith(b'\r\n') else value
+    return fields
+
+
+def make_handler(state):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def _send(self, payload, status=200, raw=None, headers=None):
+            data = raw if raw is not None else json.dumps(payload).encode('utf-8')
+            self.send_response(status)
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.send_header('content-type', 'application/octet-stream' if raw is not None else 'application/json')
+            self.send_header('content-length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _body(self):
+            return self.rfile.read(int(self.headers.get('content-length') or 0))
+
+        def do_POST(self):
+            body = self._body()
+            if self.path.endswith('/chat/completions'):
+                if random.random() < state.slow_rate:
+                    with state.lock:
+                        state.stats['slow_answers'] += 1
+                    time.sleep(state.slow_latency)
+                else:
+                    time.sleep(state.latency)
+                roll = random.random()
+                with state.lock:
+                    if roll < state.rate_limit_rate:
+                        state.stats['rate_limited'] += 1
+                        return self._send({'error': {'message': 'Rate limit reached', 'type': 'requests', 'code': 'rate_limit_exceeded'}},
+                                          status=429, headers={'retry-after': str(state.retry_after)})
+                    if roll < state.rate_limit_rate + state.error_rate:
+                        state.stats['server_errors'] += 1
+                        return self._send({'error': {'message': 'The server had an error', 'type': 'server_error'}}, status=500)
+                    state.stats['chat_completions'] += 1
+                    prose = random.random() < state.prose_rate
+                    if prose:
+                        state.stats['prose_answers'] += 1
+                request = json.loads(body)
+                if request.get('model') in state.weak_models:
+                    with state.lock:
+                        state.stats['weak_model_answers'] += 1
+                    prose = True
+                content = (PROSE_PREFIX if prose else "") + canned_answer(request)
+                if request.get('stream'):
+                    return self._stream(request, content)
+                return self._send(chat_completion(request, content))
+            if self.path.endswith('/files'):
+                fields = _parse_multipart(body, self.headers.get('content-type', ''))
+                file_id = state.add_file(fields.get('file', b''), fields.get('purpose', b'batch').decode('utf-8'))
+                return self._send({k: v for k, v in state.files[file_id].items() if k != 'content'})
+            if self.path.endswith('/batches'):
+                return self._send(self._public(state.create_batch(json.loads(body))))
+            match = re.search(r'/batches/([^/]+)/cancel$', self.path)
+            if match and match.group(1) in state.batches:
+                state.batches[match.group(1)]['status'] = 'cancelled'
+                return self._send(self._public(state.batches[match.group(1)]))
+            self._send({'error': {'message': f"Unknown path {self.path}"}}, status=404)
+
+        def do_GET(self):
+            if self.path.rstrip('/') in ('', '/stats'):
+                return self._send(state.stats)
+            match = re.search(r'/batches/([^/]+)$', self.path)
+            if match and match.group(1) in state.batches:
+                batch = state.batches[match.group(1)]
+                with state.lock:
+                    state.refresh_batch(batch)
+                return self._send(self._public(batch))
+            match = re.search(r'/files/([^/]+)/content$', self.path)
+            if match and match.group(1) in state.files:
+                return self._send(None, raw=state.files[match.group(1)]['content'])
+            self._send({'error': {'message': f"Unknown path {self.path}"}}, status=404)
+
+        def _stream(self, request, content):
+            """Send the answer as server-sent events, using chunked transfer encoding."""
+            self.send_response(200)
+            self.send_header('content-type', 'text/event-stream')
+            self.send_header('transfer-encoding', 'chunked')
+            self.end_headers()
+            completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+            with state.lock:
+                state.stats['streams'] += 1
+            pieces = [content[i:i + STREAM_CHUNK_CHARS] for i in range(0, len(content), STREAM_CHUNK_CHARS)]
+            events = []
+            for index, piece in enumerate(pieces):
+                delta = {'role': 'assistant', 'content': piece} if index == 0 else {'content': piece}
+                events.append({'index': 0, 'delta': delta, 'finish_reason': None})
+            events.append({'index': 0, 'delta': {}, 'finish_reason': 'stop'})
+            try:
+                for choice in events:
+                    chunk = {'id': completion_id, 'object': 'chat.completion.chunk', 'created': int(time.time()),
+                             'model': request.get('model', 'gpt-3.5-turbo'), 'choices': [choice]}
+                    self._write_chunk(f"data: {json.dumps(chunk)}\n\n".encode('utf-8'))
+                    if state.chunk_delay:
+                        time.sleep(state.chunk_delay)
+                self._write_chunk(b"data: [DONE]\n\n")
+                self._write_chunk(b"")
+            except (BrokenPipeError, ConnectionResetError):
+                with state.lock:
+                    state.stats['streams_closed_early'] += 1
+                self.close_connection = True
+
+        def _write_chunk(self, data):
+            self.wfile.write(f"{len(data):x}\r\n".encode('ascii') + data + b"\r\n")
+            self.wfile.flush()
+
+        @staticmethod
+        def _public(batch):
+            return {k: v for k, v in batch.items() if not k.startswith('_')}
+
+    return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for the OpenAI chat, file and batch endpoints")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=18080)
+    parser.add_argument('--latency', type=float, default=0.0, help="Seconds to sleep per chat completion")
+    parser.add_argument('--batch-delay', type=float, default=1.0, help="Seconds until a submitted batch completes")
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0, help="Fraction of chat completions answered with 429")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Fraction of chat completions answered with 500")
+    parser.add_argument('--retry-after', type=float, default=1.0, help="Retry-After seconds sent with 429 responses")
+    parser.add_argument('--prose-rate', type=float, default=0.0, help="Fraction of answers prefixed with prose")
+    parser.add_argument('--chunk-delay', type=float, default=0.0, help="Seconds between streamed chunks")
+    parser.add_argument('--weak-models', nargs='*', default=(), help="Models whose answers are always prefixed with prose")
+    parser.add_argument('--slow-rate', type=float, default=0.0, help="Fraction of chat completions that take --slow-latency")
+    parser.add_argument('--slow-latency', type=float, default=5.0, help="Seconds a slow chat completion takes")
+    args = parser.parse_args()
+
+    state = MockState(args.latency, args.batch_delay, args.rate_limit_rate, args.error_rate, args.retry_after,
+                      args.prose_rate, args.chunk_delay, args.weak_models,
+                      args.slow_rate, args.slow_latency)
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(state))
+    print(f"Mock OpenAI server listening on http://{args.host}:{args.port}/v1", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,311 @@
+"""
+End-to-end converter benchmark against the local mock OpenAI server.
+
+Generates a synthetic corpus, then runs each scenario in its own process (so peak RSS
+is the converter's own) against its own mock server, driving process_jenkins_files
+exactly as the CLI does. Reports files/sec, p50/p95/p99 latency per stage and peak RSS:
+
+    python bench/run_benchmark.py --count 100 --latency 0.05 --output bench_results.json
+    python bench/run_benchmark.py --count 100 --latency 0.05 --baseline bench_results.json
+
+With --baseline the run fails (exit code 1) if any scenario's files/sec drops by more
+than --max-regression compared to the baseline results. No network access is needed.
+"""
+import os
+import sys
+import json
+import time
+import socket
+import tempfile
+import argparse
+import functools
+import subprocess
+import urllib.request
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_ROOT = os.path.dirname(BENCH_DIR)
+SRC_DIR = os.path.join(PROJECT_ROOT, 'src')
+sys.path.insert(0, BENCH_DIR)
+
+from generate_jenkinsfiles import generate_corpus  # noqa: E402
+
+RUN_NUMBER = 1
+STAGES = ('jenkins2json', 'json2tekton', 'validate', 'fix')
+PERCENTILES = (50, 95, 99)
+# Config applied to every scenario: quiet logs, fast retries, and model routes kept in memory so
+# scenarios neither read nor change the project's model_routes.json
+BASE_CONFIG = {
+    'logging': {'level': 'WARNING', 'file': None},
+    'models': {'routes_file': None},
+    'error_handling': {'retry_base_delay_seconds': 0.05, 'retry_max_delay_seconds': 1.0},
+}
+SCENARIOS = {
+    'default': {
+        'description': "Shipped configuration: local parser, template renderer, static validator",
+        'config': {},
+        'mock': {},
+    },
+    'llm-only': {
+        'description': "Every stage through the LLM",
+        'config': {'conversion': {'local_parser': False, 'template_renderer': False, 'shard_min_stages': None},
+                   'validation': {'static_validator': False}},
+        'mock': {},
+    },
+    'sharded': {
+        'description': "Renderer off; pipelines converted per stage",
+        'config': {'conversion': {'template_renderer': False, 'shard_min_stages': 2}},
+        'mock': {},
+    },
+    'flaky': {
+        'description': "5% 429s and 5% 500s from the provider",
+        'config': {},
+        'mock': {'rate_limit_rate': 0.05, 'error_rate': 0.05, 'retry_after': 0.2},
+    },
+    'streaming': {
+        'description': "Streamed completions, 10% of answers start with prose",
+        'config': {'streaming': {'enabled': True}},
+        'mock': {'prose_rate': 0.1},
+    },
+    'stragglers': {
+        'description': "Every stage through the LLM, 5% of answers 20x slower, no hedging",
+        'config': {'conversion': {'local_parser': False, 'template_renderer': False, 'shard_min_stages': None},
+                   'validation': {'static_validator': False}, 'hedging': {'enabled': False},
+                   'rate_limits': {'requests_per_minute': None, 'tokens_per_minute': None}},
+        'mock': {'slow_rate': 0.05, 'slow_latency_factor': 20},
+    },
+    'hedged': {
+        'description': "As stragglers, with hedged requests after each stage's p95",
+        'config': {'conversion': {'local_parser': False, 'template_renderer': False, 'shard_min_stages': None},
+                   'validation': {'static_validator': False},
+                   'hedging': {'enabled': True, 'min_samples': 10, 'min_delay_seconds': 0.0},
+                   'rate_limits': {'requests_per_minute': None, 'tokens_per_minute': None}},
+        'mock': {'slow_rate': 0.05, 'slow_latency_factor': 20},
+    },
+}
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers (None for an empty list)."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, -(-pct * len(ordered) // 100))
+    return ordered[min(len(ordered), rank) - 1]
+
+
+def merge(base, override):
+    """Deep-merge two config dicts (override wins)."""
+    merged = dict(base)
+    for key, value in override.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = merge(merged[key], value)
+        else:
+            merged[key] = value
+    return merged
+
+
+# --- Child process: one scenario ---
+
+def _instrument(pipeline_class, latencies):
+    """Time the per-stage coroutines of the pipeline (wall time, including queueing)."""
+    def timed(method, stage_of):
+        @functools.wraps(method)
+        async def wrapper(self, *args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await method(self, *args, **kwargs)
+            finally:
+                latencies.setdefault(stage_of(kwargs), []).append(time.perf_counter() - start)
+        return wrapper
+
+    pipeline_class.convert_jenkins_to_json = timed(pipeline_class.convert_jenkins_to_json, lambda kwargs: 'jenkins2json')
+    pipeline_class.convert_json_to_tekton = timed(pipeline_class.convert_json_to_tekton, lambda kwargs: 'json2tekton')
+    pipeline_class.validate_tekton_pipeline = timed(pipeline_class.validate_tekton_pipeline,
+                                                    lambda kwargs: kwargs.get('stage', 'validate'))
+
+
+def run_scenario(name, input_dir, work_dir, base_url, concurrency=None):
+    """
+    Convert a corpus with one scenario's configuration.
+
+    :return: Result dict (files, seconds, files_per_second, stage latencies, peak RSS, mock stats)
+    """
+    import yaml
+    import resource
+    sys.path.insert(0, SRC_DIR)
+    from async_pipeline import AsyncConversionPipeline
+    from converter import process_jenkins_files
+    from context import ConverterContext
+    from llm_cache import CACHE_MODE_OFF
+
+    with open(os.path.join(PROJECT_ROOT, 'config.yaml'), 'r') as config_file:
+        config = merge(merge(yaml.safe_load(config_file), BASE_CONFIG), SCENARIOS[name]['config'])
+    config_path = os.path.join(work_dir, 'config.yaml')
+    with open(config_path, 'w') as config_file:
+        yaml.safe_dump(config, config_file)
+    output_dir = os.path.join(work_dir, 'output')
+
+    latencies = {}
+    _instrument(AsyncConversionPipeline, latencies)
+    context = ConverterContext(config_path=config_path, cache_mode=CACHE_MODE_OFF)
+    files = sum(1 for entry in os.scandir(input_dir) if entry.is_file())
+    start = time.perf_counter()
+    process_jenkins_files(input_dir, output_dir, os.path.join(work_dir, 'validation.log'), RUN_NUMBER,
+                          max_concurrent_requests=concurrency, context=context)
+    seconds = time.perf_counter() - start
+    summary = context.metrics.summary()
+    completed = sum(1 for entry in os.scandir(output_dir) if entry.name.startswith(f"{RUN_NUMBER}-validated-"))
+    with urllib.request.urlopen(f"{base_url.rsplit('/v1', 1)[0]}/stats") as response:
+        mock_stats = json.load(response)
+
+    return {
+        'scenario': name,
+        'files': files,
+        'completed': completed,
+        'seconds': round(seconds, 3),
+        'files_per_second': round(files / seconds, 2) if seconds else None,
+        'stages': {
+            stage: {'count': len(latencies.get(stage, [])),
+                    **{f"p{pct}_ms": round(percentile(latencies.get(stage, []), pct) * 1000, 1)
+                       if latencies.get(stage) else None for pct in PERCENTILES}}
+            for stage in STAGES
+        },
+        'file_seconds': {f"p{pct}": summary['files'][f"p{pct}_seconds"] for pct in PERCENTILES},
+        'hedged_requests': summary['counters'].get('hedged_requests', 0),
+        'hedge_wins': summary['counters'].get('hedge_wins', 0),
+        # ru_maxrss is in kilobytes on Linux
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        'mock': mock_stats,
+    }
+
+
+# --- Parent process: corpus, mock servers, report ---
+
+def _free_port():
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        return probe.getsockname()[1]
+
+
+def _start_mock(port, latency, options):
+    command = [sys.executable, os.path.join(BENCH_DIR, 'mock_openai_server.py'), '--port', str(port),
+               '--latency', str(latency)]
+    for key, value in options.items():
+        if key == 'slow_latency_factor':
+            key, value = 'slow_latency', latency * value
+        command += [f"--{key.replace('_', '-')}", str(value)]
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 10
+    while time.time() < deadline:
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/stats", timeout=1).close()
+            return process
+        except OSError:
+            time.sleep(0.05)
+    process.terminate()
+    raise RuntimeError(f"Mock server on port {port} did not start")
+
+
+def _run_child(name, corpus_dir, latency, concurrency):
+    port = _free_port()
+    mock = _start_mock(port, latency, SCENARIOS[name]['mock'])
+    try:
+        with tempfile.TemporaryDirectory(prefix=f"bench-{name}-") as work_dir:
+            env = dict(os.environ, OPENAI_API_KEY='bench', OPENAI_BASE_URL=f"http://127.0.0.1:{port}/v1")
+            command = [sys.executable, os.path.abspath(__file__), '--child', name, '--input-dir', corpus_dir,
+                       '--work-dir', work_dir]
+            if concurrency:
+                command += ['--concurrency', str(concurrency)]
+            result = subprocess.run(command, env=env, capture_output=True, text=True)
+            if result.returncode != 0:
+                raise RuntimeError(f"Scenario {name} failed:\n{result.stderr[-4000:]}")
+            return json.loads(result.stdout.strip().splitlines()[-1])
+    finally:
+        mock.terminate()
+        mock.wait()
+
+
+def format_table(results):
+    """Plain-text report of scenario results."""
+    header = f"{'scenario':<10} {'files':>5} {'ok':>5} {'sec':>7} {'files/s':>8} {'rss MB':>7} {'LLM req':>7} {'file p50/p99 s':>15}  stage p50/p95/p99 ms"
+    lines = [header, "-" * len(header)]
+    for result in results:
+        stage_text = "  ".join(
+            f"{stage}={stats['p50_ms']}/{stats['p95_ms']}/{stats['p99_ms']}"
+            for stage, stats in result['stages'].items() if stats['count']
+        )
+        requests = result['mock'].get('chat_completions', 0) + result['mock'].get('batch_requests', 0)
+        file_seconds = f"{result['file_seconds']['p50']}/{result['file_seconds']['p99']}"
+        lines.append(f"{result['scenario']:<10} {result['files']:>5} {result['completed']:>5} {result['seconds']:>7} "
+                     f"{result['files_per_second']:>8} {result['peak_rss_mb']:>7} {requests:>7} {file_seconds:>15}  {stage_text}")
+    return "\n".join(lines)
+
+
+def compare(results, baseline, max_regression):
+    """
+    :return: List of messages for scenarios whose throughput regressed beyond max_regression
+    """
+    previous = {result['scenario']: result for result in baseline.get('results', [])}
+    regressions = []
+    for result in results:
+        before = previous.get(result['scenario'])
+        if not before or not before.get('files_per_second') or not result.get('files_per_second'):
+            continue
+        change = result['files_per_second'] / before['files_per_second'] - 1
+        if change < -max_regression:
+            regressions.append(f"{result['scenario']}: {before['files_per_second']} -> {result['files_per_second']} "
+                               f"files/s ({change:+.0%})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the converter against a local mock OpenAI server")
+    parser.add_argument('--scenarios', nargs='+', choices=sorted(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument('--count', type=int, default=50, help="Number of synthetic Jenkinsfiles")
+    parser.add_argument('--min-stages', type=int, default=3)
+    parser.add_argument('--max-stages', type=int, default=12)
+    parser.add_argument('--duplicate-rate', type=float, default=0.0)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--latency', type=float, default=0.05, help="Mock seconds per chat completion")
+    parser.add_argument('--concurrency', type=int, default=None, help="Override concurrency.max_concurrent_requests")
+    parser.add_argument('--output', help="Write the results as JSON to this file")
+    parser.add_argument('--baseline', help="Results JSON of an earlier run to compare against")
+    parser.add_argument('--max-regression', type=float, default=0.2, help="Allowed files/sec drop against the baseline")
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    parser.add_argument('--input-dir', help=argparse.SUPPRESS)
+    parser.add_argument('--work-dir', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        result = run_scenario(args.child, args.input_dir, args.work_dir, os.environ['OPENAI_BASE_URL'], args.concurrency)
+        print(json.dumps(result))
+        return 0
+
+    with tempfile.TemporaryDirectory(prefix="bench-corpus-") as corpus_dir:
+        generate_corpus(corpus_dir, args.count, args.min_stages, args.max_stages,
+                        duplicate_rate=args.duplicate_rate, seed=args.seed)
+        results = []
+        for name in args.scenarios:
+            print(f"Running scenario {name}: {SCENARIOS[name]['description']}", file=sys.stderr)
+            results.append(_run_child(name, corpus_dir, args.latency, args.concurrency))
+
+    print(format_table(results))
+    report = {
+        'parameters': {key: getattr(args, key) for key in ('count', 'min_stages', 'max_stages', 'duplicate_rate',
+                                                           'seed', 'latency', 'concurrency')},
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(report, output_file, indent=2)
+    if args.baseline:
+        with open(args.baseline, 'r') as baseline_file:
+            regressions = compare(results, json.load(baseline_file), args.max_regression)
+        if regressions:
+            print("Throughput regressions:\n  " + "\n  ".join(regressions), file=sys.stderr)
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,1076 @@
+import os
+import time
+import json
+import asyncio
+import logging
+import threading
+import concurrent.futures
+from llm_cache import make_cache_key
+from jenkins_parser import jenkinsfile_to_json, UnsupportedJenkinsfileError
+from manifest import sha256_text
+from tekton_renderer import plan_pipeline, count_stages, rename_pipeline, parse_yaml_documents, RENDERER_VERSION, STEP_PROMPT, STAGE_PROMPT
+from rate_limiter import RateLimiter, RetryPolicy, estimate_tokens, CHARS_PER_TOKEN, is_retryable, retry_after_seconds, DEFAULT_COMPLETION_TOKENS_ESTIMATE, DEFAULT_BURST_SECONDS
+from streaming import make_stream_checker, StreamAbortedError, FORMAT_JSON, FORMAT_YAML, FORMAT_YAML_FRAGMENT, PARTIAL_SUFFIX
+from metrics import RunMetrics, IOTimer, current_file
+from model_router import fingerprint
+from discovery import output_name
+from tekton_validator import validate_tekton_yaml, fix_request_message, VALIDATOR_VERSION
+from yaml_patch import apply_patch_response, VALIDATE_PATCH_PROMPT, FIX_PATCH_PROMPT
+from pipeline_optimizer import optimize_pipeline, OPTIMIZER_VERSION
+from hedging import HedgePolicy
+
+logger = logging.getLogger(__name__)
+
+# Stage names, in chain order
+STAGE_JENKINS2JSON = "jenkins2json"
+STAGE_JSON2TEKTON = "json2tekton"
+STAGE_VALIDATE = "validate"
+STAGE_FIX = "fix"
+STAGES = (STAGE_JENKINS2JSON, STAGE_JSON2TEKTON, STAGE_VALIDATE, STAGE_FIX)
+
+# Prompt file used by each stage
+STAGE_PROMPTS = {
+    STAGE_JENKINS2JSON: "jenkins2json.txt",
+    STAGE_JSON2TEKTON: "json2tekton.txt",
+    STAGE_VALIDATE: "validate_tekton_pipeline.txt",
+    STAGE_FIX: "fix_tekton_pipeline.txt",
+}
+# Prompts of the validation passes when they answer with a JSON Patch (validation.patch_mode)
+PATCH_STAGE_PROMPTS = {
+    STAGE_VALIDATE: VALIDATE_PATCH_PROMPT,
+    STAGE_FIX: FIX_PATCH_PROMPT,
+}
+DEFAULT_MAX_VALIDATION_PASSES = 2
+
+DEFAULT_MAX_CONCURRENT_REQUESTS = 8
+# Files converted at the same time; more files are taken from discovery as these finish
+DEFAULT_FILES_IN_FLIGHT = 256
+# Server mode: how many recently converted files are remembered for answering exact duplicates
+SERVER_MAX_FILE_OUTPUTS = 1024
+# Server mode: latency samples per stage and per-file totals kept by the metrics
+SERVER_MAX_LATENCY_SAMPLES = 4096
+SERVER_MAX_METRIC_FILES = 1024
+# Save the manifest after this many finished files so an interrupted run keeps its progress
+MANIFEST_CHECKPOINT_EVERY = 25
+
+
+class AsyncConversionPipeline:
+    """
+    Runs the jenkins2json -> json2tekton -> validate -> fix chain for many files at once.
+
+    Up to files_in_flight files are converted at once, taken from the file list as it
+    is discovered, so while one file waits on its validation call another can already
+    be in json2tekton. Two limits apply to each LLM request: a global
+    one on the total number of in-flight requests, and a per-stage one so a slow stage
+    cannot starve the others. Outputs and log entries are written as soon as a file's
+    chain finishes, using the same file names as the serial loop.
+    """
+
+    def __init__(self, context, output_dir, errors_log_path, run_number,
+                 max_concurrent_requests=DEFAULT_MAX_CONCURRENT_REQUESTS, stage_limits=None,
+                 manifest=None, incremental=False, batch=None, streaming=None, metrics=None, results=None,
+                 source=None, input_dir=None, files_in_flight=DEFAULT_FILES_IN_FLIGHT):
+        """
+        :param context: ConverterContext providing the shared client, prompts and cache
+        :param output_dir: Directory to save converted Tekton pipeline files
+        :param errors_log_path: Path to log validation errors and reports
+        :param run_number: The current execution run number
+        :param max_concurrent_requests: Global cap on in-flight LLM requests
+        :param stage_limits: Optional dict of stage name -> cap on in-flight requests for that stage
+        :param manifest: Optional ConversionManifest recording each stage's inputs and artifacts
+        :param incremental: If True, reuse manifest artifacts for stages whose inputs are unchanged
+        :param batch: Optional BatchScheduler; if set, requests go through the Batch API instead of one call each
+        :param streaming: If True, stream completions and check them as they arrive; defaults to config.yaml
+        :param metrics: Optional RunMetrics collecting timing, tokens and cost; a new one is created if omitted
+        :param results: Optional ResultsStore indexing each stage's prompt version, artifact, findings and timing
+        :param source: Optional JenkinsfileSource the files are read through (needed for archive and git inputs)
+        :param input_dir: Input root; outputs of files below it are named after their relative path
+        :param files_in_flight: Number of files converted at the same time
+        """
+        self.context = context
+        self.output_dir = output_dir
+        self.errors_log_path = errors_log_path
+        self.run_number = run_number
+        self.cache = context.cache
+        conversion_config = context.config.get('conversion') or {}
+        self.local_parser = conversion_config.get('local_parser', True)
+        self.template_renderer = conversion_config.get('template_renderer', True)
+        self.shard_min_stages = conversion_config.get('shard_min_stages')
+        validation_config = context.config.get('validation') or {}
+        self.static_validator = validation_config.get('static_validator', True)
+        self.patch_mode = validation_config.get('patch_mode', True)
+        self.max_passes = max(1, int(validation_config.get('max_passes') or DEFAULT_MAX_VALIDATION_PASSES))
+        # Post-processing of the json2tekton output: minimal runAfter DAG and cache workspaces
+        optimization_config = context.config.get('optimization') or {}
+        self.optimize_dag = optimization_config.get('dag', True)
+        self.add_cache_workspaces = optimization_config.get('cache_workspaces', True)
+        self.optimization = {'pipelines': 0, 'run_after_removed': 0, 'critical_path_before': 0,
+                             'critical_path_after': 0, 'cache_workspaces': 0}
+        self.manifest = manifest
+        self.incremental = incremental
+        self.results = results
+        self.source = source
+        self.input_dir = input_dir
+        self.files_in_flight = max(1, int(files_in_flight))
+        # When each file's current stage started, for the stage timings in the results store
+        self._stage_started = {}
+        self.batch = batch
+        error_config = context.config.get('error_handling') or {}
+        self.retry_policy = RetryPolicy(
+            max_retries=error_config.get('max_retries', 3),
+            base_delay=error_config.get('retry_base_delay_seconds', 1.0),
+            max_delay=error_config.get('retry_max_delay_seconds', 60.0)
+        )
+        # Per-stage deadlines, and hedged requests for answers slower than the stage's p95
+        self.hedging = HedgePolicy.from_config(context.config)
+        self.rate_config = context.config.get('rate_limits') or {}
+        self.rate_limiter = None
+        self.retries = 0
+        streaming_config = context.config.get('streaming') or {}
+        self.streaming = bool(streaming_config.get('enabled', False)) if streaming is None else streaming
+        self.write_partial = streaming_config.get('write_partial', True)
+        self.stream_aborts = 0
+        self.metrics = metrics if metrics is not None else RunMetrics.from_config(context.config.get('metrics'))
+        # Requests of this run by cache key, so identical requests are sent once; a long-running
+        # server only shares requests while they are in flight and relies on the LLM cache after that
+        self._requests = {}
+        self.retain_requests = True
+        self.shared_requests = 0
+        # Output of the first file with each content hash, so exact duplicates are not converted again
+        self._file_outputs = {}
+        self.max_file_outputs = None
+        # Server mode: callables told about each finished stage, by file
+        self._stage_listeners = {}
+        self.duplicate_files = 0
+        # Files by the validation pass that first made no changes, and files still changing after max_passes
+        self.converged_passes = {}
+        self.unconverged_files = 0
+        # Worker mode: the shared WorkQueue and this worker's leases by file
+        self.work_queue = None
+        self._leases = {}
+        self.max_concurrent_requests = max(1, int(max_concurrent_requests))
+        stage_limits = stage_limits or {}
+        self.stage_limits = {
+            stage: max(1, int(stage_limits.get(stage, self.max_concurrent_requests)))
+            for stage in STAGES
+        }
+        # Semaphores are created lazily inside the running event loop
+        self._global_semaphore = None
+        self._stage_semaphores = None
+        self._log_lock = None
+        self._finished_files = 0
+
+    def _init_loop_state(self):
+        self._global_semaphore = asyncio.Semaphore(self.max_concurrent_requests)
+        self._stage_semaphores = {stage: asyncio.Semaphore(limit) for stage, limit in self.stage_limits.items()}
+        self._log_lock = asyncio.Lock()
+        self.rate_limiter = RateLimiter(
+            requests_per_minute=self.rate_config.get('requests_per_minute'),
+            tokens_per_minute=self.rate_config.get('tokens_per_minute'),
+            burst_seconds=self.rate_config.get('burst_seconds', DEFAULT_BURST_SECONDS)
+        )
+
+    def _prompt_name(self, stage):
+        if self.patch_mode and stage in PATCH_STAGE_PROMPTS:
+            return PATCH_STAGE_PROMPTS[stage]
+        return STAGE_PROMPTS[stage]
+
+    def _load_prompt(self, stage):
+        return self.context.prompts.get(self._prompt_name(stage))
+
+    def _prompt_hash(self, stage):
+        prompt_hash = self.context.prompts.hash(self._prompt_name(stage))
+        if stage == STAGE_JSON2TEKTON and (self.template_renderer or self.shard_min_stages):
+            # Rendered output also depends on the renderer rules and the per-step/stage prompts
+            prompts = self.context.prompts
+            prompt_hash = sha256_text(f"{prompt_hash}:{RENDERER_VERSION}:{prompts.hash(STEP_PROMPT)}:{prompts.hash(STAGE_PROMPT)}")
+        elif stage in (STAGE_VALIDATE, STAGE_FIX) and self.static_validator:
+            # Whether the LLM pass runs at all depends on the static validator's rules
+            prompt_hash = sha256_text(f"{prompt_hash}:validator-{VALIDATOR_VERSION}")
+        if stage == STAGE_JSON2TEKTON and (self.optimize_dag or self.add_cache_workspaces):
+            # The post-processing rules change the stage's output too
+            prompt_hash = sha256_text(f"{prompt_hash}:optimizer-{OPTIMIZER_VERSION}-{self.optimize_dag}-{self.add_cache_workspaces}")
+        if stage == STAGE_FIX and self.max_passes != DEFAULT_MAX_VALIDATION_PASSES:
+            # The fix stage's output is the result of validation passes 2 to max_passes
+            prompt_hash = sha256_text(f"{prompt_hash}:passes-{self.max_passes}")
+        return prompt_hash
+
+    async def _complete(self, stage, user_message, validator=None, prompt_name=None, output_format=None,
+                        partial_path=None, **params):
+        """
+        Send one chat completion for a stage, respecting the stage and global limits.
+
+        The request goes along the stage's model ladder (see ModelRouter): the cheapest
+        model first, or the model that worked for a request with the same fingerprint,
+        and the next model only if the answer is rejected by the validator (or cannot
+        become valid output while it streams in). Cache hits return immediately without taking a concurrency slot, and identical
+        requests within a run (e.g. the same parameterized shared-library stage in many
+        files) share one call. In batch mode the request is queued for the next batch of
+        its stage instead. Otherwise the request
+        waits for the rate limiter, and rate limits, timeouts and server errors are retried
+        with jittered backoff up to error_handling.max_retries.
+
+        :param stage: One of STAGES
+        :param user_message: The user message content
+        :param validator: Optional callable run on the content before it is cached; raise to reject it
+        :param prompt_name: Optional prompt file to use instead of the stage's default prompt
+        :param output_format: Expected output (streaming.FORMAT_*), checked as it streams in
+        :param partial_path: Optional file the answer is written to while it streams in
+        :return: The stripped message content of the first choice
+        """
+        prompt_name = prompt_name or self._prompt_name(stage)
+        messages = [
+            {"role": "system", "content": self.context.prompts.get(prompt_name)},
+            {"role": "user", "content": user_message}
+        ]
+        router = self.context.models
+        request_fingerprint = fingerprint(stage, prompt_name, user_message)
+        models = router.candidates(stage, request_fingerprint)
+        for index, model in enumerate(models):
+            try:
+                content = await self._complete_with(stage, model, messages, validator, output_format, partial_path, params)
+            except ValueError as e:
+                # Parsing and validation failures (and aborted streams) are rejections; API errors are not
+                if index == len(models) - 1:
+                    raise
+                router.escalate(stage, model, e)
+                continue
+            router.record(stage, request_fingerprint, model)
+            return content
+
+    async def _complete_with(self, stage, model, messages, validator, output_format, partial_path, params):
+        """Send one chat completion to one model, or answer it from the cache or an identical request."""
+        key = make_cache_key(model, messages, params)
+        if self.cache is not None and self.cache.enabled:
+            cached = self.cache.get(key)
+            if cached is not None:
+                logger.debug(f"LLM cache hit for stage {stage}")
+                self.metrics.record_cache_hit(stage)
+                return cached
+
+        request = self._requests.get(key)
+        if request is not None:
+            self.shared_requests += 1
+            self.metrics.record_cache_hit(stage, shared=True)
+            logger.debug(f"Sharing an identical in-run {stage} request")
+            return await asyncio.shield(request)
+        request = asyncio.ensure_future(self._request(stage, key, model, messages, validator, params,
+                                                      output_format, partial_path))
+        # Failed requests are forgotten so a later identical request tries again
+        request.add_done_callback(lambda done: self._forget(key, done))
+        self._requests[key] = request
+        return await asyncio.shield(request)
+
+    def _forget(self, key, request):
+        if not self.retain_requests or request.cancelled() or request.exception() is not None:
+            self._requests.pop(key, None)
+
+    async def _request(self, stage, key, model, messages, validator, params, output_format, partial_path):
+        if self.batch is not None:
+            start = time.perf_counter()
+            try:
+                content = await self.batch.request(key, stage, {"model": model, "messages": messages, **params})
+            except Exception as e:
+                self.metrics.record_llm_call(stage, model, time.perf_counter() - start, error=e.__class__.__name__, batch=True)
+                raise
+            usage = self.batch.usage.get(key) or {}
+            self.metrics.record_llm_call(stage, model, time.perf_counter() - start, prompt_tokens=usage.get('prompt_tokens'),
+                                         completion_tokens=usage.get('completion_tokens'), batch=True)
+        else:
+            content, _, _ = await self._send_with_retries(stage, model, messages, params, output_format, partial_path)
+        if validator is not None:
+            validator(content)
+        if self.cache is not None and self.cache.enabled:
+            self.cache.put(key, content, model=model, stage=stage)
+        return content
+
+    async def send_request(self, stage, model, messages, params=None):
+        """
+        Send one chat completion to one model under the pipeline's limits, retries, deadlines and
+        hedging, without the cache, the model ladder or sharing with identical requests.
+
+        Used by the prompt evaluation; the pipeline must have been prepared with start().
+
+        :return: Tuple (stripped content, completion tokens, seconds the answering attempt took)
+        """
+        return await self._send_with_retries(stage, model, messages, params or {})
+
+    async def _send_with_retries(self, stage, model, messages, params, output_format=None, partial_path=None):
+        """:return: Tuple (stripped content, completion tokens, seconds the answering attempt took)"""
+        estimated_tokens = estimate_tokens(
+            messages, params, self.rate_config.get('completion_tokens_estimate', DEFAULT_COMPLETION_TOKENS_ESTIMATE)
+        )
+        deadline = self.hedging.deadline(stage)
+        request_options = {'timeout': deadline} if deadline else {}
+
+        def can_hedge():
+            return not (self._stage_semaphores[stage].locked() or self._global_semaphore.locked())
+
+        async def send(hedge):
+            if not hedge:
+                # Only the original request writes the partial file
+                return await self._send_once(model, messages, params, request_options, output_format, partial_path)
+            # The hedged copy is a request of its own: it takes its own slots and rate limit budget
+            async with self._stage_semaphores[stage]:
+                async with self._global_semaphore:
+                    await self.rate_limiter.acquire(estimated_tokens)
+                    return await self._send_once(model, messages, params, request_options, output_format, None)
+
+        attempt = 0
+        start = time.perf_counter()
+        queue_seconds = 0.0
+        while True:
+            try:
+                queued = time.perf_counter()
+                async with self._stage_semaphores[stage]:
+                    async with self._global_semaphore:
+                        await self.rate_limiter.acquire(estimated_tokens)
+                        sent = time.perf_counter()
+                        queue_seconds += sent - queued
+                        content, prompt_tokens, completion_tokens = await self.hedging.run(stage, send, can_hedge)
+                        seconds = time.perf_counter() - sent
+            except Exception as e:
+                if isinstance(e, StreamAbortedError):
+                    self.stream_aborts += 1
+                if attempt >= self.retry_policy.max_retries or not (is_retryable(e) or isinstance(e, StreamAbortedError)):
+                    self.metrics.record_llm_call(stage, model, time.perf_counter() - start, queue_seconds,
+                                                 retries=attempt, error=e.__class__.__name__)
+                    raise
+                retry_after = retry_after_seconds(e)
+                if retry_after is not None:
+                    self.rate_limiter.pause(retry_after)
+                delay = self.retry_policy.delay(attempt, retry_after)
+                attempt += 1
+                self.retries += 1
+                logger.warning(f"{stage} request failed ({e.__class__.__name__}: {e}); retry {attempt}/{self.retry_policy.max_retries} in {delay:.1f}s")
+                await asyncio.sleep(delay)
+                continue
+            if prompt_tokens is not None:
+                self.rate_limiter.reconcile(estimated_tokens, prompt_tokens + (completion_tokens or 0))
+            self.metrics.record_llm_call(stage, model, time.perf_counter() - start, queue_seconds, prompt_tokens,
+                                         completion_tokens, retries=attempt)
+            content = content.strip()
+            return content, completion_tokens if completion_tokens is not None else len(content) // CHARS_PER_TOKEN, seconds
+
+    async def _send_once(self, model, messages, params, request_options, output_format, partial_path):
+        """
+        Send one copy of a chat completion.
+
+        :return: Tuple (content, prompt_tokens, completion_tokens); the token counts may be None
+        """
+        if self.streaming:
+            content = await self._stream(model, messages, params, request_options,
+                                         make_stream_checker(output_format), partial_path)
+            # Streamed responses carry no usage; count the answer instead
+            return content, estimate_tokens(messages, None, 0), len(content) // CHARS_PER_TOKEN
+        response = await self.context.async_client.chat.completions.create(
+            model=model, messages=messages, **params, **request_options
+        )
+        usage = getattr(response, 'usage', None)
+        return (response.choices[0].message.content, getattr(usage, 'prompt_tokens', None),
+                getattr(usage, 'completion_tokens', None))
+
+    async def _stream(self, model, messages, params, request_options, checker, partial_path):
+        """
+        Stream one completion, checking it as tokens arrive.
+
+        :param checker: Optional stream checker from make_stream_checker
+        :param partial_path: Optional file the answer is written to as it arrives
+        :return: The complete answer
+        :raises StreamAbortedError: As soon as the answer cannot become valid output; the stream is closed
+        """
+        stream = await self.context.async_client.chat.completions.create(
+            model=model, messages=messages, stream=True, **params, **request_options
+        )
+        parts = []
+        partial_file = open(partial_path, 'w') if partial_path and self.write_partial else None
+        try:
+            async for chunk in stream:
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if not delta:
+                    continue
+                parts.append(delta)
+                if checker is not None:
+                    checker.feed(delta)
+                if partial_file is not None:
+                    partial_file.write(delta)
+                    partial_file.flush()
+            if checker is not None:
+                checker.finish()
+        finally:
+            # Closing the response stops the generation of an aborted answer
+            await stream.close()
+            if partial_file is not None:
+                partial_file.close()
+        return "".join(parts)
+
+    async def convert_jenkins_to_json(self, jenkins_content, partial_path=None):
+        """
+        Convert Jenkins file content to JSON.
+
+        Declarative pipelines are parsed locally; the LLM is only used for files the
+        local parser cannot handle.
+
+        :param jenkins_content: Content of the Jenkins file
+        :param partial_path: Optional file a streamed answer is written to as it arrives
+        :return: JSON representation of the Jenkins file
+        """
+        if self.local_parser:
+            try:
+                json_content = jenkinsfile_to_json(jenkins_content)
+                logger.info("Parsed declarative Jenkins file locally")
+                return json_content
+            except UnsupportedJenkinsfileError as e:
+                logger.info(f"Local parser cannot handle this Jenkins file ({e}); falling back to the LLM")
+
+        # Validate JSON before it can be cached
+        return await self._complete(
+            STAGE_JENKINS2JSON,
+            f"Convert this Jenkins file to JSON:\n{jenkins_content}",
+            validator=json.loads,
+            output_format=FORMAT_JSON,
+            partial_path=partial_path
+        )
+
+    async def convert_json_to_tekton(self, json_content, name=None, partial_path=None):
+        """
+        Convert JSON to Tekton pipeline YAML.
+
+        With the template renderer enabled, known steps and stages are rendered by rules
+        and only the remaining ones are sent to the LLM, concurrently and one at a time.
+        Pipelines the renderer cannot handle that have at least conversion.shard_min_stages
+        stages are split at stage boundaries: each stage is converted to a Task on its own,
+        concurrently, and the Tasks are stitched into one Pipeline. Otherwise, or if a
+        per-stage answer is unusable, the whole document goes to the LLM.
+
+        :param json_content: JSON content of the pipeline
+        :param name: Optional pipeline name, e.g. the Jenkins file base name
+        :param partial_path: Optional file a streamed whole-document answer is written to as it arrives
+        :return: Tekton pipeline YAML
+        """
+        if self.template_renderer:
+            try:
+                plan = plan_pipeline(json.loads(json_content), name)
+                if plan.holes:
+                    logger.info(f"Template renderer sending {len(plan.holes)} unmapped steps/stages to the LLM")
+                tekton_yaml = await self._render_plan(plan)
+                logger.info("Rendered Tekton pipeline from templates")
+                return tekton_yaml
+            except ValueError as e:
+                logger.info(f"Template renderer cannot handle this pipeline ({e}); falling back to the LLM")
+
+        if self.shard_min_stages:
+            try:
+                data = json.loads(json_content)
+                stage_count = count_stages(data)
+                if stage_count >= self.shard_min_stages:
+                    plan = plan_pipeline(data, name, shard=True)
+                    logger.info(f"Converting {stage_count} stages as {len(plan.holes)} concurrent stage requests")
+                    tekton_yaml = await self._render_plan(plan)
+                    logger.info("Stitched Tekton pipeline from per-stage conversions")
+                    return tekton_yaml
+            except ValueError as e:
+                logger.info(f"Sharded conversion failed ({e}); converting the whole pipeline at once")
+
+        return await self._complete(STAGE_JSON2TEKTON, f"Convert this JSON pipeline to Tekton YAML:\n{json_content}",
+                                    validator=parse_yaml_documents, output_format=FORMAT_YAML, partial_path=partial_path)
+
+    async def _render_plan(self, plan):
+        """Resolve the holes of a render plan concurrently and render it."""
+        answers = await asyncio.gather(*(
+            self._complete(STAGE_JSON2TEKTON, hole.user_message(), validator=hole.accept, prompt_name=hole.prompt_name,
+                           output_format=FORMAT_YAML_FRAGMENT)
+            for hole in plan.holes
+        ))
+        for hole, answer in zip(plan.holes, answers):
+            hole.accept(answer)
+        return plan.render()
+
+    def _optimize(self, tekton_content, jenkins_file):
+        """Rebuild the runAfter DAG of the converted pipeline and add cache workspaces (see pipeline_optimizer)."""
+        if not (self.optimize_dag or self.add_cache_workspaces):
+            return tekton_content
+        try:
+            optimized, reports = optimize_pipeline(tekton_content, dag=self.optimize_dag,
+                                                   cache_workspaces=self.add_cache_workspaces)
+        except ValueError as e:
+            logger.warning(f"Cannot optimize the Tekton pipeline of {jenkins_file}: {e}")
+            return tekton_content
+        for report in reports:
+            logger.info(f"Optimized {jenkins_file}: {report.to_text()}")
+            self.optimization['pipelines'] += 1
+            self.optimization['run_after_removed'] += report.edges_before - report.edges_after
+            self.optimization['critical_path_before'] += len(report.critical_path_before)
+            self.optimization['critical_path_after'] += len(report.critical_path_after)
+            self.optimization['cache_workspaces'] += len(report.cache_workspaces)
+        return optimized
+
+    async def validate_tekton_pipeline(self, tekton_content, source_path, stage=STAGE_VALIDATE):
+        """
+        Validate and improve Tekton pipeline YAML content.
+
+        With the static validator enabled, content without errors is accepted as is and
+        no LLM call is made; otherwise the LLM only receives the errors found. In patch
+        mode the LLM answers with a JSON Patch that is applied here instead of the whole
+        YAML, so a pass that finds nothing to change returns the content unchanged.
+
+        :param tekton_content: Tekton pipeline YAML content
+        :param source_path: Path the content was saved to, used in messages
+        :param stage: STAGE_VALIDATE or STAGE_FIX
+        :return: Tuple (validation_report, fixed_tekton_yaml) or (error_message, None) on failure
+        """
+        static_report = None
+        user_message = f"Analyze and validate this Tekton pipeline YAML:\n```yaml\n{tekton_content}\n```"
+        if self.static_validator:
+            static_report = validate_tekton_yaml(tekton_content)
+            if static_report.ok:
+                logger.info(f"Static validation passed for {source_path}; skipping LLM {stage} pass")
+                return static_report.to_text(), tekton_content
+            logger.info(f"Static validation found {len(static_report.errors)} errors in {source_path}; running LLM {stage} pass")
+            user_message = fix_request_message(tekton_content, static_report)
+
+        if self.patch_mode:
+            # Patches that do not apply are rejected (and not cached) like malformed JSON
+            def validator(content):
+                apply_patch_response(tekton_content, content)
+        else:
+            validator = json.loads
+        try:
+            response_content = await self._complete(
+                stage,
+                user_message,
+                validator=validator,
+                output_format=FORMAT_JSON,
+                response_format={"type": "json_object"}
+            )
+        except json.JSONDecodeError as json_e:
+            error_msg = f"Failed to parse JSON response from OpenAI for {source_path}: {json_e}"
+            logger.error(error_msg)
+            return f"JSON Parse Error: {error_msg}", None
+        except Exception as e:
+            error_msg = f"Error during Tekton pipeline validation for {source_path}: {e}"
+            logger.error(error_msg)
+            return f"Validation Exception: {error_msg}", None
+
+        logger.debug(f"Raw validation response for {source_path}: {response_content}")
+        if self.patch_mode:
+            validation_report, fixed_tekton_yaml = apply_patch_response(tekton_content, response_content)
+        else:
+            result_json = json.loads(response_content)
+            validation_report = result_json.get('validation_report', 'Validation report missing in response.')
+            fixed_tekton_yaml = result_json.get('fixed_tekton_yaml', '# Fixed YAML missing in response.')
+        if static_report is not None:
+            validation_report = f"{static_report.to_text()}\n\n{validation_report}"
+        logger.info(f"Successfully validated and processed improvements for {source_path}")
+        return validation_report, fixed_tekton_yaml
+
+    async def _fix_passes(self, tekton_content, source_path, converged):
+        """
+        Run validation passes 2 to validation.max_passes until one changes nothing.
+
+        :param tekton_content: Output of the first validation pass
+        :param source_path: Path the content was saved to, used in messages
+        :param converged: True if the first pass changed nothing, so no further pass is needed
+        :return: Tuple (final YAML or None on failure, log entry for the passes)
+        """
+        log_entry = f"--- Second Validation Report for Run {self.run_number}, File: {source_path} ---\n"
+        passes = 1
+        while not converged and passes < self.max_passes:
+            passes += 1
+            validation_report, fixed_tekton_yaml = await self.validate_tekton_pipeline(tekton_content, source_path,
+                                                                                       stage=STAGE_FIX)
+            if validation_report:
+                log_entry += validation_report + "\n"
+            else:
+                log_entry += f"Second validation failed or no report generated. Check logs for {source_path}.\n"
+            if not fixed_tekton_yaml or fixed_tekton_yaml.startswith('# Fixed YAML missing'):
+                return None, log_entry + "--- End Second Report ---\n\n"
+            converged = fixed_tekton_yaml == tekton_content
+            tekton_content = fixed_tekton_yaml
+        if converged:
+            self.converged_passes[passes] = self.converged_passes.get(passes, 0) + 1
+            log_entry += f"Converged: validation pass {passes} made no changes.\n"
+        else:
+            self.unconverged_files += 1
+            log_entry += f"Not converged: validation pass {passes} still made changes (validation.max_passes is {self.max_passes}).\n"
+        return tekton_content, log_entry + "--- End Second Report ---\n\n"
+
+    def _write_output(self, path, content, description, stage=None):
+        try:
+            with IOTimer(self.metrics, 'write', stage) as timer, open(path, 'w') as output_file:
+                timer.nbytes = output_file.write(content)
+            if os.path.exists(path + PARTIAL_SUFFIX):
+                os.remove(path + PARTIAL_SUFFIX)
+            logger.info(f"Successfully saved {description}: {path}")
+            return True
+        except IOError as e:
+            logger.error(f"Failed to save {description} {path}: {e}")
+            return False
+
+    async def _append_log(self, entry, description):
+        async with self._log_lock:
+            try:
+                with IOTimer(self.metrics, 'log') as timer, open(self.errors_log_path, 'a') as log_file:
+                    timer.nbytes = log_file.write(entry)
+                logger.info(f"{description} appended to {self.errors_log_path}")
+            except IOError as e:
+                logger.error(f"Failed to append {description} to {self.errors_log_path}: {e}")
+
+    def _reuse(self, jenkins_file, stage, input_content):
+        """
+        Return (content, path) of a reusable previous artifact, else (None, None).
+
+        In worker mode that is a stage an earlier lease of the file already finished in
+        this run; in incremental mode, a stage the manifest says is unchanged.
+        """
+        item = self._leases.get(jenkins_file)
+        if item is not None and stage in item.stages_done:
+            path = self._output_paths(self._base_name(jenkins_file))[stage]
+            try:
+                with open(path, 'r') as artifact_file:
+                    content = artifact_file.read()
+                logger.info(f"Resuming {jenkins_file} after {stage}, finished by an earlier lease: {path}")
+                self._record_result(jenkins_file, stage, input_content, path, content, reused=True)
+                return content, path
+            except IOError as e:
+                logger.warning(f"Checkpointed {stage} output of {jenkins_file} is unreadable ({e}); running it again")
+        if not self.incremental or self.manifest is None:
+            return None, None
+        content, path = self.manifest.reusable(jenkins_file, stage, self._prompt_hash(stage), input_content)
+        if content is not None:
+            logger.info(f"Reusing unchanged {stage} output for {jenkins_file}: {path}")
+            self._record_result(jenkins_file, stage, input_content, path, content, reused=True)
+        return content, path
+
+    def _record(self, jenkins_file, stage, input_content, artifact_path, artifact_content):
+        if self.manifest is not None:
+            self.manifest.record_stage(jenkins_file, stage, self._prompt_hash(stage), input_content,
+                                       artifact_path, artifact_content, self.run_number)
+        item = self._leases.get(jenkins_file)
+        if item is not None:
+            self.work_queue.checkpoint(item, stage)
+        self._record_result(jenkins_file, stage, input_content, artifact_path, artifact_content)
+
+    def _record_result(self, jenkins_file, stage, input_content, artifact_path, artifact_content, reused=False):
+        """
+        Add a stage's artifact to the results store and tell the file's stage listener,
+        timed from the end of the file's previous stage.
+        """
+        now = time.perf_counter()
+        seconds = now - self._stage_started.get(jenkins_file, now)
+        self._stage_started[jenkins_file] = now
+        if self.results is not None:
+            prompt_name = self._prompt_name(stage)
+            self.results.record_stage(self.run_number, jenkins_file, stage, prompt_name,
+                                      self.context.prompts.get(prompt_name), input_content, artifact_content, seconds)
+        listener = self._stage_listeners.get(jenkins_file)
+        if listener is not None:
+            listener(jenkins_file, stage, artifact_path, artifact_content, seconds, reused)
+
+    def _base_name(self, jenkins_file):
+        return output_name(jenkins_file, self.input_dir)
+
+    def _output_paths(self, base_filename):
+        """Output paths of a file's stages, keyed by stage."""
+        run_number = self.run_number
+        return {
+            STAGE_JENKINS2JSON: os.path.join(self.output_dir, f"{run_number}-{base_filename}.json"),
+            STAGE_JSON2TEKTON: os.path.join(self.output_dir, f"{run_number}-{base_filename}-tekton-pipeline.yaml"),
+            STAGE_VALIDATE: os.path.join(self.output_dir, f"{run_number}-validated-{base_filename}-tekton-pipeline.yaml"),
+            STAGE_FIX: os.path.join(self.output_dir, f"{run_number}-validated2-{base_filename}-tekton-pipeline.yaml"),
+        }
+
+    async def process_file(self, jenkins_file):
+        """
+        Run the full conversion chain for one Jenkins file and save its outputs.
+
+        In incremental mode each stage whose input and prompt are unchanged since the
+        recorded run reuses its previous artifact, so the chain re-enters at the first
+        stage that actually changed. A file whose content is identical to a file already
+        converted in this run gets copies of that file's outputs, renamed after itself.
+
+        :param jenkins_file: Path to the Jenkins file
+        :return: True if the chain reached the second validation, False otherwise
+        """
+        logger.info(f"--- Processing file: {jenkins_file} (Run: {self.run_number}) ---")
+        current_file.set(jenkins_file)
+        try:
+            with IOTimer(self.metrics, 'read', STAGE_JENKINS2JSON) as timer:
+                if self.source is not None:
+                    jenkins_content = self.source.read(jenkins_file)
+                else:
+                    with open(jenkins_file, 'r') as file:
+                        jenkins_content = file.read()
+                timer.nbytes = len(jenkins_content)
+        except IOError as e:
+            logger.error(f"Failed to read {jenkins_file}: {e}")
+            logger.info(f"--- Finished processing file: {jenkins_file} ---")
+            return False
+
+        digest = sha256_text(jenkins_content)
+        if digest in self._file_outputs:
+            return await self._copy_duplicate(jenkins_file, jenkins_content, *self._file_outputs[digest])
+        first = asyncio.get_running_loop().create_future()
+        self._file_outputs[digest] = (jenkins_file, first)
+        self._evict_file_outputs()
+        outputs = {}
+        ok = False
+        try:
+            ok = await self._convert_file(jenkins_file, jenkins_content, outputs)
+            return ok
+        finally:
+            first.set_result(outputs if ok else None)
+            if not ok and self.max_file_outputs is not None and self._file_outputs.get(digest, (None, None))[1] is first:
+                # A server converts failed content again in later jobs, e.g. once the provider recovers
+                del self._file_outputs[digest]
+
+    def _evict_file_outputs(self):
+        """Keep at most max_file_outputs entries, dropping the oldest finished ones; files in flight stay."""
+        if self.max_file_outputs is None:
+            return
+        excess = len(self._file_outputs) - self.max_file_outputs
+        if excess <= 0:
+            return
+        finished = [digest for digest, (_, future) in self._file_outputs.items() if future.done()]
+        for digest in finished[:excess]:
+            del self._file_outputs[digest]
+
+    async def _copy_duplicate(self, jenkins_file, jenkins_content, original_file, original_outputs):
+        """Save the outputs of an identical file converted earlier in this run under this file's name."""
+        try:
+            outputs = await asyncio.shield(original_outputs)
+            if outputs is None:
+                logger.warning(f"Skipping {jenkins_file}: it is identical to {original_file}, whose conversion failed")
+                return False
+            logger.info(f"{jenkins_file} is identical to {original_file}; reusing its outputs")
+            self.duplicate_files += 1
+            original_name = self._base_name(original_file)
+            base_filename = self._base_name(jenkins_file)
+            paths = self._output_paths(base_filename)
+            input_content = jenkins_content
+            for stage in STAGES:
+                if stage not in outputs:
+                    break
+                content = outputs[stage]
+                if stage != STAGE_JENKINS2JSON:
+                    content = rename_pipeline(content, original_name, base_filename)
+                if not self._write_output(paths[stage], content, f"{stage} output (duplicate of {original_file})", stage):
+                    return False
+                self._record(jenkins_file, stage, input_content, paths[stage], content)
+                input_content = content
+            return True
+        finally:
+            logger.info(f"--- Finished processing file: {jenkins_file} ---")
+
+    async def _convert_file(self, jenkins_file, jenkins_content, outputs):
+        """
+        Run the conversion chain on a file's content.
+
+        :param jenkins_file: Path to the Jenkins file
+        :param jenkins_content: Its content
+        :param outputs: Dict filled with each stage's output content, keyed by stage
+        :return: True if the chain reached the second validation, False otherwise
+        """
+        run_number = self.run_number
+        base_filename = self._base_name(jenkins_file)
+        paths = self._output_paths(base_filename)
+        json_output_path = paths[STAGE_JENKINS2JSON]
+        initial_tekton_output_path = paths[STAGE_JSON2TEKTON]
+        validated_output_file_path = paths[STAGE_VALIDATE]
+        validated2_output_file_path = paths[STAGE_FIX]
+
+        try:
+            json_content_str, reused_path = self._reuse(jenkins_file, STAGE_JENKINS2JSON, jenkins_content)
+            if json_content_str is None:
+                json_content_str = await self.convert_jenkins_to_json(jenkins_content, partial_path=json_output_path + PARTIAL_SUFFIX)
+                if not json_content_str:
+                    logger.warning(f"Skipping file {jenkins_file} due to empty JSON conversion result.")
+                    return False
+                if not self._write_output(json_output_path, json_content_str, "intermediate JSON", STAGE_JENKINS2JSON):
+                    return False
+                self._record(jenkins_file, STAGE_JENKINS2JSON, jenkins_content, json_output_path, json_content_str)
+            outputs[STAGE_JENKINS2JSON] = json_content_str
+
+            tekton_content, reused_path = self._reuse(jenkins_file, STAGE_JSON2TEKTON, json_content_str)
+            if tekton_content is None:
+                tekton_content = await self.convert_json_to_tekton(json_content_str, name=base_filename,
+                                                                   partial_path=initial_tekton_output_path + PARTIAL_SUFFIX)
+                if not tekton_content:
+                    logger.warning(f"Skipping Tekton conversion for {jenkins_file} due to empty Tekton content result.")
+                    return False
+                tekton_content = self._optimize(tekton_content, jenkins_file)
+                if not self._write_output(initial_tekton_output_path, tekton_content, "initial Tekton file", STAGE_JSON2TEKTON):
+                    return False
+                self._record(jenkins_file, STAGE_JSON2TEKTON, json_content_str, initial_tekton_output_path, tekton_content)
+            else:
+                initial_tekton_output_path = reused_path
+            outputs[STAGE_JSON2TEKTON] = tekton_content
+
+            fixed_tekton_yaml, reused_path = self._reuse(jenkins_file, STAGE_VALIDATE, tekton_content)
+            if fixed_tekton_yaml is None:
+                validation_report, fixed_tekton_yaml = await self.validate_tekton_pipeline(tekton_content, initial_tekton_output_path)
+                log_entry = f"--- Validation Report for Run {run_number}, File: {initial_tekton_output_path} ---\n"
+                if validation_report:
+                    log_entry += validation_report + "\n"
+                else:
+                    log_entry += f"Validation failed or no report generated. Check previous logs for errors related to {initial_tekton_output_path}.\n"
+                log_entry += "--- End Report ---\n\n"
+                await self._append_log(log_entry, f"Validation report for {initial_tekton_output_path}")
+
+                if not fixed_tekton_yaml or fixed_tekton_yaml.startswith('# Fixed YAML missing'):
+                    logger.warning(f"No valid fixed Tekton YAML provided or validation failed for {initial_tekton_output_path}. Skipping save for validated file and subsequent second validation.")
+                    if self.manifest is not None:
+                        self.manifest.clear_stage(jenkins_file, STAGE_VALIDATE)
+                    return False
+                if not self._write_output(validated_output_file_path, fixed_tekton_yaml, "validated Tekton file", STAGE_VALIDATE):
+                    return False
+                self._record(jenkins_file, STAGE_VALIDATE, tekton_content, validated_output_file_path, fixed_tekton_yaml)
+            else:
+                validated_output_file_path = reused_path
+            outputs[STAGE_VALIDATE] = fixed_tekton_yaml
+
+            reused_fix, reused_path = self._reuse(jenkins_file, STAGE_FIX, fixed_tekton_yaml)
+            if reused_fix is not None:
+                outputs[STAGE_FIX] = reused_fix
+                return True
+
+            fixed_tekton_yaml_2, log_entry_2 = await self._fix_passes(
+                fixed_tekton_yaml, validated_output_file_path, converged=fixed_tekton_yaml == tekton_content
+            )
+            await self._append_log(log_entry_2, f"Second validation report for {validated_output_file_path}")
+
+            if fixed_tekton_yaml_2 and not fixed_tekton_yaml_2.startswith('# Fixed YAML missing'):
+                if self._write_output(validated2_output_file_path, fixed_tekton_yaml_2, "second validated Tekton file", STAGE_FIX):
+                    self._record(jenkins_file, STAGE_FIX, fixed_tekton_yaml, validated2_output_file_path, fixed_tekton_yaml_2)
+                    outputs[STAGE_FIX] = fixed_tekton_yaml_2
+            else:
+                logger.warning(f"No valid fixed Tekton YAML provided from second validation for {validated_output_file_path}. Skipping save for validated2 file.")
+                if self.manifest is not None:
+                    self.manifest.clear_stage(jenkins_file, STAGE_FIX)
+            return True
+
+        except Exception as e:
+            logger.error(f"An unexpected error occurred processing file {jenkins_file}: {e}", exc_info=True)
+            return False
+
+        finally:
+            logger.info(f"--- Finished processing file: {jenkins_file} ---")
+
+    async def _process_and_checkpoint(self, jenkins_file):
+        start = time.perf_counter()
+        self._stage_started[jenkins_file] = start
+        ok = await self.process_file(jenkins_file)
+        seconds = time.perf_counter() - start
+        self.metrics.record_file(jenkins_file, seconds, ok)
+        del self._stage_started[jenkins_file]
+        if self.results is not None:
+            self.results.record_file(self.run_number, jenkins_file, ok, seconds)
+        self._finished_files += 1
+        if self.manifest is not None and self._finished_files % MANIFEST_CHECKPOINT_EVERY == 0:
+            self.manifest.save()
+        return ok
+
+    async def run(self, jenkins_files):
+        """
+        Process all files concurrently, up to files_in_flight at a time.
+
+        A list is handed out directly. Any other iterable (e.g. JenkinsfileSource.iter_files())
+        is consumed in a thread, so conversion starts with the first file found while the
+        rest of the tree is still being walked.
+
+        :param jenkins_files: Iterable of Jenkins file paths
+        :return: Number of files whose chain completed
+        """
+        self._init_loop_state()
+        files = asyncio.Queue(maxsize=self.files_in_flight)
+        try:
+            work = asyncio.gather(self._feed(jenkins_files, files),
+                                  *(self._file_slot(files) for _ in range(self.files_in_flight)))
+            results = await (self.batch.run_until_complete(work) if self.batch is not None else work)
+        finally:
+            await self._finish_run()
+        return sum(results[1:])
+
+    async def _feed(self, jenkins_files, files):
+        """Put the files on the queue as they come, then one end marker per slot."""
+        if isinstance(jenkins_files, (list, tuple)):
+            for path in jenkins_files:
+                await files.put(path)
+        else:
+            loop = asyncio.get_running_loop()
+            stop = threading.Event()
+
+            def produce():
+                for path in jenkins_files:
+                    put = asyncio.run_coroutine_threadsafe(files.put(path), loop)
+                    while True:
+                        try:
+                            put.result(timeout=0.5)
+                            break
+                        except concurrent.futures.TimeoutError:
+                            if stop.is_set():
+                                put.cancel()
+                                return
+            try:
+                await asyncio.to_thread(produce)
+            finally:
+                # Lets the discovery thread stop if the run is cancelled
+                stop.set()
+        for _ in range(self.files_in_flight):
+            await files.put(None)
+        return 0
+
+    async def _file_slot(self, files):
+        completed = 0
+        while True:
+            path = await files.get()
+            if path is None:
+                return completed
+            completed += 1 if await self._process_and_checkpoint(path) else 0
+
+    def start(self):
+        """Prepare a long-running pipeline (server mode, prompt evaluation) inside the running event loop."""
+        self._init_loop_state()
+        # Identical requests are shared while in flight, then answered by the LLM cache
+        self.retain_requests = False
+        self.max_file_outputs = SERVER_MAX_FILE_OUTPUTS
+        self.metrics.bound(SERVER_MAX_LATENCY_SAMPLES, SERVER_MAX_METRIC_FILES)
+
+    async def convert(self, jenkins_file, on_stage=None):
+        """
+        Convert one file in a pipeline prepared with start(), e.g. for a server job.
+
+        :param jenkins_file: File path or identifier readable through the pipeline's source
+        :param on_stage: Optional callable(jenkins_file, stage, artifact_path, artifact_content, seconds, reused)
+                         called as each stage finishes
+        :return: True if the chain reached the second validation
+        """
+        if on_stage is not None:
+            self._stage_listeners[jenkins_file] = on_stage
+        try:
+            return await self._process_and_checkpoint(jenkins_file)
+        finally:
+            self._stage_listeners.pop(jenkins_file, None)
+
+    async def finish(self):
+        """Close a pipeline prepared with start()."""
+        await self._finish_run()
+
+    async def run_worker(self, work_queue):
+        """
+        Convert files leased from a shared WorkQueue until the run has none left.
+
+        Up to work_queue.files_in_flight files are converted at once. When no file is
+        pending but other workers still hold leases, the worker waits: their files come
+        back to the queue if their leases expire.
+
+        :param work_queue: WorkQueue with an opened run
+        :return: Number of files whose chain this worker completed
+        """
+        self._init_loop_state()
+        self.work_queue = work_queue
+        work_queue.start_heartbeat()
+        try:
+            work = asyncio.gather(*(self._worker_slot(work_queue) for _ in range(work_queue.files_in_flight)))
+            results = await (self.batch.run_until_complete(work) if self.batch is not None else work)
+        finally:
+            try:
+                await self._finish_run()
+            finally:
+                work_queue.stop_heartbeat()
+        return sum(results)
+
+    async def _worker_slot(self, work_queue):
+        completed = 0
+        while True:
+            item = await asyncio.to_thread(work_queue.lease)
+            if item is None:
+                if await asyncio.to_thread(work_queue.finish_if_idle):
+                    return completed
+                await asyncio.sleep(work_queue.poll_interval)
+                continue
+            logger.info(f"Leased {item.file} (attempt {item.attempt}, finished stages: {', '.join(item.stages_done) or 'none'})")
+            self._leases[item.file] = item
+            try:
+                ok = await self._process_and_checkpoint(item.file)
+            finally:
+                del self._leases[item.file]
+            await asyncio.to_thread(work_queue.complete, item, ok, None if ok else "Conversion chain did not complete")
+            completed += 1 if ok else 0
+
+    async def _finish_run(self):
+        """Close the clients, save the manifest and log and record the run statistics."""
+        await self.context.aclose()
+        if self.manifest is not None:
+            self.manifest.save()
+        if self.results is not None:
+            self.results.finish_run(self.run_number)
+        if self.stream_aborts:
+            logger.info(f"Streaming: {self.stream_aborts} answers aborted early and retried")
+        if self.converged_passes or self.unconverged_files:
+            passes_text = ", ".join(f"{count} after pass {passes}" for passes, count in sorted(self.converged_passes.items()))
+            logger.info(f"Validation passes: converged {passes_text or 'none'}; "
+                        f"{self.unconverged_files} still changing after {self.max_passes} passes")
+        if self.optimization['pipelines']:
+            logger.info(f"Pipeline optimization: critical paths {self.optimization['critical_path_before']} -> "
+                        f"{self.optimization['critical_path_after']} tasks over {self.optimization['pipelines']} pipelines, "
+                        f"{self.optimization['run_after_removed']} runAfter edges removed, "
+                        f"{self.optimization['cache_workspaces']} cache workspaces added")
+        hedges = self.hedging.counters()
+        if hedges['hedged_requests'] or hedges['hedges_skipped'] or hedges['deadline_timeouts']:
+            logger.info(f"Hedging: {hedges['hedged_requests']} hedged requests, {hedges['hedge_wins']} answered by the hedge first, "
+                        f"{hedges['hedges_skipped']} skipped for lack of a free slot, "
+                        f"{hedges['deadline_timeouts']} requests past their stage deadline")
+        if self.shared_requests or self.duplicate_files:
+            logger.info(f"Reuse within run: {self.shared_requests} requests shared with an identical request, "
+                        f"{self.duplicate_files} files copied from an identical file")
+        if self.rate_limiter is not None and (self.retries or self.rate_limiter.waited_seconds):
+            logger.info(f"Rate limiting: {self.retries} retries, {self.rate_limiter.pauses} provider pauses, "
+                        f"{self.rate_limiter.waited_seconds:.1f}s spent waiting for budget")
+        if self.cache is not None:
+            self.cache.prune()
+            logger.info(f"LLM cache stats: {self.cache.stats()}")
+        router = self.context.models
+        router.save()
+        if router.escalations or router.routed:
+            logger.info(f"Model routing: {sum(router.escalations.values())} escalations "
+                        f"({', '.join(f'{stage}: {count}' for stage, count in sorted(router.escalations.items())) or 'none'}), "
+                        f"{router.routed} requests started at a stronger model that worked for similar input")
+        self._record_run_counters()
+
+    def _record_run_counters(self):
+        counters = {
+            'retries': self.retries,
+            'shared_requests': self.shared_requests,
+            'duplicate_files': self.duplicate_files,
+            'stream_aborts': self.stream_aborts,
+            'validation_unconverged_files': self.unconverged_files,
+            'optimized_pipelines': self.optimization['pipelines'],
+            'run_after_edges_removed': self.optimization['run_after_removed'],
+            'critical_path_tasks_before': self.optimization['critical_path_before'],
+            'critical_path_tasks_after': self.optimization['critical_path_after'],
+            'cache_workspaces_added': self.optimization['cache_workspaces'],
+            **self.hedging.counters(),
+        }
+        for passes, count in self.converged_passes.items():
+            counters[f"validation_converged_pass_{passes}_files"] = count
+        if self.rate_limiter is not None:
+            counters['rate_limit_pauses'] = self.rate_limiter.pauses
+            counters['rate_limit_wait_seconds'] = round(self.rate_limiter.waited_seconds, 3)
+        if self.cache is not None:
+            cache_stats = self.cache.stats()
+            counters['cache_hits'] = cache_stats['hits']
+            counters['cache_misses'] = cache_stats['misses']
+        router = self.context.models
+        counters['model_routed_requests'] = router.routed
+        for stage, count in router.escalations.items():
+            counters[f"model_escalations_{stage}"] = count
+        if self.work_queue is not None:
+            for status, count in self.work_queue.counts().items():
+                counters[f"queue_{status}_files"] = count
+        if self.batch is not None:
+            counters['batches_submitted'] = self.batch.submitted
+            counters['batches_resumed'] = self.batch.resumed
+        for name, value in counters.items():
+            self.metrics.set_counter(name, value)
+        self.metrics.finish()
@@ -0,0 +1,289 @@
+import os
+import json
+import asyncio
+import logging
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+BATCH_STATE_FILENAME = "batch_state.json"
+BATCH_ENDPOINT = "/v1/chat/completions"
+# Batch statuses after which the batch will not change any more
+TERMINAL_STATUSES = ('completed', 'failed', 'expired', 'cancelled')
+DEFAULT_POLL_INTERVAL_SECONDS = 30
+DEFAULT_COLLECT_WINDOW_SECONDS = 1.0
+DEFAULT_COMPLETION_WINDOW = "24h"
+
+
+class BatchRequestError(RuntimeError):
+    """Raised for a request that a batch did not answer successfully."""
+
+
+def _as_dict(obj):
+    """Normalise an SDK model or a raw JSON response to a dict."""
+    if isinstance(obj, dict):
+        return obj
+    if hasattr(obj, 'model_dump'):
+        return obj.model_dump()
+    return dict(obj)
+
+
+class BatchScheduler:
+    """
+    Sends LLM requests through the OpenAI Batch API instead of one call per request.
+
+    Conversion coroutines call request() and wait. Once no new requests have arrived
+    for a collect window, the pending requests of each stage are written to a JSONL
+    file, uploaded and submitted as one batch. The batches are polled until they
+    finish and each waiting coroutine gets its result. The coroutines then move on to
+    their next stage, and those requests make up the next round of batches.
+
+    Every submitted batch and every downloaded output file is recorded in
+    batch_state.json in the batch directory. A rerun after an interruption attaches to
+    batches that were still running, instead of submitting the same requests again.
+    Batches an earlier run already collected are dropped from the state, with their
+    files: their accepted answers are in the LLM cache. Requests are identified by their
+    cache key, so the same request maps to the same custom_id in every run.
+    """
+
+    def __init__(self, context, batch_dir, run_number, poll_interval=DEFAULT_POLL_INTERVAL_SECONDS,
+                 collect_window=DEFAULT_COLLECT_WINDOW_SECONDS, completion_window=DEFAULT_COMPLETION_WINDOW):
+        """
+        :param context: ConverterContext providing the async client
+        :param batch_dir: Directory for batch input/output files and the state file
+        :param run_number: The current execution run number, used in file names
+        :param poll_interval: Seconds between status checks of a running batch
+        :param collect_window: Seconds without new requests before pending requests are submitted
+        :param completion_window: Batch API completion window
+        """
+        self.context = context
+        self.batch_dir = batch_dir
+        self.run_number = run_number
+        self.poll_interval = poll_interval
+        self.collect_window = collect_window
+        self.completion_window = completion_window
+        self.state_path = os.path.join(batch_dir, BATCH_STATE_FILENAME)
+        self.batches = {}
+        self.results = {}
+        # Token usage reported for each answered request
+        self.usage = {}
+        self._errors = {}
+        self._pending = {}
+        self.submitted = 0
+        self.resumed = 0
+        os.makedirs(batch_dir, exist_ok=True)
+        self._load_state()
+
+    # --- State on disk ---
+
+    def _load_state(self):
+        if not os.path.exists(self.state_path):
+            return
+        try:
+            with open(self.state_path, 'r') as state_file:
+                self.batches = json.load(state_file).get('batches', {})
+        except (IOError, ValueError) as e:
+            logger.error(f"Failed to read batch state {self.state_path}: {e}. Starting without recorded batches.")
+            return
+        collected = [batch_id for batch_id, record in self.batches.items() if record.get('collected')]
+        for batch_id in collected:
+            record = self.batches.pop(batch_id)
+            for name in [record.get('input_file')] + record.get('output_files', []):
+                if not name:
+                    continue
+                try:
+                    os.remove(os.path.join(self.batch_dir, name))
+                except FileNotFoundError:
+                    pass
+                except OSError as e:
+                    logger.warning(f"Failed to remove batch file {name}: {e}")
+        if collected:
+            self._save_state()
+        for record in self.batches.values():
+            for output_file in record.get('output_files', []):
+                try:
+                    with open(os.path.join(self.batch_dir, output_file), 'r') as output:
+                        self._ingest(output.read())
+                except IOError as e:
+                    logger.warning(f"Failed to read batch output {output_file}: {e}")
+        logger.info(f"Loaded batch state: {len(self.batches)} batches not yet collected, {len(collected)} collected ones removed")
+
+    def _save_state(self):
+        tmp_path = f"{self.state_path}.tmp"
+        try:
+            with open(tmp_path, 'w') as state_file:
+                json.dump({'batches': self.batches}, state_file, indent=2, sort_keys=True)
+            os.replace(tmp_path, self.state_path)
+        except (IOError, OSError) as e:
+            logger.error(f"Failed to write batch state {self.state_path}: {e}")
+
+    def _ingest(self, text):
+        """Store the results of a batch output (or error) file."""
+        for line in text.splitlines():
+            if not line.strip():
+                continue
+            try:
+                item = json.loads(line)
+            except ValueError:
+                logger.warning(f"Skipping malformed batch output line: {line[:200]}")
+                continue
+            custom_id = item.get('custom_id')
+            response = item.get('response') or {}
+            if response.get('status_code') == 200 and not item.get('error'):
+                try:
+                    self.results[custom_id] = response['body']['choices'][0]['message']['content'].strip()
+                    self.usage[custom_id] = response['body'].get('usage')
+                    continue
+                except (KeyError, IndexError, TypeError, AttributeError):
+                    self._errors[custom_id] = "response has no message content"
+                    continue
+            error = item.get('error') or (response.get('body') or {}).get('error') or {}
+            self._errors[custom_id] = error.get('message') if isinstance(error, dict) else str(error)
+
+    # --- Requests ---
+
+    async def request(self, custom_id, stage, body):
+        """
+        Queue one chat completion and wait for its batch to finish.
+
+        :param custom_id: Stable request id (the cache key)
+        :param stage: Stage name; each stage is submitted as its own batch
+        :param body: Chat completion request body
+        :return: The stripped message content
+        :raises BatchRequestError: If the batch did not answer the request
+        """
+        if custom_id in self.results:
+            return self.results[custom_id]
+        future = asyncio.get_running_loop().create_future()
+        entry = self._pending.setdefault(custom_id, {'stage': stage, 'body': body, 'futures': []})
+        entry['futures'].append(future)
+        return await future
+
+    async def run_until_complete(self, awaitable):
+        """
+        Drive the conversion coroutines, flushing pending requests whenever they all wait.
+
+        :param awaitable: The gathered conversion coroutines
+        :return: Their result
+        """
+        task = asyncio.ensure_future(awaitable)
+        last_count = -1
+        while not task.done():
+            await asyncio.wait({task}, timeout=self.collect_window)
+            count = len(self._pending)
+            if count and count == last_count:
+                await self._flush()
+                last_count = -1
+            else:
+                last_count = count
+        logger.info(f"Batch mode finished: {self.submitted} batches submitted, {self.resumed} resumed from a previous run")
+        return task.result()
+
+    async def _flush(self):
+        snapshot, self._pending = self._pending, {}
+        try:
+            by_stage = {}
+            for custom_id, entry in snapshot.items():
+                by_stage.setdefault(entry['stage'], {})[custom_id] = entry
+            batch_ids = set()
+            for stage, entries in by_stage.items():
+                remaining = dict(entries)
+                # Attach to batches an interrupted run submitted but never collected
+                for batch_id, record in self.batches.items():
+                    if record.get('collected') or record.get('status') in ('failed', 'expired', 'cancelled'):
+                        continue
+                    overlap = remaining.keys() & set(record.get('custom_ids', []))
+                    if overlap:
+                        logger.info(f"Resuming {stage} batch {batch_id} for {len(overlap)} requests")
+                        batch_ids.add(batch_id)
+                        self.resumed += 1
+                        for custom_id in overlap:
+                            remaining.pop(custom_id)
+                if remaining:
+                    batch_ids.add(await self._submit(stage, remaining))
+            await asyncio.gather(*(self._wait_and_collect(batch_id) for batch_id in batch_ids))
+        except Exception as e:
+            logger.error(f"Batch submission failed: {e}", exc_info=True)
+            for custom_id, entry in snapshot.items():
+                self._errors.setdefault(custom_id, f"batch submission failed: {e}")
+
+        for custom_id, entry in snapshot.items():
+            for future in entry['futures']:
+                if future.done():
+                    continue
+                if custom_id in self.results:
+                    future.set_result(self.results[custom_id])
+                else:
+                    reason = self._errors.get(custom_id, "no result in batch output")
+                    future.set_exception(BatchRequestError(f"Batch request {custom_id[:12]} ({entry['stage']}) failed: {reason}"))
+
+    async def _submit(self, stage, entries):
+        timestamp = datetime.now().strftime('%Y%m%d%H%M%S%f')
+        input_name = f"{self.run_number}-{stage}-{timestamp}.jsonl"
+        input_path = os.path.join(self.batch_dir, input_name)
+        with open(input_path, 'w') as input_file:
+            for custom_id, entry in entries.items():
+                input_file.write(json.dumps({"custom_id": custom_id, "method": "POST",
+                                             "url": BATCH_ENDPOINT, "body": entry['body']}) + "\n")
+        with open(input_path, 'rb') as input_file:
+            content = input_file.read()
+
+        client = self.context.async_client
+        uploaded = await client.files.create(file=(input_name, content), purpose="batch")
+        request = {"input_file_id": uploaded.id, "endpoint": BATCH_ENDPOINT,
+                   "completion_window": self.completion_window,
+                   "metadata": {"stage": stage, "run_number": str(self.run_number)}}
+        if hasattr(client, 'batches'):
+            batch = _as_dict(await client.batches.create(**request))
+        else:
+            batch = _as_dict(await client.post('/batches', body=request, cast_to=object))
+
+        self.batches[batch['id']] = {
+            'stage': stage,
+            'run_number': self.run_number,
+            'input_file': input_name,
+            'input_file_id': uploaded.id,
+            'custom_ids': list(entries),
+            'status': batch.get('status'),
+            'submitted': datetime.now().isoformat(timespec='seconds'),
+            'output_files': [],
+            'collected': False,
+        }
+        self._save_state()
+        self.submitted += 1
+        logger.info(f"Submitted {stage} batch {batch['id']} with {len(entries)} requests ({input_path})")
+        return batch['id']
+
+    async def _retrieve(self, batch_id):
+        client = self.context.async_client
+        if hasattr(client, 'batches'):
+            return _as_dict(await client.batches.retrieve(batch_id))
+        return _as_dict(await client.get(f"/batches/{batch_id}", cast_to=object))
+
+    async def _wait_and_collect(self, batch_id):
+        record = self.batches[batch_id]
+        while True:
+            batch = await self._retrieve(batch_id)
+            status = batch.get('status')
+            if status != record.get('status'):
+                record['status'] = status
+                self._save_state()
+                logger.info(f"{record['stage']} batch {batch_id}: {status} {batch.get('request_counts') or ''}")
+            if status in TERMINAL_STATUSES:
+                break
+            await asyncio.sleep(self.poll_interval)
+
+        for key, suffix in (('output_file_id', 'output'), ('error_file_id', 'errors')):
+            file_id = batch.get(key)
+            if not file_id:
+                continue
+            content = await self.context.async_client.files.content(file_id)
+            output_name = f"{batch_id}.{suffix}.jsonl"
+            with open(os.path.join(self.batch_dir, output_name), 'w') as output_file:
+                output_file.write(content.text)
+            record['output_files'].append(output_name)
+            self._ingest(content.text)
+        if status != 'completed':
+            logger.error(f"{record['stage']} batch {batch_id} ended with status {status}: {batch.get('errors')}")
+        record['collected'] = True
+        self._save_state()
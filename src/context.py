@@ -0,0 +1,195 @@
+import os
+import hashlib
+import logging
+import yaml
+from llm_cache import ResponseCache
+from metrics import RunMetrics
+from model_router import ModelRouter
+
+logger = logging.getLogger(__name__)
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PROMPTS_DIR = os.path.join(PROJECT_ROOT, 'src', 'prompts')
+DEFAULT_CONFIG_PATH = os.path.join(PROJECT_ROOT, 'config.yaml')
+
+
+class PromptStore:
+    """
+    Loads every prompt file once and keeps its text and SHA-256 in memory.
+
+    With reload_on_change enabled, each lookup stats the file and re-reads it only when
+    its mtime or size changed, so long-running processes pick up prompt edits (for
+    example after --refine-prompt) without re-reading unchanged files.
+    """
+
+    def __init__(self, prompts_dir=PROMPTS_DIR, reload_on_change=False):
+        """
+        :param prompts_dir: Directory containing the *.txt prompt files
+        :param reload_on_change: If True, re-read a prompt when its file changes on disk
+        """
+        self.prompts_dir = prompts_dir
+        self.reload_on_change = reload_on_change
+        self._entries = {}
+
+    def load_all(self):
+        """Preload every *.txt prompt in the prompts directory."""
+        for entry in os.scandir(self.prompts_dir):
+            if entry.name.endswith('.txt') and entry.is_file():
+                self._load(entry.name)
+        logger.info(f"Loaded {len(self._entries)} prompts from {self.prompts_dir}")
+        return self
+
+    def path(self, name):
+        return os.path.join(self.prompts_dir, name)
+
+    def _load(self, name):
+        path = self.path(name)
+        stat = os.stat(path)
+        with open(path, 'r') as prompt_file:
+            text = prompt_file.read()
+        entry = {
+            'text': text,
+            'sha256': hashlib.sha256(text.encode('utf-8')).hexdigest(),
+            'signature': (stat.st_mtime_ns, stat.st_size),
+        }
+        self._entries[name] = entry
+        return entry
+
+    def _entry(self, name):
+        entry = self._entries.get(name)
+        if entry is None:
+            return self._load(name)
+        if self.reload_on_change:
+            try:
+                stat = os.stat(self.path(name))
+            except OSError:
+                return entry
+            if (stat.st_mtime_ns, stat.st_size) != entry['signature']:
+                logger.info(f"Prompt {name} changed on disk, reloading")
+                return self._load(name)
+        return entry
+
+    def get(self, name):
+        """
+        :param name: Prompt file name, e.g. 'jenkins2json.txt'
+        :return: The prompt text
+        """
+        return self._entry(name)['text']
+
+    def hash(self, name):
+        """
+        :param name: Prompt file name
+        :return: Hex SHA-256 of the prompt text
+        """
+        return self._entry(name)['sha256']
+
+    def invalidate(self, name=None):
+        """Forget one cached prompt (or all of them) so the next lookup re-reads it."""
+        if name is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(name, None)
+
+
+def resolve_api_key(config):
+    """
+    Return the OpenAI API key from the environment or config.yaml.
+
+    Environment references such as ${OPENAI_API_KEY} in config.yaml are expanded; a
+    reference that cannot be resolved counts as missing.
+    """
+    api_key = os.getenv('OPENAI_API_KEY')
+    if api_key:
+        return api_key
+    api_key = (config.get('openai') or {}).get('api_key')
+    if api_key:
+        api_key = os.path.expandvars(str(api_key))
+        if '${' in api_key or api_key.startswith('$'):
+            return None
+    return api_key or None
+
+
+class ConverterContext:
+    """
+    Shared state for one converter process.
+
+    Owns the parsed configuration, one lazily created OpenAI client (and one AsyncOpenAI
+    client) so HTTP connections are pooled across all calls, the preloaded prompts and
+    the LLM response cache, the model router and the run metrics. The openai package is only imported when a client is first
+    needed.
+    """
+
+    def __init__(self, config_path=None, cache_mode=None):
+        """
+        :param config_path: Path to config.yaml; defaults to the project root
+        :param cache_mode: Optional LLM cache mode overriding the config
+        """
+        self.config_path = config_path or DEFAULT_CONFIG_PATH
+        with open(self.config_path, 'r') as config_file:
+            self.config = yaml.safe_load(config_file)
+
+        self.api_key = resolve_api_key(self.config)
+        if not self.api_key:
+            raise ValueError("OpenAI API key is missing. Please set in .env or config.yaml")
+
+        prompts_config = self.config.get('prompts') or {}
+        self.prompts = PromptStore(reload_on_change=prompts_config.get('reload_on_change', False)).load_all()
+        self.cache = ResponseCache.from_config(self.config.get('cache'), PROJECT_ROOT, mode=cache_mode)
+        self.metrics = RunMetrics.from_config(self.config.get('metrics'))
+        self.models = ModelRouter.from_config(self.config, PROJECT_ROOT)
+        self._client = None
+        self._async_client = None
+
+    @property
+    def client(self):
+        """The shared synchronous OpenAI client, created on first use."""
+        if self._client is None:
+            from openai import OpenAI
+            # The synchronous helpers rely on the SDK's own retries (which honour Retry-After)
+            error_config = self.config.get('error_handling') or {}
+            self._client = OpenAI(api_key=self.api_key, max_retries=error_config.get('max_retries', 3),
+                                  timeout=error_config.get('request_timeout_seconds') or None)
+        return self._client
+
+    @property
+    def async_client(self):
+        """The shared AsyncOpenAI client, created on first use inside the running event loop."""
+        if self._async_client is None:
+            from openai import AsyncOpenAI
+            # Retries are done by the async pipeline's rate-aware scheduler, not the SDK
+            self._async_client = AsyncOpenAI(api_key=self.api_key, max_retries=0)
+        return self._async_client
+
+    async def aclose(self):
+        """Close the async client; a new one is created if it is needed again (e.g. in another event loop)."""
+        if self._async_client is not None:
+            await self._async_client.close()
+            self._async_client = None
+
+    def close(self):
+        """Close the synchronous client."""
+        if self._client is not None:
+            self._client.close()
+            self._client = None
+
+
+_default_context = None
+
+
+def get_default_context():
+    """
+    Return the process-wide ConverterContext, creating it on first use.
+
+    Used by the module-level helpers (validate_tekton_pipeline, refine_json2tekton_prompt)
+    when no context is passed, so repeated calls share one client and one prompt store.
+    """
+    global _default_context
+    if _default_context is None:
+        _default_context = ConverterContext()
+    return _default_context
+
+
+def set_default_context(context):
+    """Make an already constructed context the process-wide default."""
+    global _default_context
+    _default_context = context
@@ -0,0 +1,384 @@
+"""
+Long-running conversion server.
+
+`python3 src/converter.py --serve` starts one process that keeps the converter context
+warm: the pooled OpenAI clients, the loaded prompts, the LLM cache, the model routes and
+the pipeline's concurrency limits are shared by every job, so a job costs the model
+calls and not the interpreter start, imports, config parsing and client construction.
+All jobs belong to the run number the server took at startup.
+
+The server speaks HTTP/1.1 over TCP or a Unix socket:
+
+    POST /convert   {"name": "app.jenkinsfile", "content": "..."}
+                    or {"files": [{"name": ..., "content": ...}, ...]}
+                    Streams newline-delimited JSON events: "accepted", one "stage" event
+                    per finished stage of each file, one "file" event per file and "done".
+                    With "stream": false the events are returned as one JSON document.
+    GET  /health    Run number, uptime, jobs in flight and totals
+    GET  /metrics   The run metrics as Prometheus text
+
+`python3 src/conversion_server.py submit FILE...` is a small client for CI jobs.
+"""
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import logging
+import argparse
+import http.client
+
+from discovery import SEPARATOR
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+DEFAULT_MAX_BODY_BYTES = 32 * 1024 * 1024
+JOB_CONTAINER = "job"
+
+
+class JobSource:
+    """Source for the pipeline serving the content of submitted files from memory."""
+
+    def __init__(self):
+        self._contents = {}
+
+    def add(self, identifier, content):
+        self._contents[identifier] = content
+
+    def read(self, identifier):
+        try:
+            return self._contents.pop(identifier)
+        except KeyError:
+            raise FileNotFoundError(f"No submitted content for {identifier}")
+
+    def discard(self, identifier):
+        self._contents.pop(identifier, None)
+
+    def close(self):
+        self._contents = {}
+
+
+class HttpError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+_REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+            411: "Length Required", 413: "Payload Too Large", 500: "Internal Server Error"}
+
+
+class ConversionServer:
+    """Serves conversion jobs on a pipeline prepared with AsyncConversionPipeline.start()."""
+
+    def __init__(self, pipeline, source, include_content=True, max_body_bytes=DEFAULT_MAX_BODY_BYTES):
+        """
+        :param pipeline: AsyncConversionPipeline whose source is `source`
+        :param source: JobSource the submitted files are read from
+        :param include_content: Default for whether stage events carry the artifact content
+        :param max_body_bytes: Largest accepted request body
+        """
+        self.pipeline = pipeline
+        self.source = source
+        self.include_content = include_content
+        self.max_body_bytes = max_body_bytes
+        self.started = time.time()
+        self.jobs = 0
+        self.jobs_in_flight = 0
+        self.files = 0
+        self.files_completed = 0
+        self._servers = []
+
+    async def start(self, host=None, port=None, socket_path=None):
+        """
+        Start listening on a Unix socket and/or a TCP address.
+
+        :param host: TCP host (with port)
+        :param port: TCP port; None for no TCP listener
+        :param socket_path: Unix socket path; None for no socket
+        """
+        self.pipeline.start()
+        if socket_path:
+            if os.path.exists(socket_path):
+                os.remove(socket_path)
+            self._servers.append(await asyncio.start_unix_server(self._handle, path=socket_path))
+            logger.info(f"Conversion server listening on unix socket {socket_path}")
+        if port is not None:
+            self._servers.append(await asyncio.start_server(self._handle, host=host or DEFAULT_HOST, port=port))
+            logger.info(f"Conversion server listening on http://{host or DEFAULT_HOST}:{port}")
+
+    async def serve_forever(self, stop_event):
+        """Serve until stop_event is set, then close the listeners and finish the run."""
+        try:
+            await stop_event.wait()
+        finally:
+            for server in self._servers:
+                server.close()
+                await server.wait_closed()
+            logger.info(f"Conversion server stopping after {self.jobs} jobs ({self.files_completed}/{self.files} files completed)")
+            await self.pipeline.finish()
+
+    async def _handle(self, reader, writer):
+        try:
+            method, path, body = await self._read_request(reader)
+            if path == '/health' and method == 'GET':
+                await self._send_json(writer, 200, self.health())
+            elif path == '/metrics' and method == 'GET':
+                await self._send(writer, 200, self.pipeline.metrics.prometheus_text().encode('utf-8'),
+                                 'text/plain; version=0.0.4')
+            elif path == '/convert':
+                if method != 'POST':
+                    raise HttpError(405, "Use POST /convert")
+                await self._convert(writer, self._parse_job(body))
+            else:
+                raise HttpError(404, f"No route for {method} {path}")
+        except HttpError as e:
+            await self._send_json(writer, e.status, {'error': str(e)})
+        except (ConnectionError, asyncio.IncompleteReadError):
+            logger.info("Client disconnected")
+        except Exception as e:
+            logger.error(f"Error serving request: {e}", exc_info=True)
+            try:
+                await self._send_json(writer, 500, {'error': str(e)})
+            except ConnectionError:
+                pass
+        finally:
+            writer.close()
+
+    async def _read_request(self, reader):
+        request_line = (await reader.readline()).decode('latin-1').strip()
+        parts = request_line.split()
+        if len(parts) != 3:
+            raise HttpError(400, "Malformed request line")
+        method, target = parts[0].upper(), parts[1]
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        if method != 'POST':
+            return method, target.split('?', 1)[0], b''
+        if 'content-length' not in headers:
+            raise HttpError(411, "Content-Length is required")
+        length = int(headers['content-length'])
+        if length > self.max_body_bytes:
+            raise HttpError(413, f"Request body exceeds {self.max_body_bytes} bytes")
+        return method, target.split('?', 1)[0], await reader.readexactly(length)
+
+    def _parse_job(self, body):
+        try:
+            job = json.loads(body or b'{}')
+        except ValueError as e:
+            raise HttpError(400, f"Request body is not JSON: {e}")
+        if not isinstance(job, dict):
+            raise HttpError(400, "Request body must be a JSON object")
+        files = job.get('files')
+        if files is None and 'content' in job:
+            files = [{'name': job.get('name'), 'content': job['content']}]
+        if not isinstance(files, list) or not files:
+            raise HttpError(400, "Send 'content' (and 'name') or a non-empty 'files' list")
+        for index, entry in enumerate(files):
+            if not isinstance(entry, dict) or not isinstance(entry.get('content'), str):
+                raise HttpError(400, f"File {index} has no 'content' string")
+        return job
+
+    def health(self):
+        return {
+            'status': 'ok',
+            'run': self.pipeline.run_number,
+            'uptime_seconds': round(time.time() - self.started, 1),
+            'jobs': self.jobs,
+            'jobs_in_flight': self.jobs_in_flight,
+            'files': self.files,
+            'files_completed': self.files_completed,
+        }
+
+    async def _convert(self, writer, job):
+        """Run a job's files concurrently and write an event for every stage and file as it finishes."""
+        self.jobs += 1
+        job_id = f"job{self.jobs}"
+        include_content = job.get('include_content', self.include_content)
+        stream = job.get('stream', True)
+        start = time.perf_counter()
+        events = asyncio.Queue()
+        identifiers = {}
+        used = set()
+        for index, entry in enumerate(job['files']):
+            # Only the base name is used, so names cannot point outside the job
+            name = os.path.basename(str(entry.get('name') or f"Jenkinsfile{index or ''}"))
+            while name in used:
+                name = f"{index}-{name}"
+            used.add(name)
+            identifier = f"{JOB_CONTAINER}{SEPARATOR}{job_id}/{name}"
+            self.source.add(identifier, entry['content'])
+            identifiers[identifier] = name
+
+        def on_stage(identifier, stage, artifact_path, artifact_content, seconds, reused):
+            event = {'event': 'stage', 'job': job_id, 'file': identifiers[identifier], 'stage': stage,
+                     'path': artifact_path, 'seconds': round(seconds, 3), 'reused': reused}
+            if include_content:
+                event['content'] = artifact_content
+            events.put_nowait(event)
+
+        async def convert_one(identifier):
+            file_start = time.perf_counter()
+            event = {'event': 'file', 'job': job_id, 'file': identifiers[identifier], 'ok': False}
+            try:
+                event['ok'] = await self.pipeline.convert(identifier, on_stage)
+            except Exception as e:
+                # Reported as a failed file, so the other files of the job and the response carry on
+                logger.error(f"Job {job_id}: converting {identifiers[identifier]} failed: {e}", exc_info=True)
+                event['error'] = f"{e.__class__.__name__}: {e}"
+            finally:
+                self.source.discard(identifier)
+            event['seconds'] = round(time.perf_counter() - file_start, 3)
+            events.put_nowait(event)
+            return event['ok']
+
+        async def run_job():
+            self.jobs_in_flight += 1
+            self.files += len(identifiers)
+            results = []
+            try:
+                results = await asyncio.gather(*(convert_one(identifier) for identifier in identifiers))
+            finally:
+                self.jobs_in_flight -= 1
+                completed = sum(1 for ok in results if ok)
+                self.files_completed += completed
+                # Always end the event stream, or the client's response would never finish
+                events.put_nowait({'event': 'done', 'job': job_id, 'run': self.pipeline.run_number,
+                                   'files': len(identifiers), 'completed': completed,
+                                   'seconds': round(time.perf_counter() - start, 3)})
+                events.put_nowait(None)
+
+        logger.info(f"Job {job_id}: {len(identifiers)} files")
+        # The job runs to the end even if the client goes away; its outputs are still written
+        task = asyncio.ensure_future(run_job())
+        task.add_done_callback(lambda done: done.cancelled() or done.exception() is None or
+                               logger.error(f"Job {job_id} failed: {done.exception()}"))
+        accepted = {'event': 'accepted', 'job': job_id, 'run': self.pipeline.run_number,
+                    'files': list(identifiers.values())}
+        if not stream:
+            collected = [accepted]
+            while (event := await events.get()) is not None:
+                collected.append(event)
+            await self._send_json(writer, 200, {'events': collected})
+            return
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/x-ndjson\r\n"
+                     b"Transfer-Encoding: chunked\r\nConnection: close\r\n\r\n")
+        event = accepted
+        while event is not None:
+            line = (json.dumps(event) + "\n").encode('utf-8')
+            writer.write(f"{len(line):x}\r\n".encode('ascii') + line + b"\r\n")
+            await writer.drain()
+            event = await events.get()
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+
+    async def _send_json(self, writer, status, payload):
+        await self._send(writer, status, json.dumps(payload).encode('utf-8'), 'application/json')
+
+    async def _send(self, writer, status, body, content_type):
+        writer.write(f"HTTP/1.1 {status} {_REASONS.get(status, '')}\r\nContent-Type: {content_type}\r\n"
+                     f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode('latin-1') + body)
+        await writer.drain()
+
+
+# --- Client ---
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, socket_path, timeout=None):
+        super().__init__('localhost', timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+def connect(url=None, socket_path=None, timeout=None):
+    """:return: An HTTPConnection to the server's Unix socket or TCP address"""
+    if socket_path:
+        return UnixHTTPConnection(socket_path, timeout=timeout)
+    host, _, port = (url or f"{DEFAULT_HOST}:{DEFAULT_PORT}").replace('http://', '').rstrip('/').partition(':')
+    return http.client.HTTPConnection(host, int(port or DEFAULT_PORT), timeout=timeout)
+
+
+def submit(files, url=None, socket_path=None, include_content=True):
+    """
+    Send a job and yield its events as they arrive.
+
+    :param files: List of (name, content)
+    :return: Iterator of event dicts
+    """
+    connection = connect(url, socket_path)
+    body = json.dumps({'files': [{'name': name, 'content': content} for name, content in files],
+                       'include_content': include_content})
+    connection.request('POST', '/convert', body=body, headers={'Content-Type': 'application/json'})
+    response = connection.getresponse()
+    if response.status != 200:
+        raise RuntimeError(f"Server answered {response.status}: {response.read().decode('utf-8', 'replace')}")
+    try:
+        for line in response:
+            if line.strip():
+                yield json.loads(line)
+    finally:
+        connection.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Client for the conversion server (python3 src/converter.py --serve)")
+    parser.add_argument('--url', default=None, help=f"Server address (default: {DEFAULT_HOST}:{DEFAULT_PORT})")
+    parser.add_argument('--socket', default=None, help="Unix socket of the server (instead of --url)")
+    commands = parser.add_subparsers(dest='command', required=True)
+    submit_parser = commands.add_parser('submit', help="Convert Jenkins files and print the per-stage events")
+    submit_parser.add_argument('files', nargs='+')
+    submit_parser.add_argument('--output', default=None, help="Write each file's final Tekton YAML to this directory")
+    submit_parser.add_argument('--json', action='store_true', help="Print the raw events")
+    commands.add_parser('health', help="Print the server's status")
+    args = parser.parse_args()
+
+    if args.command == 'health':
+        connection = connect(args.url, args.socket, timeout=10)
+        connection.request('GET', '/health')
+        print(connection.getresponse().read().decode('utf-8'))
+        return 0
+
+    files = []
+    for path in args.files:
+        with open(path, 'r') as jenkins_file:
+            files.append((os.path.basename(path), jenkins_file.read()))
+    final = {}
+    failed = 0
+    for event in submit(files, args.url, args.socket, include_content=bool(args.output) or args.json):
+        if args.json:
+            print(json.dumps(event), flush=True)
+        elif event['event'] == 'stage':
+            print(f"{event['file']}: {event['stage']} {'reused' if event['reused'] else 'done'} "
+                  f"in {event['seconds']}s -> {event['path']}", flush=True)
+        elif event['event'] == 'file':
+            error = f" ({event['error']})" if event.get('error') else ""
+            print(f"{event['file']}: {'completed' if event['ok'] else 'FAILED'} in {event['seconds']}s{error}", flush=True)
+        elif event['event'] == 'done':
+            print(f"Run {event['run']}, {event['job']}: {event['completed']}/{event['files']} files completed "
+                  f"in {event['seconds']}s", flush=True)
+        if event['event'] == 'stage' and 'content' in event:
+            final[event['file']] = event['content']
+        if event['event'] == 'file' and not event['ok']:
+            failed += 1
+    if args.output:
+        os.makedirs(args.output, exist_ok=True)
+        for name, content in final.items():
+            with open(os.path.join(args.output, f"{os.path.splitext(name)[0]}-tekton-pipeline.yaml"), 'w') as output_file:
+                output_file.write(content)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,15 +1,33 @@
 import os
-import yaml
 import logging
 import json
 import glob
 import re
 import shutil
 import argparse
+import asyncio
+import itertools
+import signal
+import sys
 from datetime import datetime
 from dotenv import load_dotenv
-import openai
-from openai import OpenAI
+from async_pipeline import AsyncConversionPipeline, DEFAULT_MAX_CONCURRENT_REQUESTS, DEFAULT_FILES_IN_FLIGHT
+from batch_runner import BatchScheduler, DEFAULT_POLL_INTERVAL_SECONDS, DEFAULT_COLLECT_WINDOW_SECONDS, DEFAULT_COMPLETION_WINDOW
+from context import ConverterContext, get_default_context, set_default_context
+from llm_cache import cached_chat_completion, CACHE_MODE_OFF, CACHE_MODE_REFRESH
+from manifest import ConversionManifest, MANIFEST_FILENAME
+from jenkins_parser import jenkinsfile_to_json, UnsupportedJenkinsfileError
+from tekton_renderer import plan_pipeline, count_stages, parse_yaml_documents
+from model_router import fingerprint
+from tekton_validator import validate_tekton_yaml, fix_request_message
+from metrics import IOTimer
+from yaml_patch import apply_patch_response, VALIDATE_PATCH_PROMPT, FIX_PATCH_PROMPT
+from work_queue import WorkQueue, file_lock
+from feedback_digest import digest_log, DEFAULT_TOKEN_BUDGET, DEFAULT_SIMILARITY, DEFAULT_MAX_EXAMPLE_CHARS
+from results_store import ResultsStore
+from discovery import JenkinsfileSource
+from prompt_eval import PromptEvaluator, beats, format_table
+from conversion_server import ConversionServer, JobSource, DEFAULT_HOST, DEFAULT_PORT, DEFAULT_MAX_BODY_BYTES
 
 # Load environment variables
 load_dotenv()
@@ -27,26 +45,41 @@ logger = logging.getLogger(__name__)
 load_dotenv()
 
 
-def refine_json2tekton_prompt(log_file_path, prompt_file_path):
+def refine_json2tekton_prompt(log_file_path, prompt_file_path, context=None):
     """
     Uses the validation feedback log to refine the json2tekton prompt via an LLM call.
 
+    The log is not sent as is: it is condensed into a digest of grouped findings ranked by
+    frequency (see feedback_digest), bounded by refinement.digest_token_budget in config.yaml.
+    With evaluation.gate_refinement, the refined prompt is compared with the current one on
+    the evaluation corpus (see prompt_eval) and only replaces it if it scores higher; a
+    rejected prompt is kept next to it as <name>_rejected.txt.
+
     :param log_file_path: Path to the tekton_validation_errors.log file.
     :param prompt_file_path: Path to the src/prompts/json2tekton.txt file.
-    :return: True if successful, False otherwise.
+    :param context: Optional ConverterContext; defaults to the process-wide context.
+    :return: True if successful, False otherwise (including a refined prompt that did not score higher).
     """
     logger.info(f"Starting prompt refinement for {os.path.basename(prompt_file_path)} using feedback from {os.path.basename(log_file_path)}")
 
     try:
-        # --- 1. Read Log File Content ---
+        # --- 1. Digest Log File Content ---
         if not os.path.exists(log_file_path):
             logger.error(f"Log file not found: {log_file_path}")
             return False
-        with open(log_file_path, 'r') as f:
-            log_content = f.read()
-        if not log_content.strip():
-            logger.warning(f"Log file {log_file_path} is empty. Skipping prompt refinement.")
+        try:
+            if context is None:
+                context = get_default_context()
+        except Exception as cfg_e:
+            logger.error(f"OpenAI configuration unavailable for prompt refinement: {cfg_e}")
+            return False
+        refinement_config = context.config.get('refinement') or {}
+        digest = digest_log(log_file_path, refinement_config.get('similarity_threshold', DEFAULT_SIMILARITY))
+        if not digest.findings:
+            logger.warning(f"Log file {log_file_path} contains no validation findings. Skipping prompt refinement.")
             return True # Not an error, just nothing to do
+        log_content = digest.render(refinement_config.get('digest_token_budget', DEFAULT_TOKEN_BUDGET),
+                                    refinement_config.get('max_example_chars', DEFAULT_MAX_EXAMPLE_CHARS))
 
         # --- 2. Read Current Prompt Content ---
         if not os.path.exists(prompt_file_path):
@@ -55,44 +88,25 @@ def refine_json2tekton_prompt(log_file_path, prompt_file_path):
         with open(prompt_file_path, 'r') as f:
             current_prompt = f.read()
 
-        # --- 3. Initialize OpenAI Client --- 
-        # Reusing API key loading logic structure
-        api_key = os.getenv('OPENAI_API_KEY')
-        if not api_key:
-            try:
-                project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-                config_path = os.path.join(project_root, 'config.yaml')
-                if os.path.exists(config_path):
-                    with open(config_path, 'r') as cfg_file:
-                        config = yaml.safe_load(cfg_file)
-                        api_key = config.get('openai', {}).get('api_key')
-                    if api_key:
-                        logger.info("Loaded API key from config.yaml for prompt refinement")
-            except Exception as cfg_e:
-                logger.error(f"Error reading config.yaml for API key during refinement: {cfg_e}")
-        
-        if not api_key:
-            error_msg = "OpenAI API key missing for prompt refinement. Set OPENAI_API_KEY or add to config.yaml."
-            logger.error(error_msg)
-            return False
-
-        client = OpenAI(api_key=api_key)
+        # --- 3. Get the shared OpenAI Client --- 
+        client = context.client
 
         # --- 4. Construct Refinement Prompt for LLM ---
         refinement_system_prompt = ("You are an expert prompt engineer. Your task is to refine a system prompt used for converting structured JSON into Tekton Pipeline YAML. "
-                                  "You will be given the original prompt and feedback/validation reports generated from Tekton YAML produced using that original prompt. "
-                                  "Analyze the feedback and modify the original prompt to address the issues raised in the feedback, aiming to generate higher quality, more compliant Tekton YAML in the future. "
+                                  "You will be given the original prompt and a digest of the validation reports generated from Tekton YAML produced using that original prompt. "
+                                  "In the digest, similar findings are grouped and listed most frequent first, each with its number of occurrences and one example. "
+                                  "Analyze the feedback and modify the original prompt to address the issues raised in the feedback, most frequent first, aiming to generate higher quality, more compliant Tekton YAML in the future. "
                                   "Output ONLY the refined prompt text. Do not include any explanations, greetings, or markdown formatting around the prompt text.")
         
         refinement_user_message = (f"Original Prompt:\n```text\n{current_prompt}\n```\n\n"
-                                 f"Validation Feedback Log:\n```log\n{log_content}\n```\n\n"
-                                 f"Based on the Validation Feedback Log, please refine the Original Prompt. Remember to output ONLY the refined prompt text.")
+                                 f"Validation Feedback Digest:\n```text\n{log_content}\n```\n\n"
+                                 f"Based on the Validation Feedback Digest, please refine the Original Prompt. Remember to output ONLY the refined prompt text.")
 
         # --- 5. Call LLM for Refinement --- 
         logger.info("Sending request to LLM for prompt refinement...")
         try:
             response = client.chat.completions.create(
-                model="gpt-4o", # Using a more capable model for prompt engineering might yield better results
+                model=context.models.ladder('refine')[0], # A capable model (models.stages.refine) gives better prompts
                 messages=[
                     {"role": "system", "content": refinement_system_prompt},
                     {"role": "user", "content": refinement_user_message}
@@ -111,7 +125,30 @@ def refine_json2tekton_prompt(log_file_path, prompt_file_path):
             logger.error("LLM returned an empty response for the refined prompt.")
             return False
 
-        # --- 6. Version existing prompt --- 
+        # --- 7. Promote the refined prompt only if it beats the current one on the evaluation corpus ---
+        evaluation_config = context.config.get('evaluation') or {}
+        if evaluation_config.get('gate_refinement', True):
+            try:
+                evaluator = PromptEvaluator.from_config(context, PROJECT_ROOT)
+                scores = {score.label: score for score in evaluator.run([("current", current_prompt), ("refined", refined_prompt)])}
+            except Exception as eval_e:
+                logger.error(f"Could not evaluate the refined prompt: {eval_e}")
+                return False
+            logger.info(f"Prompt evaluation on {evaluator.source.describe()}:\n{format_table(scores.values())}")
+            if not beats(scores['refined'], scores['current'], evaluation_config.get('min_improvement', 0.0)):
+                base_name = os.path.splitext(os.path.basename(prompt_file_path))[0]
+                rejected_path = os.path.join(os.path.dirname(prompt_file_path), f"{base_name}_rejected.txt")
+                try:
+                    with open(rejected_path, 'w') as f:
+                        f.write(refined_prompt)
+                except IOError as write_e:
+                    logger.error(f"Error writing rejected prompt to {rejected_path}: {write_e}")
+                logger.warning(f"Refined prompt scored {scores['refined'].score:.4f}, not above the current prompt's "
+                               f"{scores['current'].score:.4f}; keeping the current prompt (refined prompt saved to {rejected_path})")
+                return False
+            logger.info(f"Refined prompt scored {scores['refined'].score:.4f} against {scores['current'].score:.4f}; promoting it")
+
+        # --- 8. Version existing prompt --- 
         try:
             prompt_dir = os.path.dirname(prompt_file_path)
             base_name = os.path.splitext(os.path.basename(prompt_file_path))[0]
@@ -133,15 +170,17 @@ def refine_json2tekton_prompt(log_file_path, prompt_file_path):
                 logger.info(f"Backed up current prompt to {backup_file_path}")
             else:
                  logger.warning(f"Original prompt file {prompt_file_path} not found for backup.")
+            context.prompts.invalidate(os.path.basename(backup_file_path))
 
         except Exception as backup_e:
             logger.error(f"Error backing up existing prompt file {prompt_file_path}: {backup_e}")
             # Continue to writing the new prompt even if backup fails, but log error
 
-        # --- 7. Write Refined Prompt --- 
+        # --- 9. Write Refined Prompt --- 
         try:
             with open(prompt_file_path, 'w') as f:
                 f.write(refined_prompt)
+            context.prompts.invalidate(os.path.basename(prompt_file_path))
             logger.info(f"Successfully updated prompt file: {prompt_file_path}")
             return True
         except Exception as write_e:
@@ -154,18 +193,14 @@ def refine_json2tekton_prompt(log_file_path, prompt_file_path):
 
 
 class JenkinsTektonConverter:
-    def __init__(self, config_path=None):
-        # Load configuration
-        if config_path is None:
-            config_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'config.yaml')
-        
-        with open(config_path, 'r') as config_file:
-            self.config = yaml.safe_load(config_file)
-        
-        # Initialize OpenAI API key
-        api_key = os.getenv('OPENAI_API_KEY') or self.config['openai']['api_key']
-        if not api_key:
-            raise ValueError("OpenAI API key is missing. Please set in .env or config.yaml")
+    def __init__(self, config_path=None, cache_mode=None, context=None):
+        # Load configuration, API key, prompts and cache (shared when a context is passed in)
+        if context is None:
+            context = ConverterContext(config_path=config_path, cache_mode=cache_mode)
+        self.context = context
+        self.config = context.config
+        self.api_key = context.api_key
+        self.cache = context.cache
         
         # Configure logging
         logging.basicConfig(
@@ -174,40 +209,56 @@ class JenkinsTektonConverter:
             filename=self.config['logging'].get('file')
         )
         
-        # Create OpenAI client
-        self.client = OpenAI(api_key=api_key)
+    @property
+    def client(self):
+        # The OpenAI client is created on first use and shared through the context
+        return self.context.client
 
     def convert_jenkins_to_json(self, jenkins_file_path):
         """
-        Convert Jenkins file to JSON using OpenAI
+        Convert Jenkins file to JSON, parsing declarative pipelines locally and using OpenAI otherwise
         
         :param jenkins_file_path: Path to the Jenkins file
         :return: JSON representation of the Jenkins file
         """
         try:
             # Read Jenkins file
-            with open(jenkins_file_path, 'r') as file:
+            with IOTimer(self.context.metrics, 'read', 'jenkins2json', jenkins_file_path) as timer, open(jenkins_file_path, 'r') as file:
                 jenkins_content = file.read()
+                timer.nbytes = len(jenkins_content)
+
+            # Declarative pipelines are parsed locally without an LLM round-trip
+            if self.config['conversion'].get('local_parser', True):
+                try:
+                    json_content = jenkinsfile_to_json(jenkins_content)
+                    logger.info(f"Parsed {jenkins_file_path} locally")
+                    return json_content
+                except UnsupportedJenkinsfileError as parse_e:
+                    logger.info(f"Local parser cannot handle {jenkins_file_path} ({parse_e}); falling back to the LLM")
             
-            # Read system prompt from file
-            with open(os.path.join(os.path.dirname(__file__), 'prompts', 'jenkins2json.txt'), 'r') as prompt_file:
-                system_prompt = prompt_file.read()
+            # System prompt is preloaded by the context
+            system_prompt = self.context.prompts.get('jenkins2json.txt')
             
-            # Make API call to OpenAI
-            response = self.client.chat.completions.create(
-                model="gpt-3.5-turbo",
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": f"Convert this Jenkins file to JSON:\n{jenkins_content}"}
-                ]
+            # Make API call to OpenAI (or reuse a cached response); the JSON is validated before caching,
+            # and a stronger model is tried if it is rejected
+            user_message = f"Convert this Jenkins file to JSON:\n{jenkins_content}"
+            json_content = self.context.models.complete(
+                "jenkins2json",
+                fingerprint("jenkins2json", 'jenkins2json.txt', user_message),
+                lambda model: cached_chat_completion(
+                    self.client,
+                    self.cache,
+                    stage="jenkins2json",
+                    metrics=self.context.metrics,
+                    validator=json.loads,
+                    model=model,
+                    messages=[
+                        {"role": "system", "content": system_prompt},
+                        {"role": "user", "content": user_message}
+                    ]
+                )
             )
             
-            # Extract JSON from response
-            json_content = response.choices[0].message.content.strip()
-            
-            # Validate JSON
-            json.loads(json_content)
-            
             logger.info(f"Successfully converted Jenkins file to JSON")
             return json_content
         
@@ -215,30 +266,87 @@ class JenkinsTektonConverter:
             logger.error(f"Error converting Jenkins file to JSON: {e}")
             raise
 
-    def convert_json_to_tekton(self, json_content):
+    def _render_plan(self, plan):
+        """
+        Resolve the holes of a render plan with OpenAI and render it
+        
+        :param plan: RenderPlan from plan_pipeline
+        :return: Tekton YAML
+        """
+        for hole in plan.holes:
+            user_message = hole.user_message()
+            answer = self.context.models.complete(
+                "json2tekton",
+                fingerprint("json2tekton", hole.prompt_name, user_message),
+                lambda model: cached_chat_completion(
+                    self.client,
+                    self.cache,
+                    stage="json2tekton",
+                    metrics=self.context.metrics,
+                    validator=hole.accept,
+                    model=model,
+                    messages=[
+                        {"role": "system", "content": self.context.prompts.get(hole.prompt_name)},
+                        {"role": "user", "content": user_message}
+                    ]
+                )
+            )
+            hole.accept(answer)
+        return plan.render()
+
+    def convert_json_to_tekton(self, json_content, name=None):
         """
-        Convert JSON to Tekton pipeline file
+        Convert JSON to Tekton pipeline file, rendering known steps from templates and using OpenAI for the rest
         
         :param json_content: JSON content of the pipeline
+        :param name: Optional pipeline name, e.g. the Jenkins file base name
         :return: Tekton pipeline YAML
         """
         try:
-            # Read system prompt from file
-            with open(os.path.join(os.path.dirname(__file__), 'prompts', 'json2tekton.txt'), 'r') as prompt_file:
-                system_prompt = prompt_file.read()
+            # Known steps and stages are rendered by rules; only unmapped ones go to OpenAI
+            if self.config['conversion'].get('template_renderer', True):
+                try:
+                    tekton_yaml = self._render_plan(plan_pipeline(json.loads(json_content), name))
+                    logger.info("Successfully rendered Tekton pipeline from templates")
+                    return tekton_yaml
+                except ValueError as render_e:
+                    logger.info(f"Template renderer cannot handle this pipeline ({render_e}); falling back to OpenAI")
+
+            # Large pipelines are converted one stage at a time and stitched into one Pipeline
+            shard_min_stages = self.config['conversion'].get('shard_min_stages')
+            if shard_min_stages:
+                try:
+                    data = json.loads(json_content)
+                    if count_stages(data) >= shard_min_stages:
+                        tekton_yaml = self._render_plan(plan_pipeline(data, name, shard=True))
+                        logger.info("Successfully stitched Tekton pipeline from per-stage conversions")
+                        return tekton_yaml
+                except ValueError as shard_e:
+                    logger.info(f"Sharded conversion failed ({shard_e}); converting the whole pipeline at once")
+
+            # System prompt is preloaded by the context
+            system_prompt = self.context.prompts.get('json2tekton.txt')
             
-            # Make API call to OpenAI for Tekton conversion
-            response = self.client.chat.completions.create(
-                model="gpt-3.5-turbo",
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": f"Convert this JSON pipeline to Tekton YAML:\n{json_content}"}
-                ]
+            # Make API call to OpenAI for Tekton conversion (or reuse a cached response); answers that
+            # are not YAML go to a stronger model
+            user_message = f"Convert this JSON pipeline to Tekton YAML:\n{json_content}"
+            tekton_yaml = self.context.models.complete(
+                "json2tekton",
+                fingerprint("json2tekton", 'json2tekton.txt', user_message),
+                lambda model: cached_chat_completion(
+                    self.client,
+                    self.cache,
+                    stage="json2tekton",
+                    metrics=self.context.metrics,
+                    validator=parse_yaml_documents,
+                    model=model,
+                    messages=[
+                        {"role": "system", "content": system_prompt},
+                        {"role": "user", "content": user_message}
+                    ]
+                )
             )
             
-            # Extract Tekton YAML from response
-            tekton_yaml = response.choices[0].message.content.strip()
-            
             logger.info("Successfully converted JSON to Tekton pipeline")
             return tekton_yaml
         
@@ -246,78 +354,95 @@ class JenkinsTektonConverter:
             logger.error(f"Error converting JSON to Tekton pipeline: {e}")
             raise
 
-def validate_tekton_pipeline(tekton_file_path, prompt_file_basename="validate_tekton_pipeline.txt"):
+def validate_tekton_pipeline(tekton_file_path, prompt_file_basename="validate_tekton_pipeline.txt", cache=None, context=None):
     """
-    Validate and improve a Tekton pipeline YAML file using OpenAI.
+    Validate a Tekton pipeline YAML file statically and, if it has errors, fix it using OpenAI.
+
+    With validation.patch_mode the LLM answers with a JSON Patch that is applied locally,
+    using the patch variant of the validate or fix prompt.
 
     :param tekton_file_path: Path to the Tekton pipeline YAML file
     :param prompt_file_basename: The basename of the prompt file to use (e.g., 'validate_tekton_pipeline.txt')
+    :param cache: Optional ResponseCache to reuse responses for identical requests; defaults to the context's cache
+    :param context: Optional ConverterContext; defaults to the process-wide context
     :return: Tuple (validation_report, fixed_tekton_yaml) or (error_message, None) on failure
     """
     try:
-        # --- 1. Load the specified system prompt --- 
-        project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-        prompts_dir = os.path.join(project_root, 'src/prompts')
-        prompt_file_path = os.path.join(prompts_dir, prompt_file_basename)
-
+        # --- 1. Get the shared context (config, client, prompts) --- 
+        if context is None:
+            try:
+                context = get_default_context()
+            except Exception as cfg_e:
+                error_msg = f"Failed to load configuration: {cfg_e}"
+                logger.error(error_msg)
+                # Return an error tuple instead of raising an exception
+                return f"Configuration Error: {error_msg}", None
+        if cache is None:
+            cache = context.cache
+
+        # --- 2. Load the specified system prompt --- 
+        validation_config = context.config.get('validation') or {}
+        patch_mode = validation_config.get('patch_mode', True)
+        if patch_mode:
+            prompt_file_basename = {
+                "validate_tekton_pipeline.txt": VALIDATE_PATCH_PROMPT,
+                "fix_tekton_pipeline.txt": FIX_PATCH_PROMPT,
+            }.get(prompt_file_basename, prompt_file_basename)
+        prompt_file_path = context.prompts.path(prompt_file_basename)
         if not os.path.exists(prompt_file_path):
             error_msg = f"Prompt file not found: {prompt_file_path}"
             logger.error(error_msg)
             return f"Error: {error_msg}", None
+        system_prompt = context.prompts.get(prompt_file_basename)
+        stage = "fix" if prompt_file_basename in ("fix_tekton_pipeline.txt", FIX_PATCH_PROMPT) else "validate"
 
-        with open(prompt_file_path, 'r') as f:
-            system_prompt = f.read()
-        logger.info(f"Loaded prompt: {prompt_file_basename}")
-
-        # --- 2. Load Tekton pipeline content --- 
-        with open(tekton_file_path, 'r') as file:
+        # --- 3. Load Tekton pipeline content --- 
+        with IOTimer(context.metrics, 'read', stage) as timer, open(tekton_file_path, 'r') as file:
             tekton_content = file.read()
-
-        # --- 3. Initialize OpenAI Client --- 
-        api_key = os.getenv('OPENAI_API_KEY')
-        if not api_key:
-             # Attempt to load from config.yaml as a fallback (adjust path if needed)
-             try:
-                 config_path = os.path.join(project_root, 'config.yaml')
-                 if os.path.exists(config_path):
-                     with open(config_path, 'r') as cfg_file:
-                         config = yaml.safe_load(cfg_file)
-                         api_key = config.get('openai', {}).get('api_key')
-                     if api_key:
-                         logger.info("Loaded API key from config.yaml")
-                     else:
-                          logger.warning("API key not found in config.yaml")
-                 else:
-                      logger.warning("config.yaml not found, cannot load API key from it.")
-             except Exception as cfg_e:
-                 logger.error(f"Error reading config.yaml for API key: {cfg_e}")
-
-        if not api_key:
-            error_msg = "OpenAI API key is missing. Set OPENAI_API_KEY environment variable or add to config.yaml."
-            logger.error(error_msg)
-            # Return an error tuple instead of raising an exception
-            return f"Configuration Error: {error_msg}", None
-
-        client = OpenAI(api_key=api_key)
-
-        # Make API call to OpenAI for validation and fixing, requesting JSON
-        response = client.chat.completions.create(
-            model="gpt-3.5-turbo", # Consider allowing model selection via config
-            response_format={ "type": "json_object" }, # Request JSON output
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": f"Analyze and validate this Tekton pipeline YAML:\n```yaml\n{tekton_content}\n```"} # Added ```yaml fence for clarity
-            ]
+            timer.nbytes = len(tekton_content)
+
+        # --- 4. Static validation: clean files need no LLM pass; otherwise only the errors are sent ---
+        static_report = None
+        user_message = f"Analyze and validate this Tekton pipeline YAML:\n```yaml\n{tekton_content}\n```" # Added ```yaml fence for clarity
+        if validation_config.get('static_validator', True):
+            static_report = validate_tekton_yaml(tekton_content)
+            if static_report.ok:
+                logger.info(f"Static validation passed for {tekton_file_path}; skipping LLM validation")
+                return static_report.to_text(), tekton_content
+            user_message = fix_request_message(tekton_content, static_report)
+
+        client = context.client
+
+        # Make API call to OpenAI for validation and fixing, requesting JSON; rejected answers go to a stronger model
+        response_content = context.models.complete(
+            stage,
+            fingerprint(stage, prompt_file_basename, user_message),
+            lambda model: cached_chat_completion(
+                client,
+                cache,
+                stage=stage,
+                metrics=context.metrics,
+                # Only well-formed JSON responses (and patches that apply) are cached
+                validator=(lambda content: apply_patch_response(tekton_content, content)) if patch_mode else json.loads,
+                model=model,
+                response_format={ "type": "json_object" }, # Request JSON output
+                messages=[
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": user_message}
+                ]
+            )
         )
-
-        # Extract and parse JSON response
-        response_content = response.choices[0].message.content.strip()
         logger.debug(f"Raw validation response for {tekton_file_path}: {response_content}")
 
         try:
-            result_json = json.loads(response_content)
-            validation_report = result_json.get('validation_report', 'Validation report missing in response.')
-            fixed_tekton_yaml = result_json.get('fixed_tekton_yaml', '# Fixed YAML missing in response.')
+            if patch_mode:
+                validation_report, fixed_tekton_yaml = apply_patch_response(tekton_content, response_content)
+            else:
+                result_json = json.loads(response_content)
+                validation_report = result_json.get('validation_report', 'Validation report missing in response.')
+                fixed_tekton_yaml = result_json.get('fixed_tekton_yaml', '# Fixed YAML missing in response.')
+            if static_report is not None:
+                validation_report = f"{static_report.to_text()}\n\n{validation_report}"
 
             logger.info(f"Successfully validated and processed improvements for {tekton_file_path}")
             return validation_report, fixed_tekton_yaml
@@ -333,6 +458,11 @@ def validate_tekton_pipeline(tekton_file_path, prompt_file_basename="validate_te
             # Return error report and indicate failure for fixed yaml
             return f"Key Error: {error_msg}", None
 
+    except json.JSONDecodeError as json_e:
+        error_msg = f"Failed to parse JSON response from OpenAI for {tekton_file_path}: {json_e}"
+        logger.error(error_msg)
+        return f"JSON Parse Error: {error_msg}", None
+
     except Exception as e:
         error_msg = f"Error during Tekton pipeline validation for {tekton_file_path}: {e}"
         logger.error(error_msg, exc_info=True)
@@ -340,221 +470,362 @@ def validate_tekton_pipeline(tekton_file_path, prompt_file_basename="validate_te
         return f"Validation Exception: {error_msg}", None
 
 
-def process_jenkins_files(input_dir, output_dir, errors_log_path, run_number):
+def init_errors_log(errors_log_path, run_number):
     """
-    Process Jenkins files: convert to Tekton, validate/improve, save both versions, log reports.
+    Clear or create the validation log with the run's header.
 
-    :param input_dir: Directory containing Jenkins pipeline files
-    :param output_dir: Directory to save converted Tekton pipeline files
-    :param errors_log_path: Path to log validation errors and reports
-    :param run_number: The current execution run number
+    :return: True if the log was initialized, False otherwise
     """
-    converter = JenkinsTektonConverter() # Assuming config is loaded within JenkinsTektonConverter
-
-    # Create output directory if it doesn't exist
-    os.makedirs(output_dir, exist_ok=True)
     # Ensure errors log directory exists
     errors_log_dir = os.path.dirname(errors_log_path)
     if errors_log_dir:
         os.makedirs(errors_log_dir, exist_ok=True)
-
-    # Clear or create the error log file at the start of processing for this run
     try:
         with open(errors_log_path, 'w') as log_file:
             log_file.write(f"# Tekton Validation Errors and Reports - Run {run_number}\n\n")
         logger.info(f"Initialized log file for Run {run_number}: {errors_log_path}")
+        return True
     except IOError as e:
         logger.error(f"Failed to initialize log file {errors_log_path}: {e}")
-        # Decide if we should exit or continue without logging
-        return # Exit if log file cannot be initialized
-
-    # Find Jenkins files
-    patterns = ['*.jenkinsfile', '*.jenkins', '*.groovy']
-    jenkins_files = []
-    logger.info(f"Searching for Jenkins files in: {input_dir}")
-    for pattern in patterns:
-        found_files = glob.glob(os.path.join(input_dir, pattern))
-        jenkins_files.extend(found_files)
-        logger.info(f"Found {len(found_files)} files matching pattern {pattern}")
-
-    if not jenkins_files:
-        logger.warning("No Jenkins files found in the input directory.")
-        return
+        return False
 
-    logger.info(f"Found total {len(jenkins_files)} Jenkins files to process.")
 
-    for jenkins_file in jenkins_files:
-        logger.info(f"--- Processing file: {jenkins_file} (Run: {run_number}) ---")
-        base_filename = os.path.splitext(os.path.basename(jenkins_file))[0]
-        # Construct filenames with run number
-        json_output_path = os.path.join(output_dir, f"{run_number}-{base_filename}.json")
-        initial_tekton_output_path = os.path.join(output_dir, f"{run_number}-{base_filename}-tekton-pipeline.yaml")
-        validated_output_file_path = os.path.join(output_dir, f"{run_number}-validated-{base_filename}-tekton-pipeline.yaml")
+def process_jenkins_files(input_dir, output_dir, errors_log_path, run_number, max_concurrent_requests=None, cache_mode=None, incremental=None, context=None, batch_mode=None, streaming=None, work_queue=None, source=None):
+    """
+    Process Jenkins files: convert to Tekton, validate/improve, save both versions, log reports.
 
-        try:
-            # Convert Jenkins file to JSON string
-            logger.info(f"Converting {jenkins_file} to JSON...")
-            json_content_str = converter.convert_jenkins_to_json(jenkins_file)
-            if not json_content_str:
-                logger.warning(f"Skipping file {jenkins_file} due to empty JSON conversion result.")
-                continue
-
-            # Save intermediate JSON
-            logger.info(f"Saving intermediate JSON to {json_output_path}...")
-            try:
-                # Optionally validate JSON before saving (already done in convert_jenkins_to_json)
-                # json.loads(json_content_str)
-                with open(json_output_path, 'w') as json_file:
-                    json_file.write(json_content_str)
-                logger.info(f"Successfully saved intermediate JSON: {json_output_path}")
-            except IOError as e:
-                logger.error(f"Failed to save intermediate JSON {json_output_path}: {e}")
-                continue # Skip to next file if we can't save JSON
-
-            # Convert JSON content string to Tekton pipeline
-            logger.info(f"Converting JSON to Tekton for {jenkins_file}...")
-            tekton_content = converter.convert_json_to_tekton(json_content_str)
-            if not tekton_content:
-                logger.warning(f"Skipping Tekton conversion for {jenkins_file} due to empty Tekton content result.")
-                continue
-
-            # Save the initial Tekton pipeline file
-            logger.info(f"Saving initial Tekton pipeline to {initial_tekton_output_path}...")
-            try:
-                with open(initial_tekton_output_path, 'w') as file:
-                    file.write(tekton_content)
-                logger.info(f"Successfully saved initial Tekton file: {initial_tekton_output_path}")
-            except IOError as e:
-                logger.error(f"Failed to save initial Tekton file {initial_tekton_output_path}: {e}")
-                continue # Skip validation if saving failed
-
-            # Validate the generated Tekton pipeline
-            logger.info(f"Validating and improving Tekton pipeline {initial_tekton_output_path}...")
-            validation_report, fixed_tekton_yaml = validate_tekton_pipeline(initial_tekton_output_path)
-
-            # Log the validation report
-            log_entry = f"--- Validation Report for Run {run_number}, File: {initial_tekton_output_path} ---\n"
-            if validation_report:
-                log_entry += validation_report + "\n"
-            else:
-                log_entry += f"Validation failed or no report generated. Check previous logs for errors related to {initial_tekton_output_path}.\n"
-            log_entry += "--- End Report ---\n\n"
+    Files are pipelined through the conversion stages concurrently (see AsyncConversionPipeline),
+    starting as soon as discovery finds the first one.
 
-            # Append report to the central log file
-            try:
-                with open(errors_log_path, 'a') as log_file:
-                    log_file.write(log_entry)
-                logger.info(f"Validation report for {initial_tekton_output_path} appended to {errors_log_path}")
-            except IOError as e:
-                logger.error(f"Failed to append validation report to {errors_log_path}: {e}")
-
-            # Save the validated/improved Tekton pipeline file if available
-            if fixed_tekton_yaml and not fixed_tekton_yaml.startswith('# Fixed YAML missing'):
-                logger.info(f"Saving validated/improved Tekton pipeline to {validated_output_file_path}...")
-                try:
-                    with open(validated_output_file_path, 'w') as file:
-                        file.write(fixed_tekton_yaml)
-                    logger.info(f"Successfully saved validated Tekton file: {validated_output_file_path}")
-
-                    # --- Start Second Validation Step ---
-                    logger.info(f"Starting second validation (fix focused) for {validated_output_file_path}...")
-                    # Use the 'fix' prompt for the second pass
-                    validation_report_2, fixed_tekton_yaml_2 = validate_tekton_pipeline(
-                        validated_output_file_path,
-                        prompt_file_basename="fix_tekton_pipeline.txt"
-                    )
-
-                    # Log the second validation report
-                    log_entry_2 = f"--- Second Validation Report for Run {run_number}, File: {validated_output_file_path} ---\n"
-                    if validation_report_2:
-                        log_entry_2 += validation_report_2 + "\n"
-                    else:
-                        log_entry_2 += f"Second validation failed or no report generated. Check logs for {validated_output_file_path}.\n"
-                    log_entry_2 += "--- End Second Report ---\n\n"
-                    try:
-                        with open(errors_log_path, 'a') as log_file:
-                            log_file.write(log_entry_2)
-                        logger.info(f"Second validation report for {validated_output_file_path} appended to {errors_log_path}")
-                    except IOError as e:
-                        logger.error(f"Failed to append second validation report to {errors_log_path}: {e}")
-
-                    # Save the second validated/improved Tekton pipeline file if available
-                    if fixed_tekton_yaml_2 and not fixed_tekton_yaml_2.startswith('# Fixed YAML missing'):
-                        validated2_output_file_path = os.path.join(output_dir, f"{run_number}-validated2-{base_filename}-tekton-pipeline.yaml")
-                        logger.info(f"Saving second validated/improved Tekton pipeline to {validated2_output_file_path}...")
-                        try:
-                            with open(validated2_output_file_path, 'w') as file:
-                                file.write(fixed_tekton_yaml_2)
-                            logger.info(f"Successfully saved second validated Tekton file: {validated2_output_file_path}")
-                        except IOError as e:
-                            logger.error(f"Failed to save second validated Tekton file {validated2_output_file_path}: {e}")
-                    else:
-                        logger.warning(f"No valid fixed Tekton YAML provided from second validation for {validated_output_file_path}. Skipping save for validated2 file.")
-                    # --- End Second Validation Step ---
-
-                except IOError as e:
-                    logger.error(f"Failed to save validated Tekton file {validated_output_file_path}: {e}")
-            else:
-                logger.warning(f"No valid fixed Tekton YAML provided or validation failed for {initial_tekton_output_path}. Skipping save for validated file and subsequent second validation.")
+    :param input_dir: Directory (searched recursively), tar/zip archive or git checkout containing Jenkins pipeline files
+    :param output_dir: Directory to save converted Tekton pipeline files
+    :param errors_log_path: Path to log validation errors and reports
+    :param run_number: The current execution run number
+    :param max_concurrent_requests: Global cap on in-flight LLM requests; defaults to config.yaml
+    :param cache_mode: Optional LLM cache mode ('use', 'refresh' or 'off'); defaults to config.yaml
+    :param incremental: If True, skip stages whose inputs and prompts are unchanged since the last recorded run; defaults to config.yaml
+    :param context: Optional ConverterContext to share with the caller; cache_mode is ignored when it is given
+    :param batch_mode: If True, send requests through the OpenAI Batch API; defaults to config.yaml
+    :param streaming: If True, stream completions and abort answers that cannot become valid early; defaults to config.yaml
+    :param work_queue: Optional WorkQueue with an opened run; files are then leased from it and shared with other workers
+    :param source: Optional JenkinsfileSource for input_dir; defaults to one built from config.yaml
+    :return: The LLM cache statistics for the run, or None if nothing was processed
+    """
+    if context is None:
+        context = ConverterContext(cache_mode=cache_mode)
+    if source is None:
+        source = JenkinsfileSource.from_config(context.config, input_dir)
 
-        except Exception as e:
-            logger.error(f"An unexpected error occurred processing file {jenkins_file}: {e}", exc_info=True)
+    # Create output directory if it doesn't exist
+    os.makedirs(output_dir, exist_ok=True)
+
+    if work_queue is not None:
+        # The worker that created the run initialized the log; the files come from the queue
+        jenkins_files = None
+        logger.info(f"Worker {work_queue.worker_id} on run {run_number}; files by status: {work_queue.counts()}")
+    else:
+        # Clear or create the error log file at the start of processing for this run
+        if not init_errors_log(errors_log_path, run_number):
+            return # Exit if log file cannot be initialized
 
-        logger.info(f"--- Finished processing file: {jenkins_file} ---")
+        # Files are handed to the pipeline as they are discovered; only the first one is waited for
+        try:
+            jenkins_files = source.iter_files()
+            first_file = next(jenkins_files, None)
+        except OSError as e:
+            logger.error(f"Cannot read input {source.describe()}: {e}")
+            return
+        if first_file is None:
+            logger.warning("No Jenkins files found in the input directory.")
+            return
+        jenkins_files = itertools.chain([first_file], jenkins_files)
+
+    # Every run records per-stage hashes; incremental runs reuse the unchanged stages
+    if incremental is None:
+        incremental = context.config['conversion'].get('incremental', False)
+    manifest = ConversionManifest(os.path.join(output_dir, MANIFEST_FILENAME), base_dir=input_dir)
+    if work_queue is not None:
+        # Workers would overwrite each other's manifest; the queue's stage checkpoints take its place
+        if incremental:
+            logger.warning("Incremental mode is not available for workers; the work queue resumes unfinished stages instead")
+        manifest = None
+        incremental = False
+
+    # In batch mode each stage's requests are submitted together and the run can resume from recorded batch IDs
+    batch_config = context.config.get('batch') or {}
+    if batch_mode is None:
+        batch_mode = batch_config.get('enabled', False)
+    batch = None
+    if batch_mode:
+        batch_dir = batch_config.get('directory') or os.path.join(output_dir, 'batches')
+        if not os.path.isabs(batch_dir):
+            batch_dir = os.path.join(PROJECT_ROOT, batch_dir)
+        batch = BatchScheduler(
+            context,
+            batch_dir,
+            run_number,
+            poll_interval=batch_config.get('poll_interval_seconds', DEFAULT_POLL_INTERVAL_SECONDS),
+            collect_window=batch_config.get('collect_window_seconds', DEFAULT_COLLECT_WINDOW_SECONDS),
+            completion_window=batch_config.get('completion_window', DEFAULT_COMPLETION_WINDOW)
+        )
+        logger.info(f"Batch mode: requests are submitted through the Batch API (state in {batch_dir})")
+
+    # Every stage's prompt version, artifact, findings and timing go to the indexed results store
+    results = ResultsStore.from_config(context.config.get('results'), output_dir, PROJECT_ROOT)
+    if results is not None:
+        results.start_run(run_number)
+
+    # Run the conversion chain for all files concurrently
+    concurrency_config = context.config.get('concurrency') or {}
+    if max_concurrent_requests is None:
+        max_concurrent_requests = concurrency_config.get('max_concurrent_requests', DEFAULT_MAX_CONCURRENT_REQUESTS)
+    pipeline = AsyncConversionPipeline(
+        context=context,
+        output_dir=output_dir,
+        errors_log_path=errors_log_path,
+        run_number=run_number,
+        max_concurrent_requests=max_concurrent_requests,
+        stage_limits=concurrency_config.get('stage_limits'),
+        manifest=manifest,
+        incremental=incremental,
+        batch=batch,
+        streaming=streaming,
+        metrics=context.metrics,
+        results=results,
+        source=source,
+        input_dir=input_dir,
+        files_in_flight=concurrency_config.get('files_in_flight', DEFAULT_FILES_IN_FLIGHT)
+    )
+    if pipeline.streaming and batch is not None:
+        logger.info("Streaming is not used in batch mode")
+    logger.info(f"Processing with up to {pipeline.max_concurrent_requests} concurrent requests (stage limits: {pipeline.stage_limits})")
+    try:
+        if work_queue is not None:
+            completed = asyncio.run(pipeline.run_worker(work_queue))
+            logger.info(f"Worker {work_queue.worker_id} completed the full conversion chain for {completed} files; "
+                        f"run {run_number} files by status: {work_queue.counts()}")
+            work_queue.close()
+            export_run_metrics(context, output_dir, run_number, worker_id=work_queue.worker_id)
+        else:
+            completed = asyncio.run(pipeline.run(jenkins_files))
+            logger.info(f"Completed full conversion chain for {completed}/{source.found} files.")
+            export_run_metrics(context, output_dir, run_number)
+    finally:
+        source.close()
+        if results is not None:
+            results.close()
 
     logger.info("Conversion and validation process finished.")
+    return context.cache.stats()
+
+def serve_conversions(output_dir, errors_log_path, run_number, context, host=None, port=None, socket_path=None, max_concurrent_requests=None, streaming=None):
+    """
+    Run the conversion server until SIGINT/SIGTERM: every job it accepts is converted by one
+    pipeline that keeps the context (clients, prompts, caches, routes) warm across jobs.
+
+    :param output_dir: Directory to save converted Tekton pipeline files
+    :param errors_log_path: Path to log validation errors and reports
+    :param run_number: The run all jobs of this server belong to
+    :param context: ConverterContext shared by all jobs
+    :param host: TCP host; defaults to config.yaml
+    :param port: TCP port; defaults to config.yaml
+    :param socket_path: Unix socket path; defaults to config.yaml
+    :param max_concurrent_requests: Global cap on in-flight LLM requests; defaults to config.yaml
+    :param streaming: If True, stream completions and abort answers that cannot become valid early; defaults to config.yaml
+    """
+    server_config = context.config.get('server') or {}
+    host = host or server_config.get('host') or DEFAULT_HOST
+    socket_path = socket_path or server_config.get('socket')
+    if port is None and not socket_path:
+        port = server_config.get('port', DEFAULT_PORT)
+    max_body_mb = server_config.get('max_body_mb')
+
+    os.makedirs(output_dir, exist_ok=True)
+    if not init_errors_log(errors_log_path, run_number):
+        return
+    results = ResultsStore.from_config(context.config.get('results'), output_dir, PROJECT_ROOT)
+    if results is not None:
+        results.start_run(run_number)
+
+    concurrency_config = context.config.get('concurrency') or {}
+    if max_concurrent_requests is None:
+        max_concurrent_requests = concurrency_config.get('max_concurrent_requests', DEFAULT_MAX_CONCURRENT_REQUESTS)
+    source = JobSource()
+    # No manifest: jobs have no stable input tree to compare against; the LLM cache answers repeated inputs
+    pipeline = AsyncConversionPipeline(
+        context=context,
+        output_dir=output_dir,
+        errors_log_path=errors_log_path,
+        run_number=run_number,
+        max_concurrent_requests=max_concurrent_requests,
+        stage_limits=concurrency_config.get('stage_limits'),
+        streaming=streaming,
+        metrics=context.metrics,
+        results=results,
+        source=source
+    )
+    server = ConversionServer(
+        pipeline,
+        source,
+        include_content=server_config.get('include_content', True),
+        max_body_bytes=int(max_body_mb * 1024 * 1024) if max_body_mb else DEFAULT_MAX_BODY_BYTES
+    )
+
+    async def serve():
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, stop.set)
+        await server.start(host=host, port=port, socket_path=socket_path)
+        print(f"Conversion server ready (run {run_number}); stop it with Ctrl+C")
+        await server.serve_forever(stop)
 
-def get_and_increment_run_number(counter_file):
-    """Reads the run number from a file, increments it, saves it back, and returns the NEW run number."""
-    run_number = 1 # Default if file doesn't exist or is invalid
     try:
-        if os.path.exists(counter_file):
-            with open(counter_file, 'r') as f:
-                try:
-                    current_number = int(f.read().strip())
-                    run_number = current_number + 1
-                except ValueError:
-                    logger.warning(f"Invalid content in {counter_file}. Resetting run number to 1.")
-                    run_number = 1
-        else:
-             logger.info(f"Counter file {counter_file} not found. Starting run number from 1.")
-             run_number = 1 # Start from 1 if file does not exist
-    except IOError as e:
-        logger.error(f"Could not read counter file {counter_file}: {e}. Starting run number from 1.")
-        run_number = 1
+        asyncio.run(serve())
+        export_run_metrics(context, output_dir, run_number)
+    finally:
+        if socket_path and os.path.exists(socket_path):
+            os.remove(socket_path)
+        if results is not None:
+            results.close()
+    logger.info("Conversion server stopped.")
+
+
+def export_run_metrics(context, output_dir, run_number, worker_id=None):
+    """
+    Write the run's metrics as a JSON summary and, if configured, a Prometheus textfile.
 
+    :param context: ConverterContext holding the run metrics
+    :param output_dir: Output directory; the summary is saved as <run>-run-summary.json
+    :param run_number: The current execution run number
+    :param worker_id: In worker mode, the worker's name; each worker writes its own files, suffixed with it
+    """
+    suffix = f"-{worker_id}" if worker_id else ""
+    metrics_config = context.config.get('metrics') or {}
+    metrics = context.metrics
+    totals = metrics.summary()['totals']
+    logger.info(f"Run metrics: {totals['requests']} LLM requests, {totals['prompt_tokens']} prompt + "
+                f"{totals['completion_tokens']} completion tokens, ~${totals['cost_usd']:.4f}, "
+                f"{totals['cache_hits']} cache hits, {totals['retries']} retries")
     try:
-        with open(counter_file, 'w') as f:
-            f.write(str(run_number))
-        logger.info(f"Current run number: {run_number}. Updated counter file: {counter_file}")
-    except IOError as e:
-        # If writing fails, we still proceed with the potentially correct run number, but log the error.
-        logger.error(f"Could not write to counter file {counter_file}: {e}. Proceeding with run number {run_number}.")
+        if metrics_config.get('summary', True):
+            summary_path = os.path.join(output_dir, f"{run_number}-run-summary{suffix}.json")
+            metrics.write_json(summary_path)
+            logger.info(f"Run summary written to {summary_path}")
+        textfile = metrics_config.get('prometheus_textfile')
+        if textfile:
+            textfile = textfile if os.path.isabs(textfile) else os.path.join(PROJECT_ROOT, textfile)
+            if suffix:
+                textfile = f"{os.path.splitext(textfile)[0]}{suffix}{os.path.splitext(textfile)[1]}"
+            metrics.write_prometheus(textfile)
+            logger.info(f"Prometheus metrics written to {textfile}")
+    except (IOError, OSError) as e:
+        logger.error(f"Failed to export run metrics: {e}")
+
+
+def get_and_increment_run_number(counter_file):
+    """
+    Reads the run number from a file, increments it, saves it back, and returns the NEW run number.
+
+    The read and write happen under a lock file and the new number replaces the file
+    atomically, so processes starting at the same time (e.g. several workers) never get
+    the same run number.
+
+    :raises TimeoutError: If the counter file stays locked; guessing a number could reuse another run's outputs
+    """
+    with file_lock(counter_file):
+        run_number = 1 # Default if file doesn't exist or is invalid
+        try:
+            if os.path.exists(counter_file):
+                with open(counter_file, 'r') as f:
+                    try:
+                        current_number = int(f.read().strip())
+                        run_number = current_number + 1
+                    except ValueError:
+                        logger.warning(f"Invalid content in {counter_file}. Resetting run number to 1.")
+                        run_number = 1
+            else:
+                 logger.info(f"Counter file {counter_file} not found. Starting run number from 1.")
+                 run_number = 1 # Start from 1 if file does not exist
+        except IOError as e:
+            logger.error(f"Could not read counter file {counter_file}: {e}. Starting run number from 1.")
+            run_number = 1
+
+        try:
+            temp_file = f"{counter_file}.{os.getpid()}.tmp"
+            with open(temp_file, 'w') as f:
+                f.write(str(run_number))
+            os.replace(temp_file, counter_file)
+            logger.info(f"Current run number: {run_number}. Updated counter file: {counter_file}")
+        except IOError as e:
+            # If writing fails, we still proceed with the potentially correct run number, but log the error.
+            logger.error(f"Could not write to counter file {counter_file}: {e}. Proceeding with run number {run_number}.")
 
     return run_number
 
 def main():
-    # Initialize converter to load configuration
+    # --- Argument Parsing ---
+    parser = argparse.ArgumentParser(description="Convert Jenkinsfiles to Tekton Pipelines and optionally refine prompts.")
+    parser.add_argument("--refine-prompt", action="store_true", help="If set, attempts to refine the json2tekton prompt based on validation feedback.")
+    parser.add_argument("--concurrency", type=int, default=None, help="Maximum number of concurrent LLM requests (overrides concurrency.max_concurrent_requests in config.yaml).")
+    parser.add_argument("--incremental", action="store_true", default=None, help="Only re-run the stages whose source, prompt or upstream artifact changed since the last run.")
+    parser.add_argument("--stream", action="store_true", default=None, help="Stream completions, check them as tokens arrive and retry an answer as soon as it cannot become valid JSON/YAML.")
+    parser.add_argument("--worker", action="store_true", help="Run as one of several workers sharing a work queue: join the unfinished run (or start one) and convert the files leased from the queue.")
+    parser.add_argument("--queue", default=None, help="Work queue database for --worker (overrides queue.database in config.yaml).")
+    parser.add_argument("--input", default=None, help="Directory, tar/zip archive or git checkout to convert (overrides conversion.input_directory in config.yaml).")
+    parser.add_argument("--ref", default=None, help="Read the input git checkout at this ref (branch, tag or commit) instead of its working tree.")
+    parser.add_argument("--batch", action="store_true", default=None, help="Submit each stage's requests through the OpenAI Batch API (cheaper, slower); an interrupted batch run resumes from the recorded batch IDs.")
+    parser.add_argument("--serve", action="store_true", help="Run as a long-running conversion server that keeps clients, prompts and caches warm and streams per-stage results of submitted jobs (see python3 src/conversion_server.py).")
+    parser.add_argument("--host", default=None, help="Host for --serve (overrides server.host in config.yaml).")
+    parser.add_argument("--port", type=int, default=None, help="TCP port for --serve (overrides server.port in config.yaml).")
+    parser.add_argument("--socket", default=None, help="Unix socket for --serve (overrides server.socket in config.yaml).")
+    cache_group = parser.add_mutually_exclusive_group()
+    cache_group.add_argument("--no-cache", action="store_true", help="Disable the LLM response cache for this run (no reads, no writes).")
+    cache_group.add_argument("--refresh", action="store_true", help="Ignore cached LLM responses but store fresh ones.")
+    args = parser.parse_args()
+    cache_mode = CACHE_MODE_OFF if args.no_cache else CACHE_MODE_REFRESH if args.refresh else None
+
+    # Build the shared context once: configuration, prompts, cache and (lazily) the OpenAI client
     try:
-        converter = JenkinsTektonConverter()
-        config = converter.config
+        context = ConverterContext(cache_mode=cache_mode)
+        set_default_context(context)
+        config = context.config
     except Exception as config_e:
         logger.error(f"Failed to load configuration: {config_e}")
         print(f"Error: Failed to load configuration. Check config.yaml and .env. Details: {config_e}")
         return # Exit if config fails
 
-    # Get and increment run number
-    run_number = get_and_increment_run_number('run_counter.txt')
-
     # Use directories and log path from configuration, constructing absolute paths
     base_dir = os.path.dirname(os.path.dirname(__file__)) # Project root
-    input_dir = os.path.join(base_dir, config['conversion']['input_directory'])
+    input_dir = os.path.join(base_dir, args.input or config['conversion']['input_directory'])
+    source = JenkinsfileSource.from_config(config, input_dir, git_ref=args.ref)
     output_dir = os.path.join(base_dir, config['conversion']['output_directory'])
     # Define error log path relative to project root
     errors_log_path = os.path.join(base_dir, 'tekton_validation_errors.log')
 
+    # Get and increment run number (workers take the run number of the run they join)
+    work_queue = None
+    try:
+        if args.worker:
+            def new_run_number():
+                # Runs inside the queue transaction, so the log is ready before any other worker joins
+                new_number = get_and_increment_run_number('run_counter.txt')
+                init_errors_log(errors_log_path, new_number)
+                return new_number
+
+            work_queue = WorkQueue.from_config(config.get('queue'), base_dir, path=args.queue)
+            run_number = work_queue.open_run(source.iter_files(), new_run_number, input_dir=input_dir)
+        else:
+            run_number = get_and_increment_run_number('run_counter.txt')
+    except TimeoutError as lock_e:
+        # Falling back to a fixed number would overwrite that run's outputs and validation log
+        logger.error(f"Could not take a run number: {lock_e}")
+        print(f"Error: Could not take a run number ({lock_e}). Remove run_counter.txt.lock if no other converter is running.")
+        sys.exit(1)
+
     print(f"Starting Jenkins to Tekton conversion...")
-    print(f"Input directory: {input_dir}")
+    if not args.serve:
+        print(f"Input: {source.describe()}")
     print(f"Output directory: {output_dir}")
     print(f"Validation Log: {errors_log_path}")
 
@@ -574,14 +845,20 @@ def main():
     console_handler.setFormatter(logging.Formatter(log_format))
     logging.getLogger('').addHandler(console_handler)
 
+    if args.serve:
+        serve_conversions(output_dir, errors_log_path, run_number, context, host=args.host, port=args.port,
+                          socket_path=args.socket, max_concurrent_requests=args.concurrency, streaming=args.stream)
+        return
+
     # Process Jenkins files (conversion, validation, saving fixed files, logging reports)
-    process_jenkins_files(input_dir, output_dir, errors_log_path, run_number)
+    cache_stats = process_jenkins_files(input_dir, output_dir, errors_log_path, run_number,
+                                        max_concurrent_requests=args.concurrency, cache_mode=cache_mode,
+                                        incremental=args.incremental, context=context, batch_mode=args.batch,
+                                        streaming=args.stream, work_queue=work_queue, source=source)
     print("\nConversion and validation process finished.")
-
-    # --- Argument Parsing ---
-    parser = argparse.ArgumentParser(description="Convert Jenkinsfiles to Tekton Pipelines and optionally refine prompts.")
-    parser.add_argument("--refine-prompt", action="store_true", help="If set, attempts to refine the json2tekton prompt based on validation feedback.")
-    args = parser.parse_args()
+    if cache_stats:
+        print(f"LLM cache ({cache_stats['mode']}): {cache_stats['hits']} hits, {cache_stats['misses']} misses, "
+              f"{cache_stats['writes']} writes, {cache_stats['evictions']} evictions")
 
     # --- Attempt to Refine Prompt based on logs (ONLY IF FLAG IS SET) ---
     if args.refine_prompt:
@@ -589,11 +866,11 @@ def main():
         print("Attempting to refine the json2tekton prompt based on the latest validation feedback...")
         prompts_dir = os.path.join(os.path.dirname(__file__), 'prompts')
         json2tekton_prompt_path = os.path.join(prompts_dir, 'json2tekton.txt')
-        refinement_success = refine_json2tekton_prompt(errors_log_path, json2tekton_prompt_path)
+        refinement_success = refine_json2tekton_prompt(errors_log_path, json2tekton_prompt_path, context=context)
         if refinement_success:
             print(f"Prompt refinement successful. The updated prompt is now in {json2tekton_prompt_path}.")
         else:
-            print("Prompt refinement failed. Check logs for details.")
+            print("The prompt was not updated: refinement failed or the refined prompt did not score higher than the current one. Check logs for details.")
     else:
         print("\nSkipping prompt refinement step (--refine-prompt flag not provided).")
 
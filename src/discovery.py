@@ -0,0 +1,437 @@
+"""
+Discovery of the Jenkins files to convert.
+
+The input can be a directory, a tar or zip archive, or a git checkout read at a given
+ref. Directories are walked recursively with os.scandir, honouring .gitignore files and
+the configured exclude patterns; excluded directories are not descended into. Files are
+yielded as they are found, so conversion starts with the first file instead of after a
+walk of the whole tree.
+
+A file is converted if its name ends with one of conversion.supported_extensions or is
+one of discovery.names (e.g. Jenkinsfile, Jenkinsfile.release). Files inside an archive
+or a git tree are identified as "<archive>::<member>" or "<repo>@<commit>::<path>" and
+read through JenkinsfileSource.read(), so they are never extracted to disk.
+"""
+import os
+import re
+import tarfile
+import zipfile
+import threading
+import subprocess
+import logging
+
+logger = logging.getLogger(__name__)
+
+SEPARATOR = "::"
+DEFAULT_EXTENSIONS = ('.jenkinsfile', '.jenkins', '.groovy')
+DEFAULT_NAMES = ('Jenkinsfile',)
+DEFAULT_EXCLUDE = ('node_modules/', '.venv/', '__pycache__/')
+ARCHIVE_SUFFIXES = ('.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2', '.tar.xz', '.txz', '.zip')
+# Members larger than this are not Jenkins files worth converting
+MAX_FILE_BYTES = 1024 * 1024
+
+
+def split_identifier(identifier):
+    """
+    :param identifier: A file path, "<archive>::<member>" or "<repo>@<commit>::<path>"
+    :return: Tuple (container, member); member is None for a plain file path
+    """
+    if SEPARATOR in identifier and not os.path.exists(identifier):
+        container, member = identifier.split(SEPARATOR, 1)
+        return container, member
+    return identifier, None
+
+
+def input_key(identifier, base_dir):
+    """Path of an input relative to the input root, e.g. for the manifest."""
+    container, member = split_identifier(identifier)
+    if member is not None:
+        return member
+    return os.path.relpath(os.path.abspath(identifier), os.path.abspath(base_dir))
+
+
+def output_name(identifier, base_dir=None):
+    """
+    Base name for a file's outputs: its path relative to the input root without the
+    extension, directories joined with '-' (services/api/Jenkinsfile -> services-api-Jenkinsfile).
+    Files at the top of the input root keep their plain base name.
+
+    :param identifier: The file's identifier
+    :param base_dir: Input root; without it only the file name is used
+    """
+    container, member = split_identifier(identifier)
+    if member is None:
+        member = os.path.basename(identifier)
+        if base_dir:
+            relative = os.path.relpath(os.path.abspath(identifier), os.path.abspath(base_dir))
+            if not relative.startswith('..'):
+                member = relative
+    parts = [part for part in member.replace(os.sep, '/').split('/') if part and part != '.']
+    stem = os.path.splitext(parts[-1])[0]
+    # Jenkinsfile.release must not share its outputs with Jenkinsfile
+    parts[-1] = parts[-1].replace('.', '-') if stem in DEFAULT_NAMES else (stem or parts[-1])
+    return "-".join(parts)
+
+
+def _member_name(name):
+    return re.sub(r'^(?:\./)+', '', name).strip('/')
+
+
+def is_archive(path):
+    return os.path.isfile(path) and path.lower().endswith(ARCHIVE_SUFFIXES)
+
+
+# --- .gitignore patterns ---
+
+def _translate(pattern):
+    """Translate a gitignore glob (without negation, anchoring or trailing slash) to a regex."""
+    out = []
+    i, n = 0, len(pattern)
+    while i < n:
+        c = pattern[i]
+        if c == '*':
+            if pattern.startswith('**', i) and (i == 0 or pattern[i - 1] == '/') and (i + 2 == n or pattern[i + 2] == '/'):
+                if i + 2 == n:
+                    out.append('.*')
+                    i += 2
+                else:
+                    out.append('(?:.*/)?')
+                    i += 3
+                continue
+            while i < n and pattern[i] == '*':
+                i += 1
+            out.append('[^/]*')
+            continue
+        if c == '?':
+            out.append('[^/]')
+        elif c == '[':
+            j = i + 1
+            if j < n and pattern[j] in '!^':
+                j += 1
+            if j < n and pattern[j] == ']':
+                j += 1
+            j = pattern.find(']', j)
+            if j == -1:
+                out.append(re.escape(c))
+            else:
+                body = pattern[i + 1:j].replace('\\', '\\\\')
+                if body.startswith('!'):
+                    body = '^' + body[1:]
+                out.append(f'[{body}]')
+                i = j
+        elif c == '\\' and i + 1 < n:
+            i += 1
+            out.append(re.escape(pattern[i]))
+        else:
+            out.append(re.escape(c))
+        i += 1
+    return ''.join(out)
+
+
+class IgnoreRule:
+    """One .gitignore or exclude pattern, relative to the directory it applies below."""
+
+    def __init__(self, pattern, prefix=''):
+        """
+        :param pattern: A gitignore pattern line
+        :param prefix: Directory the pattern is relative to, as 'a/b/' ('' for the root)
+        """
+        self.prefix = prefix
+        self.negated = pattern.startswith('!')
+        if self.negated or pattern.startswith(('\\!', '\\#')):
+            pattern = pattern[1:]
+        self.dir_only = pattern.endswith('/')
+        pattern = pattern.rstrip('/')
+        anchored = '/' in pattern
+        regex = _translate(pattern.lstrip('/'))
+        self.regex = re.compile('^' + ('' if anchored else '(?:.*/)?') + regex + '$')
+
+    def matches(self, relative_path, is_dir):
+        if self.dir_only and not is_dir:
+            return False
+        if not relative_path.startswith(self.prefix):
+            return False
+        return self.regex.match(relative_path[len(self.prefix):]) is not None
+
+
+def parse_ignore_lines(lines, prefix=''):
+    """:return: IgnoreRules of the non-empty, non-comment lines"""
+    rules = []
+    for line in lines:
+        line = re.sub(r'(?<!\\)\s+$', '', line.rstrip('\n'))
+        if not line or line.startswith('#') or line.strip('/!') == '':
+            continue
+        rules.append(IgnoreRule(line, prefix))
+    return rules
+
+
+def is_ignored(rules, relative_path, is_dir):
+    """The last matching rule decides; a negated rule re-includes."""
+    ignored = False
+    for rule in rules:
+        if rule.matches(relative_path, is_dir):
+            ignored = not rule.negated
+    return ignored
+
+
+class JenkinsfileSource:
+    """Finds the Jenkins files of an input directory, archive or git ref and reads them."""
+
+    def __init__(self, root, extensions=DEFAULT_EXTENSIONS, names=DEFAULT_NAMES, exclude=DEFAULT_EXCLUDE,
+                 gitignore=True, git_ref=None, follow_symlinks=False):
+        """
+        :param root: Input directory, archive file or git checkout
+        :param extensions: File name endings of Jenkins files
+        :param names: File names of Jenkins files, with any extension (Jenkinsfile, Jenkinsfile.release)
+        :param exclude: Gitignore-style patterns of paths to skip, relative to the root
+        :param gitignore: If True, honour the .gitignore files of a directory walk
+        :param git_ref: If set, read the files of this ref of the git checkout at root instead of the working tree
+        :param follow_symlinks: If True, descend into symlinked directories
+        """
+        self.root = os.path.abspath(root)
+        self.extensions = tuple(extension.lower() for extension in extensions)
+        self.names = tuple(names)
+        self.exclude = parse_ignore_lines(exclude or ())
+        self.gitignore = gitignore
+        self.git_ref = git_ref
+        self.follow_symlinks = follow_symlinks
+        self.found = 0
+        self.scanned = 0
+        self._contents = {}
+        self._zips = {}
+        self._git = None
+        self._git_commit = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config, root, git_ref=None):
+        """
+        :param config: The whole parsed config.yaml
+        :param root: Input directory, archive or git checkout
+        :param git_ref: Optional ref overriding discovery.git_ref
+        """
+        conversion_config = config.get('conversion') or {}
+        discovery_config = config.get('discovery') or {}
+        exclude = discovery_config.get('exclude')
+        return cls(
+            root,
+            extensions=conversion_config.get('supported_extensions') or DEFAULT_EXTENSIONS,
+            names=discovery_config.get('names') or DEFAULT_NAMES,
+            exclude=DEFAULT_EXCLUDE if exclude is None else exclude,
+            gitignore=discovery_config.get('gitignore', True),
+            git_ref=git_ref or discovery_config.get('git_ref'),
+            follow_symlinks=discovery_config.get('follow_symlinks', False)
+        )
+
+    @property
+    def kind(self):
+        if self.git_ref:
+            return "git"
+        return "archive" if is_archive(self.root) else "directory"
+
+    def describe(self):
+        if self.git_ref:
+            return f"{self.root} at {self.git_ref}"
+        return self.root
+
+    def matches(self, name):
+        """True if a file name is a Jenkins file."""
+        if name.lower().endswith(self.extensions):
+            return True
+        return any(name == jenkins_name or name.startswith(jenkins_name + '.') for jenkins_name in self.names)
+
+    def iter_files(self):
+        """
+        Yield the identifiers of the Jenkins files as they are found.
+
+        :raises FileNotFoundError: If the input does not exist
+        """
+        if self.git_ref:
+            iterator = self._iter_git()
+        elif is_archive(self.root):
+            iterator = self._iter_archive()
+        elif os.path.isdir(self.root):
+            iterator = self._iter_directory()
+        else:
+            raise FileNotFoundError(f"Input {self.root} is neither a directory nor a tar/zip archive")
+        logger.info(f"Discovering Jenkins files in {self.describe()}")
+        for identifier in iterator:
+            self.found += 1
+            yield identifier
+        logger.info(f"Discovery finished: {self.found} Jenkins files among {self.scanned} entries")
+
+    def _iter_directory(self):
+        # Depth-first, in name order, so runs over the same tree see the files in the same order
+        stack = [(self.root, '', [])]
+        while stack:
+            directory, prefix, rules = stack.pop()
+            try:
+                with os.scandir(directory) as iterator:
+                    entries = sorted(iterator, key=lambda entry: entry.name)
+            except OSError as e:
+                logger.warning(f"Skipping unreadable directory {directory}: {e}")
+                continue
+            self.scanned += len(entries)
+            if self.gitignore and any(entry.name == '.gitignore' for entry in entries):
+                try:
+                    with open(os.path.join(directory, '.gitignore'), 'r', errors='replace') as ignore_file:
+                        rules = rules + parse_ignore_lines(ignore_file, prefix)
+                except OSError as e:
+                    logger.warning(f"Ignoring unreadable {directory}/.gitignore: {e}")
+            subdirectories = []
+            for entry in entries:
+                relative_path = prefix + entry.name
+                try:
+                    is_dir = entry.is_dir(follow_symlinks=self.follow_symlinks)
+                except OSError:
+                    continue
+                if is_dir:
+                    if entry.name == '.git' or self._skipped(rules, relative_path, True):
+                        continue
+                    subdirectories.append((entry.path, relative_path + '/', rules))
+                elif self.matches(entry.name) and not self._skipped(rules, relative_path, False):
+                    yield entry.path
+            stack.extend(reversed(subdirectories))
+
+    def _skipped(self, rules, relative_path, is_dir):
+        return is_ignored(rules, relative_path, is_dir) or is_ignored(self.exclude, relative_path, is_dir)
+
+    def _path_excluded(self, path, excluded_dirs):
+        """Exclude check for flat listings (archives, git trees): the path and every directory above it."""
+        parts = path.split('/')
+        for depth in range(1, len(parts)):
+            directory = '/'.join(parts[:depth])
+            excluded = excluded_dirs.get(directory)
+            if excluded is None:
+                excluded = is_ignored(self.exclude, directory, True)
+                excluded_dirs[directory] = excluded
+            if excluded:
+                return True
+        return is_ignored(self.exclude, path, False)
+
+    def _iter_archive(self):
+        excluded_dirs = {}
+        if self.root.lower().endswith('.zip'):
+            archive = self._zip(self.root)
+            for info in archive.infolist():
+                self.scanned += 1
+                if info.is_dir() or info.file_size > MAX_FILE_BYTES:
+                    continue
+                name = _member_name(info.filename)
+                if self.matches(os.path.basename(name)) and not self._path_excluded(name, excluded_dirs):
+                    yield f"{self.root}{SEPARATOR}{name}"
+            return
+        # Read as a stream: compressed tars have no index, so matching members are kept until read
+        try:
+            with tarfile.open(self.root, 'r|*') as archive:
+                for member in archive:
+                    self.scanned += 1
+                    if not member.isfile() or member.size > MAX_FILE_BYTES:
+                        continue
+                    name = _member_name(member.name)
+                    if not self.matches(os.path.basename(name)) or self._path_excluded(name, excluded_dirs):
+                        continue
+                    identifier = f"{self.root}{SEPARATOR}{name}"
+                    self._contents[identifier] = archive.extractfile(member).read()
+                    yield identifier
+        except tarfile.TarError as e:
+            raise OSError(f"Cannot read archive {self.root}: {e}")
+
+    def _zip(self, path):
+        archive = self._zips.get(path)
+        if archive is None:
+            archive = self._zips[path] = zipfile.ZipFile(path)
+        return archive
+
+    def _commit(self):
+        if self._git_commit is None:
+            result = subprocess.run(['git', '-C', self.root, 'rev-parse', '--verify', f"{self.git_ref}^{{commit}}"],
+                                    capture_output=True, text=True)
+            if result.returncode != 0:
+                raise FileNotFoundError(f"Cannot resolve git ref {self.git_ref} in {self.root}: {result.stderr.strip()}")
+            self._git_commit = result.stdout.strip()
+        return self._git_commit
+
+    def _iter_git(self):
+        commit = self._commit()
+        excluded_dirs = {}
+        process = subprocess.Popen(['git', '-C', self.root, 'ls-tree', '-r', '-z', '--full-tree', commit],
+                                   stdout=subprocess.PIPE)
+        try:
+            buffer = b''
+            for chunk in iter(lambda: process.stdout.read(65536), b''):
+                buffer += chunk
+                *records, buffer = buffer.split(b'\0')
+                for record in records:
+                    self.scanned += 1
+                    info, _, path = record.partition(b'\t')
+                    mode, object_type = info.split(b' ')[:2]
+                    if object_type != b'blob' or mode == b'120000':
+                        continue
+                    path = path.decode('utf-8', errors='surrogateescape')
+                    if self.matches(path.rsplit('/', 1)[-1]) and not self._path_excluded(path, excluded_dirs):
+                        yield f"{self.root}@{commit}{SEPARATOR}{path}"
+        finally:
+            process.stdout.close()
+            process.wait()
+
+    def read(self, identifier):
+        """
+        Read a discovered file.
+
+        :param identifier: File path or an identifier yielded by iter_files()
+        :return: The file's text
+        :raises OSError: If it cannot be read
+        """
+        container, member = split_identifier(identifier)
+        if member is None:
+            with open(identifier, 'r') as jenkins_file:
+                return jenkins_file.read()
+        data = self._contents.pop(identifier, None)
+        if data is None:
+            git_source = re.match(r'^(.*)@([0-9a-f]{40,64})$', container)
+            if git_source and not os.path.isfile(container):
+                data = self._git_blob(git_source.group(1), f"{git_source.group(2)}:{member}")
+            elif container.lower().endswith('.zip'):
+                try:
+                    data = self._zip(container).read(member)
+                except (KeyError, zipfile.BadZipFile) as e:
+                    raise OSError(f"Cannot read {member} from {container}: {e}")
+            else:
+                data = self._tar_member(container, member)
+        return data.decode('utf-8', errors='replace')
+
+    def _tar_member(self, path, member):
+        # Another process discovered the file (worker mode); scan the archive for it
+        try:
+            with tarfile.open(path, 'r|*') as archive:
+                for info in archive:
+                    if info.isfile() and _member_name(info.name) == member:
+                        return archive.extractfile(info).read()
+        except tarfile.TarError as e:
+            raise OSError(f"Cannot read archive {path}: {e}")
+        raise FileNotFoundError(f"{member} not found in {path}")
+
+    def _git_blob(self, repo, object_name):
+        """Read a blob through one long-lived 'git cat-file --batch' process instead of one process per file."""
+        with self._lock:
+            if self._git is None:
+                self._git = subprocess.Popen(['git', '-C', repo, 'cat-file', '--batch'],
+                                             stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+            self._git.stdin.write(object_name.encode('utf-8', errors='surrogateescape') + b'\n')
+            self._git.stdin.flush()
+            header = self._git.stdout.readline().split()
+            if len(header) != 3:
+                raise FileNotFoundError(f"{object_name} not found in {repo}")
+            data = self._git.stdout.read(int(header[2]))
+            self._git.stdout.read(1)
+            return data
+
+    def close(self):
+        for archive in self._zips.values():
+            archive.close()
+        self._zips = {}
+        if self._git is not None:
+            self._git.stdin.close()
+            self._git.wait()
+            self._git = None
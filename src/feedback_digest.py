@@ -0,0 +1,237 @@
+"""
+Compact digest of the validation feedback log for prompt refinement.
+
+The validation log grows with every converted file, but most of its findings repeat:
+the same missing runAfter, the same unpinned image, the same hardcoded secret. The
+digest reads the log line by line, groups near-identical findings (same section,
+same words once names, quoted values, paths and numbers are masked) and renders the
+groups most frequent first, each with its count and one representative example, cut
+off at a token budget. The refinement request therefore stays the same size however
+many files were converted.
+"""
+import re
+import logging
+
+from rate_limiter import CHARS_PER_TOKEN
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TOKEN_BUDGET = 4000
+# Minimum Jaccard similarity of the masked word sets for two findings to share a group
+DEFAULT_SIMILARITY = 0.6
+DEFAULT_MAX_EXAMPLE_CHARS = 300
+
+_REPORT_START_RE = re.compile(r'^--- (Second )?Validation Report for Run .*, File: (.*) ---$')
+_REPORT_END_RE = re.compile(r'^--- End (Second )?Report ---$')
+_ITEM_RE = re.compile(r'^\s*(?:[-*+]|\d+[.)])\s+(.*)$')
+# "- Best Practices: 6/10", "**Structural Integrity**: Pass"
+_SCORE_RE = re.compile(r'^\**([A-Za-z][\w /&-]*?)\**\s*:\s*\**\s*(pass(?:ed)?|fail(?:ed)?|\d+(?:\.\d+)?\s*/\s*10)\**\s*$',
+                       re.IGNORECASE)
+# "Best Practices:", "### Security Considerations", "**Performance Optimization:**"
+_SECTION_RE = re.compile(r'^\s*(?:#+\s*\**([A-Za-z][\w /&-]{2,60}?)\**:?|\**([A-Z][\w /&-]{2,60}?)(?::\*\*|\*\*:|:))\s*$')
+# Status lines that are not findings: the static validator's header and the convergence note
+_STATUS_RE = re.compile(r'^(Static validation|Converged): ')
+# Findings written by ValidationReport.to_text(): "[error] code at path: message"
+_STATIC_FINDING_RE = re.compile(r'^\[(error|warning)\] ([\w-]+) at \S+: (.*)$')
+_MASKS = (
+    (re.compile(r"`[^`]*`|'[^']*'|\"[^\"]*\""), ' value '),
+    (re.compile(r'[\w.-]*[/:][\w./:@-]+'), ' path '),
+    (re.compile(r'\d+(?:\.\d+)*'), ' n '),
+)
+_WORD_RE = re.compile(r'[a-z]+')
+_STOPWORDS = frozenset(('a', 'an', 'the', 'and', 'or', 'of', 'to', 'in', 'for', 'on', 'is', 'are', 'be', 'it',
+                        'this', 'that', 'with', 'as', 'by', 'at', 'from', 'should', 'could', 'consider'))
+
+
+def _words(text):
+    """The masked word set a finding is compared by."""
+    text = text.lower()
+    for pattern, replacement in _MASKS:
+        text = pattern.sub(replacement, text)
+    return frozenset(word for word in _WORD_RE.findall(text) if word not in _STOPWORDS)
+
+
+def _similarity(first, second):
+    if not first and not second:
+        return 1.0
+    return len(first & second) / len(first | second)
+
+
+class FindingGroup:
+    """Near-identical findings: how often they occurred and one example."""
+
+    def __init__(self, section, example, words):
+        self.section = section
+        self.example = example
+        self.words = words
+        self.count = 0
+        self.reports = 0
+        self._last_report = None
+
+    def add(self, report_index):
+        self.count += 1
+        if report_index != self._last_report:
+            self.reports += 1
+            self._last_report = report_index
+
+
+class FeedbackDigest:
+    """Findings of a validation log grouped by similarity, with the reports' average scores."""
+
+    def __init__(self, similarity=DEFAULT_SIMILARITY):
+        """
+        :param similarity: Minimum Jaccard similarity for a finding to join an existing group
+        """
+        self.similarity = similarity
+        self.reports = 0
+        self.findings = 0
+        self.groups = []
+        self._exact = {}
+        self._by_section = {}
+        # category -> [score sum, scored reports, passes, pass/fail reports]
+        self.scores = {}
+
+    def add_finding(self, text, section=None):
+        """
+        Add one finding of the current report.
+
+        :param text: Finding text
+        :param section: Report section the finding was listed under, if any
+        """
+        text = " ".join(text.split())
+        if not text:
+            return
+        section = section or ''
+        words = _words(text)
+        key = (section, words)
+        group = self._exact.get(key)
+        if group is None:
+            candidates = self._by_section.setdefault(section, [])
+            group = max(((_similarity(words, candidate.words), candidate) for candidate in candidates),
+                        key=lambda scored: scored[0], default=(0.0, None))[1]
+            if group is None or _similarity(words, group.words) < self.similarity:
+                group = FindingGroup(section, text, words)
+                candidates.append(group)
+                self.groups.append(group)
+            self._exact[key] = group
+        group.add(self.reports)
+        self.findings += 1
+
+    def add_score(self, category, value):
+        totals = self.scores.setdefault(category.strip(), [0.0, 0, 0, 0])
+        value = value.lower().replace(' ', '')
+        if '/' in value:
+            totals[0] += float(value.split('/')[0])
+            totals[1] += 1
+        else:
+            totals[2] += 1 if value.startswith('pass') else 0
+            totals[3] += 1
+
+    def add_report(self, lines):
+        """
+        Add one report: the lines between its start and end markers.
+
+        List items are findings, filed under the heading above them. Static validator
+        findings are grouped by their code. A report without list items (e.g. the
+        free-text summary of a second validation) contributes each of its lines.
+        """
+        self.reports += 1
+        section = None
+        loose = []
+        itemized = False
+        for line in lines:
+            stripped = line.strip().strip('*').strip()
+            if not stripped or _STATUS_RE.match(stripped):
+                continue
+            item = _ITEM_RE.match(line)
+            text = item.group(1).strip() if item else stripped
+            static = _STATIC_FINDING_RE.match(text)
+            score = _SCORE_RE.match(text)
+            if static:
+                self.add_finding(f"[{static.group(1)}] {static.group(2)}: {static.group(3)}",
+                                 section=f"static {static.group(2)}")
+                itemized = True
+            elif score:
+                self.add_score(score.group(1), score.group(2))
+            elif item:
+                self.add_finding(text, section)
+                itemized = True
+            elif _SECTION_RE.match(line):
+                heading = _SECTION_RE.match(line)
+                section = (heading.group(1) or heading.group(2)).strip()
+            else:
+                loose.append(stripped)
+        if not itemized:
+            for text in loose:
+                self.add_finding(text, section)
+
+    def ranked(self):
+        """Groups, most frequent first."""
+        return sorted(self.groups, key=lambda group: (-group.count, -group.reports, group.example))
+
+    def render(self, token_budget=DEFAULT_TOKEN_BUDGET, max_example_chars=DEFAULT_MAX_EXAMPLE_CHARS):
+        """
+        The digest as text for the refinement request.
+
+        :param token_budget: Approximate token limit for the whole digest
+        :param max_example_chars: Examples longer than this are shortened
+        :return: Digest text
+        """
+        lines = [f"{self.reports} validation reports with {self.findings} findings, "
+                 f"grouped into {len(self.groups)} kinds of finding (most frequent first)."]
+        score_texts = []
+        for category, (total, scored, passes, judged) in sorted(self.scores.items()):
+            if scored:
+                score_texts.append(f"{category} {total / scored:.1f}/10")
+            if judged:
+                score_texts.append(f"{category} passed {passes / judged:.0%}")
+        if score_texts:
+            lines.append("Average scores: " + ", ".join(score_texts) + ".")
+        lines.append("")
+        budget = token_budget * CHARS_PER_TOKEN - sum(len(line) + 1 for line in lines)
+        ranked = self.ranked()
+        shown = 0
+        for group in ranked:
+            example = group.example if len(group.example) <= max_example_chars else group.example[:max_example_chars - 3] + "..."
+            section = f"[{group.section}] " if group.section else ""
+            line = f"- {group.count}x in {group.reports} reports: {section}{example}"
+            # Keep room for the line that says what was left out
+            if len(line) + 1 > budget - 100:
+                break
+            lines.append(line)
+            budget -= len(line) + 1
+            shown += 1
+        if shown < len(ranked):
+            omitted = sum(group.count for group in ranked[shown:])
+            lines.append(f"({len(ranked) - shown} less frequent kinds of finding, {omitted} findings in total, "
+                         f"left out to stay within the token budget.)")
+        return "\n".join(lines)
+
+
+def digest_log(log_file_path, similarity=DEFAULT_SIMILARITY):
+    """
+    Read a validation log into a FeedbackDigest without holding the whole log in memory.
+
+    :param log_file_path: Path to the tekton_validation_errors.log file
+    :param similarity: Minimum Jaccard similarity for findings to share a group
+    :return: FeedbackDigest
+    """
+    digest = FeedbackDigest(similarity)
+    report = None
+    with open(log_file_path, 'r') as log_file:
+        for line in log_file:
+            line = line.rstrip("\n")
+            if _REPORT_START_RE.match(line):
+                if report is not None:
+                    digest.add_report(report)
+                report = []
+            elif _REPORT_END_RE.match(line):
+                if report is not None:
+                    digest.add_report(report)
+                report = None
+            elif report is not None:
+                report.append(line)
+    if report:
+        digest.add_report(report)
+    logger.info(f"Digested {digest.reports} validation reports: {digest.findings} findings in {len(digest.groups)} groups")
+    return digest
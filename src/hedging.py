@@ -0,0 +1,184 @@
+"""
+Hedged requests and per-stage deadlines for LLM calls.
+
+Every request of a stage gets a deadline (hedging.deadlines, or
+error_handling.request_timeout_seconds), after which it is abandoned and retried.
+Once a stage has enough answers to know its latency, a request that is still running
+after the stage's p95 latency gets an identical hedged request: whichever answers
+first is used and the other one is cancelled. Hedges are capped at a fraction of a
+stage's requests, so a provider that is slow for everyone is not sent twice the load,
+and a request is not hedged while its concurrency limits have no free slot.
+"""
+import asyncio
+import logging
+from collections import deque
+
+from metrics import percentile
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PERCENTILE = 95
+DEFAULT_MIN_SAMPLES = 20
+DEFAULT_WINDOW = 200
+DEFAULT_MIN_DELAY_SECONDS = 1.0
+DEFAULT_MAX_HEDGE_FRACTION = 0.1
+
+
+class HedgePolicy:
+    """Per-stage latency windows, deadlines and hedge counts for one pipeline."""
+
+    def __init__(self, enabled=True, deadlines=None, default_deadline=None, percentile=DEFAULT_PERCENTILE,
+                 min_samples=DEFAULT_MIN_SAMPLES, window=DEFAULT_WINDOW, min_delay=DEFAULT_MIN_DELAY_SECONDS,
+                 max_hedge_fraction=DEFAULT_MAX_HEDGE_FRACTION):
+        """
+        :param enabled: Send hedged requests; deadlines apply either way
+        :param deadlines: Optional dict of stage name -> seconds a request may take
+        :param default_deadline: Seconds for stages without their own deadline; None for no deadline
+        :param percentile: Latency percentile of the stage after which a request is hedged
+        :param min_samples: Answers a stage needs before its requests are hedged
+        :param window: Number of most recent answer latencies kept per stage
+        :param min_delay: Never hedge a request earlier than this many seconds
+        :param max_hedge_fraction: Hedges allowed per stage as a fraction of its requests
+        """
+        self.enabled = enabled
+        self.deadlines = {stage: float(seconds) for stage, seconds in (deadlines or {}).items() if seconds}
+        self.default_deadline = float(default_deadline) if default_deadline else None
+        self.percentile = percentile
+        self.min_samples = max(1, int(min_samples))
+        self.window = max(self.min_samples, int(window))
+        self.min_delay = float(min_delay or 0.0)
+        self.max_hedge_fraction = float(max_hedge_fraction)
+        self.latencies = {}
+        self.requests = {}
+        self.hedged = {}
+        self.wins = {}
+        self.skipped = {}
+        self.deadline_timeouts = {}
+
+    @classmethod
+    def from_config(cls, config):
+        """
+        Build the policy from the hedging and error_handling sections of config.yaml.
+
+        :param config: The whole config dict
+        """
+        hedging_config = config.get('hedging') or {}
+        error_config = config.get('error_handling') or {}
+        return cls(
+            enabled=hedging_config.get('enabled', True),
+            deadlines=hedging_config.get('deadlines'),
+            default_deadline=error_config.get('request_timeout_seconds'),
+            percentile=hedging_config.get('percentile', DEFAULT_PERCENTILE),
+            min_samples=hedging_config.get('min_samples', DEFAULT_MIN_SAMPLES),
+            window=hedging_config.get('window', DEFAULT_WINDOW),
+            min_delay=hedging_config.get('min_delay_seconds', DEFAULT_MIN_DELAY_SECONDS),
+            max_hedge_fraction=hedging_config.get('max_hedge_fraction', DEFAULT_MAX_HEDGE_FRACTION),
+        )
+
+    def deadline(self, stage):
+        """Seconds a request of the stage may take, or None."""
+        return self.deadlines.get(stage, self.default_deadline)
+
+    def observe(self, stage, seconds):
+        """Record how long an answer of the stage took, from sending the request to the answer."""
+        self.latencies.setdefault(stage, deque(maxlen=self.window)).append(seconds)
+
+    def delay(self, stage):
+        """
+        Seconds after which a request of the stage is hedged.
+
+        :return: The stage's latency percentile (at least min_delay), or None while there
+            are too few answers, the hedge budget is spent or hedging is off
+        """
+        if not self.enabled:
+            return None
+        latencies = self.latencies.get(stage)
+        if not latencies or len(latencies) < self.min_samples:
+            return None
+        if self.hedged.get(stage, 0) + 1 > self.max_hedge_fraction * max(1, self.requests.get(stage, 0)):
+            return None
+        delay = max(self.min_delay, percentile(latencies, self.percentile))
+        deadline = self.deadline(stage)
+        # A hedge sent at the deadline could never answer in time
+        return delay if deadline is None or delay < deadline else None
+
+    async def run(self, stage, send, can_hedge=None):
+        """
+        Send a request, hedge it if it runs past the stage's delay, and enforce the deadline.
+
+        :param stage: Stage name
+        :param send: Coroutine function send(hedge) sending one copy of the request;
+            hedge is True for the hedged copy
+        :param can_hedge: Optional callable returning False while there is no capacity for a hedged copy
+        :return: The answer of whichever copy answered first
+        :raises asyncio.TimeoutError: If no copy answered within the stage's deadline
+        """
+        self.requests[stage] = self.requests.get(stage, 0) + 1
+        deadline = self.deadline(stage)
+        try:
+            return await asyncio.wait_for(self._race(stage, send, can_hedge), deadline)
+        except asyncio.TimeoutError:
+            self.deadline_timeouts[stage] = self.deadline_timeouts.get(stage, 0) + 1
+            logger.warning(f"{stage} request passed its {deadline:g}s deadline")
+            raise
+
+    async def _race(self, stage, send, can_hedge):
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        primary = asyncio.ensure_future(send(False))
+        delay = self.delay(stage)
+        if delay is None:
+            result = await primary
+            self.observe(stage, loop.time() - started)
+            return result
+        pending = set()
+        try:
+            done, pending = await asyncio.wait({primary}, timeout=delay)
+            if done:
+                self.observe(stage, loop.time() - started)
+                return primary.result()
+            if can_hedge is not None and not can_hedge():
+                self.skipped[stage] = self.skipped.get(stage, 0) + 1
+                logger.debug(f"{stage} request still running after {delay:.2f}s; no free slot for a hedged request")
+                result = await primary
+                self.observe(stage, loop.time() - started)
+                return result
+            self.hedged[stage] = self.hedged.get(stage, 0) + 1
+            logger.debug(f"{stage} request still running after {delay:.2f}s; sending a hedged request")
+            hedge_started = loop.time()
+            hedge = asyncio.ensure_future(send(True))
+            pending = {primary, hedge}
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for winner in done:
+                    if winner.cancelled() or winner.exception() is not None:
+                        continue
+                    if winner is hedge:
+                        self.wins[stage] = self.wins.get(stage, 0) + 1
+                        self.observe(stage, loop.time() - hedge_started)
+                    else:
+                        self.observe(stage, loop.time() - started)
+                    return winner.result()
+            # Both copies failed; report the original request's error
+            return primary.result()
+        finally:
+            for task in pending | {primary}:
+                if not task.done():
+                    task.cancel()
+
+    def counters(self):
+        """Run summary counters: hedged requests, hedge wins, skipped hedges and deadline timeouts per stage and in total."""
+        counters = {
+            'hedged_requests': sum(self.hedged.values()),
+            'hedge_wins': sum(self.wins.values()),
+            'hedges_skipped': sum(self.skipped.values()),
+            'deadline_timeouts': sum(self.deadline_timeouts.values()),
+        }
+        for stage, count in self.requests.items():
+            hedged = self.hedged.get(stage, 0)
+            counters[f"hedged_requests_{stage}"] = hedged
+            counters[f"hedge_wins_{stage}"] = self.wins.get(stage, 0)
+            counters[f"hedges_skipped_{stage}"] = self.skipped.get(stage, 0)
+            counters[f"hedge_rate_{stage}"] = round(hedged / count, 4) if count else 0.0
+            counters[f"deadline_timeouts_{stage}"] = self.deadline_timeouts.get(stage, 0)
+        return counters
@@ -0,0 +1,701 @@
+"""
+Deterministic parser for declarative Jenkinsfiles.
+
+Produces the same intermediate JSON shape that prompts/jenkins2json.txt asks the LLM
+for, without a network round-trip. Only the declarative `pipeline {}` subset is
+understood: agent, environment, parameters, tools, options, triggers, stages (including
+nested and parallel stages), when, steps and post. Anything else (scripted `node {}`
+pipelines, `script {}` blocks containing real Groovy such as `def`, `if` or method
+chains, matrix stages, string concatenation, ...) raises UnsupportedJenkinsfileError so
+the caller can fall back to the LLM.
+"""
+import re
+import json
+import textwrap
+
+PIPELINE_TYPE = "Declarative"
+
+
+class UnsupportedJenkinsfileError(ValueError):
+    """Raised when a Jenkinsfile uses a construct the local parser does not handle."""
+
+
+# --- Tokenizer ---
+
+IDENT = "ident"
+STRING = "string"
+NUMBER = "number"
+PUNCT = "punct"
+EOF = "eof"
+
+_IDENT_RE = re.compile(r'[A-Za-z_$][A-Za-z0-9_$]*')
+_NUMBER_RE = re.compile(r'\d+(\.\d+)?')
+_ESCAPES = {'n': '\n', 't': '\t', 'r': '\r', '\\': '\\', "'": "'", '"': '"', '$': '$', '\n': ''}
+_PUNCT_CHARS = set('{}()[],:=.+-!<>&|?;/*%~@')
+
+GROOVY_KEYWORDS = {
+    'def', 'if', 'else', 'for', 'while', 'try', 'catch', 'finally', 'return', 'new',
+    'import', 'switch', 'case', 'break', 'continue', 'throw', 'class', 'void', 'in',
+}
+
+
+class Token:
+    __slots__ = ('kind', 'value', 'start', 'end', 'line', 'newline_before')
+
+    def __init__(self, kind, value, start, end, line, newline_before):
+        self.kind = kind
+        self.value = value
+        self.start = start
+        self.end = end
+        self.line = line
+        self.newline_before = newline_before
+
+    def is_punct(self, value):
+        return self.kind == PUNCT and self.value == value
+
+    def __repr__(self):
+        return f"Token({self.kind}, {self.value!r}, line {self.line})"
+
+
+def _unescape(text):
+    out = []
+    i = 0
+    while i < len(text):
+        char = text[i]
+        if char == '\\' and i + 1 < len(text):
+            nxt = text[i + 1]
+            out.append(_ESCAPES.get(nxt, '\\' + nxt))
+            i += 2
+        else:
+            out.append(char)
+            i += 1
+    return ''.join(out)
+
+
+def _clean_multiline(text):
+    # Multi-line shell scripts are usually indented to match the Jenkinsfile
+    if text.startswith('\n'):
+        text = text[1:]
+    return textwrap.dedent(text).rstrip()
+
+
+def tokenize(source):
+    """
+    Split Jenkinsfile source into tokens, dropping comments.
+
+    :param source: Jenkinsfile text
+    :return: List of Token, ending with an EOF token
+    """
+    tokens = []
+    i = 0
+    line = 1
+    newline_before = True
+    length = len(source)
+    while i < length:
+        char = source[i]
+        if char == '\n':
+            line += 1
+            newline_before = True
+            i += 1
+            continue
+        if char in ' \t\r\f':
+            i += 1
+            continue
+        if source.startswith('//', i):
+            end = source.find('\n', i)
+            i = length if end == -1 else end
+            continue
+        if source.startswith('/*', i):
+            end = source.find('*/', i + 2)
+            if end == -1:
+                raise UnsupportedJenkinsfileError(f"Unterminated block comment at line {line}")
+            line += source.count('\n', i, end)
+            i = end + 2
+            continue
+
+        start = i
+        if source.startswith("'''", i) or source.startswith('"""', i):
+            quote = source[i:i + 3]
+            end = source.find(quote, i + 3)
+            while end != -1 and source[end - 1] == '\\':
+                end = source.find(quote, end + 1)
+            if end == -1:
+                raise UnsupportedJenkinsfileError(f"Unterminated string at line {line}")
+            raw = source[i + 3:end]
+            tokens.append(Token(STRING, _clean_multiline(_unescape(raw)), start, end + 3, line, newline_before))
+            line += raw.count('\n')
+            i = end + 3
+        elif char in ('"', "'"):
+            j = i + 1
+            while j < length and source[j] != char:
+                if source[j] == '\\':
+                    j += 1
+                elif source[j] == '\n':
+                    raise UnsupportedJenkinsfileError(f"Unterminated string at line {line}")
+                j += 1
+            if j >= length:
+                raise UnsupportedJenkinsfileError(f"Unterminated string at line {line}")
+            tokens.append(Token(STRING, _unescape(source[i + 1:j]), start, j + 1, line, newline_before))
+            i = j + 1
+        elif char.isdigit():
+            match = _NUMBER_RE.match(source, i)
+            text = match.group(0)
+            value = float(text) if '.' in text else int(text)
+            tokens.append(Token(NUMBER, value, start, match.end(), line, newline_before))
+            i = match.end()
+        elif _IDENT_RE.match(source, i):
+            match = _IDENT_RE.match(source, i)
+            tokens.append(Token(IDENT, match.group(0), start, match.end(), line, newline_before))
+            i = match.end()
+        elif char in _PUNCT_CHARS:
+            tokens.append(Token(PUNCT, char, start, i + 1, line, newline_before))
+            i += 1
+        else:
+            raise UnsupportedJenkinsfileError(f"Unexpected character {char!r} at line {line}")
+        newline_before = False
+    tokens.append(Token(EOF, None, length, length, line, True))
+    return tokens
+
+
+# --- Syntax tree ---
+
+class Closure:
+    """A `{ ... }` body: its tokens (parsed on demand) and raw source text."""
+
+    def __init__(self, source, tokens, open_token, close_token):
+        self.source = source
+        self.tokens = tokens
+        self.line = open_token.line
+        self.raw = textwrap.dedent(source[open_token.end:close_token.start]).strip()
+
+    def statements(self):
+        return _Parser(self.source, self.tokens + [Token(EOF, None, 0, 0, self.line, True)]).parse_statements()
+
+
+class Call:
+    """`name args`, `name(args)`, `name { ... }` or `name(args) { ... }`."""
+
+    def __init__(self, name, args, kwargs, closure, line):
+        self.name = name
+        self.args = args
+        self.kwargs = kwargs
+        self.closure = closure
+        self.line = line
+
+
+class Assign:
+    """`NAME = value`, as used in environment blocks."""
+
+    def __init__(self, name, value, line):
+        self.name = name
+        self.value = value
+        self.line = line
+
+
+class Expr:
+    """A non-literal value kept as source text, e.g. `params.VERSION`."""
+
+    def __init__(self, text):
+        self.text = text
+
+
+class _Parser:
+    def __init__(self, source, tokens):
+        self.source = source
+        self.tokens = tokens
+        self.pos = 0
+
+    def peek(self, offset=0):
+        return self.tokens[min(self.pos + offset, len(self.tokens) - 1)]
+
+    def advance(self):
+        token = self.tokens[self.pos]
+        self.pos += 1
+        return token
+
+    def expect_punct(self, value):
+        token = self.advance()
+        if not token.is_punct(value):
+            raise UnsupportedJenkinsfileError(f"Expected '{value}' at line {token.line}, found {token.value!r}")
+        return token
+
+    def parse_statements(self):
+        statements = []
+        while self.peek().kind != EOF:
+            if self.peek().is_punct(';'):
+                self.advance()
+                continue
+            statements.append(self.parse_statement())
+            following = self.peek()
+            if not (following.kind == EOF or following.newline_before or following.is_punct(';') or following.is_punct('}')):
+                raise UnsupportedJenkinsfileError(f"Unsupported expression at line {following.line}")
+        return statements
+
+    def parse_statement(self):
+        token = self.advance()
+        if token.kind != IDENT:
+            raise UnsupportedJenkinsfileError(f"Unsupported statement starting with {token.value!r} at line {token.line}")
+        if token.value in GROOVY_KEYWORDS:
+            raise UnsupportedJenkinsfileError(f"Groovy '{token.value}' statement at line {token.line}")
+        nxt = self.peek()
+        if nxt.is_punct('.'):
+            raise UnsupportedJenkinsfileError(f"Method call on '{token.value}' at line {token.line}")
+        if nxt.is_punct('='):
+            self.advance()
+            return Assign(token.value, self.parse_value(), token.line)
+
+        args, kwargs, closure = [], {}, None
+        if nxt.is_punct('(') and not nxt.newline_before:
+            self.advance()
+            args, kwargs = self.parse_arguments(')')
+        elif self._starts_value(nxt) and not nxt.newline_before:
+            args, kwargs = self.parse_command_arguments()
+        if self.peek().is_punct('{'):
+            closure = self.parse_closure()
+        return Call(token.value, args, kwargs, closure, token.line)
+
+    def _starts_value(self, token):
+        if token.kind in (STRING, NUMBER):
+            return True
+        if token.kind == IDENT:
+            return token.value not in GROOVY_KEYWORDS
+        return token.is_punct('[') or token.is_punct('-')
+
+    def parse_closure(self):
+        open_token = self.expect_punct('{')
+        depth = 1
+        start = self.pos
+        while True:
+            token = self.advance()
+            if token.kind == EOF:
+                raise UnsupportedJenkinsfileError(f"Unbalanced '{{' at line {open_token.line}")
+            if token.is_punct('{'):
+                depth += 1
+            elif token.is_punct('}'):
+                depth -= 1
+                if depth == 0:
+                    return Closure(self.source, self.tokens[start:self.pos - 1], open_token, token)
+
+    def _parse_argument(self, args, kwargs):
+        token = self.peek()
+        if token.kind in (IDENT, STRING) and self.peek(1).is_punct(':'):
+            self.advance()
+            self.advance()
+            kwargs[token.value] = self.parse_value()
+        else:
+            args.append(self.parse_value())
+
+    def parse_arguments(self, closing):
+        args, kwargs = [], {}
+        while not self.peek().is_punct(closing):
+            self._parse_argument(args, kwargs)
+            if self.peek().is_punct(','):
+                self.advance()
+            elif not self.peek().is_punct(closing):
+                raise UnsupportedJenkinsfileError(f"Unsupported argument expression at line {self.peek().line}")
+        self.advance()
+        return args, kwargs
+
+    def parse_command_arguments(self):
+        args, kwargs = [], {}
+        self._parse_argument(args, kwargs)
+        while self.peek().is_punct(','):
+            self.advance()
+            self._parse_argument(args, kwargs)
+        return args, kwargs
+
+    def parse_value(self):
+        token = self.advance()
+        if token.kind in (STRING, NUMBER):
+            value = token.value
+        elif token.is_punct('-') and self.peek().kind == NUMBER:
+            value = -self.advance().value
+        elif token.is_punct('['):
+            value = self.parse_collection()
+        elif token.kind == IDENT:
+            value = self.parse_identifier_value(token)
+        else:
+            raise UnsupportedJenkinsfileError(f"Unsupported value {token.value!r} at line {token.line}")
+        nxt = self.peek()
+        if nxt.kind == PUNCT and nxt.value in '+-*/%?<>=!&|' and not nxt.newline_before:
+            raise UnsupportedJenkinsfileError(f"Unsupported expression at line {nxt.line}")
+        return value
+
+    def parse_identifier_value(self, token):
+        if token.value == 'true':
+            return True
+        if token.value == 'false':
+            return False
+        if token.value == 'null':
+            return None
+        if self.peek().is_punct('(') and not self.peek().newline_before:
+            self.advance()
+            args, kwargs = self.parse_arguments(')')
+            if self.peek().is_punct('{'):
+                raise UnsupportedJenkinsfileError(f"Closure argument at line {token.line}")
+            return Call(token.value, args, kwargs, None, token.line)
+        if self.peek().is_punct('.'):
+            parts = [token.value]
+            while self.peek().is_punct('.') and self.peek(1).kind == IDENT:
+                self.advance()
+                parts.append(self.advance().value)
+            if self.peek().is_punct('(') or self.peek().is_punct('.'):
+                raise UnsupportedJenkinsfileError(f"Method call in value at line {token.line}")
+            return Expr('.'.join(parts))
+        return token.value
+
+    def parse_collection(self):
+        if self.peek().is_punct(':') and self.peek(1).is_punct(']'):
+            self.advance()
+            self.advance()
+            return {}
+        args, kwargs = self.parse_arguments(']')
+        if args and kwargs:
+            raise UnsupportedJenkinsfileError("Mixed list/map literal")
+        return kwargs if kwargs else args
+
+
+def parse_statements(source):
+    """Parse Jenkinsfile source into a list of top-level Call/Assign statements."""
+    return _Parser(source, tokenize(source)).parse_statements()
+
+
+# --- Conversion to the intermediate JSON ---
+
+# Name under which the first positional argument of common steps is stored
+STEP_PRIMARY_ARGUMENT = {
+    'echo': 'message', 'error': 'message', 'input': 'message', 'mail': 'to',
+    'git': 'url', 'junit': 'testResults', 'archiveArtifacts': 'artifacts',
+    'dir': 'path', 'stash': 'name', 'unstash': 'name', 'sleep': 'time',
+    'build': 'job', 'retry': 'count', 'readFile': 'file', 'fileExists': 'file',
+    'tool': 'name', 'publishHTML': 'target', 'checkout': 'scm', 'timeout': 'time',
+    'withEnv': 'variables', 'withCredentials': 'bindings', 'sshagent': 'credentials',
+    'cleanWs': 'options', 'slackSend': 'message', 'waitUntil': 'options',
+}
+SCRIPT_STEPS = ('sh', 'bat', 'powershell', 'pwsh')
+POST_CONDITIONS = (
+    'always', 'changed', 'fixed', 'regression', 'aborted', 'failure',
+    'success', 'unstable', 'unsuccessful', 'cleanup',
+)
+WHEN_PRIMARY_ARGUMENT = {
+    'branch': 'pattern', 'tag': 'pattern', 'changeset': 'pattern', 'changelog': 'pattern',
+    'buildingTag': None, 'changeRequest': None, 'triggeredBy': 'cause', 'equals': 'expected',
+    'beforeAgent': 'value', 'beforeInput': 'value', 'beforeOptions': 'value',
+}
+PARAMETER_KEYS = {'defaultValue': 'default_value'}
+
+
+def _value_json(value):
+    if isinstance(value, Expr):
+        return f"${{{value.text}}}"
+    if isinstance(value, Call):
+        return _call_json(value)
+    if isinstance(value, list):
+        return [_value_json(item) for item in value]
+    if isinstance(value, dict):
+        return {key: _value_json(item) for key, item in value.items()}
+    return value
+
+
+def _arguments_json(call, primary=None):
+    args = [_value_json(arg) for arg in call.args]
+    kwargs = {key: _value_json(value) for key, value in call.kwargs.items()}
+    if primary and args:
+        kwargs = {primary: args[0] if len(args) == 1 else args, **kwargs}
+        args = []
+    if args and kwargs:
+        kwargs['args'] = args
+        return kwargs
+    return kwargs or args or None
+
+
+def _call_json(call):
+    result = {"type": call.name}
+    arguments = _arguments_json(call, STEP_PRIMARY_ARGUMENT.get(call.name))
+    if arguments is not None:
+        result["arguments"] = arguments
+    return result
+
+
+def _require_closure(call, section):
+    if call.closure is None:
+        raise UnsupportedJenkinsfileError(f"'{section}' without a block at line {call.line}")
+    return call.closure.statements()
+
+
+def _settings_json(statements):
+    """Convert a block of simple `key value` / `key { ... }` statements to a dict."""
+    settings = {}
+    for statement in statements:
+        if isinstance(statement, Assign):
+            settings[statement.name] = _value_json(statement.value)
+        elif statement.closure is not None:
+            settings[statement.name] = _settings_json(statement.closure.statements())
+        else:
+            settings[statement.name] = _arguments_json(statement, 'value') if statement.args or statement.kwargs else True
+            if isinstance(settings[statement.name], dict) and list(settings[statement.name]) == ['value']:
+                settings[statement.name] = settings[statement.name]['value']
+    return settings
+
+
+def _agent_json(call):
+    if call.closure is None:
+        if len(call.args) != 1:
+            raise UnsupportedJenkinsfileError(f"Unsupported agent declaration at line {call.line}")
+        return {"type": str(_value_json(call.args[0]))}
+    statements = call.closure.statements()
+    if len(statements) != 1 or not isinstance(statements[0], Call):
+        raise UnsupportedJenkinsfileError(f"Unsupported agent block at line {call.line}")
+    kind = statements[0]
+    agent = {"type": kind.name}
+    if kind.closure is not None:
+        agent.update(_settings_json(kind.closure.statements()))
+    primary = {'label': 'label', 'docker': 'image', 'dockerfile': 'filename', 'node': 'label'}.get(kind.name, 'value')
+    arguments = _arguments_json(kind, primary)
+    if isinstance(arguments, dict):
+        agent.update(arguments)
+    if kind.name == 'dockerfile' and agent.get('filename') is True:
+        agent.pop('filename')
+    return agent
+
+
+def _environment_json(call):
+    environment = {}
+    for statement in _require_closure(call, 'environment'):
+        if not isinstance(statement, Assign):
+            raise UnsupportedJenkinsfileError(f"Unsupported environment entry at line {statement.line}")
+        value = statement.value
+        if isinstance(value, Call) and value.name == 'credentials' and len(value.args) == 1:
+            environment[statement.name] = {"type": "credentials", "credentials_id": _value_json(value.args[0])}
+        else:
+            environment[statement.name] = _value_json(value)
+    return environment
+
+
+def _parameters_json(call):
+    parameters = []
+    for statement in _require_closure(call, 'parameters'):
+        if not isinstance(statement, Call) or statement.closure is not None:
+            raise UnsupportedJenkinsfileError(f"Unsupported parameter definition at line {statement.line}")
+        parameter = {"type": statement.name}
+        for key, value in statement.kwargs.items():
+            parameter[PARAMETER_KEYS.get(key, key)] = _value_json(value)
+        if statement.args:
+            parameter.setdefault("name", _value_json(statement.args[0]))
+        parameters.append(parameter)
+    return parameters
+
+
+def _call_list_json(call, section):
+    entries = []
+    for statement in _require_closure(call, section):
+        if not isinstance(statement, Call) or statement.closure is not None:
+            raise UnsupportedJenkinsfileError(f"Unsupported {section} entry at line {statement.line}")
+        entries.append(_call_json(statement))
+    return entries
+
+
+def _tools_json(call):
+    tools = {}
+    for statement in _require_closure(call, 'tools'):
+        if not isinstance(statement, Call) or len(statement.args) != 1:
+            raise UnsupportedJenkinsfileError(f"Unsupported tools entry at line {statement.line}")
+        tools[statement.name] = _value_json(statement.args[0])
+    return tools
+
+
+def _when_condition_json(statement):
+    if not isinstance(statement, Call):
+        raise UnsupportedJenkinsfileError(f"Unsupported when condition at line {statement.line}")
+    name = statement.name
+    if name in ('allOf', 'anyOf', 'not'):
+        conditions = [_when_condition_json(child) for child in _require_closure(statement, name)]
+        if name == 'not':
+            if len(conditions) != 1:
+                raise UnsupportedJenkinsfileError(f"'not' needs exactly one condition at line {statement.line}")
+            return {"condition": "not", "conditions": conditions}
+        return {"condition": name, "conditions": conditions}
+    if name == 'expression':
+        if statement.closure is None:
+            raise UnsupportedJenkinsfileError(f"'expression' without a block at line {statement.line}")
+        return {"condition": "expression", "expression": statement.closure.raw}
+    if statement.closure is not None:
+        raise UnsupportedJenkinsfileError(f"Unsupported when block '{name}' at line {statement.line}")
+    condition = {"condition": name}
+    arguments = _arguments_json(statement, WHEN_PRIMARY_ARGUMENT.get(name, 'value'))
+    if isinstance(arguments, dict):
+        condition.update(arguments)
+    return condition
+
+
+def _when_json(call):
+    conditions = []
+    flags = {}
+    for statement in _require_closure(call, 'when'):
+        if isinstance(statement, Call) and statement.name in ('beforeAgent', 'beforeInput', 'beforeOptions'):
+            flags[statement.name] = _value_json(statement.args[0]) if statement.args else True
+        else:
+            conditions.append(_when_condition_json(statement))
+    if not conditions:
+        raise UnsupportedJenkinsfileError(f"Empty when block at line {call.line}")
+    when = conditions[0] if len(conditions) == 1 else {"condition": "allOf", "conditions": conditions}
+    when.update(flags)
+    return when
+
+
+def _credential_bindings(call):
+    bindings = []
+    for arg in call.args:
+        for item in arg if isinstance(arg, list) else [arg]:
+            if isinstance(item, Call):
+                binding = {"type": item.name}
+                binding.update({key: _value_json(value) for key, value in item.kwargs.items()})
+                bindings.append(binding)
+    return bindings
+
+
+def _steps_json(statements, credentials_used=None):
+    steps = []
+    for statement in statements:
+        if isinstance(statement, Assign):
+            raise UnsupportedJenkinsfileError(f"Variable assignment in steps at line {statement.line}")
+        steps.append(_step_json(statement, credentials_used))
+    return steps
+
+
+def _step_json(call, credentials_used=None):
+    if call.name == 'script':
+        if call.closure is None:
+            raise UnsupportedJenkinsfileError(f"'script' without a block at line {call.line}")
+        step = {
+            "type": "script",
+            "script_content": call.closure.raw,
+            "nested_steps": _steps_json(call.closure.statements(), credentials_used),
+        }
+    elif call.name in SCRIPT_STEPS:
+        kwargs = {key: _value_json(value) for key, value in call.kwargs.items()}
+        script = kwargs.pop('script', None)
+        if call.args:
+            script = _value_json(call.args[0])
+        if script is None:
+            raise UnsupportedJenkinsfileError(f"'{call.name}' without a script at line {call.line}")
+        step = {"type": call.name, "script_content": script}
+        if kwargs:
+            step["arguments"] = kwargs
+    else:
+        step = _call_json(call)
+        if call.closure is not None:
+            nested_credentials = credentials_used
+            if call.name == 'withCredentials':
+                nested_credentials = _credential_bindings(call)
+                step["credentials_used"] = nested_credentials
+            step["nested_steps"] = _steps_json(call.closure.statements(), nested_credentials)
+    if credentials_used and "credentials_used" not in step:
+        step["credentials_used"] = credentials_used
+    return step
+
+
+def _post_json(call):
+    post = {}
+    for statement in _require_closure(call, 'post'):
+        if not isinstance(statement, Call) or statement.name not in POST_CONDITIONS or statement.closure is None:
+            raise UnsupportedJenkinsfileError(f"Unsupported post condition at line {statement.line}")
+        post[statement.name] = _steps_json(statement.closure.statements())
+    return post
+
+
+def _stages_json(call):
+    stages = []
+    for statement in _require_closure(call, call.name):
+        if not isinstance(statement, Call) or statement.name != 'stage':
+            raise UnsupportedJenkinsfileError(f"Expected 'stage' at line {statement.line}")
+        stages.append(_stage_json(statement))
+    return stages
+
+
+def _stage_json(call):
+    if len(call.args) != 1 or call.closure is None:
+        raise UnsupportedJenkinsfileError(f"Unsupported stage declaration at line {call.line}")
+    stage = {"name": _value_json(call.args[0])}
+    for statement in call.closure.statements():
+        if isinstance(statement, Assign):
+            raise UnsupportedJenkinsfileError(f"Assignment in stage at line {statement.line}")
+        name = statement.name
+        if name == 'agent':
+            stage["agent"] = _agent_json(statement)
+        elif name == 'environment':
+            stage["environment"] = _environment_json(statement)
+        elif name == 'tools':
+            stage["tools"] = _tools_json(statement)
+        elif name == 'options':
+            stage["options"] = _call_list_json(statement, 'options')
+        elif name == 'when':
+            stage["when"] = _when_json(statement)
+        elif name == 'input':
+            stage["input"] = _settings_json(_require_closure(statement, 'input'))
+        elif name == 'steps':
+            stage["steps"] = _steps_json(_require_closure(statement, 'steps'))
+        elif name == 'parallel':
+            stage["parallel"] = _stages_json(statement)
+        elif name == 'stages':
+            stage["stages"] = _stages_json(statement)
+        elif name == 'failFast':
+            stage["failFast"] = _value_json(statement.args[0]) if statement.args else True
+        elif name == 'post':
+            stage["post"] = _post_json(statement)
+        else:
+            raise UnsupportedJenkinsfileError(f"Unsupported stage directive '{name}' at line {statement.line}")
+    if not any(key in stage for key in ('steps', 'parallel', 'stages')):
+        raise UnsupportedJenkinsfileError(f"Stage '{stage['name']}' has no steps at line {call.line}")
+    return stage
+
+
+def parse_declarative_jenkinsfile(source):
+    """
+    Parse a declarative Jenkinsfile into the intermediate JSON structure.
+
+    :param source: Jenkinsfile text
+    :return: Dict matching the structure described in prompts/jenkins2json.txt
+    :raises UnsupportedJenkinsfileError: If the file uses constructs the parser does not handle
+    """
+    statements = parse_statements(source)
+    pipelines = [s for s in statements if isinstance(s, Call) and s.name == 'pipeline' and s.closure is not None]
+    if len(pipelines) != 1 or len(statements) != 1:
+        names = ', '.join(sorted({getattr(s, 'name', '?') for s in statements}))
+        raise UnsupportedJenkinsfileError(f"Not a single declarative pipeline block (top-level: {names})")
+
+    result = {"pipeline_type": PIPELINE_TYPE}
+    for statement in pipelines[0].closure.statements():
+        if isinstance(statement, Assign):
+            raise UnsupportedJenkinsfileError(f"Assignment in pipeline block at line {statement.line}")
+        name = statement.name
+        if name == 'agent':
+            result["agent"] = _agent_json(statement)
+        elif name == 'environment':
+            result["environment"] = _environment_json(statement)
+        elif name == 'parameters':
+            result["parameters"] = _parameters_json(statement)
+        elif name == 'tools':
+            result["tools"] = _tools_json(statement)
+        elif name in ('options', 'triggers'):
+            result[name] = _call_list_json(statement, name)
+        elif name == 'stages':
+            result["stages"] = _stages_json(statement)
+        elif name == 'post':
+            result["post"] = _post_json(statement)
+        else:
+            raise UnsupportedJenkinsfileError(f"Unsupported pipeline directive '{name}' at line {statement.line}")
+    if "stages" not in result:
+        raise UnsupportedJenkinsfileError("Pipeline has no stages block")
+    return result
+
+
+def jenkinsfile_to_json(source):
+    """
+    Parse a declarative Jenkinsfile and serialize the result like the jenkins2json stage.
+
+    :param source: Jenkinsfile text
+    :return: Indented JSON string
+    :raises UnsupportedJenkinsfileError: If the file needs the LLM
+    """
+    return json.dumps(parse_declarative_jenkinsfile(source), indent=2)
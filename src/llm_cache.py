@@ -0,0 +1,248 @@
+import os
+import json
+import time
+import hashlib
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Cache modes
+CACHE_MODE_USE = "use"          # Read hits and store new responses
+CACHE_MODE_REFRESH = "refresh"  # Ignore existing entries but store new responses
+CACHE_MODE_OFF = "off"          # Neither read nor write
+CACHE_MODES = (CACHE_MODE_USE, CACHE_MODE_REFRESH, CACHE_MODE_OFF)
+
+
+def make_cache_key(model, messages, params=None):
+    """
+    Build the content address for a chat completion request.
+
+    The key covers the model, every message (so the system prompt content is included,
+    not just its file name) and any extra request parameters such as response_format.
+
+    :param model: Model name
+    :param messages: List of chat messages
+    :param params: Optional dict of extra request parameters
+    :return: Hex SHA-256 digest
+    """
+    payload = json.dumps(
+        {"model": model, "messages": messages, "params": params or {}},
+        sort_keys=True, separators=(',', ':'), ensure_ascii=False
+    )
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    """
+    Persistent, content-addressed store of LLM responses.
+
+    Each entry lives in its own JSON file under cache_dir/<first two hex chars>/<key>.json.
+    Entries older than max_age_days are treated as misses, and prune() removes expired
+    entries and then the least recently used ones until the cache fits max_size_mb and
+    max_entries.
+    """
+
+    def __init__(self, cache_dir, mode=CACHE_MODE_USE, max_size_mb=None, max_age_days=None, max_entries=None):
+        """
+        :param cache_dir: Directory holding the cache entries
+        :param mode: One of CACHE_MODES
+        :param max_size_mb: Optional size limit for the whole cache
+        :param max_age_days: Optional age after which entries expire
+        :param max_entries: Optional limit on the number of entries
+        """
+        if mode not in CACHE_MODES:
+            raise ValueError(f"Invalid cache mode '{mode}'. Expected one of {CACHE_MODES}")
+        self.cache_dir = cache_dir
+        self.mode = mode
+        self.max_size_bytes = int(max_size_mb * 1024 * 1024) if max_size_mb else None
+        self.max_age_seconds = max_age_days * 86400 if max_age_days else None
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+
+    @classmethod
+    def from_config(cls, cache_config, project_root, mode=None):
+        """
+        Build a cache from the 'cache' section of config.yaml.
+
+        :param cache_config: The 'cache' config dict (may be None)
+        :param project_root: Base directory for a relative cache directory
+        :param mode: Optional mode overriding the config (e.g. from --no-cache/--refresh)
+        :return: ResponseCache instance
+        """
+        cache_config = cache_config or {}
+        if mode is None:
+            mode = CACHE_MODE_USE if cache_config.get('enabled', True) else CACHE_MODE_OFF
+        cache_dir = os.path.join(project_root, cache_config.get('directory', '.llm_cache'))
+        return cls(
+            cache_dir,
+            mode=mode,
+            max_size_mb=cache_config.get('max_size_mb'),
+            max_age_days=cache_config.get('max_age_days'),
+            max_entries=cache_config.get('max_entries')
+        )
+
+    @property
+    def enabled(self):
+        return self.mode != CACHE_MODE_OFF
+
+    def _entry_path(self, key):
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def get(self, key):
+        """
+        Look up a cached response.
+
+        :param key: Cache key from make_cache_key
+        :return: The cached response content, or None on a miss
+        """
+        if self.mode != CACHE_MODE_USE:
+            return None
+        path = self._entry_path(key)
+        try:
+            with open(path, 'r') as entry_file:
+                entry = json.load(entry_file)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        except (IOError, ValueError) as e:
+            logger.warning(f"Discarding unreadable cache entry {path}: {e}")
+            self._remove(path)
+            self.misses += 1
+            return None
+
+        if self.max_age_seconds and time.time() - entry.get('created', 0) > self.max_age_seconds:
+            self._remove(path)
+            self.evictions += 1
+            self.misses += 1
+            return None
+
+        # Touch the entry so pruning evicts least recently used entries first
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        self.hits += 1
+        return entry.get('content')
+
+    def put(self, key, content, model=None, stage=None):
+        """
+        Store a response.
+
+        :param key: Cache key from make_cache_key
+        :param content: Response content to store
+        :param model: Model name, kept for inspection
+        :param stage: Conversion stage, kept for inspection
+        """
+        if not self.enabled:
+            return
+        path = self._entry_path(key)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp_path, 'w') as entry_file:
+                json.dump({"created": time.time(), "model": model, "stage": stage, "content": content}, entry_file)
+            os.replace(tmp_path, path)
+            self.writes += 1
+        except (IOError, OSError) as e:
+            logger.warning(f"Failed to write cache entry {path}: {e}")
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def prune(self):
+        """
+        Evict expired entries, then least recently used entries over the size/count limits.
+
+        :return: Number of entries removed
+        """
+        if not os.path.isdir(self.cache_dir):
+            return 0
+        now = time.time()
+        entries = []
+        removed = 0
+        for shard in os.scandir(self.cache_dir):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                if not entry.name.endswith('.json'):
+                    continue
+                stat = entry.stat()
+                if self.max_age_seconds and now - stat.st_mtime > self.max_age_seconds:
+                    self._remove(entry.path)
+                    removed += 1
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        entries.sort()
+        total_size = sum(size for _, size, _ in entries)
+        while entries and (
+            (self.max_size_bytes and total_size > self.max_size_bytes)
+            or (self.max_entries and len(entries) > self.max_entries)
+        ):
+            _, size, path = entries.pop(0)
+            self._remove(path)
+            total_size -= size
+            removed += 1
+
+        self.evictions += removed
+        if removed:
+            logger.info(f"Evicted {removed} entries from LLM cache {self.cache_dir}")
+        return removed
+
+    def stats(self):
+        """Return the hit/miss/write/eviction counters as a dict."""
+        return {
+            "mode": self.mode,
+            "hits": self.hits,
+            "misses": self.misses,
+            "writes": self.writes,
+            "evictions": self.evictions,
+        }
+
+
+def cached_chat_completion(client, cache, stage=None, validator=None, metrics=None, **request):
+    """
+    Synchronous chat completion that goes through the response cache.
+
+    :param client: OpenAI client
+    :param cache: ResponseCache instance or None
+    :param stage: Conversion stage name, stored alongside the entry
+    :param validator: Optional callable run on the content before it is cached; raise to reject it
+    :param metrics: Optional RunMetrics recording the call's time, tokens and cache hits
+    :param request: Arguments for client.chat.completions.create (model, messages, ...)
+    :return: The stripped message content of the first choice
+    """
+    key = None
+    if cache is not None and cache.enabled:
+        params = {k: v for k, v in request.items() if k not in ('model', 'messages')}
+        key = make_cache_key(request['model'], request['messages'], params)
+        cached = cache.get(key)
+        if cached is not None:
+            if metrics is not None:
+                metrics.record_cache_hit(stage)
+            return cached
+
+    start = time.perf_counter()
+    try:
+        response = client.chat.completions.create(**request)
+    except Exception as e:
+        if metrics is not None:
+            metrics.record_llm_call(stage, request['model'], time.perf_counter() - start, error=e.__class__.__name__)
+        raise
+    if metrics is not None:
+        usage = getattr(response, 'usage', None)
+        metrics.record_llm_call(stage, request['model'], time.perf_counter() - start,
+                                prompt_tokens=getattr(usage, 'prompt_tokens', None),
+                                completion_tokens=getattr(usage, 'completion_tokens', None))
+    content = response.choices[0].message.content.strip()
+    if validator is not None:
+        validator(content)
+    if key is not None:
+        cache.put(key, content, model=request['model'], stage=stage)
+    return content
@@ -0,0 +1,131 @@
+import os
+import json
+import hashlib
+import logging
+from datetime import datetime
+
+from discovery import input_key
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILENAME = "conversion_manifest.json"
+MANIFEST_VERSION = 1
+
+
+def sha256_text(text):
+    """Return the hex SHA-256 of a string."""
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+class ConversionManifest:
+    """
+    Per-file record of what each conversion stage consumed and produced.
+
+    For every input file and stage the manifest stores the hash of the stage input
+    (the Jenkinsfile source for jenkins2json, the previous stage's artifact otherwise),
+    the hash of the prompt used, and the path and hash of the artifact written. A stage
+    whose input and prompt hashes still match and whose artifact is intact on disk can be
+    reused instead of re-run, so an edit to one prompt only re-runs the stages from that
+    point on.
+
+    Input file keys are relative to base_dir and artifact paths are relative to the
+    manifest's directory, so the whole output tree can be moved.
+    """
+
+    def __init__(self, path, base_dir):
+        """
+        :param path: Path of the manifest JSON file
+        :param base_dir: Directory input file keys are made relative to
+        """
+        self.path = path
+        self.base_dir = base_dir
+        self.root = os.path.dirname(os.path.abspath(path))
+        self.files = {}
+        self._dirty = False
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r') as manifest_file:
+                data = json.load(manifest_file)
+            if data.get('version') != MANIFEST_VERSION:
+                logger.warning(f"Ignoring manifest {self.path} with unsupported version {data.get('version')}")
+                return
+            self.files = data.get('files', {})
+            logger.info(f"Loaded conversion manifest with {len(self.files)} files: {self.path}")
+        except (IOError, ValueError) as e:
+            logger.error(f"Failed to read manifest {self.path}: {e}. Starting with an empty manifest.")
+
+    def _key(self, jenkins_file):
+        return input_key(jenkins_file, self.base_dir)
+
+    def reusable(self, jenkins_file, stage, prompt_hash, input_content):
+        """
+        Return the previous artifact of a stage if it can be reused.
+
+        :param jenkins_file: Path to the Jenkins file
+        :param stage: Stage name
+        :param prompt_hash: Hash of the prompt the stage would use now
+        :param input_content: The content the stage would consume now
+        :return: Tuple (artifact_content, artifact_path), or (None, None) if the stage must re-run
+        """
+        record = self.files.get(self._key(jenkins_file), {}).get('stages', {}).get(stage)
+        if not record:
+            return None, None
+        if record.get('prompt_sha256') != prompt_hash or record.get('input_sha256') != sha256_text(input_content):
+            return None, None
+        artifact_path = os.path.join(self.root, record['artifact'])
+        try:
+            with open(artifact_path, 'r') as artifact_file:
+                content = artifact_file.read()
+        except IOError:
+            return None, None
+        if sha256_text(content) != record.get('artifact_sha256'):
+            logger.warning(f"Artifact {artifact_path} changed since it was recorded; {stage} will re-run.")
+            return None, None
+        return content, artifact_path
+
+    def record_stage(self, jenkins_file, stage, prompt_hash, input_content, artifact_path, artifact_content, run_number):
+        """
+        Record the artifact a stage produced.
+
+        :param jenkins_file: Path to the Jenkins file
+        :param stage: Stage name
+        :param prompt_hash: Hash of the prompt used
+        :param input_content: The content the stage consumed
+        :param artifact_path: Path the artifact was written to
+        :param artifact_content: The artifact content
+        :param run_number: The run that produced the artifact
+        """
+        entry = self.files.setdefault(self._key(jenkins_file), {'stages': {}})
+        entry['stages'][stage] = {
+            'prompt_sha256': prompt_hash,
+            'input_sha256': sha256_text(input_content),
+            'artifact': os.path.relpath(os.path.abspath(artifact_path), self.root),
+            'artifact_sha256': sha256_text(artifact_content),
+            'run_number': run_number,
+        }
+        entry['updated'] = datetime.now().isoformat(timespec='seconds')
+        self._dirty = True
+
+    def clear_stage(self, jenkins_file, stage):
+        """Forget a stage's artifact, e.g. after it failed to produce one."""
+        stages = self.files.get(self._key(jenkins_file), {}).get('stages', {})
+        if stages.pop(stage, None) is not None:
+            self._dirty = True
+
+    def save(self):
+        """Atomically write the manifest if it changed."""
+        if not self._dirty:
+            return
+        tmp_path = f"{self.path}.tmp"
+        try:
+            os.makedirs(self.root, exist_ok=True)
+            with open(tmp_path, 'w') as manifest_file:
+                json.dump({'version': MANIFEST_VERSION, 'files': self.files}, manifest_file, indent=2, sort_keys=True)
+            os.replace(tmp_path, self.path)
+            self._dirty = False
+        except (IOError, OSError) as e:
+            logger.error(f"Failed to write manifest {self.path}: {e}")
@@ -0,0 +1,321 @@
+import os
+import json
+import time
+import threading
+import contextvars
+from collections import deque
+from datetime import datetime
+
+# The Jenkins file being processed; set per conversion chain so LLM calls and I/O are tagged with it
+current_file = contextvars.ContextVar('current_file', default=None)
+
+# USD per 1,000 tokens; override or extend with metrics.pricing in config.yaml
+DEFAULT_PRICING = {
+    'gpt-3.5-turbo': {'prompt_per_1k': 0.0005, 'completion_per_1k': 0.0015},
+    'gpt-4o-mini': {'prompt_per_1k': 0.00015, 'completion_per_1k': 0.0006},
+    'gpt-4o': {'prompt_per_1k': 0.0025, 'completion_per_1k': 0.01},
+}
+DEFAULT_BATCH_DISCOUNT = 0.5
+PROMETHEUS_PREFIX = "jenkins_tekton"
+PERCENTILES = (50, 95, 99)
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of values, or None if there are none."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, -(-pct * len(ordered) // 100))
+    return ordered[min(len(ordered), rank) - 1]
+
+
+def _new_totals():
+    return {'requests': 0, 'errors': 0, 'retries': 0, 'cache_hits': 0, 'shared': 0, 'wall_seconds': 0.0,
+            'queue_seconds': 0.0, 'prompt_tokens': 0, 'completion_tokens': 0, 'cost_usd': 0.0}
+
+
+def _label_value(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class RunMetrics:
+    """
+    Collects timing, token usage and cost for one conversion run.
+
+    LLM calls and file I/O are recorded with the stage and the Jenkins file they belong
+    to (taken from current_file unless given). The totals are exported as a JSON run
+    summary, with breakdowns per stage, per model and per file, and as a Prometheus
+    textfile with per-stage and per-model series. Per-file series are left out of the
+    textfile to keep its cardinality bounded.
+    """
+
+    def __init__(self, pricing=None, batch_discount=DEFAULT_BATCH_DISCOUNT):
+        """
+        :param pricing: Dict model -> {'prompt_per_1k', 'completion_per_1k'} in USD, merged over DEFAULT_PRICING
+        :param batch_discount: Price factor for requests answered through the Batch API
+        """
+        self.pricing = {**DEFAULT_PRICING, **(pricing or {})}
+        self.batch_discount = batch_discount
+        self.started = time.time()
+        self.finished = None
+        self._lock = threading.Lock()
+        self.stages = {}
+        self.models = {}
+        self.files = {}
+        self.io = {}
+        self.latencies = {}
+        self.queue_waits = {}
+        self.counters = {}
+        # Unbounded for a run; a long-running server keeps windows instead (see bound())
+        self.max_samples = None
+        self.max_files = None
+        self.dropped_files = {'ok': 0, 'failed': 0}
+
+    def bound(self, max_samples, max_files):
+        """
+        Keep only recent data, for metrics that live as long as a server.
+
+        :param max_samples: Latency and queue wait samples kept per stage for the percentiles
+        :param max_files: Finished files kept in the per-file breakdown; older ones only count in the totals
+        """
+        with self._lock:
+            self.max_samples = max_samples
+            self.max_files = max_files
+            for samples in (self.latencies, self.queue_waits):
+                for stage, values in samples.items():
+                    samples[stage] = deque(values, maxlen=max_samples)
+            self._drop_files()
+
+    def _drop_files(self):
+        if not self.max_files or len(self.files) <= self.max_files:
+            return
+        for file in [file for file, totals in self.files.items() if totals['ok'] is not None]:
+            totals = self.files.pop(file)
+            self.dropped_files['ok' if totals['ok'] else 'failed'] += 1
+            if len(self.files) <= self.max_files:
+                return
+
+    @classmethod
+    def from_config(cls, metrics_config):
+        metrics_config = metrics_config or {}
+        return cls(pricing=metrics_config.get('pricing'),
+                   batch_discount=metrics_config.get('batch_discount', DEFAULT_BATCH_DISCOUNT))
+
+    def cost(self, model, prompt_tokens, completion_tokens, batch=False):
+        """Estimated USD cost of a request, or 0.0 for a model without a price."""
+        price = self.pricing.get(model)
+        if not price:
+            return 0.0
+        cost = ((prompt_tokens or 0) * price.get('prompt_per_1k', 0.0)
+                + (completion_tokens or 0) * price.get('completion_per_1k', 0.0)) / 1000.0
+        return cost * self.batch_discount if batch else cost
+
+    def _file(self, file):
+        file = file or current_file.get()
+        if file is None:
+            return None
+        return self.files.setdefault(file, {**_new_totals(), 'io_seconds': 0.0, 'seconds': None, 'ok': None})
+
+    def record_llm_call(self, stage, model, wall_seconds, queue_seconds=0.0, prompt_tokens=None,
+                        completion_tokens=None, retries=0, error=None, batch=False, file=None):
+        """
+        Record one LLM request (including its retries).
+
+        :param stage: Conversion stage
+        :param model: Model name
+        :param wall_seconds: Time from the first attempt to the answer, including queueing and backoff
+        :param queue_seconds: Time spent waiting for concurrency slots and the rate limiter
+        :param prompt_tokens: Prompt tokens from response.usage (or an estimate)
+        :param completion_tokens: Completion tokens from response.usage (or an estimate)
+        :param retries: Retries before the final attempt
+        :param error: Exception class name if the request finally failed
+        :param batch: True if the request went through the Batch API
+        :param file: Jenkins file; defaults to current_file
+        """
+        cost = self.cost(model, prompt_tokens, completion_tokens, batch)
+        with self._lock:
+            for totals in (self.stages.setdefault(stage, _new_totals()),
+                           self.models.setdefault(model, _new_totals()),
+                           self._file(file)):
+                if totals is None:
+                    continue
+                totals['requests'] += 1
+                totals['errors'] += 1 if error else 0
+                totals['retries'] += retries
+                totals['wall_seconds'] += wall_seconds
+                totals['queue_seconds'] += queue_seconds
+                totals['prompt_tokens'] += prompt_tokens or 0
+                totals['completion_tokens'] += completion_tokens or 0
+                totals['cost_usd'] += cost
+            self.latencies.setdefault(stage, deque(maxlen=self.max_samples)).append(wall_seconds)
+            self.queue_waits.setdefault(stage, deque(maxlen=self.max_samples)).append(queue_seconds)
+
+    def record_cache_hit(self, stage, shared=False, file=None):
+        """Record a request answered from the LLM cache, or (shared=True) by an identical in-flight request."""
+        key = 'shared' if shared else 'cache_hits'
+        with self._lock:
+            self.stages.setdefault(stage, _new_totals())[key] += 1
+            totals = self._file(file)
+            if totals is not None:
+                totals[key] += 1
+
+    def record_io(self, operation, seconds, nbytes=0, stage=None, file=None):
+        """
+        Record one file read or write.
+
+        :param operation: e.g. 'read', 'write', 'log'
+        :param seconds: Time taken
+        :param nbytes: Bytes read or written
+        :param stage: Conversion stage the I/O belongs to, if any
+        """
+        with self._lock:
+            totals = self.io.setdefault((operation, stage or ''), {'count': 0, 'seconds': 0.0, 'bytes': 0})
+            totals['count'] += 1
+            totals['seconds'] += seconds
+            totals['bytes'] += nbytes
+            file_totals = self._file(file)
+            if file_totals is not None:
+                file_totals['io_seconds'] += seconds
+
+    def record_file(self, file, seconds, ok):
+        """Record the end of a file's conversion chain."""
+        with self._lock:
+            totals = self._file(file)
+            totals['seconds'] = seconds
+            totals['ok'] = ok
+            self._drop_files()
+
+    def set_counter(self, name, value):
+        """Attach a run-level number (e.g. rate limiter pauses) to the summary and the textfile."""
+        with self._lock:
+            self.counters[name] = value
+
+    def finish(self):
+        self.finished = time.time()
+
+    # --- Export ---
+
+    def summary(self):
+        """The run summary as a JSON-serialisable dict."""
+        with self._lock:
+            finished = self.finished or time.time()
+            stages = {}
+            for stage, totals in self.stages.items():
+                stages[stage] = {**totals}
+                for pct in PERCENTILES:
+                    latency = percentile(self.latencies.get(stage, []), pct)
+                    stages[stage][f"p{pct}_seconds"] = round(latency, 4) if latency is not None else None
+                queue = percentile(self.queue_waits.get(stage, []), 95)
+                stages[stage]['queue_p95_seconds'] = round(queue, 4) if queue is not None else None
+            totals = _new_totals()
+            for stage_totals in self.stages.values():
+                for key in totals:
+                    totals[key] += stage_totals[key]
+            files_ok = sum(1 for totals_ in self.files.values() if totals_['ok']) + self.dropped_files['ok']
+            files_total = len(self.files) + self.dropped_files['ok'] + self.dropped_files['failed']
+            file_seconds = [totals_['seconds'] for totals_ in self.files.values() if totals_['seconds'] is not None]
+            files = {'total': files_total, 'ok': files_ok, 'failed': files_total - files_ok}
+            for pct in PERCENTILES:
+                seconds = percentile(file_seconds, pct)
+                files[f"p{pct}_seconds"] = round(seconds, 4) if seconds is not None else None
+            return {
+                'started': datetime.fromtimestamp(self.started).isoformat(timespec='seconds'),
+                'finished': datetime.fromtimestamp(finished).isoformat(timespec='seconds'),
+                'wall_seconds': round(finished - self.started, 3),
+                'files': files,
+                'totals': totals,
+                'stages': stages,
+                'models': {model: {**model_totals} for model, model_totals in self.models.items()},
+                'io': [{'operation': operation, 'stage': stage or None, **io_totals}
+                       for (operation, stage), io_totals in sorted(self.io.items())],
+                'counters': dict(self.counters),
+                'per_file': {file: {**file_totals} for file, file_totals in sorted(self.files.items())},
+            }
+
+    def write_json(self, path):
+        """Write the run summary to a JSON file."""
+        _atomic_write(path, json.dumps(self.summary(), indent=2, sort_keys=True, default=str))
+
+    def prometheus_text(self):
+        """The run's metrics in the Prometheus text exposition format."""
+        summary = self.summary()
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            full_name = f"{PROMETHEUS_PREFIX}_{name}"
+            lines.append(f"# HELP {full_name} {help_text}")
+            lines.append(f"# TYPE {full_name} {kind}")
+            for labels, value in samples:
+                label_text = ",".join(f'{key}="{_label_value(val)}"' for key, val in labels.items())
+                lines.append(f"{full_name}{{{label_text}}} {value}" if label_text else f"{full_name} {value}")
+
+        stages = summary['stages']
+        metric('llm_requests_total', 'counter', "LLM requests sent, by stage",
+               [({'stage': stage}, totals['requests']) for stage, totals in stages.items()])
+        metric('llm_errors_total', 'counter', "LLM requests that finally failed, by stage",
+               [({'stage': stage}, totals['errors']) for stage, totals in stages.items()])
+        metric('llm_retries_total', 'counter', "LLM request retries, by stage",
+               [({'stage': stage}, totals['retries']) for stage, totals in stages.items()])
+        metric('llm_cache_hits_total', 'counter', "LLM requests answered from the response cache, by stage",
+               [({'stage': stage}, totals['cache_hits']) for stage, totals in stages.items()])
+        metric('llm_shared_requests_total', 'counter', "LLM requests answered by an identical in-flight request",
+               [({'stage': stage}, totals['shared']) for stage, totals in stages.items()])
+        metric('llm_request_seconds_total', 'counter', "Wall time of LLM requests including queueing, by stage",
+               [({'stage': stage}, round(totals['wall_seconds'], 4)) for stage, totals in stages.items()])
+        metric('llm_queue_seconds_total', 'counter', "Time LLM requests waited for slots and rate limits, by stage",
+               [({'stage': stage}, round(totals['queue_seconds'], 4)) for stage, totals in stages.items()])
+        metric('llm_request_seconds', 'gauge', "LLM request wall time percentiles, by stage",
+               [({'stage': stage, 'quantile': f"0.{pct}"}, totals[f"p{pct}_seconds"])
+                for stage, totals in stages.items() for pct in PERCENTILES if totals[f"p{pct}_seconds"] is not None])
+        metric('llm_tokens_total', 'counter', "Tokens used, by model and kind",
+               [({'model': model, 'kind': kind}, totals[f"{kind}_tokens"])
+                for model, totals in summary['models'].items() for kind in ('prompt', 'completion')])
+        metric('llm_cost_usd_total', 'counter', "Estimated cost in USD, by model",
+               [({'model': model}, round(totals['cost_usd'], 6)) for model, totals in summary['models'].items()])
+        metric('io_seconds_total', 'counter', "Time spent on file I/O, by operation and stage",
+               [({'operation': io['operation'], 'stage': io['stage'] or ''}, round(io['seconds'], 4)) for io in summary['io']])
+        metric('io_bytes_total', 'counter', "Bytes read or written, by operation and stage",
+               [({'operation': io['operation'], 'stage': io['stage'] or ''}, io['bytes']) for io in summary['io']])
+        metric('files', 'gauge', "Files in the run, by outcome",
+               [({'status': 'ok'}, summary['files']['ok']), ({'status': 'failed'}, summary['files']['failed'])])
+        for name, value in sorted(summary['counters'].items()):
+            if isinstance(value, (int, float)):
+                metric(name, 'gauge', f"Run counter {name}", [({}, value)])
+        metric('run_duration_seconds', 'gauge', "Wall time of the run", [({}, summary['wall_seconds'])])
+        metric('run_finished_timestamp_seconds', 'gauge', "Unix time the run finished",
+               [({}, round(self.finished or time.time(), 3))])
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path):
+        """Write the Prometheus textfile (atomically, as the node exporter's textfile collector expects)."""
+        _atomic_write(path, self.prometheus_text())
+
+
+def _atomic_write(path, text):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as output_file:
+        output_file.write(text)
+    os.replace(tmp_path, path)
+
+
+class IOTimer:
+    """Context manager that records the duration of a file operation."""
+
+    def __init__(self, metrics, operation, stage=None, file=None):
+        self.metrics = metrics
+        self.operation = operation
+        self.stage = stage
+        self.file = file
+        self.nbytes = 0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.metrics is not None:
+            self.metrics.record_io(self.operation, time.perf_counter() - self.start, self.nbytes, self.stage, self.file)
+        return False
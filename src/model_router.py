@@ -0,0 +1,200 @@
+"""
+Cost/latency-tiered model routing.
+
+Each stage has a ladder of models, cheapest and fastest first: the stage's entry in
+models.stages, or openai.model followed by models.escalation. A request goes to the
+first model of the ladder and moves to the next one only when the answer is rejected,
+i.e. it fails parsing or local validation. API errors are retried, not escalated.
+
+The model that produced an accepted answer is recorded under the request's fingerprint:
+the stage, the prompt and the words of the input once quoted values and numbers are
+masked, so inputs that differ only in names and values share a fingerprint. Later
+requests with a recorded fingerprint start at the model that worked and skip the
+cheaper ones that failed before. Only escalations are recorded: a fingerprint whose
+answer from the first model is accepted again loses its route. The routes are kept in
+a JSON file across runs, without routes older than max_age_days and at most
+max_routes of the most recently updated ones.
+"""
+import os
+import re
+import json
+import time
+import logging
+
+from manifest import sha256_text
+from work_queue import file_lock
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MODEL = "gpt-3.5-turbo"
+DEFAULT_ESCALATION = ("gpt-4o",)
+# Prompt refinement asks for a rewrite of a whole prompt, which the cheapest models do poorly
+DEFAULT_STAGE_LADDERS = {'refine': ("gpt-4o",)}
+ROUTES_FILENAME = "model_routes.json"
+DEFAULT_MAX_ROUTES = 10000
+DEFAULT_ROUTES_MAX_AGE_DAYS = 90
+
+_LITERAL_RE = re.compile(r"'[^'\n]*'|\"[^\"\n]*\"|\d+")
+_TOKEN_RE = re.compile(r"[A-Za-z_][\w-]*")
+
+
+def fingerprint(stage, prompt_name, user_message):
+    """
+    Fingerprint of a request for routing: similar inputs of a stage share it.
+
+    :param stage: Stage name
+    :param prompt_name: Prompt file the request uses
+    :param user_message: The request's user message
+    :return: Hex digest
+    """
+    tokens = sorted(set(_TOKEN_RE.findall(_LITERAL_RE.sub(" ", user_message))))
+    return sha256_text(json.dumps([stage, prompt_name, tokens]))
+
+
+class ModelRouter:
+    """Model ladders per stage and the model that last succeeded per request fingerprint."""
+
+    def __init__(self, default_ladder, stage_ladders=None, routes_path=None, max_routes=DEFAULT_MAX_ROUTES,
+                 max_age_days=DEFAULT_ROUTES_MAX_AGE_DAYS):
+        """
+        :param default_ladder: Models tried in order by stages without their own ladder
+        :param stage_ladders: Optional dict of stage name -> list of models, cheapest first
+        :param routes_path: JSON file the successful models are kept in; None keeps them in memory only
+        :param max_routes: Most recently updated routes kept in the file; None for no cap
+        :param max_age_days: Routes not updated for this many days are dropped; None to keep them
+        """
+        self.default_ladder = tuple(default_ladder)
+        self.stage_ladders = {stage: tuple(models) for stage, models in (stage_ladders or {}).items() if models}
+        self.routes_path = routes_path
+        self.max_routes = max_routes
+        self.max_age_days = max_age_days
+        self.routes = {}
+        self._changed = {}
+        self.escalations = {}
+        self.routed = 0
+        if routes_path and os.path.exists(routes_path):
+            try:
+                with open(routes_path, 'r') as routes_file:
+                    self.routes = json.load(routes_file)
+            except (IOError, ValueError) as e:
+                logger.warning(f"Ignoring unreadable model routes {routes_path}: {e}")
+
+    @classmethod
+    def from_config(cls, config, project_root):
+        """
+        :param config: The whole parsed config.yaml
+        :param project_root: Base directory for a relative routes file
+        :return: ModelRouter
+        """
+        models_config = config.get('models') or {}
+        first = (config.get('openai') or {}).get('model') or DEFAULT_MODEL
+        escalation = models_config.get('escalation')
+        escalation = DEFAULT_ESCALATION if escalation is None else escalation
+        default_ladder = [first] + [model for model in escalation if model != first]
+        stage_ladders = dict(DEFAULT_STAGE_LADDERS)
+        stage_ladders.update(models_config.get('stages') or {})
+        routes_path = models_config.get('routes_file', ROUTES_FILENAME)
+        if routes_path and not os.path.isabs(routes_path):
+            routes_path = os.path.join(project_root, routes_path)
+        return cls(default_ladder, stage_ladders, routes_path,
+                   max_routes=models_config.get('max_routes', DEFAULT_MAX_ROUTES),
+                   max_age_days=models_config.get('routes_max_age_days', DEFAULT_ROUTES_MAX_AGE_DAYS))
+
+    def ladder(self, stage):
+        return self.stage_ladders.get(stage, self.default_ladder)
+
+    def candidates(self, stage, request_fingerprint):
+        """
+        Models to try for a request, in order.
+
+        :param stage: Stage name
+        :param request_fingerprint: The request's fingerprint()
+        :return: The stage's ladder, starting at the recorded model if there is one
+        """
+        ladder = self.ladder(stage)
+        route = self.routes.get(request_fingerprint)
+        if route and route.get('model') in ladder and route['model'] != ladder[0]:
+            self.routed += 1
+            return ladder[ladder.index(route['model']):]
+        return ladder
+
+    def escalate(self, stage, model, error):
+        self.escalations[stage] = self.escalations.get(stage, 0) + 1
+        logger.info(f"{stage} answer of {model} rejected ({error}); escalating to the next model")
+
+    def record(self, stage, request_fingerprint, model):
+        """
+        Remember the model whose answer was accepted for a fingerprint.
+
+        The first model of the ladder is where requests start anyway, so it is not
+        recorded; its success removes the fingerprint's route instead.
+        """
+        route = self.routes.get(request_fingerprint)
+        if model == self.ladder(stage)[0]:
+            if route is not None:
+                del self.routes[request_fingerprint]
+                self._changed[request_fingerprint] = None
+            return
+        if route is not None and route.get('model') == model:
+            return
+        route = {'stage': stage, 'model': model, 'updated': time.time()}
+        self.routes[request_fingerprint] = route
+        self._changed[request_fingerprint] = route
+
+    def _prune(self, routes):
+        """Drop routes to the first model of their ladder, routes past max_age_days and the oldest beyond max_routes."""
+        cutoff = time.time() - self.max_age_days * 86400 if self.max_age_days else None
+        kept = {fingerprint_: route for fingerprint_, route in routes.items()
+                if route.get('model') != self.ladder(route.get('stage'))[0]
+                and (cutoff is None or route.get('updated', 0) >= cutoff)}
+        if self.max_routes and len(kept) > self.max_routes:
+            newest = sorted(kept, key=lambda key: kept[key].get('updated', 0), reverse=True)[:self.max_routes]
+            kept = {key: kept[key] for key in newest}
+        return kept
+
+    def complete(self, stage, request_fingerprint, call):
+        """
+        Run a synchronous request along the stage's ladder.
+
+        :param stage: Stage name
+        :param request_fingerprint: The request's fingerprint()
+        :param call: Callable taking a model name and returning the accepted answer; raises ValueError to reject it
+        :return: The first accepted answer
+        :raises ValueError: The last model's rejection, if no model's answer was accepted
+        """
+        models = self.candidates(stage, request_fingerprint)
+        for index, model in enumerate(models):
+            try:
+                content = call(model)
+            except ValueError as e:
+                if index == len(models) - 1:
+                    raise
+                self.escalate(stage, model, e)
+                continue
+            self.record(stage, request_fingerprint, model)
+            return content
+
+    def save(self):
+        """Merge this process's route changes into the routes file; other processes may have added theirs."""
+        if not self.routes_path or not self._changed:
+            return
+        try:
+            with file_lock(self.routes_path):
+                routes = {}
+                if os.path.exists(self.routes_path):
+                    with open(self.routes_path, 'r') as routes_file:
+                        routes = json.load(routes_file)
+                for request_fingerprint, route in self._changed.items():
+                    if route is None:
+                        routes.pop(request_fingerprint, None)
+                    else:
+                        routes[request_fingerprint] = route
+                routes = self._prune(routes)
+                temp_path = f"{self.routes_path}.{os.getpid()}.tmp"
+                with open(temp_path, 'w') as routes_file:
+                    json.dump(routes, routes_file, indent=1, sort_keys=True)
+                os.replace(temp_path, self.routes_path)
+            self.routes = routes
+            self._changed = {}
+        except (IOError, ValueError, TimeoutError) as e:
+            logger.warning(f"Could not save model routes to {self.routes_path}: {e}")
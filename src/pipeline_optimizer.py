@@ -0,0 +1,410 @@
+"""
+Post-processing of generated Tekton pipelines for faster PipelineRuns.
+
+Jenkins stages run one after another, so converted Pipelines chain every task to the
+previous one with runAfter. Most of that order is not needed: a lint and a test task
+that only read the checked-out sources can run at the same time. optimize_pipeline()
+rebuilds runAfter from what the tasks actually share:
+
+- results: a task that uses $(tasks.X.results.*) runs after X
+- the shared workspace: every step is classified as not touching it (echo, sleep),
+  reading it (tests, linters, scanners), writing it (checkout, install, build and
+  anything unknown) or acting outside the pipeline (deploy, push, publish). A task
+  runs after the earlier tasks that wrote what it reads, and a writing task also
+  runs after the earlier tasks that read or wrote it.
+- deploy/publish tasks run after every earlier task, and every later task runs after
+  them, so nothing ships before the checks that preceded it in Jenkins
+- tasks that run a Task not defined in the same file are treated like deploy tasks
+
+Orderings are only ever removed, never added: two tasks that could run in parallel
+before still can. The result is reduced to the minimal runAfter lists.
+
+It also adds an optional cache workspace to each task that runs npm/yarn, Maven,
+Gradle or pip (npm-cache, maven-cache, gradle-cache, pip-cache). When a PipelineRun
+binds a persistent volume to it, the tool's download cache points there and
+dependencies are not downloaded again on every run; unbound, nothing changes.
+
+The critical path (the longest runAfter chain) before and after is reported and
+recorded on the Pipeline as an annotation.
+"""
+import re
+import json
+
+from tekton_renderer import parse_yaml_documents, dump_yaml_documents, ANNOTATION_PREFIX
+
+OPTIMIZER_VERSION = "1"
+CRITICAL_PATH_ANNOTATION = f"{ANNOTATION_PREFIX}/critical-path"
+
+# Workspace access of a step or task, in increasing order of what it must wait for
+ACCESS_NONE = 0
+ACCESS_READ = 1
+ACCESS_WRITE = 2
+ACCESS_EXTERNAL = 3
+ACCESS_NAMES = {ACCESS_NONE: 'none', ACCESS_READ: 'read', ACCESS_WRITE: 'write', ACCESS_EXTERNAL: 'external'}
+
+# Commands that neither read nor change files
+NEUTRAL_COMMANDS = {'echo', 'printf', 'sleep', 'true', 'false', 'exit', 'cd', 'export', 'set', 'pwd', 'date',
+                    'whoami', 'test', '[', 'unset', 'shopt', 'return', ':'}
+# Commands that only read the workspace (or write reports next to it)
+READ_COMMANDS = {'cat', 'ls', 'grep', 'head', 'tail', 'wc', 'diff', 'stat', 'file', 'sha256sum', 'md5sum',
+                 'pytest', 'flake8', 'pylint', 'mypy', 'black', 'ruff', 'eslint', 'tsc', 'shellcheck',
+                 'hadolint', 'yamllint', 'sonar-scanner', 'trivy', 'checkov'}
+READ_SUBCOMMANDS = {
+    'npm': {'test', 't', 'lint', 'audit', 'outdated', 'ls'},
+    'yarn': {'test', 'lint', 'audit'},
+    'go': {'test', 'vet'},
+    'cargo': {'test', 'clippy', 'check'},
+    'git': {'status', 'log', 'diff', 'show', 'rev-parse', 'describe'},
+    'kubectl': {'get', 'describe', 'logs', 'version', 'diff'},
+    'helm': {'lint', 'template', 'list', 'status', 'version'},
+    'terraform': {'validate', 'fmt', 'plan', 'show'},
+}
+# npm/yarn run <script> with these script names only reads, or deploys
+READ_RUN_SCRIPTS = re.compile(r'^(test|lint|check|audit)([:\-_].*)?$')
+EXTERNAL_RUN_SCRIPTS = re.compile(r'^(deploy|publish|release)([:\-_].*)?$')
+# Commands acting outside the pipeline: deployments, pushes and publications
+EXTERNAL_COMMANDS = {'oc', 'scp', 'rsync', 'aws', 'gcloud', 'az', 'twine', '/kaniko/executor', 'skopeo', 'crane'}
+EXTERNAL_SUBCOMMANDS = {
+    'kubectl': {'apply', 'create', 'delete', 'replace', 'patch', 'rollout', 'set', 'scale', 'label', 'annotate', 'expose', 'run'},
+    'helm': {'install', 'upgrade', 'uninstall', 'rollback', 'push'},
+    'docker': {'push', 'login'},
+    'npm': {'publish', 'deprecate', 'dist-tag'},
+    'yarn': {'publish'},
+    'git': {'push'},
+    'terraform': {'apply', 'destroy', 'import'},
+}
+# Build tool goals/tasks that publish
+EXTERNAL_GOALS = {'mvn': {'deploy', 'release:perform'}, 'gradle': {'publish', 'uploadArchives'}}
+COMMAND_ALIASES = {'./mvnw': 'mvn', 'mvnw': 'mvn', './gradlew': 'gradle', 'gradlew': 'gradle', 'npx': 'npm',
+                   'pip3': 'pip', 'python3': 'python', 'sudo': None, 'exec': None, 'time': None, 'env': None,
+                   'if': None, 'then': None, 'else': None, 'elif': None, 'do': None, 'while': None, 'until': None,
+                   '!': None, '{': None, '(': None}
+_SEGMENT_SPLIT_RE = re.compile(r'&&|\|\||[;|\n]')
+_ASSIGNMENT_RE = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*=')
+_REDIRECT_RE = re.compile(r'>>?\s*(?!&|/dev/)\S')
+_TASK_REF_RE = re.compile(r'\$\(tasks\.([a-z0-9]([-a-z0-9]*[a-z0-9])?)\.results\.')
+_SHELL_SHEBANG_RE = re.compile(r'^#!\s*(/usr/bin/env\s+)?(/bin/|/usr/bin/)?(sh|bash|ash|dash|zsh)\b')
+
+# Toolchain -> cache workspace and the shell exports pointing the tool's cache at it
+CACHE_TOOLCHAINS = {
+    'npm': {
+        'commands': re.compile(r'(?<![\w./-])(npm|npx|yarn)(?![\w.-])'),
+        'workspace': 'npm-cache',
+        'exports': ['npm_config_cache="{path}/npm"', 'YARN_CACHE_FOLDER="{path}/yarn"'],
+        'description': "npm/yarn download cache",
+    },
+    'maven': {
+        'commands': re.compile(r'(?<![\w/-])(\./)?mvnw?(?![\w.-])'),
+        'workspace': 'maven-cache',
+        'exports': ['MAVEN_OPTS="${{MAVEN_OPTS:-}} -Dmaven.repo.local={path}"'],
+        'description': "Maven local repository",
+    },
+    'gradle': {
+        'commands': re.compile(r'(?<![\w/-])(\./)?gradlew?(?![\w.-])'),
+        'workspace': 'gradle-cache',
+        'exports': ['GRADLE_USER_HOME="{path}"'],
+        'description': "Gradle user home (dependency and build cache)",
+    },
+    'pip': {
+        'commands': re.compile(r'(?<![\w./-])(pip3?|python3?\s+-m\s+pip)(?![\w.-])'),
+        'workspace': 'pip-cache',
+        'exports': ['PIP_CACHE_DIR="{path}"'],
+        'description': "pip download cache",
+    },
+}
+
+
+class OptimizationReport:
+    """What optimize_pipeline() changed in one Pipeline."""
+
+    def __init__(self, pipeline):
+        self.pipeline = pipeline
+        self.tasks = 0
+        self.edges_before = 0
+        self.edges_after = 0
+        self.critical_path_before = []
+        self.critical_path_after = []
+        self.cache_workspaces = []
+        self.access = {}
+
+    @property
+    def changed(self):
+        return self.edges_before != self.edges_after or bool(self.cache_workspaces)
+
+    def to_text(self):
+        text = (f"Pipeline {self.pipeline}: critical path {len(self.critical_path_before)} -> "
+                f"{len(self.critical_path_after)} of {self.tasks} tasks ({' -> '.join(self.critical_path_after)}), "
+                f"runAfter edges {self.edges_before} -> {self.edges_after}")
+        if self.cache_workspaces:
+            text += f", cache workspaces: {', '.join(sorted(set(self.cache_workspaces)))}"
+        return text
+
+
+def _command_words(segment):
+    """The command name and its arguments, without env assignments and prefixes like sudo."""
+    words = segment.strip().split()
+    while words:
+        if _ASSIGNMENT_RE.match(words[0]):
+            words.pop(0)
+        elif words[0] in COMMAND_ALIASES and COMMAND_ALIASES[words[0]] is None:
+            words.pop(0)
+        else:
+            break
+    if words:
+        words[0] = COMMAND_ALIASES.get(words[0], words[0])
+    return words
+
+
+def classify_command(segment):
+    """
+    :param segment: One simple shell command
+    :return: ACCESS_* level of the command
+    """
+    words = _command_words(segment)
+    if not words or words[0].startswith('#') or words[0] in ('fi', 'done', 'esac', '}', ')', 'then', 'else'):
+        return ACCESS_NONE
+    command, arguments = words[0], words[1:]
+    subcommand = next((word for word in arguments if not word.startswith('-')), None)
+    if command in EXTERNAL_COMMANDS or subcommand in EXTERNAL_SUBCOMMANDS.get(command, ()):
+        return ACCESS_EXTERNAL
+    if command in EXTERNAL_GOALS and any(word in EXTERNAL_GOALS[command] for word in arguments):
+        return ACCESS_EXTERNAL
+    if command == 'curl' and any(word in ('-T', '--upload-file', '-d', '--data', '--data-binary', '-F', '--form')
+                                 or word in ('-XPOST', '-XPUT', '-XDELETE', '-XPATCH') for word in arguments):
+        return ACCESS_EXTERNAL
+    if command == 'curl' and any(arguments[i] in ('-X', '--request') and arguments[i + 1].upper() in ('POST', 'PUT', 'DELETE', 'PATCH')
+                                 for i in range(len(arguments) - 1)):
+        return ACCESS_EXTERNAL
+    if _REDIRECT_RE.search(segment):
+        # Output redirected to a file
+        return ACCESS_WRITE
+    if command in NEUTRAL_COMMANDS:
+        return ACCESS_NONE
+    if command in READ_COMMANDS or subcommand in READ_SUBCOMMANDS.get(command, ()):
+        return ACCESS_READ
+    if command in ('npm', 'yarn') and subcommand == 'run':
+        script = next((word for word in arguments[arguments.index('run') + 1:] if not word.startswith('-')), '')
+        if EXTERNAL_RUN_SCRIPTS.match(script):
+            return ACCESS_EXTERNAL
+        if READ_RUN_SCRIPTS.match(script):
+            return ACCESS_READ
+    if command == 'find' and '-delete' not in arguments and '-exec' not in arguments:
+        return ACCESS_READ
+    if command == 'python' and arguments[:2] in (['-m', 'pytest'], ['-m', 'flake8'], ['-m', 'pylint'], ['-m', 'mypy']):
+        return ACCESS_READ
+    return ACCESS_WRITE
+
+
+def classify_step(step):
+    """:return: ACCESS_* level of a Tekton step, from its script or command"""
+    if not isinstance(step, dict):
+        return ACCESS_WRITE
+    script = step.get('script')
+    if isinstance(script, str):
+        if script.startswith('#!') and not _SHELL_SHEBANG_RE.match(script):
+            return ACCESS_WRITE
+        segments = _SEGMENT_SPLIT_RE.split(script)
+    else:
+        command = [str(word) for word in (step.get('command') or []) + (step.get('args') or [])]
+        if command[:1] in (['sh'], ['/bin/sh'], ['bash'], ['/bin/bash']) and '-c' in command:
+            segments = _SEGMENT_SPLIT_RE.split(' '.join(command[command.index('-c') + 1:]))
+        elif command:
+            segments = [' '.join(command)]
+        else:
+            # The image's entrypoint: nothing is known about it
+            return ACCESS_WRITE
+    return max((classify_command(segment) for segment in segments if not segment.strip().startswith('#!')),
+               default=ACCESS_NONE)
+
+
+def _task_specs(documents):
+    return {document['metadata']['name']: document.get('spec') or {}
+            for document in documents
+            if isinstance(document, dict) and document.get('kind') == 'Task'
+            and isinstance(document.get('metadata'), dict) and document['metadata'].get('name')}
+
+
+def _resolve_spec(task, task_specs):
+    if isinstance(task.get('taskSpec'), dict):
+        return task['taskSpec']
+    ref = task.get('taskRef')
+    if isinstance(ref, dict) and ref.get('name') in task_specs and not ref.get('resolver') and ref.get('kind', 'Task') == 'Task':
+        return task_specs[ref['name']]
+    return None
+
+
+def task_access(task, spec):
+    """:return: ACCESS_* level of a pipeline task with its resolved Task spec (None if defined elsewhere)"""
+    if spec is None:
+        return ACCESS_EXTERNAL
+    level = max((classify_step(step) for step in spec.get('steps') or []), default=ACCESS_NONE)
+    bindings = [binding for binding in task.get('workspaces') or [] if isinstance(binding, dict)]
+    cache_workspaces = {toolchain['workspace'] for toolchain in CACHE_TOOLCHAINS.values()}
+    if level in (ACCESS_READ, ACCESS_WRITE) and not any(b.get('workspace') not in cache_workspaces for b in bindings):
+        # Files written without a shared workspace stay in the task's own pod
+        return ACCESS_NONE
+    return level
+
+
+def _longest_path(names, run_after):
+    """:return: The longest runAfter chain, as task names in run order"""
+    best = {}
+    for name in names:
+        previous = max((best[dependency] for dependency in run_after[name] if dependency in best), key=len, default=[])
+        best[name] = previous + [name]
+    return max(best.values(), key=len, default=[])
+
+
+def _topological(names, run_after):
+    """:return: The names with every task after its dependencies (keeping the file order), or None on a cycle"""
+    order, placed, pending = [], set(), list(names)
+    while pending:
+        ready = [name for name in pending if all(d in placed for d in run_after[name])]
+        if not ready:
+            return None
+        for name in ready:
+            order.append(name)
+            placed.add(name)
+        pending = [name for name in pending if name not in placed]
+    return order
+
+
+def _rebuild_run_after(tasks, task_specs, report):
+    names = [task['name'] for task in tasks]
+    by_name = dict(zip(names, tasks))
+    known = set(names)
+    if len(known) != len(names):
+        return False
+    original = {}
+    for task in tasks:
+        run_after = task.get('runAfter') or []
+        if not isinstance(run_after, list) or not all(isinstance(d, str) and d in known for d in run_after):
+            return False
+        result_refs = {match[0] for match in _TASK_REF_RE.findall(json.dumps(task))} & known
+        original[task['name']] = list(dict.fromkeys(run_after + sorted(result_refs)))
+    order = _topological(names, original)
+    if order is None:
+        return False
+
+    access = {name: task_access(by_name[name], _resolve_spec(by_name[name], task_specs)) for name in names}
+    report.access = {name: ACCESS_NAMES[level] for name, level in access.items()}
+    ancestors = {}
+    required = {}
+    for name in order:
+        ancestors[name] = set(original[name]).union(*(ancestors[d] for d in original[name]))
+        results = {match[0] for match in _TASK_REF_RE.findall(json.dumps(by_name[name]))}
+        needed = set()
+        for ancestor in ancestors[name]:
+            level = access[ancestor]
+            if (ancestor in results or level == ACCESS_EXTERNAL or access[name] == ACCESS_EXTERNAL
+                    or (access[name] == ACCESS_READ and level == ACCESS_WRITE)
+                    or (access[name] == ACCESS_WRITE and level >= ACCESS_READ)):
+                needed.add(ancestor)
+        required[name] = needed
+
+    # Keep only the dependencies not already implied by another one
+    reachable = {}
+    for name in order:
+        reachable[name] = set(required[name]).union(*(reachable[d] for d in required[name]))
+    rebuilt = {name: [d for d in order if d in required[name]
+                      and not any(d in reachable[other] for other in required[name] if other != d)]
+               for name in names}
+
+    report.tasks = len(names)
+    report.edges_before = sum(len(task.get('runAfter') or []) for task in tasks)
+    report.critical_path_before = _longest_path(order, original)
+    report.critical_path_after = _longest_path(order, rebuilt)
+    for task in tasks:
+        run_after = rebuilt[task['name']]
+        if run_after:
+            task['runAfter'] = run_after
+        else:
+            task.pop('runAfter', None)
+    report.edges_after = sum(len(task.get('runAfter') or []) for task in tasks)
+    return True
+
+
+def _cache_prelude(toolchain):
+    path = f"$(workspaces.{toolchain['workspace']}.path)"
+    exports = " ".join(export.format(path=path) for export in toolchain['exports'])
+    return f"if [ \"$(workspaces.{toolchain['workspace']}.bound)\" = \"true\" ]; then export {exports}; fi\n"
+
+
+def _add_cache(script, prelude):
+    """Insert the cache exports after the shebang and set options of a shell script."""
+    lines = script.splitlines(keepends=True)
+    index = 0
+    while index < len(lines) and (lines[index].startswith('#!') or re.match(r'^set\s+-', lines[index])):
+        index += 1
+    if index and not lines[index - 1].endswith('\n'):
+        lines[index - 1] += '\n'
+    return "".join(lines[:index]) + prelude + "".join(lines[index:])
+
+
+def _add_cache_workspaces(pipeline_spec, tasks, task_specs, report):
+    pipeline_workspaces = pipeline_spec.setdefault('workspaces', [])
+    declared = {w.get('name') for w in pipeline_workspaces if isinstance(w, dict)}
+    for task in tasks:
+        spec = _resolve_spec(task, task_specs)
+        if spec is None:
+            continue
+        for toolchain_name, toolchain in CACHE_TOOLCHAINS.items():
+            workspace = toolchain['workspace']
+            steps = [step for step in spec.get('steps') or [] if isinstance(step, dict) and isinstance(step.get('script'), str)
+                     and (not step['script'].startswith('#!') or _SHELL_SHEBANG_RE.match(step['script']))
+                     and toolchain['commands'].search(step['script'])]
+            if not steps:
+                continue
+            # A Task shared by several pipeline tasks is only changed once
+            for step in steps:
+                if f"workspaces.{workspace}." not in step['script']:
+                    step['script'] = _add_cache(step['script'], _cache_prelude(toolchain))
+            task_workspaces = spec.setdefault('workspaces', [])
+            if not any(isinstance(w, dict) and w.get('name') == workspace for w in task_workspaces):
+                task_workspaces.append({'name': workspace, 'description': toolchain['description'], 'optional': True})
+            bindings = task.setdefault('workspaces', [])
+            if not any(isinstance(b, dict) and b.get('name') == workspace for b in bindings):
+                bindings.append({'name': workspace, 'workspace': workspace})
+                report.cache_workspaces.append(toolchain_name)
+            if workspace not in declared:
+                pipeline_workspaces.append({'name': workspace, 'optional': True,
+                                            'description': f"{toolchain['description']}; bind a PersistentVolumeClaim to reuse it across runs"})
+                declared.add(workspace)
+
+
+def optimize_pipeline(tekton_yaml, dag=True, cache_workspaces=True):
+    """
+    Rebuild the runAfter graph of the Pipelines in a Tekton YAML document and add cache workspaces.
+
+    :param tekton_yaml: Multi-document Tekton YAML (Tasks and Pipelines)
+    :param dag: Rebuild runAfter from result, workspace and deployment dependencies
+    :param cache_workspaces: Add cache workspaces for npm, Maven, Gradle and pip
+    :return: Tuple (YAML, list of OptimizationReport); the YAML is returned unchanged if nothing changed
+    :raises ValueError: If the YAML cannot be parsed
+    """
+    documents = parse_yaml_documents(tekton_yaml)
+    task_specs = _task_specs(documents)
+    reports = []
+    for document in documents:
+        if not isinstance(document, dict) or document.get('kind') != 'Pipeline' or not isinstance(document.get('spec'), dict):
+            continue
+        spec = document['spec']
+        tasks = [task for task in spec.get('tasks') or [] if isinstance(task, dict) and task.get('name')]
+        if not tasks:
+            continue
+        if not isinstance(document.get('metadata'), dict):
+            document['metadata'] = {}
+        metadata = document['metadata']
+        report = OptimizationReport(metadata.get('name'))
+        report.tasks = len(tasks)
+        if dag:
+            # Pipelines with unknown runAfter targets or cycles are left to the validator
+            _rebuild_run_after(tasks, task_specs, report)
+        if cache_workspaces:
+            _add_cache_workspaces(spec, tasks, task_specs, report)
+        if report.critical_path_after:
+            metadata.setdefault('annotations', {})[CRITICAL_PATH_ANNOTATION] = " -> ".join(report.critical_path_after)
+        reports.append(report)
+    if not reports:
+        return tekton_yaml, reports
+    return dump_yaml_documents(documents), reports
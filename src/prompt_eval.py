@@ -0,0 +1,356 @@
+"""
+Prompt version evaluation.
+
+Runs several versions of the json2tekton prompt (json2tekton.txt and the json2tekton_v<N>.txt
+backups written by --refine-prompt, or any prompt file) against a fixed corpus of Jenkins
+files, concurrently, and scores each version on:
+
+- parse: share of answers that are Tekton YAML documents at all
+- valid: share of answers without static validation errors
+- tokens: mean completion tokens of an answer (fewer is better)
+- latency: median request latency (lower is better)
+
+Tokens and latency are scored relative to the best version in the comparison, and the
+four scores are combined with evaluation.weights. The JSON input of every file is built
+once and shared by all versions: locally for declarative pipelines, through the
+jenkins2json prompt otherwise.
+
+Requests go to the configured endpoint (OPENAI_BASE_URL can point at the mock server in
+bench/) through the conversion pipeline's request path, so its concurrency caps, rate
+limits, retries and deadlines apply. Answers that parse (JSON for jenkins2json, YAML
+documents for json2tekton) are recorded in the LLM cache like the pipeline's own. With
+--replay only recorded answers are used and nothing is sent; latency is then not scored,
+and answers that were not recorded because they did not parse count as failures.
+
+    python3 src/prompt_eval.py                                  # json2tekton.txt and every version
+    python3 src/prompt_eval.py --versions json2tekton.txt v3 v5 --corpus jenkins_files
+    python3 src/prompt_eval.py --replay --json evaluation.json
+"""
+import os
+import re
+import sys
+import json
+import asyncio
+import logging
+import argparse
+
+from llm_cache import make_cache_key
+from async_pipeline import AsyncConversionPipeline
+from manifest import sha256_text
+from metrics import percentile
+from discovery import JenkinsfileSource, output_name
+from jenkins_parser import jenkinsfile_to_json, UnsupportedJenkinsfileError
+from rate_limiter import CHARS_PER_TOKEN
+from tekton_renderer import parse_yaml_documents, strip_fences
+from tekton_validator import validate_tekton_yaml
+
+logger = logging.getLogger(__name__)
+
+STAGE_JENKINS2JSON = "jenkins2json"
+STAGE_JSON2TEKTON = "json2tekton"
+CURRENT_PROMPT = "json2tekton.txt"
+JENKINS2JSON_PROMPT = "jenkins2json.txt"
+DEFAULT_WEIGHTS = {'valid': 0.5, 'parse': 0.3, 'tokens': 0.1, 'latency': 0.1}
+DEFAULT_MAX_CONCURRENT_REQUESTS = 8
+
+_VERSION_RE = re.compile(r'^json2tekton_v(\d+)\.txt$')
+
+
+def prompt_versions(prompts_dir):
+    """:return: The current json2tekton prompt followed by its versions, newest first"""
+    versions = []
+    for name in os.listdir(prompts_dir):
+        match = _VERSION_RE.match(name)
+        if match:
+            versions.append((int(match.group(1)), name))
+    return [CURRENT_PROMPT] + [name for _, name in sorted(versions, reverse=True)]
+
+
+def resolve_version(prompts_dir, version):
+    """
+    :param version: A prompt file name, 'v3' for json2tekton_v3.txt, 'current' or a path to a prompt file
+    :return: Tuple (label, prompt text)
+    """
+    if version == 'current':
+        version = CURRENT_PROMPT
+    elif re.fullmatch(r'v\d+', version):
+        version = f"json2tekton_{version}.txt"
+    path = version if os.path.sep in version or not os.path.exists(os.path.join(prompts_dir, version)) else \
+        os.path.join(prompts_dir, version)
+    with open(path, 'r') as prompt_file:
+        return os.path.basename(version), prompt_file.read()
+
+
+class VersionScore:
+    """Results of one prompt version over the corpus."""
+
+    def __init__(self, label, prompt):
+        self.label = label
+        self.sha256 = sha256_text(prompt)
+        self.files = 0
+        self.answered = 0
+        self.parsed = 0
+        self.valid = 0
+        self.errors = 0
+        self.completion_tokens = []
+        self.latencies = []
+        self.score = None
+
+    def rate(self, count):
+        return count / self.files if self.files else 0.0
+
+    @property
+    def mean_tokens(self):
+        return sum(self.completion_tokens) / len(self.completion_tokens) if self.completion_tokens else None
+
+    @property
+    def p50_latency(self):
+        return percentile(self.latencies, 50)
+
+    def to_dict(self):
+        return {
+            'version': self.label,
+            'sha256': self.sha256,
+            'files': self.files,
+            'answered': self.answered,
+            'parse_rate': round(self.rate(self.parsed), 4),
+            'valid_rate': round(self.rate(self.valid), 4),
+            'errors': self.errors,
+            'mean_completion_tokens': None if self.mean_tokens is None else round(self.mean_tokens, 1),
+            'p50_latency_seconds': None if self.p50_latency is None else round(self.p50_latency, 3),
+            'p95_latency_seconds': None if not self.latencies else round(percentile(self.latencies, 95), 3),
+            'score': None if self.score is None else round(self.score, 4),
+        }
+
+
+def score_versions(scores, weights=None):
+    """
+    Set the combined score of each version; tokens and latency are relative to the best version.
+
+    Criteria no version has data for (latency of replayed answers) are left out and the
+    remaining weights are scaled up.
+
+    :param scores: List of VersionScore
+    :param weights: Dict of criterion -> weight; defaults to DEFAULT_WEIGHTS
+    :return: The scores, best first
+    """
+    weights = dict(DEFAULT_WEIGHTS, **(weights or {}))
+    best_tokens = min((s.mean_tokens for s in scores if s.mean_tokens), default=None)
+    best_latency = min((s.p50_latency for s in scores if s.p50_latency), default=None)
+    if best_tokens is None:
+        weights.pop('tokens')
+    if best_latency is None:
+        weights.pop('latency')
+    total = sum(weights.values()) or 1.0
+    for s in scores:
+        parts = {
+            'valid': s.rate(s.valid),
+            'parse': s.rate(s.parsed),
+            'tokens': best_tokens / s.mean_tokens if best_tokens and s.mean_tokens else 0.0,
+            'latency': best_latency / s.p50_latency if best_latency and s.p50_latency else 0.0,
+        }
+        s.score = sum(weight * parts[criterion] for criterion, weight in weights.items()) / total
+    return sorted(scores, key=lambda s: s.score, reverse=True)
+
+
+class PromptEvaluator:
+    """Runs json2tekton prompt versions concurrently over a corpus of Jenkins files."""
+
+    def __init__(self, context, source, model=None, replay=False, max_concurrent_requests=DEFAULT_MAX_CONCURRENT_REQUESTS,
+                 weights=None):
+        """
+        :param context: ConverterContext (config, client, prompts, cache)
+        :param source: JenkinsfileSource of the corpus
+        :param model: Model to ask; defaults to the first model of the json2tekton ladder
+        :param replay: If True, only use answers recorded in the LLM cache
+        :param max_concurrent_requests: Cap on in-flight requests
+        :param weights: Dict of criterion -> weight for score_versions
+        """
+        self.context = context
+        self.source = source
+        self.model = model or context.models.ladder(STAGE_JSON2TEKTON)[0]
+        self.replay = replay
+        self.max_concurrent_requests = max_concurrent_requests
+        self.weights = weights
+        self.cache = context.cache
+        # Only the pipeline's request path is used; nothing is written to its output directory
+        self.pipeline = AsyncConversionPipeline(context, None, None, None, max_concurrent_requests=max_concurrent_requests)
+        self.missing = 0
+
+    @classmethod
+    def from_config(cls, context, project_root, corpus=None, **overrides):
+        """
+        :param context: ConverterContext
+        :param project_root: Base directory for a relative corpus
+        :param corpus: Corpus directory or archive; defaults to evaluation.corpus, then conversion.input_directory
+        :param overrides: model, replay, max_concurrent_requests
+        :return: PromptEvaluator
+        """
+        config = context.config
+        evaluation_config = config.get('evaluation') or {}
+        corpus = corpus or evaluation_config.get('corpus') or config['conversion']['input_directory']
+        source = JenkinsfileSource.from_config(config, os.path.join(project_root, corpus))
+        if overrides.get('max_concurrent_requests') is None:
+            overrides['max_concurrent_requests'] = evaluation_config.get(
+                'max_concurrent_requests', (config.get('concurrency') or {}).get('max_concurrent_requests', DEFAULT_MAX_CONCURRENT_REQUESTS))
+        return cls(context, source, model=overrides.get('model') or evaluation_config.get('model'),
+                   replay=overrides.get('replay', False), max_concurrent_requests=overrides['max_concurrent_requests'],
+                   weights=evaluation_config.get('weights'))
+
+    def run(self, versions):
+        """
+        :param versions: List of (label, prompt text)
+        :return: List of VersionScore, best first
+        """
+        try:
+            return asyncio.run(self.evaluate(versions))
+        finally:
+            self.source.close()
+
+    async def evaluate(self, versions):
+        if not self.replay:
+            self.pipeline.start()
+        try:
+            corpus = [item for item in await asyncio.gather(*(self._json_input(identifier)
+                                                              for identifier in self.source.iter_files()))
+                      if item is not None]
+            if not corpus:
+                raise ValueError(f"No usable Jenkins files in {self.source.describe()}")
+            logger.info(f"Evaluating {len(versions)} prompt versions on {len(corpus)} files with {self.model}")
+            scores = [VersionScore(label, prompt) for label, prompt in versions]
+            await asyncio.gather(*(self._evaluate_one(score, prompt, name, json_content)
+                                   for score, (_, prompt) in zip(scores, versions)
+                                   for name, json_content in corpus))
+        finally:
+            if not self.replay:
+                await self.context.aclose()
+        if self.missing:
+            logger.warning(f"{self.missing} requests had no recorded answer and count as failures")
+        return score_versions(scores, self.weights)
+
+    async def _json_input(self, identifier):
+        """:return: Tuple (output name, JSON input of json2tekton), or None if the file cannot be used"""
+        content = self.source.read(identifier)
+        try:
+            return output_name(identifier), jenkinsfile_to_json(content)
+        except UnsupportedJenkinsfileError:
+            pass
+        try:
+            answer, _, _ = await self._answer(self.context.prompts.get(JENKINS2JSON_PROMPT),
+                                              f"Convert this Jenkins file to JSON:\n{content}", STAGE_JENKINS2JSON,
+                                              self.context.models.ladder(STAGE_JENKINS2JSON)[0], json.loads)
+            json.loads(answer)
+            return output_name(identifier), answer
+        except Exception as e:
+            logger.warning(f"Leaving {identifier} out of the corpus: no JSON input ({e})")
+            return None
+
+    async def _evaluate_one(self, score, prompt, name, json_content):
+        score.files += 1
+        try:
+            answer, tokens, seconds = await self._answer(prompt, f"Convert this JSON pipeline to Tekton YAML:\n{json_content}",
+                                                         STAGE_JSON2TEKTON, self.model, parse_yaml_documents)
+        except Exception as e:
+            score.errors += 1
+            logger.warning(f"{score.label} on {name}: {e.__class__.__name__}: {e}")
+            return
+        score.answered += 1
+        score.completion_tokens.append(tokens)
+        if seconds is not None:
+            score.latencies.append(seconds)
+        try:
+            parse_yaml_documents(answer)
+        except ValueError:
+            return
+        score.parsed += 1
+        if validate_tekton_yaml(strip_fences(answer)).ok:
+            score.valid += 1
+
+    async def _answer(self, system_prompt, user_message, stage, model, parse):
+        """
+        Ask the model (or the LLM cache in replay mode) with the exact request the pipeline sends.
+
+        :param parse: Callable raising ValueError for answers that must not be recorded in the LLM cache
+        :return: Tuple (answer, completion tokens, seconds); seconds is None for recorded answers
+        """
+        messages = [{"role": "system", "content": system_prompt}, {"role": "user", "content": user_message}]
+        key = make_cache_key(model, messages, {})
+        if self.replay:
+            content = self.cache.get(key) if self.cache.enabled else None
+            if content is None:
+                self.missing += 1
+                raise LookupError("no recorded answer")
+            return content, len(content) // CHARS_PER_TOKEN, None
+        content, completion_tokens, seconds = await self.pipeline.send_request(stage, model, messages)
+        if self.cache.enabled:
+            try:
+                parse(content)
+            except ValueError:
+                # Unusable answers stay out of the cache the conversion pipeline reads
+                pass
+            else:
+                # Recorded so the same comparison can be replayed later
+                self.cache.put(key, content, model=model, stage=stage)
+        return content, completion_tokens, seconds
+
+
+def beats(candidate, current, min_improvement=0.0):
+    """
+    :param candidate: VersionScore of the new prompt
+    :param current: VersionScore of the prompt it would replace, scored in the same comparison
+    :param min_improvement: Score margin the candidate must win by
+    :return: True if the candidate should replace the current prompt
+    """
+    return candidate.score > current.score + min_improvement
+
+
+def format_table(scores):
+    """:return: The comparison table of the scores as text"""
+    header = ("version", "sha256", "files", "answered", "parse %", "valid %", "out tokens", "p50 s", "p95 s", "score")
+    rows = []
+    for s in scores:
+        d = s.to_dict()
+        rows.append([d['version'], d['sha256'][:10], d['files'], d['answered'], f"{100 * d['parse_rate']:.1f}",
+                     f"{100 * d['valid_rate']:.1f}", d['mean_completion_tokens'], d['p50_latency_seconds'],
+                     d['p95_latency_seconds'], d['score']])
+    rows = [[("-" if value is None else str(value)) for value in row] for row in rows]
+    widths = [max(len(column), *(len(row[i]) for row in rows)) for i, column in enumerate(header)]
+    lines = ["  ".join(column.ljust(width) for column, width in zip(header, widths))]
+    lines.extend("  ".join(value.ljust(width) for value, width in zip(row, widths)) for row in rows)
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare json2tekton prompt versions on a corpus of Jenkins files")
+    parser.add_argument('--versions', nargs='+', default=None,
+                        help="Prompt files, 'current' or vN (default: json2tekton.txt and every json2tekton_vN.txt)")
+    parser.add_argument('--corpus', default=None, help="Directory or archive of Jenkins files (default: evaluation.corpus)")
+    parser.add_argument('--model', default=None, help="Model to ask (default: evaluation.model or the json2tekton ladder's first model)")
+    parser.add_argument('--replay', action='store_true', help="Only use answers recorded in the LLM cache; send nothing")
+    parser.add_argument('--concurrency', type=int, default=None, help="Maximum number of concurrent requests")
+    parser.add_argument('--json', default=None, help="Also write the results to this JSON file")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    from dotenv import load_dotenv
+    from context import ConverterContext, PROJECT_ROOT, PROMPTS_DIR
+    load_dotenv()
+    context = ConverterContext()
+    versions = [resolve_version(PROMPTS_DIR, version) for version in (args.versions or prompt_versions(PROMPTS_DIR))]
+    evaluator = PromptEvaluator.from_config(context, PROJECT_ROOT, corpus=args.corpus, model=args.model,
+                                            replay=args.replay, max_concurrent_requests=args.concurrency)
+    try:
+        scores = evaluator.run(versions)
+    except ValueError as e:
+        print(str(e), file=sys.stderr)
+        return 1
+    print(format_table(scores))
+    if args.json:
+        with open(args.json, 'w') as json_file:
+            json.dump({'model': evaluator.model, 'replay': args.replay, 'versions': [s.to_dict() for s in scores]},
+                      json_file, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,196 @@
+import time
+import random
+import asyncio
+import logging
+from email.utils import parsedate_to_datetime
+
+logger = logging.getLogger(__name__)
+
+# Rough characters-per-token ratio for English text and code, used when no tokenizer is available
+CHARS_PER_TOKEN = 4
+# Per-message overhead of the chat format
+MESSAGE_OVERHEAD_TOKENS = 4
+DEFAULT_COMPLETION_TOKENS_ESTIMATE = 1024
+DEFAULT_BURST_SECONDS = 10
+# HTTP statuses worth retrying: timeout, conflict, rate limit and server errors
+RETRYABLE_STATUS_CODES = (408, 409, 429)
+# Exception classes (by name, so openai does not have to be imported) that signal transient failures
+RETRYABLE_EXCEPTION_NAMES = ('APITimeoutError', 'APIConnectionError', 'TimeoutException', 'ConnectError',
+                             'ReadTimeout', 'TimeoutError')
+
+
+def estimate_tokens(messages, params=None, completion_tokens_estimate=DEFAULT_COMPLETION_TOKENS_ESTIMATE):
+    """
+    Estimate the tokens a chat completion will consume (prompt plus completion).
+
+    :param messages: Chat messages
+    :param params: Request parameters; max_tokens bounds the completion estimate
+    :param completion_tokens_estimate: Expected completion size when max_tokens is not set
+    :return: Estimated total tokens
+    """
+    prompt_tokens = sum(len(str(message.get('content') or '')) // CHARS_PER_TOKEN + MESSAGE_OVERHEAD_TOKENS
+                        for message in messages)
+    max_tokens = (params or {}).get('max_tokens')
+    completion_tokens = min(max_tokens, completion_tokens_estimate) if max_tokens else completion_tokens_estimate
+    return prompt_tokens + completion_tokens
+
+
+class TokenBucket:
+    """A token bucket refilled continuously at a per-minute rate."""
+
+    def __init__(self, rate_per_minute, burst_seconds=DEFAULT_BURST_SECONDS):
+        """
+        :param rate_per_minute: Sustained budget per minute
+        :param burst_seconds: Bucket capacity expressed as seconds of budget
+        """
+        self.rate = float(rate_per_minute) / 60.0
+        self.capacity = max(1.0, self.rate * burst_seconds)
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount, now):
+        """Seconds until amount can be taken (requests larger than the bucket wait for a full bucket)."""
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) / self.rate
+
+    def take(self, amount):
+        self.level -= min(amount, self.capacity)
+
+    def adjust(self, delta):
+        """Charge (positive) or refund (negative) tokens after the real usage is known."""
+        self.level = min(self.capacity, self.level - delta)
+
+
+class RateLimiter:
+    """
+    Keeps request and token throughput under per-minute budgets.
+
+    Each request first waits until both the request bucket and the token bucket can
+    cover it. A 429 with Retry-After pauses all requests, not just the one that was
+    rejected. Once the real usage is reported, the token estimate is corrected.
+    Waiters are served in arrival order.
+    """
+
+    def __init__(self, requests_per_minute=None, tokens_per_minute=None, burst_seconds=DEFAULT_BURST_SECONDS):
+        """
+        :param requests_per_minute: Request budget, or None for no limit
+        :param tokens_per_minute: Token budget, or None for no limit
+        :param burst_seconds: How many seconds of budget may be spent at once
+        """
+        self.requests = TokenBucket(requests_per_minute, burst_seconds) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute, burst_seconds) if tokens_per_minute else None
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+        self.waited_seconds = 0.0
+        self.pauses = 0
+
+    @property
+    def enabled(self):
+        return self.requests is not None or self.tokens is not None
+
+    async def acquire(self, tokens):
+        """
+        Wait until a request of the given estimated size fits the budgets, then charge it.
+
+        :param tokens: Estimated tokens of the request
+        """
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                wait = self._paused_until - now
+                if self.requests is not None:
+                    wait = max(wait, self.requests.wait_time(1, now))
+                if self.tokens is not None:
+                    wait = max(wait, self.tokens.wait_time(tokens, now))
+                if wait <= 0:
+                    break
+                self.waited_seconds += wait
+                await asyncio.sleep(wait)
+            if self.requests is not None:
+                self.requests.take(1)
+            if self.tokens is not None:
+                self.tokens.take(tokens)
+
+    def pause(self, seconds):
+        """Hold all requests for the given number of seconds (e.g. from a Retry-After header)."""
+        until = time.monotonic() + seconds
+        if until > self._paused_until:
+            self._paused_until = until
+            self.pauses += 1
+            logger.warning(f"Rate limited by the provider; pausing all requests for {seconds:.1f}s")
+
+    def reconcile(self, estimated_tokens, actual_tokens):
+        """Correct the token bucket once the real usage of a request is known."""
+        if self.tokens is not None and actual_tokens is not None:
+            self.tokens.adjust(actual_tokens - estimated_tokens)
+
+
+class RetryPolicy:
+    """Exponential backoff with full jitter, honouring Retry-After when the provider sends one."""
+
+    def __init__(self, max_retries=3, base_delay=1.0, max_delay=60.0):
+        """
+        :param max_retries: Retries after the first attempt
+        :param base_delay: Backoff base in seconds
+        :param max_delay: Upper bound of a single backoff in seconds
+        """
+        self.max_retries = max(0, int(max_retries))
+        self.base_delay = float(base_delay)
+        self.max_delay = float(max_delay)
+
+    def delay(self, attempt, retry_after=None):
+        """
+        :param attempt: Zero-based number of the attempt that just failed
+        :param retry_after: Seconds requested by the provider, if any
+        :return: Seconds to wait before the next attempt
+        """
+        backoff = random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+        if retry_after is not None:
+            return max(retry_after, backoff)
+        return backoff
+
+
+def is_retryable(error):
+    """Return True for rate limits, timeouts, connection problems and server errors."""
+    status = getattr(error, 'status_code', None)
+    if status is not None:
+        return status in RETRYABLE_STATUS_CODES or status >= 500
+    if isinstance(error, asyncio.TimeoutError):
+        return True
+    return any(cls.__name__ in RETRYABLE_EXCEPTION_NAMES for cls in type(error).__mro__)
+
+
+def retry_after_seconds(error):
+    """
+    Read the Retry-After delay from an API error's response headers.
+
+    :return: Seconds to wait, or None if the response did not say
+    """
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None)
+    if not headers:
+        return None
+    value = headers.get('retry-after-ms')
+    if value:
+        try:
+            return float(value) / 1000.0
+        except ValueError:
+            pass
+    value = headers.get('retry-after')
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
@@ -0,0 +1,413 @@
+"""
+Indexed store of conversion results.
+
+Every run records its stages in a SQLite database (by default <output_directory>/results.db):
+which prompt version each stage used, the hashes of its input and artifact, the static
+validation findings of the Tekton artifacts and how long each stage took. Artifacts and
+prompt texts are stored once per content hash, however many runs and files produced
+them. The store can be queried and exported without globbing the output directory:
+
+    python3 src/results_store.py runs
+    python3 src/results_store.py latest --passing
+    python3 src/results_store.py changed 12 15
+    python3 src/results_store.py history nodejs-sample-pipeline
+    python3 src/results_store.py findings --run 15
+    python3 src/results_store.py export /tmp/tekton --latest
+"""
+import os
+import sys
+import time
+import sqlite3
+import logging
+import argparse
+from datetime import datetime
+
+from manifest import sha256_text
+from discovery import split_identifier, output_name
+from tekton_validator import validate_tekton_yaml
+
+logger = logging.getLogger(__name__)
+
+RESULTS_FILENAME = "results.db"
+# Stages whose artifact is Tekton YAML and gets static validation findings
+TEKTON_STAGES = ('json2tekton', 'validate', 'fix')
+FINAL_STAGE = 'fix'
+# File names of exported artifacts, by stage
+EXPORT_NAMES = {
+    'jenkins2json': "{base}.json",
+    'json2tekton': "{base}-tekton-pipeline.yaml",
+    'validate': "validated-{base}-tekton-pipeline.yaml",
+    'fix': "validated2-{base}-tekton-pipeline.yaml",
+}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_number INTEGER PRIMARY KEY,
+    started REAL NOT NULL,
+    finished REAL
+);
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS blobs (
+    sha256 TEXT PRIMARY KEY,
+    content TEXT NOT NULL,
+    size INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS prompts (
+    sha256 TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    first_run INTEGER
+);
+CREATE TABLE IF NOT EXISTS stages (
+    id INTEGER PRIMARY KEY,
+    run_number INTEGER NOT NULL,
+    file_id INTEGER NOT NULL,
+    stage TEXT NOT NULL,
+    prompt_sha256 TEXT,
+    input_sha256 TEXT NOT NULL,
+    artifact_sha256 TEXT NOT NULL,
+    errors INTEGER,
+    warnings INTEGER,
+    seconds REAL,
+    created REAL NOT NULL,
+    UNIQUE (run_number, file_id, stage)
+);
+CREATE INDEX IF NOT EXISTS stages_by_file ON stages (file_id, stage, run_number);
+CREATE INDEX IF NOT EXISTS stages_by_run ON stages (run_number, stage);
+CREATE TABLE IF NOT EXISTS findings (
+    stage_id INTEGER NOT NULL,
+    severity TEXT NOT NULL,
+    code TEXT NOT NULL,
+    path TEXT,
+    message TEXT
+);
+CREATE INDEX IF NOT EXISTS findings_by_stage ON findings (stage_id);
+CREATE TABLE IF NOT EXISTS file_runs (
+    run_number INTEGER NOT NULL,
+    file_id INTEGER NOT NULL,
+    ok INTEGER NOT NULL,
+    seconds REAL,
+    PRIMARY KEY (run_number, file_id)
+);
+"""
+
+
+class ResultsStore:
+    """
+    SQLite index of runs, files, stages, prompt versions, artifacts, findings and timings.
+
+    Stage records of a file are buffered and written in one transaction when the file's
+    chain ends (record_file), so the database is not locked while requests are in flight
+    and several workers can share it.
+    """
+
+    def __init__(self, path):
+        """
+        :param path: Path of the SQLite database
+        """
+        self.path = path
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self._conn.execute("PRAGMA busy_timeout = 60000")
+        self._conn.executescript(_SCHEMA)
+        self._pending = {}
+
+    @classmethod
+    def from_config(cls, results_config, output_dir, base_dir):
+        """
+        :param results_config: The 'results' section of config.yaml (may be None)
+        :param output_dir: Output directory; the default database is <output_dir>/results.db
+        :param base_dir: Directory a relative database path is resolved against
+        :return: ResultsStore, or None if the store is disabled
+        """
+        results_config = results_config or {}
+        if not results_config.get('enabled', True):
+            return None
+        return cls(database_path(results_config, output_dir, base_dir))
+
+    def start_run(self, run_number):
+        self._conn.execute("INSERT OR IGNORE INTO runs (run_number, started) VALUES (?, ?)", (run_number, time.time()))
+
+    def finish_run(self, run_number):
+        self._conn.execute("UPDATE runs SET finished = ? WHERE run_number = ?", (time.time(), run_number))
+
+    def record_stage(self, run_number, jenkins_file, stage, prompt_name, prompt_text, input_content,
+                     artifact_content, seconds=None):
+        """
+        Buffer the record of a stage's artifact until the file's chain ends.
+
+        :param run_number: The run that produced the artifact
+        :param jenkins_file: Path to the Jenkins file
+        :param stage: Stage name
+        :param prompt_name: Prompt file the stage used (None for local-only stages)
+        :param prompt_text: Its text
+        :param input_content: The content the stage consumed
+        :param artifact_content: The artifact content
+        :param seconds: How long the stage took
+        """
+        findings = None
+        if stage in TEKTON_STAGES:
+            findings = validate_tekton_yaml(artifact_content).findings
+        self._pending.setdefault(jenkins_file, []).append(
+            (run_number, stage, prompt_name, prompt_text, sha256_text(input_content), artifact_content, findings, seconds)
+        )
+
+    def record_file(self, run_number, jenkins_file, ok, seconds):
+        """Write a file's buffered stage records and its outcome in one transaction."""
+        records = self._pending.pop(jenkins_file, [])
+        now = time.time()
+        conn = self._conn
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Archive members, git blobs and server jobs keep their identifiers
+            path = os.path.abspath(jenkins_file) if split_identifier(jenkins_file)[1] is None else jenkins_file
+            conn.execute("INSERT OR IGNORE INTO files (path) VALUES (?)", (path,))
+            file_id = conn.execute("SELECT id FROM files WHERE path = ?", (path,)).fetchone()[0]
+            for stage_run, stage, prompt_name, prompt_text, input_sha, artifact, findings, stage_seconds in records:
+                artifact_sha = self._put_blob(artifact)
+                prompt_sha = None
+                if prompt_name:
+                    prompt_sha = self._put_blob(prompt_text)
+                    conn.execute("INSERT OR IGNORE INTO prompts (sha256, name, first_run) VALUES (?, ?, ?)",
+                                 (prompt_sha, prompt_name, stage_run))
+                errors = warnings = None
+                if findings is not None:
+                    errors = sum(1 for finding in findings if finding.severity == 'error')
+                    warnings = len(findings) - errors
+                conn.execute("DELETE FROM findings WHERE stage_id IN (SELECT id FROM stages WHERE run_number = ? "
+                             "AND file_id = ? AND stage = ?)", (stage_run, file_id, stage))
+                stage_id = conn.execute(
+                    "INSERT OR REPLACE INTO stages (run_number, file_id, stage, prompt_sha256, input_sha256, "
+                    "artifact_sha256, errors, warnings, seconds, created) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (stage_run, file_id, stage, prompt_sha, input_sha, artifact_sha, errors, warnings, stage_seconds, now)
+                ).lastrowid
+                conn.executemany("INSERT INTO findings (stage_id, severity, code, path, message) VALUES (?, ?, ?, ?, ?)",
+                                 [(stage_id, f.severity, f.code, f.path, f.message) for f in findings or []])
+            conn.execute("INSERT OR REPLACE INTO file_runs (run_number, file_id, ok, seconds) VALUES (?, ?, ?, ?)",
+                         (run_number, file_id, 1 if ok else 0, seconds))
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def _put_blob(self, content):
+        digest = sha256_text(content)
+        self._conn.execute("INSERT OR IGNORE INTO blobs (sha256, content, size) VALUES (?, ?, ?)",
+                           (digest, content, len(content.encode('utf-8'))))
+        return digest
+
+    def close(self):
+        if self._pending:
+            logger.warning(f"Discarding unfinished results of {len(self._pending)} files")
+        self._conn.close()
+
+    # --- Queries ---
+
+    def runs(self):
+        """Runs with their file counts, most recent first."""
+        return self._conn.execute(
+            "SELECT r.run_number, r.started, r.finished, COUNT(f.file_id), COALESCE(SUM(f.ok), 0), "
+            "ROUND(COALESCE(SUM(f.seconds), 0), 1) FROM runs r LEFT JOIN file_runs f ON f.run_number = r.run_number "
+            "GROUP BY r.run_number ORDER BY r.run_number DESC"
+        ).fetchall()
+
+    def latest(self, stage=FINAL_STAGE, passing=False, run_number=None):
+        """
+        The most recent artifact of a stage for every file.
+
+        :param stage: Stage name
+        :param passing: Only consider artifacts without static validation errors
+        :param run_number: Only consider runs up to this one
+        :return: Rows (path, run_number, artifact_sha256, errors, warnings)
+        """
+        conditions = ["s.stage = ?"]
+        params = [stage]
+        if passing:
+            conditions.append("COALESCE(s.errors, 0) = 0")
+        if run_number is not None:
+            conditions.append("s.run_number <= ?")
+            params.append(run_number)
+        where = " AND ".join(conditions)
+        return self._conn.execute(
+            f"SELECT f.path, s.run_number, s.artifact_sha256, s.errors, s.warnings FROM stages s "
+            f"JOIN files f ON f.id = s.file_id WHERE {where} AND s.run_number = ("
+            f"  SELECT MAX(s2.run_number) FROM stages s2 WHERE s2.file_id = s.file_id AND "
+            f"  {where.replace('s.', 's2.')}) ORDER BY f.path",
+            params + params
+        ).fetchall()
+
+    def changed(self, first_run, second_run, stage=FINAL_STAGE):
+        """
+        Files whose artifact of a stage differs between two runs.
+
+        :return: Rows (path, first artifact_sha256 or None, second artifact_sha256 or None)
+        """
+        return self._conn.execute(
+            "SELECT f.path, a.artifact_sha256, b.artifact_sha256 FROM files f "
+            "LEFT JOIN stages a ON a.file_id = f.id AND a.run_number = ? AND a.stage = ? "
+            "LEFT JOIN stages b ON b.file_id = f.id AND b.run_number = ? AND b.stage = ? "
+            "WHERE (a.id IS NOT NULL OR b.id IS NOT NULL) AND a.artifact_sha256 IS NOT b.artifact_sha256 "
+            "ORDER BY f.path",
+            (first_run, stage, second_run, stage)
+        ).fetchall()
+
+    def history(self, name):
+        """
+        Stage records of the files whose path contains a name, oldest first.
+
+        :return: Rows (path, run_number, stage, prompt name, artifact_sha256, errors, warnings, seconds)
+        """
+        return self._conn.execute(
+            "SELECT f.path, s.run_number, s.stage, p.name, s.artifact_sha256, s.errors, s.warnings, s.seconds "
+            "FROM stages s JOIN files f ON f.id = s.file_id LEFT JOIN prompts p ON p.sha256 = s.prompt_sha256 "
+            "WHERE f.path LIKE ? ORDER BY f.path, s.run_number, s.id",
+            (f"%{name}%",)
+        ).fetchall()
+
+    def finding_counts(self, run_number=None, stage=FINAL_STAGE):
+        """Static validation findings of a stage's artifacts by code, most frequent first."""
+        params = [stage]
+        run_filter = ""
+        if run_number is not None:
+            run_filter = "AND s.run_number = ?"
+            params.append(run_number)
+        return self._conn.execute(
+            f"SELECT n.severity, n.code, COUNT(*), COUNT(DISTINCT s.file_id) FROM findings n "
+            f"JOIN stages s ON s.id = n.stage_id WHERE s.stage = ? {run_filter} "
+            f"GROUP BY n.severity, n.code ORDER BY COUNT(*) DESC",
+            params
+        ).fetchall()
+
+    def blob(self, digest):
+        """Content of an artifact or prompt by its hash (or a unique prefix of it)."""
+        rows = self._conn.execute("SELECT content FROM blobs WHERE sha256 LIKE ? LIMIT 2", (f"{digest}%",)).fetchall()
+        return rows[0][0] if len(rows) == 1 else None
+
+    def export(self, output_dir, run_number=None, passing=False):
+        """
+        Write artifacts from the store to a directory, named like the converter's outputs without the run prefix.
+
+        :param output_dir: Directory to write to
+        :param run_number: Export this run's artifacts; defaults to the latest artifact of each file and stage
+        :param passing: With the latest artifacts, skip Tekton artifacts that have static validation errors
+        :return: Number of files written
+        """
+        os.makedirs(output_dir, exist_ok=True)
+        rows_by_stage = {}
+        for stage in EXPORT_NAMES:
+            if run_number is not None:
+                rows_by_stage[stage] = self._conn.execute(
+                    "SELECT f.path, s.artifact_sha256 FROM stages s JOIN files f ON f.id = s.file_id "
+                    "WHERE s.run_number = ? AND s.stage = ?", (run_number, stage)).fetchall()
+            else:
+                rows_by_stage[stage] = [(path, digest) for path, _, digest, _, _ in
+                                        self.latest(stage, passing=passing and stage in TEKTON_STAGES)]
+        # Files in subdirectories are named after their path below the directory all of them share
+        directories = {os.path.dirname(path) for rows in rows_by_stage.values() for path, _ in rows
+                       if split_identifier(path)[1] is None}
+        root = os.path.commonpath(sorted(directories)) if directories else None
+        written = 0
+        for stage, pattern in EXPORT_NAMES.items():
+            for path, digest in rows_by_stage[stage]:
+                base = output_name(path, root)
+                with open(os.path.join(output_dir, pattern.format(base=base)), 'w') as output_file:
+                    output_file.write(self.blob(digest))
+                written += 1
+        return written
+
+
+def database_path(results_config, output_dir, base_dir):
+    path = (results_config or {}).get('database') or os.path.join(output_dir, RESULTS_FILENAME)
+    return path if os.path.isabs(path) else os.path.join(base_dir, path)
+
+
+def _time(timestamp):
+    return datetime.fromtimestamp(timestamp).isoformat(timespec='seconds') if timestamp else "-"
+
+
+def _print_rows(header, rows):
+    rows = [[("-" if value is None else str(value)) for value in row] for row in rows]
+    widths = [max(len(str(column)), *(len(row[i]) for row in rows)) if rows else len(str(column))
+              for i, column in enumerate(header)]
+    print("  ".join(str(column).ljust(width) for column, width in zip(header, widths)))
+    for row in rows:
+        print("  ".join(value.ljust(width) for value, width in zip(row, widths)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query and export the conversion results store")
+    parser.add_argument('--database', default=None, help="Results database (default: <output_directory>/results.db)")
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('runs', help="List runs with their file counts")
+    latest = commands.add_parser('latest', help="Latest output per file")
+    latest.add_argument('--stage', default=FINAL_STAGE, choices=sorted(EXPORT_NAMES))
+    latest.add_argument('--passing', action='store_true', help="Only outputs without static validation errors")
+    changed = commands.add_parser('changed', help="Files whose output changed between two runs")
+    changed.add_argument('first_run', type=int)
+    changed.add_argument('second_run', type=int)
+    changed.add_argument('--stage', default=FINAL_STAGE, choices=sorted(EXPORT_NAMES))
+    history = commands.add_parser('history', help="Stage records of a file across runs")
+    history.add_argument('name', help="Part of the Jenkins file's path")
+    findings = commands.add_parser('findings', help="Static validation findings by code")
+    findings.add_argument('--run', type=int, default=None)
+    findings.add_argument('--stage', default=FINAL_STAGE, choices=TEKTON_STAGES)
+    show = commands.add_parser('show', help="Print an artifact or prompt by hash (a unique prefix is enough)")
+    show.add_argument('sha256')
+    export = commands.add_parser('export', help="Write outputs from the store to a directory")
+    export.add_argument('output_dir')
+    which = export.add_mutually_exclusive_group()
+    which.add_argument('--run', type=int, default=None, help="Export one run's outputs")
+    which.add_argument('--latest', action='store_true', help="Export the latest output of every file (default)")
+    export.add_argument('--passing', action='store_true', help="With --latest, only outputs without static validation errors")
+    args = parser.parse_args()
+
+    database = args.database
+    if database is None:
+        import yaml
+        project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        with open(os.path.join(project_root, 'config.yaml'), 'r') as config_file:
+            config = yaml.safe_load(config_file) or {}
+        database = database_path(config.get('results'), config['conversion']['output_directory'], project_root)
+    if not os.path.exists(database):
+        print(f"No results database at {database}", file=sys.stderr)
+        return 1
+    store = ResultsStore(database)
+    try:
+        if args.command == 'runs':
+            _print_rows(("run", "started", "finished", "files", "ok", "file seconds"),
+                        [(run, _time(started), _time(finished), files, ok, seconds)
+                         for run, started, finished, files, ok, seconds in store.runs()])
+        elif args.command == 'latest':
+            _print_rows(("file", "run", "sha256", "errors", "warnings"),
+                        [(path, run, digest[:12], errors, warnings)
+                         for path, run, digest, errors, warnings in store.latest(args.stage, args.passing)])
+        elif args.command == 'changed':
+            _print_rows(("file", f"run {args.first_run}", f"run {args.second_run}"),
+                        [(path, (first or "")[:12] or None, (second or "")[:12] or None)
+                         for path, first, second in store.changed(args.first_run, args.second_run, args.stage)])
+        elif args.command == 'history':
+            _print_rows(("file", "run", "stage", "prompt", "sha256", "errors", "warnings", "seconds"),
+                        [(path, run, stage, prompt, digest[:12], errors, warnings,
+                          round(seconds, 2) if seconds is not None else None)
+                         for path, run, stage, prompt, digest, errors, warnings, seconds in store.history(args.name)])
+        elif args.command == 'findings':
+            _print_rows(("severity", "code", "count", "files"), store.finding_counts(args.run, args.stage))
+        elif args.command == 'show':
+            content = store.blob(args.sha256)
+            if content is None:
+                print(f"No unique artifact with hash {args.sha256}", file=sys.stderr)
+                return 1
+            print(content)
+        elif args.command == 'export':
+            written = store.export(args.output_dir, run_number=args.run, passing=args.passing)
+            print(f"Wrote {written} files to {args.output_dir}")
+    finally:
+        store.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,102 @@
+import re
+import json
+import hashlib
+
+# Keys whose string values are project-specific literals rather than pipeline structure
+LITERAL_KEYS = ('name', 'credentialsId', 'url', 'branch', 'message', 'channel', 'description')
+# Keys holding environment variable mappings; their values are literals, their names are kept
+ENVIRONMENT_KEYS = ('environment', 'pipeline_environment')
+SCRIPT_KEYS = ('script_content', 'script')
+# Quoted strings in shell scripts without interpolation, e.g. 'my-app' or "https://example.com"
+_QUOTED_LITERAL_RE = re.compile(r"""'([^'$\n]+)'|"([^"$\\\n]+)\"""")
+PLACEHOLDER_FORMAT = "xlit{}"
+_PLACEHOLDER_RE = re.compile(r'\bxlit(\d+)\b')
+# Keys of the Tekton answer whose values must stay valid Kubernetes names after substitution
+NAME_KEYS = ('name',)
+
+
+class _Parameterizer:
+    def __init__(self):
+        self.literals = []
+        self._index = {}
+
+    def placeholder(self, value):
+        if value not in self._index:
+            self._index[value] = len(self.literals)
+            self.literals.append(value)
+        return PLACEHOLDER_FORMAT.format(self._index[value])
+
+    def script(self, text):
+        def replace(match):
+            quote = "'" if match.group(1) is not None else '"'
+            return f"{quote}{self.placeholder(match.group(1) or match.group(2))}{quote}"
+        return _QUOTED_LITERAL_RE.sub(replace, text)
+
+    def walk(self, value, key=None):
+        if isinstance(value, dict):
+            if key in ENVIRONMENT_KEYS:
+                return {k: self.placeholder(v) if isinstance(v, str) and v else self.walk(v) for k, v in value.items()}
+            return {k: self.walk(v, k) for k, v in value.items()}
+        if isinstance(value, list):
+            return [self.walk(item, key) for item in value]
+        if isinstance(value, str) and value:
+            if key in LITERAL_KEYS:
+                return self.placeholder(value)
+            if key in SCRIPT_KEYS:
+                return self.script(value)
+        return value
+
+
+def parameterize(data):
+    """
+    Replace the project-specific literals of a step or stage with placeholders.
+
+    Stage and step names, credential IDs, URLs, branches, messages, environment values
+    and quoted strings in shell scripts become xlit0, xlit1, ... in order of first
+    appearance (equal values share a placeholder). What remains is the structure of the
+    stage, so the same shared-library stage looks the same in every Jenkinsfile.
+
+    :param data: Step or stage JSON (any JSON value)
+    :return: Tuple (template, literals) where literals[i] is the value of placeholder xlit<i>
+    """
+    parameterizer = _Parameterizer()
+    template = parameterizer.walk(data)
+    return template, parameterizer.literals
+
+
+def fingerprint(template):
+    """Stable hash of a parameterized template."""
+    return hashlib.sha256(json.dumps(template, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def substitute(data, literals, name_filter=None):
+    """
+    Put the literals back into a converted template.
+
+    :param data: Parsed answer for the parameterized template
+    :param literals: Literal values from parameterize()
+    :param name_filter: Optional function applied to values substituted into NAME_KEYS,
+                        e.g. to keep step names valid Kubernetes names
+    :return: A copy of data with every placeholder replaced
+    """
+    def replace(text, key):
+        def value(match):
+            index = int(match.group(1))
+            if index >= len(literals):
+                return match.group(0)
+            return literals[index]
+        result = _PLACEHOLDER_RE.sub(value, text)
+        if name_filter is not None and key in NAME_KEYS and result != text:
+            return name_filter(result)
+        return result
+
+    def walk(value, key=None):
+        if isinstance(value, dict):
+            return {walk(k) if isinstance(k, str) else k: walk(v, k) for k, v in value.items()}
+        if isinstance(value, list):
+            return [walk(item, key) for item in value]
+        if isinstance(value, str):
+            return replace(value, key)
+        return value
+
+    return walk(data)
@@ -0,0 +1,163 @@
+import re
+import yaml
+
+FORMAT_JSON = 'json'
+FORMAT_YAML = 'yaml'
+# YAML answers for steps and stages; markdown fences are tolerated because the renderer strips them
+FORMAT_YAML_FRAGMENT = 'yaml-fragment'
+# Suffix of the file a whole-document answer is written to while it streams in
+PARTIAL_SUFFIX = ".partial"
+_JSON_PAIRS = {'{': '}', '[': ']'}
+# First line of a YAML answer: a document marker, a comment, a list item or a mapping key
+_YAML_START_RE = re.compile(r'^(---|#|- |-$|[\w.\-/"\']+\s*:(\s|$))')
+_FENCE = "```"
+
+
+class StreamAbortedError(ValueError):
+    """Raised when a streamed completion can no longer become valid output; the request is retried."""
+
+
+class JsonStreamChecker:
+    """
+    Follows a JSON answer as it streams in.
+
+    Only the structure is tracked: strings, escapes and bracket nesting. That is enough
+    to catch prose or a markdown fence before the JSON, mismatched brackets, raw newlines
+    in strings and text after the value as soon as they arrive. json.loads still checks
+    the complete answer.
+    """
+
+    def __init__(self):
+        self._stack = []
+        self._started = False
+        self._done = False
+        self._in_string = False
+        self._escape = False
+        self.position = 0
+
+    def feed(self, text):
+        """
+        :param text: Next piece of the answer
+        :raises StreamAbortedError: If the answer cannot become valid JSON any more
+        """
+        for char in text:
+            self.position += 1
+            if self._done:
+                if not char.isspace():
+                    raise StreamAbortedError(f"Text after the JSON value at character {self.position}")
+            elif not self._started:
+                if char.isspace():
+                    continue
+                if char not in _JSON_PAIRS:
+                    raise StreamAbortedError(f"Answer starts with {char!r} instead of a JSON object")
+                self._started = True
+                self._stack.append(char)
+            elif self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == '\\':
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                elif char == '\n':
+                    raise StreamAbortedError(f"Unescaped newline in a JSON string at character {self.position}")
+            elif char == '"':
+                self._in_string = True
+            elif char in _JSON_PAIRS:
+                self._stack.append(char)
+            elif char in _JSON_PAIRS.values():
+                if _JSON_PAIRS[self._stack[-1]] != char:
+                    raise StreamAbortedError(f"Mismatched {char!r} at character {self.position}")
+                self._stack.pop()
+                self._done = not self._stack
+
+    def finish(self):
+        """:raises StreamAbortedError: If the answer ended before the JSON value was complete"""
+        if not self._done:
+            raise StreamAbortedError(f"Answer ended inside the JSON value after {self.position} characters")
+
+
+class YamlStreamChecker:
+    """
+    Follows a YAML answer line by line as it streams in.
+
+    Catches prose before the YAML, markdown fences (unless allowed) and tab indentation
+    as soon as the line is complete, and parses each document once its '---' separator
+    (or the end of the answer) arrives.
+    """
+
+    def __init__(self, allow_fences=False):
+        """
+        :param allow_fences: If True, markdown fence lines are skipped instead of rejected
+        """
+        self.allow_fences = allow_fences
+        self._line = ""
+        self._document = []
+        self._started = False
+        self._fences = 0
+        self.lines = 0
+
+    def feed(self, text):
+        """
+        :param text: Next piece of the answer
+        :raises StreamAbortedError: If the answer cannot become valid YAML any more
+        """
+        self._line += text
+        while "\n" in self._line:
+            line, self._line = self._line.split("\n", 1)
+            self._check_line(line)
+
+    def _check_line(self, line):
+        self.lines += 1
+        if self._fences >= 2:
+            return  # Anything after a closed fence is dropped when the fences are stripped
+        if line.lstrip().startswith(_FENCE):
+            if not self.allow_fences:
+                raise StreamAbortedError(f"Markdown fence in the YAML at line {self.lines}")
+            self._fences += 1
+            return
+        if not self._started:
+            if not line.strip():
+                return
+            if not _YAML_START_RE.match(line):
+                raise StreamAbortedError(f"Answer starts with prose instead of YAML: {line[:80]!r}")
+            self._started = True
+        if line.startswith("\t"):
+            raise StreamAbortedError(f"Tab indentation at line {self.lines}")
+        if line.rstrip() == "---":
+            self._parse_document()
+        else:
+            self._document.append(line)
+
+    def _parse_document(self):
+        text = "\n".join(self._document)
+        self._document = []
+        if not text.strip():
+            return
+        try:
+            yaml.safe_load(text)
+        except yaml.YAMLError as e:
+            raise StreamAbortedError(f"YAML document ending at line {self.lines} does not parse: {e}")
+
+    def finish(self):
+        """:raises StreamAbortedError: If the last line or document is not valid"""
+        if self._line:
+            self._check_line(self._line)
+            self._line = ""
+        if not self._started:
+            raise StreamAbortedError("Answer contains no YAML")
+        self._parse_document()
+
+
+def make_stream_checker(output_format):
+    """
+    :param output_format: FORMAT_JSON, FORMAT_YAML, FORMAT_YAML_FRAGMENT or None
+    :return: A checker with feed() and finish(), or None if the output is not checked
+    """
+    if output_format == FORMAT_JSON:
+        return JsonStreamChecker()
+    if output_format == FORMAT_YAML:
+        return YamlStreamChecker()
+    if output_format == FORMAT_YAML_FRAGMENT:
+        return YamlStreamChecker(allow_fences=True)
+    return None
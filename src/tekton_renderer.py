@@ -0,0 +1,926 @@
+"""
+Rule-based renderer from the intermediate pipeline JSON to Tekton YAML.
+
+Known step types (sh, echo, git, checkout, junit, archiveArtifacts, dir, withEnv,
+withCredentials, timeout, retry, sleep, error, cleanWs, docker build/push, ...) and
+stage structure (sequential, nested and parallel stages, when, post) are mapped
+mechanically onto one Task per stage plus a Pipeline that wires them together with
+runAfter, params, a shared workspace and finally tasks.
+
+Steps or stages the rules cannot map become "holes". The caller resolves each hole
+with a small, focused LLM request (prompts/json2tekton_step.txt or
+prompts/json2tekton_stage.txt) and the answers are spliced back in before rendering:
+
+    plan = plan_pipeline(pipeline_json, name)
+    for hole in plan.holes:
+        hole.accept(ask_llm(hole.prompt_name, hole.user_message()))
+    tekton_yaml = plan.render()
+
+With shard=True every stage becomes a stage hole. Large pipelines that the rules
+cannot render can then still be converted one stage (or one parallel branch) at a
+time, concurrently. The results are stitched into one Pipeline with the same runAfter,
+params and workspace wiring.
+"""
+import re
+import json
+import shlex
+import yaml
+from stage_memo import parameterize, substitute, fingerprint
+
+RENDERER_VERSION = "2"
+STEP_PROMPT = "json2tekton_step.txt"
+STAGE_PROMPT = "json2tekton_stage.txt"
+
+TEKTON_API_VERSION = "tekton.dev/v1"
+WORKSPACE = "source"
+WORKSPACE_PATH = "$(workspaces.source.path)"
+PIPELINE_WORKSPACE = "shared-workspace"
+ANNOTATION_PREFIX = "jenkins-tekton-converter"
+DEFAULT_IMAGE = "alpine:3.19"
+GIT_IMAGE = "alpine/git:2.43.0"
+BASH_IMAGE = "bash:5.2"
+KANIKO_IMAGE = "gcr.io/kaniko-project/executor:v1.23.0"
+DIND_IMAGE = "docker:24-dind"
+DOCKER_CLI_IMAGE = "docker:24-cli"
+
+# First command of a shell script -> image that provides it
+COMMAND_IMAGES = {
+    'npm': 'node:20-alpine', 'npx': 'node:20-alpine', 'node': 'node:20-alpine', 'yarn': 'node:20-alpine',
+    'mvn': 'maven:3.9-eclipse-temurin-17', './mvnw': 'maven:3.9-eclipse-temurin-17',
+    'gradle': 'gradle:8.7-jdk17', './gradlew': 'gradle:8.7-jdk17',
+    'python': 'python:3.12-slim', 'python3': 'python:3.12-slim', 'pip': 'python:3.12-slim',
+    'pip3': 'python:3.12-slim', 'pytest': 'python:3.12-slim', 'tox': 'python:3.12-slim',
+    'go': 'golang:1.22', 'make': 'gcc:13', 'gcc': 'gcc:13', 'cmake': 'gcc:13',
+    'docker': DOCKER_CLI_IMAGE, 'kubectl': 'bitnami/kubectl:1.29', 'helm': 'alpine/helm:3.14.0',
+    'oc': 'quay.io/openshift/origin-cli:4.15', 'git': GIT_IMAGE, 'terraform': 'hashicorp/terraform:1.7',
+    'sonar-scanner': 'sonarsource/sonar-scanner-cli:5', 'curl': 'curlimages/curl:8.6.0',
+}
+# Jenkins tools {} entries -> image
+TOOL_IMAGES = {
+    'maven': 'maven:3.9-eclipse-temurin-17', 'jdk': 'eclipse-temurin:17', 'nodejs': 'node:20-alpine',
+    'gradle': 'gradle:8.7-jdk17', 'go': 'golang:1.22', 'python': 'python:3.12-slim',
+}
+DOCKER_BUILD_STEPS = ('docker.build', 'docker.image.push', 'docker.build.push', 'dockerBuild', 'docker_build', 'docker_push')
+# Steps made redundant by the shared workspace
+DROPPED_STEPS = ('stash', 'unstash')
+# Jenkins post condition -> values of $(tasks.status) / $(tasks.<name>.status) it runs on (None = always)
+POST_STATUS = {
+    'always': None, 'cleanup': None,
+    'success': ['Succeeded', 'Completed'],
+    'failure': ['Failed'], 'unsuccessful': ['Failed'],
+}
+TIME_UNITS = {'SECONDS': 1, 'MINUTES': 60, 'HOURS': 3600, 'DAYS': 86400, 'MILLISECONDS': 0.001}
+
+_PARAM_REF_RE = re.compile(r'\$\(params\.([A-Za-z_][A-Za-z0-9_.-]*)\)')
+_FENCE_RE = re.compile(r'^\s*```[a-zA-Z]*\s*\n(.*?)\n\s*```\s*$', re.DOTALL)
+
+
+class UnsupportedPipelineError(ValueError):
+    """Raised when the pipeline JSON cannot be rendered by the rules at all."""
+
+
+class _NeedsLLM(Exception):
+    """Internal: a stage uses a construct that must be handed to the LLM as a whole."""
+
+
+def k8s_name(text, max_length=63):
+    """Turn arbitrary text into a DNS-1123 label."""
+    name = re.sub(r'[^a-z0-9]+', '-', str(text).lower()).strip('-')
+    return name[:max_length].rstrip('-') or 'unnamed'
+
+
+def _unique(name, used, max_length=63):
+    candidate = name
+    index = 2
+    while candidate in used:
+        suffix = f"-{index}"
+        candidate = name[:max_length - len(suffix)].rstrip('-') + suffix
+        index += 1
+    used.add(candidate)
+    return candidate
+
+
+def strip_fences(text):
+    """Remove a surrounding markdown code fence from an LLM answer."""
+    match = _FENCE_RE.match(text)
+    return match.group(1) if match else text
+
+
+def parse_yaml_documents(text):
+    """
+    Parse a (possibly fenced) multi-document YAML answer.
+
+    :return: The non-empty documents
+    :raises ValueError: If the answer is not YAML or contains no mapping
+    """
+    try:
+        documents = [document for document in yaml.safe_load_all(strip_fences(text)) if document is not None]
+    except yaml.YAMLError as e:
+        raise ValueError(f"Answer is not valid YAML: {e}")
+    if not any(isinstance(document, dict) for document in documents):
+        raise ValueError("Answer contains no YAML mapping")
+    return documents
+
+
+class _LiteralDumper(yaml.SafeDumper):
+    pass
+
+
+def _represent_str(dumper, value):
+    if '\n' in value:
+        return dumper.represent_scalar('tag:yaml.org,2002:str', value, style='|')
+    return dumper.represent_scalar('tag:yaml.org,2002:str', value)
+
+
+_LiteralDumper.add_representer(str, _represent_str)
+
+
+def dump_yaml_documents(documents):
+    """Dump a list of dicts as a multi-document YAML string with block-style scripts."""
+    return "---\n".join(
+        yaml.dump(document, Dumper=_LiteralDumper, sort_keys=False, default_flow_style=False, width=1000)
+        for document in documents
+    )
+
+
+def rename_pipeline(tekton_yaml, old_name, new_name):
+    """
+    Rename a converted pipeline and the Tasks named after it, e.g. for a copy of a duplicate Jenkinsfile.
+
+    :param tekton_yaml: Multi-document Tekton YAML
+    :param old_name: Name the pipeline was converted under (a file base name)
+    :param new_name: Name to use instead
+    :return: The renamed YAML, or the input unchanged if it cannot be parsed or has no matching names
+    """
+    old, new = k8s_name(old_name), k8s_name(new_name)
+    try:
+        documents = [document for document in yaml.safe_load_all(strip_fences(tekton_yaml)) if document is not None]
+    except yaml.YAMLError:
+        return tekton_yaml
+
+    def renamed(name):
+        if name == old:
+            return new
+        if isinstance(name, str) and name.startswith(f"{old}-"):
+            return k8s_name(new + name[len(old):])
+        return name
+
+    changed = False
+    for document in documents:
+        metadata = document.get('metadata') if isinstance(document, dict) else None
+        if isinstance(metadata, dict) and renamed(metadata.get('name')) != metadata.get('name'):
+            metadata['name'] = renamed(metadata['name'])
+            changed = True
+        spec = document.get('spec') if isinstance(document, dict) else None
+        if not isinstance(spec, dict):
+            continue
+        for key in ('tasks', 'finally'):
+            for task in spec.get(key) or []:
+                task_ref = task.get('taskRef') if isinstance(task, dict) else None
+                if isinstance(task_ref, dict) and renamed(task_ref.get('name')) != task_ref.get('name'):
+                    task_ref['name'] = renamed(task_ref['name'])
+                    changed = True
+    return dump_yaml_documents(documents) if changed else tekton_yaml
+
+
+class Hole:
+    """A step or stage the rules could not map, to be filled in by the LLM."""
+
+    def __init__(self, kind, payload, hint):
+        """
+        :param kind: 'step' or 'stage'
+        :param payload: The step or stage JSON
+        :param hint: Extra context for the LLM (image, working directory, parameter names)
+        """
+        self.kind = kind
+        self.payload = payload
+        self.hint = dict(hint)
+        if 'pipeline_params' in self.hint:
+            # Only the parameters the step or stage refers to, so the request does not depend on the rest of the file
+            text = json.dumps(payload)
+            self.hint['pipeline_params'] = [p for p in self.hint['pipeline_params'] if re.search(rf'\b{re.escape(p)}\b', text)]
+        # The LLM sees the step or stage with its literals replaced by placeholders, so every
+        # occurrence of a shared-library stage maps to the same request and its answer is reused
+        self.template, self.literals = parameterize({'payload': payload, 'hint': self.hint})
+        self.result = None
+
+    @property
+    def prompt_name(self):
+        return STEP_PROMPT if self.kind == 'step' else STAGE_PROMPT
+
+    @property
+    def fingerprint(self):
+        return fingerprint({'kind': self.kind, **self.template})
+
+    def user_message(self):
+        return (f"Convert this Jenkins pipeline {self.kind} to Tekton:\n"
+                f"{json.dumps(self.template['payload'], indent=2, sort_keys=True)}\n\n"
+                f"Context:\n{json.dumps(self.template['hint'], indent=2, sort_keys=True)}")
+
+    def accept(self, text):
+        """
+        Parse and validate the LLM answer for this hole.
+
+        :param text: Raw completion text
+        :raises ValueError: If the answer does not have the expected shape
+        """
+        try:
+            data = yaml.safe_load(strip_fences(text))
+        except yaml.YAMLError as e:
+            raise ValueError(f"Answer is not valid YAML: {e}")
+        data = substitute(data, self.literals, name_filter=k8s_name)
+        if self.kind == 'step':
+            if isinstance(data, dict):
+                data = [data]
+            _check_steps(data)
+            self.result = data
+        else:
+            if not isinstance(data, dict) or not isinstance(data.get('task'), dict):
+                raise ValueError("Stage answer must be a mapping with a 'task' key")
+            _check_steps((data['task'].get('spec') or {}).get('steps'))
+            when = data.get('when') or []
+            if not isinstance(when, list) or not all(isinstance(w, dict) and 'input' in w for w in when):
+                raise ValueError("Stage answer 'when' must be a list of when expressions")
+            self.result = {'task': data['task'], 'when': when}
+
+
+def _check_steps(steps):
+    if not isinstance(steps, list) or not steps:
+        raise ValueError("Expected a non-empty list of Tekton steps")
+    for step in steps:
+        if not isinstance(step, dict) or not step.get('image') or not (step.get('script') or step.get('command')):
+            raise ValueError(f"Invalid Tekton step: {step!r}")
+
+
+class TaskDraft:
+    """One pipeline task being assembled: its steps (or holes) and pipeline wiring."""
+
+    def __init__(self, name, stage_name):
+        self.name = name
+        self.stage_name = stage_name
+        self.steps = []
+        self.sidecars = []
+        self.run_after = []
+        self.when = []
+        self.timeout = None
+        self.retries = None
+        self.stage_hole = None
+        # Environment inherited from the pipeline or enclosing stages, added to stage-hole steps
+        self.inherited_env = []
+
+    @property
+    def holes(self):
+        holes = [step for step in self.steps if isinstance(step, Hole)]
+        if self.stage_hole is not None:
+            holes.append(self.stage_hole)
+        return holes
+
+
+class RenderPlan:
+    """The pipeline laid out as task drafts, with the holes that still need the LLM."""
+
+    def __init__(self, name):
+        self.name = name
+        self.params = []
+        self.tasks = []
+        self.finally_tasks = []
+        self.annotations = {}
+
+    @property
+    def holes(self):
+        return [hole for task in self.tasks + self.finally_tasks for hole in task.holes]
+
+    def _task_resource_name(self, task):
+        return k8s_name(f"{self.name}-{task.name}")
+
+    def _render_task(self, draft, pipeline_params):
+        if draft.stage_hole is not None:
+            spec = dict(draft.stage_hole.result['task'].get('spec') or {})
+            when = draft.when + draft.stage_hole.result['when']
+            if draft.inherited_env:
+                steps = []
+                for step in spec.get('steps') or []:
+                    step = dict(step)
+                    own = {e.get('name') for e in step.get('env') or [] if isinstance(e, dict)}
+                    step['env'] = [e for e in draft.inherited_env if e['name'] not in own] + list(step.get('env') or [])
+                    steps.append(step)
+                spec['steps'] = steps
+        else:
+            spec = {}
+            when = draft.when
+            used = set()
+            steps = []
+            for step in draft.steps:
+                for rendered in (step.result if isinstance(step, Hole) else [step]):
+                    rendered = dict(rendered)
+                    rendered['name'] = _unique(k8s_name(rendered.get('name') or 'step'), used)
+                    rendered.setdefault('workingDir', WORKSPACE_PATH)
+                    steps.append(rendered)
+            if not steps:
+                steps.append({'name': 'noop', 'image': DEFAULT_IMAGE, 'script': f"echo 'Stage {draft.stage_name} has no steps'"})
+            spec['steps'] = steps
+            if draft.sidecars:
+                spec['sidecars'] = draft.sidecars
+
+        workspaces = [w for w in spec.get('workspaces') or [] if isinstance(w, dict)]
+        if not any(w.get('name') == WORKSPACE for w in workspaces):
+            workspaces.append({'name': WORKSPACE})
+        referenced = sorted(set(_PARAM_REF_RE.findall(json.dumps(spec))))
+        declared = {p.get('name') for p in spec.get('params') or [] if isinstance(p, dict)}
+        params = list(spec.get('params') or []) + [{'name': name, 'type': 'string'} for name in referenced if name not in declared]
+        for name in referenced + _PARAM_REF_RE.findall(json.dumps(when)):
+            if name not in pipeline_params:
+                pipeline_params[name] = {'name': name, 'type': 'string', 'description': 'Added for an LLM-converted step'}
+
+        ordered_spec = {}
+        if params:
+            ordered_spec['params'] = params
+        ordered_spec['workspaces'] = workspaces
+        ordered_spec.update({k: v for k, v in spec.items() if k not in ('params', 'workspaces')})
+        task = {
+            'apiVersion': TEKTON_API_VERSION,
+            'kind': 'Task',
+            'metadata': {
+                'name': self._task_resource_name(draft),
+                'annotations': {f"{ANNOTATION_PREFIX}/jenkins-stage": str(draft.stage_name)},
+            },
+            'spec': ordered_spec,
+        }
+        pipeline_task = {'name': draft.name, 'taskRef': {'name': task['metadata']['name']}}
+        if draft.run_after:
+            pipeline_task['runAfter'] = list(draft.run_after)
+        if when:
+            pipeline_task['when'] = when
+        if params:
+            pipeline_task['params'] = [{'name': p['name'], 'value': f"$(params.{p['name']})"} for p in params]
+        pipeline_task['workspaces'] = [{'name': WORKSPACE, 'workspace': PIPELINE_WORKSPACE}]
+        if draft.timeout:
+            pipeline_task['timeout'] = draft.timeout
+        if draft.retries:
+            pipeline_task['retries'] = draft.retries
+        return task, pipeline_task
+
+    def render(self):
+        """
+        Render the Tasks and the Pipeline as multi-document YAML.
+
+        :return: YAML string
+        :raises ValueError: If a hole has not been resolved
+        """
+        unresolved = [hole for hole in self.holes if hole.result is None]
+        if unresolved:
+            raise ValueError(f"{len(unresolved)} unresolved steps/stages")
+        pipeline_params = {p['name']: p for p in self.params}
+        documents = []
+        tasks = []
+        finally_tasks = []
+        for draft in self.tasks:
+            task, pipeline_task = self._render_task(draft, pipeline_params)
+            documents.append(task)
+            tasks.append(pipeline_task)
+        for draft in self.finally_tasks:
+            task, pipeline_task = self._render_task(draft, pipeline_params)
+            documents.append(task)
+            finally_tasks.append(pipeline_task)
+
+        metadata = {'name': self.name}
+        if self.annotations:
+            metadata['annotations'] = dict(self.annotations)
+        spec = {}
+        if pipeline_params:
+            spec['params'] = list(pipeline_params.values())
+        spec['workspaces'] = [{'name': PIPELINE_WORKSPACE, 'description': 'Source checkout shared by all tasks'}]
+        spec['tasks'] = tasks
+        if finally_tasks:
+            spec['finally'] = finally_tasks
+        documents.append({'apiVersion': TEKTON_API_VERSION, 'kind': 'Pipeline', 'metadata': metadata, 'spec': spec})
+        return dump_yaml_documents(documents)
+
+
+class _StepContext:
+    """Image, working directory and environment inherited by nested steps."""
+
+    def __init__(self, image=None, working_dir=WORKSPACE_PATH, env=None):
+        self.image = image
+        self.working_dir = working_dir
+        self.env = env or []
+
+    def derive(self, working_dir=None, env=None):
+        return _StepContext(self.image, working_dir or self.working_dir, self.env + (env or []))
+
+
+def _first_command(script):
+    for line in script.splitlines():
+        line = line.strip()
+        if not line or line.startswith('#') or line.startswith('set '):
+            continue
+        word = line.split()[0]
+        if '=' in word and not word.startswith('./'):
+            continue
+        return word
+    return None
+
+
+def infer_image(script, default=None):
+    """Pick a container image for a shell script from its first command."""
+    command = _first_command(script or '')
+    if command in COMMAND_IMAGES:
+        return COMMAND_IMAGES[command]
+    return default or DEFAULT_IMAGE
+
+
+def _duration(value, unit='MINUTES'):
+    seconds = float(value) * TIME_UNITS.get(str(unit).upper(), 60)
+    if seconds >= 3600 and seconds % 3600 == 0:
+        return f"{int(seconds // 3600)}h"
+    if seconds >= 60 and seconds % 60 == 0:
+        return f"{int(seconds // 60)}m"
+    return f"{max(1, int(seconds))}s"
+
+
+def _arguments(step):
+    arguments = step.get('arguments')
+    if isinstance(arguments, dict):
+        return arguments
+    if isinstance(arguments, list):
+        return {'args': arguments}
+    if arguments is None:
+        return {}
+    return {'args': [arguments]}
+
+
+def _first_argument(step, *keys):
+    arguments = _arguments(step)
+    for key in keys:
+        if arguments.get(key) is not None:
+            return arguments[key]
+    args = arguments.get('args')
+    if args:
+        return args[0]
+    return None
+
+
+class _PlanBuilder:
+    def __init__(self, data, name, shard=False):
+        self.data = data
+        self.shard = shard
+        self.raw_pipeline_environment = None
+        self.plan = RenderPlan(k8s_name(name) if name else 'generated-pipeline')
+        self.task_names = set()
+        self.param_names = set()
+        self.unmapped = []
+        self.plan.params = self._pipeline_params(data.get('parameters') or [])
+
+    # --- Parameters, environment and expressions ---
+
+    def _pipeline_params(self, parameters):
+        params = []
+        for parameter in parameters:
+            if not isinstance(parameter, dict) or not parameter.get('name'):
+                continue
+            name = str(parameter['name'])
+            entry = {'name': name, 'type': 'string'}
+            kind = str(parameter.get('type', 'string'))
+            default = parameter.get('default_value', parameter.get('defaultValue'))
+            choices = parameter.get('choices')
+            if kind == 'choice' and isinstance(choices, list) and choices:
+                default = choices[0]
+            if isinstance(default, bool):
+                default = 'true' if default else 'false'
+            if default is not None and 'password' not in kind.lower():
+                entry['default'] = str(default)
+            description = parameter.get('description')
+            if choices:
+                description = f"{description or ''} (choices: {', '.join(str(c) for c in choices)})".strip()
+            if description:
+                entry['description'] = str(description)
+            params.append(entry)
+            self.param_names.add(name)
+        return params
+
+    def _add_param(self, name, default=None, description=None):
+        if name in self.param_names:
+            return
+        entry = {'name': name, 'type': 'string'}
+        if default is not None:
+            entry['default'] = default
+        if description:
+            entry['description'] = description
+        self.plan.params.append(entry)
+        self.param_names.add(name)
+
+    def _substitute(self, text):
+        """Rewrite Jenkins ${params.X} / ${env.X} references for Tekton and the shell."""
+        text = str(text)
+        text = re.sub(r'\$\{params\.(\w+)\}', lambda m: f"$(params.{m.group(1)})" if m.group(1) in self.param_names else m.group(0), text)
+        text = re.sub(r'\$\{env\.(\w+)\}', r'${\1}', text)
+        return text
+
+    def _env(self, environment):
+        env = []
+        if not isinstance(environment, dict):
+            return env
+        for name, value in environment.items():
+            if isinstance(value, dict) and value.get('credentials_id'):
+                env.append({'name': name, 'valueFrom': {'secretKeyRef': {'name': k8s_name(value['credentials_id']), 'key': 'secret'}}})
+            elif isinstance(value, (str, int, float, bool)):
+                text = str(value).lower() if isinstance(value, bool) else str(value)
+                text = re.sub(r'\$\{params\.(\w+)\}', r'$(params.\1)', text)
+                text = re.sub(r'\$\{(?:env\.)?(\w+)\}', r'$(\1)', text)
+                env.append({'name': name, 'value': text})
+            else:
+                raise _NeedsLLM(f"environment value for {name}")
+        return env
+
+    def _credential_env(self, bindings):
+        env = []
+        for binding in bindings or []:
+            if not isinstance(binding, dict):
+                continue
+            secret = k8s_name(binding.get('credentialsId', 'credentials'))
+            for variable_key, secret_key in (('usernameVariable', 'username'), ('passwordVariable', 'password'),
+                                             ('variable', 'secret'), ('keyFileVariable', 'ssh-privatekey')):
+                if binding.get(variable_key):
+                    env.append({'name': binding[variable_key], 'valueFrom': {'secretKeyRef': {'name': secret, 'key': secret_key}}})
+        return env
+
+    # --- When conditions ---
+
+    def _when(self, when):
+        if not when:
+            return []
+        if not isinstance(when, dict):
+            raise _NeedsLLM("when condition")
+        condition = when.get('condition')
+        if condition == 'allOf':
+            return [expr for child in when.get('conditions') or [] for expr in self._when(child)]
+        if condition == 'anyOf':
+            children = [self._when(child) for child in when.get('conditions') or []]
+            if len(children) == 1:
+                return children[0]
+            flat = [c[0] for c in children if len(c) == 1]
+            if len(flat) == len(children) and len({(c['input'], c['operator']) for c in flat}) == 1 and flat[0]['operator'] == 'in':
+                return [{'input': flat[0]['input'], 'operator': 'in', 'values': [v for c in flat for v in c['values']]}]
+            raise _NeedsLLM("anyOf condition")
+        if condition == 'not':
+            children = self._when((when.get('conditions') or [None])[0])
+            if len(children) != 1:
+                raise _NeedsLLM("not condition")
+            expr = dict(children[0])
+            expr['operator'] = 'notin' if expr['operator'] == 'in' else 'in'
+            return [expr]
+        if condition == 'branch':
+            pattern = str(when.get('pattern', ''))
+            if not pattern or any(char in pattern for char in '*?['):
+                raise _NeedsLLM("branch pattern")
+            self._add_param('git-branch', description='Branch being built (replaces Jenkins BRANCH_NAME)')
+            return [{'input': '$(params.git-branch)', 'operator': 'in', 'values': [pattern]}]
+        if condition == 'environment':
+            name = when.get('name')
+            if name in self.param_names and when.get('value') is not None:
+                return [{'input': f"$(params.{name})", 'operator': 'in', 'values': [str(when['value'])]}]
+            raise _NeedsLLM("environment condition")
+        if condition == 'expression':
+            return self._expression(str(when.get('expression', '')))
+        raise _NeedsLLM(f"when condition '{condition}'")
+
+    def _expression(self, expression):
+        expression = re.sub(r'^return\s+', '', expression.strip()).strip().rstrip(';')
+        match = re.fullmatch(r'(!\s*)?params\.(\w+)', expression)
+        if match and match.group(2) in self.param_names:
+            return [{'input': f"$(params.{match.group(2)})", 'operator': 'notin' if match.group(1) else 'in', 'values': ['true']}]
+        match = re.fullmatch(r'params\.(\w+)\s*(==|!=)\s*[\'"]([^\'"]*)[\'"]', expression)
+        if match and match.group(1) in self.param_names:
+            return [{'input': f"$(params.{match.group(1)})", 'operator': 'in' if match.group(2) == '==' else 'notin', 'values': [match.group(3)]}]
+        raise _NeedsLLM("expression condition")
+
+    # --- Steps ---
+
+    def _shell_step(self, name, script, context, image=None):
+        script = self._substitute(script)
+        step = {
+            'name': name,
+            'image': image or context.image or infer_image(script),
+            'workingDir': context.working_dir,
+        }
+        if context.env:
+            step['env'] = list(context.env)
+        step['script'] = f"#!/bin/sh\nset -e\n{script}" if not script.startswith('#!') else script
+        return step
+
+    def _steps(self, steps, context, draft):
+        rendered = []
+        for step in steps or []:
+            rendered.extend(self._step(step, context, draft))
+        return rendered
+
+    def _step(self, step, context, draft):
+        if not isinstance(step, dict):
+            return [Hole('step', step, self._hint(context))]
+        kind = str(step.get('type', ''))
+        nested = step.get('nested_steps')
+
+        if kind == 'sh' and isinstance(step.get('script_content'), str):
+            result = self._shell_step('sh', step['script_content'], context)
+            if result['image'] == DOCKER_CLI_IMAGE:
+                self._add_dind(draft)
+                result.setdefault('env', []).append({'name': 'DOCKER_HOST', 'value': 'tcp://localhost:2375'})
+            return [result]
+        if kind == 'script' and isinstance(nested, list):
+            return self._steps(nested, context, draft)
+        if kind == 'echo':
+            message = _first_argument(step, 'message')
+            if message is None:
+                message = step.get('script_content', '')
+            return [self._shell_step('echo', f"echo {shlex.quote(self._substitute(message))}", context, image=DEFAULT_IMAGE)]
+        if kind == 'git':
+            url = _first_argument(step, 'url')
+            if not url:
+                return [Hole('step', step, self._hint(context))]
+            branch = _arguments(step).get('branch')
+            clone = f"git clone --depth 1 {'--branch ' + shlex.quote(str(branch)) + ' ' if branch else ''}{shlex.quote(self._substitute(url))} ."
+            return [self._shell_step('git-clone', f"find . -mindepth 1 -delete\n{clone}", context, image=GIT_IMAGE)]
+        if kind == 'checkout':
+            self._add_param('git-url', description='Repository URL (replaces Jenkins checkout scm)')
+            self._add_param('git-revision', default='main', description='Revision to check out')
+            script = ("find . -mindepth 1 -delete\n"
+                      "git clone $(params.git-url) .\n"
+                      "git checkout $(params.git-revision)")
+            return [self._shell_step('checkout', script, context, image=GIT_IMAGE)]
+        if kind in ('junit', 'archiveArtifacts'):
+            pattern = _first_argument(step, 'testResults' if kind == 'junit' else 'artifacts')
+            if not pattern:
+                return [Hole('step', step, self._hint(context))]
+            target = f"{WORKSPACE_PATH}/.jenkins-artifacts/{'test-reports' if kind == 'junit' else 'artifacts'}"
+            script = (f"#!/usr/bin/env bash\nset -e\nshopt -s globstar nullglob\n"
+                      f"mkdir -p {target}\n"
+                      f"files=({' '.join(str(self._substitute(p)) for p in str(pattern).split(','))})\n"
+                      f"if [ ${{#files[@]}} -eq 0 ]; then echo 'No files matched {kind} pattern'; exit 1; fi\n"
+                      f"for f in \"${{files[@]}}\"; do mkdir -p \"{target}/$(dirname \"$f\")\"; cp \"$f\" \"{target}/$f\"; done")
+            return [self._shell_step(k8s_name(kind), script, context, image=BASH_IMAGE)]
+        if kind in DROPPED_STEPS:
+            return []
+        if kind == 'dir' and isinstance(nested, list):
+            path = _first_argument(step, 'path')
+            working_dir = f"{context.working_dir}/{self._substitute(path)}" if path else context.working_dir
+            return self._steps(nested, context.derive(working_dir=working_dir), draft)
+        if kind == 'withEnv' and isinstance(nested, list):
+            variables = _first_argument(step, 'variables') or []
+            env = []
+            for item in variables if isinstance(variables, list) else [variables]:
+                if not isinstance(item, str) or '=' not in item:
+                    return [Hole('step', step, self._hint(context))]
+                name, value = item.split('=', 1)
+                env.append({'name': name, 'value': self._substitute(value)})
+            return self._steps(nested, context.derive(env=env), draft)
+        if kind == 'withCredentials' and isinstance(nested, list):
+            return self._steps(nested, context.derive(env=self._credential_env(step.get('credentials_used'))), draft)
+        if kind == 'timeout' and isinstance(nested, list):
+            arguments = _arguments(step)
+            time_value = _first_argument(step, 'time')
+            if time_value is not None:
+                draft.timeout = _duration(time_value, arguments.get('unit', 'MINUTES'))
+            return self._steps(nested, context, draft)
+        if kind == 'retry' and isinstance(nested, list):
+            count = _first_argument(step, 'count')
+            if isinstance(count, int):
+                draft.retries = max(draft.retries or 0, count - 1)
+            return self._steps(nested, context, draft)
+        if kind == 'sleep':
+            time_value = _first_argument(step, 'time')
+            if isinstance(time_value, (int, float)):
+                seconds = int(float(time_value) * TIME_UNITS.get(str(_arguments(step).get('unit', 'SECONDS')).upper(), 1))
+                return [self._shell_step('sleep', f"sleep {seconds}", context, image=DEFAULT_IMAGE)]
+        if kind == 'error':
+            message = _first_argument(step, 'message') or 'Pipeline error'
+            return [self._shell_step('error', f"echo {shlex.quote(self._substitute(message))} >&2\nexit 1", context, image=DEFAULT_IMAGE)]
+        if kind in ('cleanWs', 'deleteDir'):
+            return [self._shell_step('clean-workspace', "find . -mindepth 1 -delete", context, image=DEFAULT_IMAGE)]
+        if kind in DOCKER_BUILD_STEPS:
+            image = _first_argument(step, 'image', 'name', 'tag', 'destination')
+            if image:
+                arguments = _arguments(step)
+                build_context = context.working_dir
+                if arguments.get('context') not in (None, '.'):
+                    build_context = f"{build_context}/{arguments['context']}"
+                step_result = {
+                    'name': 'build-and-push',
+                    'image': KANIKO_IMAGE,
+                    'workingDir': context.working_dir,
+                    'command': ['/kaniko/executor'],
+                    'args': [
+                        f"--dockerfile={arguments.get('dockerfile', 'Dockerfile')}",
+                        f"--context={build_context}",
+                        f"--destination={self._substitute(image)}",
+                    ],
+                }
+                if context.env:
+                    step_result['env'] = list(context.env)
+                return [step_result]
+        return [Hole('step', step, self._hint(context))]
+
+    def _add_dind(self, draft):
+        if any(sidecar.get('name') == 'dind' for sidecar in draft.sidecars):
+            return
+        draft.sidecars.append({
+            'name': 'dind',
+            'image': DIND_IMAGE,
+            'securityContext': {'privileged': True},
+            'env': [{'name': 'DOCKER_TLS_CERTDIR', 'value': ''}],
+        })
+
+    def _hint(self, context):
+        hint = {'image': context.image or DEFAULT_IMAGE, 'workingDir': context.working_dir}
+        if context.env:
+            hint['env'] = [e['name'] for e in context.env]
+        if self.param_names:
+            hint['pipeline_params'] = sorted(self.param_names)
+        return hint
+
+    # --- Stages ---
+
+    def _agent_image(self, agent, fallback):
+        if isinstance(agent, dict) and agent.get('type') == 'docker' and agent.get('image'):
+            return self._substitute(agent['image'])
+        return fallback
+
+    def _tools_image(self, tools):
+        for tool in (tools or {}):
+            if tool in TOOL_IMAGES:
+                return TOOL_IMAGES[tool]
+        return None
+
+    def _new_draft(self, stage_name):
+        return TaskDraft(_unique(k8s_name(stage_name), self.task_names), stage_name)
+
+    def _stage_payload(self, stage, inherited_raw):
+        """The stage JSON sent to the LLM, carrying conditions and environment of enclosing groups."""
+        payload = {key: value for key, value in stage.items() if key != 'post'}  # post becomes finally tasks
+        if inherited_raw and inherited_raw.get('environment'):
+            payload['environment'] = {**inherited_raw['environment'], **(stage.get('environment') or {})}
+        if inherited_raw and inherited_raw.get('when'):
+            conditions = inherited_raw['when'] + ([stage['when']] if stage.get('when') else [])
+            payload['when'] = conditions[0] if len(conditions) == 1 else {'condition': 'allOf', 'conditions': conditions}
+        return payload
+
+    def _stage_hint(self, image):
+        hint = {'pipeline_params': sorted(self.param_names), 'image': image or DEFAULT_IMAGE}
+        if self.raw_pipeline_environment:
+            hint['pipeline_environment'] = self.raw_pipeline_environment
+        return hint
+
+    def _stage(self, stage, run_after, image, env, inherited_when, inherited_raw=None):
+        if not isinstance(stage, dict):
+            raise UnsupportedPipelineError("Stage is not an object")
+        name = stage.get('name') or f"stage-{len(self.plan.tasks) + 1}"
+        stage_image = self._agent_image(stage.get('agent'), image) or self._tools_image(stage.get('tools'))
+
+        if isinstance(stage.get('parallel'), list) or isinstance(stage.get('stages'), list):
+            raw = inherited_raw
+            try:
+                when = inherited_when + self._when(stage.get('when'))
+                stage_env = env + self._env(stage.get('environment'))
+            except _NeedsLLM as e:
+                if not self.shard:
+                    raise UnsupportedPipelineError(f"Stage group '{name}' uses {e}")
+                # Hand the group's conditions and environment to each of its stages
+                when, stage_env = inherited_when, env
+                raw = raw or {'when': [], 'environment': {}}
+                raw = {
+                    'when': raw['when'] + ([stage['when']] if stage.get('when') else []),
+                    'environment': {**raw['environment'], **(stage.get('environment') or {})},
+                }
+            if isinstance(stage.get('parallel'), list):
+                tails = []
+                for child in stage['parallel']:
+                    tails.extend(self._stage(child, run_after, stage_image, stage_env, when, raw))
+                return tails
+            tails = run_after
+            for child in stage['stages']:
+                tails = self._stage(child, tails, stage_image, stage_env, when, raw)
+            return tails
+
+        draft = self._new_draft(name)
+        draft.run_after = list(run_after)
+        try:
+            if self.shard:
+                raise _NeedsLLM("sharded conversion")
+            unknown = set(stage) - {'name', 'agent', 'environment', 'tools', 'when', 'steps', 'post', 'options', 'failFast'}
+            if unknown:
+                raise _NeedsLLM(f"stage directives {sorted(unknown)}")
+            draft.when = inherited_when + self._when(stage.get('when'))
+            context = _StepContext(stage_image, env=env + self._env(stage.get('environment')))
+            draft.steps = self._steps(stage.get('steps'), context, draft)
+            for option in stage.get('options') or []:
+                self._task_option(option, draft)
+        except _NeedsLLM:
+            draft.steps = []
+            draft.sidecars = []
+            draft.when = list(inherited_when)
+            draft.inherited_env = list(env)
+            draft.stage_hole = Hole('stage', self._stage_payload(stage, inherited_raw), self._stage_hint(stage_image))
+        self.plan.tasks.append(draft)
+        self._post(stage.get('post'), context_image=stage_image, env=env, task_name=draft.name)
+        return [draft.name]
+
+    def _task_option(self, option, draft):
+        if not isinstance(option, dict):
+            return
+        if option.get('type') == 'timeout':
+            arguments = _arguments(option)
+            time_value = _first_argument(option, 'time')
+            if time_value is not None:
+                draft.timeout = _duration(time_value, arguments.get('unit', 'MINUTES'))
+        elif option.get('type') == 'retry':
+            count = _first_argument(option, 'count')
+            if isinstance(count, int):
+                draft.retries = count - 1
+
+    def _post(self, post, context_image, env, task_name=None):
+        if not isinstance(post, dict):
+            return
+        for condition, steps in post.items():
+            if condition not in POST_STATUS:
+                self.unmapped.append(f"post.{condition}" if task_name is None else f"{task_name}.post.{condition}")
+                continue
+            draft = self._new_draft(f"{task_name}-post-{condition}" if task_name else f"post-{condition}")
+            draft.stage_name = f"post {condition}" if task_name is None else f"{task_name} post {condition}"
+            context = _StepContext(context_image, env=list(env))
+            try:
+                draft.steps = self._steps(steps, context, draft)
+            except _NeedsLLM:
+                draft.steps = [Hole('step', step, self._hint(context)) for step in steps or []]
+            statuses = POST_STATUS[condition]
+            if statuses:
+                status_ref = f"$(tasks.{task_name}.status)" if task_name else "$(tasks.status)"
+                draft.when = [{'input': status_ref, 'operator': 'in', 'values': statuses}]
+            self.plan.finally_tasks.append(draft)
+
+    def build(self):
+        stages = self.data.get('stages')
+        if not isinstance(stages, list) or not stages:
+            raise UnsupportedPipelineError("Pipeline JSON has no stages list")
+        try:
+            env = self._env(self.data.get('environment'))
+        except _NeedsLLM as e:
+            if not self.shard:
+                raise UnsupportedPipelineError(f"Pipeline environment uses {e}")
+            env = []
+            self.raw_pipeline_environment = self.data.get('environment')
+        image = self._agent_image(self.data.get('agent'), None) or self._tools_image(self.data.get('tools'))
+
+        tails = []
+        for stage in stages:
+            tails = self._stage(stage, tails, image, env, [])
+        self._post(self.data.get('post'), context_image=image, env=env)
+
+        for option in self.data.get('options') or []:
+            if isinstance(option, dict) and option.get('type') == 'timeout':
+                time_value = _first_argument(option, 'time')
+                if time_value is not None:
+                    self.plan.annotations[f"{ANNOTATION_PREFIX}/pipelinerun-timeout"] = _duration(time_value, _arguments(option).get('unit', 'MINUTES'))
+            elif isinstance(option, dict):
+                self.unmapped.append(f"options.{option.get('type')}")
+        for trigger in self.data.get('triggers') or []:
+            if isinstance(trigger, dict):
+                self.unmapped.append(f"triggers.{trigger.get('type')}")
+        if self.unmapped:
+            self.plan.annotations[f"{ANNOTATION_PREFIX}/unmapped"] = ', '.join(self.unmapped)
+        return self.plan
+
+
+def count_stages(data):
+    """
+    Count the leaf stages of a pipeline JSON document, including nested and parallel ones.
+
+    :param data: Parsed intermediate pipeline JSON
+    :return: Number of stages that would become tasks
+    """
+    def count(stages):
+        total = 0
+        for stage in stages if isinstance(stages, list) else []:
+            if not isinstance(stage, dict):
+                continue
+            if isinstance(stage.get('parallel'), list):
+                total += count(stage['parallel'])
+            elif isinstance(stage.get('stages'), list):
+                total += count(stage['stages'])
+            else:
+                total += 1
+        return total
+    return count(data.get('stages')) if isinstance(data, dict) else 0
+
+
+def plan_pipeline(data, name=None, shard=False):
+    """
+    Lay out a pipeline JSON document as Tekton tasks.
+
+    :param data: Parsed intermediate pipeline JSON (dict)
+    :param name: Pipeline name, e.g. the Jenkinsfile base name
+    :param shard: If True, send every stage to the LLM as its own hole instead of applying the step rules
+    :return: RenderPlan whose holes must be resolved before render()
+    :raises UnsupportedPipelineError: If the JSON does not have a renderable structure
+    """
+    if not isinstance(data, dict):
+        raise UnsupportedPipelineError("Pipeline JSON is not an object")
+    return _PlanBuilder(data, name, shard=shard).build()
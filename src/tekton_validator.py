@@ -0,0 +1,509 @@
+"""
+Static validation of generated Tekton YAML.
+
+Checks the things a cluster would reject or a run would trip over, without an LLM:
+
+- the YAML parses (a markdown fence around it counts as a parse error)
+- every document is a tekton.dev/v1 Pipeline or Task with the v1 field set
+- pipeline task names are unique, runAfter/result references point at existing
+  tasks and the runAfter graph has no cycles
+- params, workspaces and results referenced with $(...) are declared, and tasks
+  defined in the same file are passed the params and workspaces they require
+- step names are unique DNS-1123 labels and step images are valid references
+
+Findings carry a severity: errors make the pipeline invalid, warnings are reported
+but do not gate the LLM fix passes.
+"""
+import re
+import json
+import yaml
+
+VALIDATOR_VERSION = "3"
+
+SEVERITY_ERROR = "error"
+SEVERITY_WARNING = "warning"
+
+TEKTON_API_VERSION = "tekton.dev/v1"
+
+PIPELINE_SPEC_FIELDS = {'displayName', 'description', 'params', 'workspaces', 'tasks', 'finally', 'results'}
+PIPELINE_TASK_FIELDS = {'name', 'displayName', 'description', 'taskRef', 'taskSpec', 'pipelineRef', 'pipelineSpec',
+                        'runAfter', 'when', 'params', 'matrix', 'workspaces', 'timeout', 'retries', 'onError'}
+TASK_SPEC_FIELDS = {'displayName', 'description', 'params', 'workspaces', 'results', 'steps', 'sidecars', 'volumes',
+                    'stepTemplate'}
+# An embedded taskSpec may also carry metadata and the apiVersion/kind of a custom task
+EMBEDDED_TASK_SPEC_FIELDS = TASK_SPEC_FIELDS | {'metadata', 'apiVersion', 'kind', 'spec'}
+STEP_FIELDS = {'name', 'displayName', 'image', 'command', 'args', 'workingDir', 'env', 'envFrom', 'script',
+               'computeResources', 'volumeMounts', 'volumeDevices', 'imagePullPolicy', 'securityContext', 'timeout',
+               'workspaces', 'onError', 'stdoutConfig', 'stderrConfig', 'ref', 'params', 'results', 'when'}
+PARAM_SPEC_FIELDS = {'name', 'type', 'description', 'default', 'properties', 'enum'}
+PARAM_TYPES = {'string', 'array', 'object'}
+TASK_WORKSPACE_FIELDS = {'name', 'description', 'mountPath', 'readOnly', 'optional'}
+PIPELINE_WORKSPACE_FIELDS = {'name', 'description', 'optional'}
+WORKSPACE_BINDING_FIELDS = {'name', 'workspace', 'subPath'}
+WHEN_FIELDS = {'input', 'operator', 'values', 'cel'}
+WHEN_OPERATORS = {'in', 'notin'}
+# Fields that moved or disappeared between v1beta1 and v1
+V1BETA1_HINTS = {'resources': "use 'computeResources' (v1) instead of 'resources'"}
+
+_DNS1123_LABEL_RE = re.compile(r'^[a-z0-9]([-a-z0-9]*[a-z0-9])?$')
+_PARAM_NAME_RE = re.compile(r'^[a-zA-Z_][a-zA-Z0-9_.-]*$')
+_IMAGE_RE = re.compile(
+    r'^(?:[a-zA-Z0-9.-]+(?::[0-9]+)?/)?[a-z0-9]+(?:[._-]+[a-z0-9]+)*(?:/[a-z0-9]+(?:[._-]+[a-z0-9]+)*)*'
+    r'(?::[\w][\w.-]{0,127})?(?:@sha256:[a-f0-9]{64})?$'
+)
+_VARIABLE_RE = re.compile(r'\$\(([^()]*)\)')
+
+
+class Finding:
+    """One problem found in a Tekton document."""
+
+    def __init__(self, severity, code, path, message):
+        """
+        :param severity: SEVERITY_ERROR or SEVERITY_WARNING
+        :param code: Short machine-readable identifier, e.g. 'dangling-run-after'
+        :param path: Location, e.g. 'Pipeline/build.spec.tasks[1].runAfter'
+        :param message: Human-readable description
+        """
+        self.severity = severity
+        self.code = code
+        self.path = path
+        self.message = message
+
+    def to_dict(self):
+        return {'severity': self.severity, 'code': self.code, 'path': self.path, 'message': self.message}
+
+    def __str__(self):
+        return f"[{self.severity}] {self.code} at {self.path}: {self.message}"
+
+
+class ValidationReport:
+    """The findings for one Tekton YAML file."""
+
+    def __init__(self, findings=None, documents=0):
+        self.findings = findings or []
+        self.documents = documents
+
+    @property
+    def errors(self):
+        return [f for f in self.findings if f.severity == SEVERITY_ERROR]
+
+    @property
+    def warnings(self):
+        return [f for f in self.findings if f.severity == SEVERITY_WARNING]
+
+    @property
+    def ok(self):
+        """True if there are no errors (warnings are allowed)."""
+        return not self.errors
+
+    def to_dict(self):
+        return {
+            'valid': self.ok,
+            'documents': self.documents,
+            'errors': len(self.errors),
+            'warnings': len(self.warnings),
+            'findings': [f.to_dict() for f in self.findings],
+        }
+
+    def to_json(self):
+        return json.dumps(self.to_dict(), indent=2)
+
+    def to_text(self):
+        """Render the report as a short markdown list for the validation log."""
+        header = (f"Static validation: {'passed' if self.ok else 'failed'} "
+                  f"({len(self.errors)} errors, {len(self.warnings)} warnings, {self.documents} documents)")
+        return "\n".join([header] + [f"- {finding}" for finding in self.findings])
+
+
+def fix_request_message(tekton_content, report):
+    """
+    Build the user message asking the LLM to fix only the errors the static validator found.
+
+    :param tekton_content: The Tekton YAML that failed validation
+    :param report: Its ValidationReport
+    :return: User message content
+    """
+    findings = "\n".join(f"- {finding}" for finding in report.errors)
+    return (f"Static validation found these problems in the Tekton pipeline YAML below. "
+            f"Fix exactly these problems and keep everything else unchanged.\n\n"
+            f"Findings:\n{findings}\n\n```yaml\n{tekton_content}\n```")
+
+
+class _Validator:
+    def __init__(self):
+        self.findings = []
+        self.tasks_by_name = {}
+
+    def error(self, code, path, message):
+        self.findings.append(Finding(SEVERITY_ERROR, code, path, message))
+
+    def warning(self, code, path, message):
+        self.findings.append(Finding(SEVERITY_WARNING, code, path, message))
+
+    # --- Generic helpers ---
+
+    def _mapping(self, value, path, required=True):
+        if isinstance(value, dict):
+            return value
+        if value is not None or required:
+            self.error('schema', path, f"expected a mapping, got {type(value).__name__}")
+        return None
+
+    def _list(self, value, path):
+        if value is None:
+            return []
+        if not isinstance(value, list):
+            self.error('schema', path, f"expected a list, got {type(value).__name__}")
+            return []
+        return value
+
+    def _fields(self, value, allowed, path):
+        for key in value:
+            if key not in allowed:
+                hint = V1BETA1_HINTS.get(key)
+                self.error('unknown-field', f"{path}.{key}", hint or f"field '{key}' is not part of the Tekton v1 schema")
+
+    def _named_list(self, items, allowed, path, what):
+        """Validate a list of {name: ...} mappings and return {name: item}."""
+        named = {}
+        for index, item in enumerate(self._list(items, path)):
+            item_path = f"{path}[{index}]"
+            if self._mapping(item, item_path) is None:
+                continue
+            self._fields(item, allowed, item_path)
+            name = item.get('name')
+            if not isinstance(name, str) or not name:
+                self.error('missing-name', item_path, f"{what} has no name")
+                continue
+            if name in named:
+                self.error('duplicate-name', item_path, f"duplicate {what} '{name}'")
+            named[name] = item
+        return named
+
+    @staticmethod
+    def _variables(value):
+        """Yield every $(...) variable expression inside a value."""
+        if isinstance(value, str):
+            for match in _VARIABLE_RE.finditer(value):
+                yield match.group(1).strip()
+        elif isinstance(value, dict):
+            for item in value.values():
+                yield from _Validator._variables(item)
+        elif isinstance(value, list):
+            for item in value:
+                yield from _Validator._variables(item)
+
+    @staticmethod
+    def _reference_name(expression, prefix):
+        """Return the first name after prefix in an expression like params.x or params['x']."""
+        rest = expression[len(prefix):]
+        match = re.match(r'\.([A-Za-z0-9_-]+)|\[[\'"]([^\'"]+)[\'"]\]', rest)
+        if not match:
+            return None
+        return match.group(1) or match.group(2)
+
+    def _check_name(self, name, path, what):
+        if not isinstance(name, str) or not _DNS1123_LABEL_RE.match(name) or len(name) > 63:
+            self.error('invalid-name', path, f"{what} '{name}' is not a valid DNS-1123 label")
+
+    # --- Params ---
+
+    def _param_specs(self, params, path):
+        specs = self._named_list(params, PARAM_SPEC_FIELDS, path, 'param')
+        for name, spec in specs.items():
+            if not _PARAM_NAME_RE.match(name):
+                self.error('invalid-param-name', path, f"param name '{name}' is not valid")
+            param_type = spec.get('type', 'string')
+            if param_type not in PARAM_TYPES:
+                self.error('invalid-param-type', path, f"param '{name}' has unknown type '{param_type}'")
+        return specs
+
+    # --- Tasks ---
+
+    def _task_spec(self, spec, path, propagated_params=(), embedded=False):
+        """Validate a Task spec (standalone or embedded) and return its declared params, workspaces and results."""
+        self._fields(spec, EMBEDDED_TASK_SPEC_FIELDS if embedded else TASK_SPEC_FIELDS, path)
+        params = self._param_specs(spec.get('params'), f"{path}.params")
+        workspaces = self._named_list(spec.get('workspaces'), TASK_WORKSPACE_FIELDS, f"{path}.workspaces", 'workspace')
+        results = self._named_list(spec.get('results'), {'name', 'type', 'description', 'properties'}, f"{path}.results", 'result')
+
+        steps = self._list(spec.get('steps'), f"{path}.steps")
+        if not steps:
+            self.error('missing-steps', f"{path}.steps", "a Task needs at least one step")
+        step_names = set()
+        for index, step in enumerate(steps):
+            self._step(step, f"{path}.steps[{index}]", step_names)
+        for index, sidecar in enumerate(self._list(spec.get('sidecars'), f"{path}.sidecars")):
+            if self._mapping(sidecar, f"{path}.sidecars[{index}]") is not None:
+                self._image(sidecar.get('image'), f"{path}.sidecars[{index}].image")
+
+        declared_params = set(params) | set(propagated_params)
+        for expression in self._variables({k: spec.get(k) for k in ('steps', 'sidecars', 'volumes', 'stepTemplate')}):
+            if expression.startswith('params'):
+                name = self._reference_name(expression, 'params')
+                if name and name not in declared_params:
+                    self.error('undeclared-param', path, f"$({expression}) refers to param '{name}' that is not declared")
+            elif expression.startswith('inputs.params'):
+                self.error('v1beta1-variable', path, f"$({expression}) uses the removed inputs.params syntax; use $(params.*)")
+            elif expression.startswith('workspaces'):
+                name = self._reference_name(expression, 'workspaces')
+                if name and name not in workspaces:
+                    self.error('undeclared-workspace', path, f"$({expression}) refers to workspace '{name}' that is not declared")
+            elif expression.startswith('results'):
+                name = self._reference_name(expression, 'results')
+                if name and name not in results:
+                    self.error('undeclared-result', path, f"$({expression}) refers to result '{name}' that is not declared")
+        return params, workspaces, results
+
+    def _step(self, step, path, step_names):
+        if self._mapping(step, path) is None:
+            return
+        self._fields(step, STEP_FIELDS, path)
+        name = step.get('name')
+        if name is not None:
+            self._check_name(name, f"{path}.name", 'step name')
+            if name in step_names:
+                self.error('duplicate-name', f"{path}.name", f"duplicate step name '{name}'")
+            step_names.add(name)
+        if step.get('ref') is None:
+            if not step.get('image'):
+                self.error('missing-image', path, "step has no image")
+            else:
+                self._image(step['image'], f"{path}.image")
+            if step.get('script') is None and step.get('command') is None:
+                self.error('missing-command', path, "step has neither script nor command")
+        if step.get('script') is not None and step.get('command') is not None:
+            self.error('script-and-command', path, "step cannot set both script and command")
+
+    def _image(self, image, path):
+        if not isinstance(image, str) or not image.strip():
+            self.error('invalid-image', path, "image is empty")
+            return
+        if '$(' in image:
+            return
+        if not _IMAGE_RE.match(image):
+            self.error('invalid-image', path, f"'{image}' is not a valid image reference")
+            return
+        last = image.rsplit('/', 1)[-1]
+        if ':' not in last and '@' not in last:
+            self.warning('untagged-image', path, f"'{image}' has no tag; pin a version")
+        elif last.split('@')[0].endswith(':latest'):
+            self.warning('latest-image', path, f"'{image}' uses the latest tag; pin a version")
+
+    # --- Pipelines ---
+
+    def _pipeline_task(self, task, path, params, workspaces, task_names, is_finally):
+        self._fields(task, PIPELINE_TASK_FIELDS, path)
+        name = task.get('name')
+        self._check_name(name, f"{path}.name", 'pipeline task name')
+        refs = [key for key in ('taskRef', 'taskSpec', 'pipelineRef', 'pipelineSpec') if task.get(key) is not None]
+        if len(refs) != 1:
+            self.error('task-reference', path, f"exactly one of taskRef or taskSpec is required, found {refs or 'none'}")
+
+        if is_finally and task.get('runAfter'):
+            self.error('finally-run-after', f"{path}.runAfter", "finally tasks cannot use runAfter")
+        for dependency in self._list(task.get('runAfter'), f"{path}.runAfter"):
+            if dependency not in task_names:
+                self.error('dangling-run-after', f"{path}.runAfter", f"runAfter refers to unknown task '{dependency}'")
+
+        for index, when in enumerate(self._list(task.get('when'), f"{path}.when")):
+            when_path = f"{path}.when[{index}]"
+            if self._mapping(when, when_path) is None:
+                continue
+            self._fields(when, WHEN_FIELDS, when_path)
+            if 'cel' not in when:
+                if when.get('operator') not in WHEN_OPERATORS:
+                    self.error('invalid-when', when_path, f"operator must be one of {sorted(WHEN_OPERATORS)}")
+                if not isinstance(when.get('values'), list) or not when.get('values'):
+                    self.error('invalid-when', when_path, "when expression needs a non-empty values list")
+
+        passed_params = self._named_list(task.get('params'), {'name', 'value'}, f"{path}.params", 'param')
+        bindings = self._named_list(task.get('workspaces'), WORKSPACE_BINDING_FIELDS, f"{path}.workspaces", 'workspace binding')
+        for binding_name, binding in bindings.items():
+            if binding.get('workspace') and binding['workspace'] not in workspaces:
+                self.error('undeclared-workspace', f"{path}.workspaces",
+                           f"binding '{binding_name}' uses pipeline workspace '{binding['workspace']}' that is not declared")
+
+        # Resolve the task definition to check the params and workspaces it needs and the results it declares
+        task_params = task_workspaces = task_results = None
+        embedded = isinstance(task.get('taskSpec'), dict)
+        if embedded:
+            spec = task['taskSpec'].get('spec') if isinstance(task['taskSpec'].get('spec'), dict) else task['taskSpec']
+            task_params, task_workspaces, task_results = self._task_spec(spec, f"{path}.taskSpec", propagated_params=params, embedded=True)
+        elif isinstance(task.get('taskRef'), dict):
+            ref_name = task['taskRef'].get('name')
+            if ref_name in self.tasks_by_name:
+                task_params, task_workspaces, task_results = self.tasks_by_name[ref_name]
+        if task_params is not None:
+            for param_name, spec in task_params.items():
+                propagated = embedded and param_name in params
+                if 'default' not in spec and param_name not in passed_params and not propagated:
+                    self.error('missing-param', f"{path}.params", f"task requires param '{param_name}' which is not passed")
+            if not embedded:
+                for param_name in passed_params:
+                    if param_name not in task_params:
+                        self.warning('extra-param', f"{path}.params", f"param '{param_name}' is not declared by task '{task['taskRef'].get('name')}'")
+        if task_workspaces is not None:
+            for workspace_name, spec in task_workspaces.items():
+                if not spec.get('optional') and workspace_name not in bindings:
+                    self.error('missing-workspace', f"{path}.workspaces", f"task requires workspace '{workspace_name}' which is not bound")
+            for binding_name in bindings:
+                if binding_name not in task_workspaces:
+                    self.error('undeclared-workspace', f"{path}.workspaces", f"task does not declare workspace '{binding_name}'")
+
+        # Variables evaluated at the pipeline level (the embedded taskSpec is checked above)
+        outer = {k: v for k, v in task.items() if k not in ('taskSpec', 'pipelineSpec')}
+        dependencies = set()
+        result_references = []
+        for expression in self._variables(outer):
+            if expression.startswith('params'):
+                param_name = self._reference_name(expression, 'params')
+                if param_name and param_name not in params:
+                    self.error('undeclared-param', path, f"$({expression}) refers to pipeline param '{param_name}' that is not declared")
+            elif expression.startswith('tasks.'):
+                parts = expression.split('.')
+                referenced = parts[1]
+                if referenced == 'status':
+                    if not is_finally:
+                        self.error('invalid-task-status', path, "$(tasks.status) is only available in finally tasks")
+                    continue
+                if referenced not in task_names:
+                    self.error('dangling-task-reference', path, f"$({expression}) refers to unknown task '{referenced}'")
+                elif len(parts) > 2 and parts[2] == 'results':
+                    dependencies.add(referenced)
+                    result_references.append((expression, referenced, path))
+                elif len(parts) > 2 and parts[2] == 'status' and not is_finally:
+                    self.error('invalid-task-status', path, f"$({expression}) is only available in finally tasks")
+        return name, dependencies, task_results, result_references
+
+    def _check_result_reference(self, expression, referenced, declared_results, path):
+        """Report $(tasks.X.results.Y) when task X is defined in the file and does not declare result Y."""
+        results = declared_results.get(referenced)
+        name = self._reference_name(expression, f"tasks.{referenced}.results")
+        if results is not None and name and name not in results:
+            self.error('undeclared-result', path,
+                       f"$({expression}) refers to result '{name}' that task '{referenced}' does not declare")
+
+    def _pipeline(self, spec, path):
+        self._fields(spec, PIPELINE_SPEC_FIELDS, path)
+        params = self._param_specs(spec.get('params'), f"{path}.params")
+        workspaces = self._named_list(spec.get('workspaces'), PIPELINE_WORKSPACE_FIELDS, f"{path}.workspaces", 'workspace')
+        tasks = self._list(spec.get('tasks'), f"{path}.tasks")
+        finally_tasks = self._list(spec.get('finally'), f"{path}.finally")
+        if not tasks:
+            self.error('missing-tasks', f"{path}.tasks", "a Pipeline needs at least one task")
+
+        task_names = {task.get('name') for task in tasks if isinstance(task, dict)}
+        all_names = set()
+        graph = {}
+        # Results declared by each pipeline task, checked once every task is known
+        declared_results = {}
+        result_references = []
+        for section, items, is_finally in (('tasks', tasks, False), ('finally', finally_tasks, True)):
+            for index, task in enumerate(items):
+                task_path = f"{path}.{section}[{index}]"
+                if self._mapping(task, task_path) is None:
+                    continue
+                name = task.get('name')
+                if name in all_names:
+                    self.error('duplicate-name', f"{task_path}.name", f"duplicate pipeline task name '{name}'")
+                all_names.add(name)
+                name, dependencies, results, references = self._pipeline_task(task, task_path, params, workspaces,
+                                                                             task_names, is_finally)
+                declared_results[name] = results
+                result_references.extend(references)
+                if not is_finally:
+                    run_after = task.get('runAfter') if isinstance(task.get('runAfter'), list) else []
+                    graph[name] = {d for d in run_after if d in task_names} | dependencies
+        self._check_cycles(graph, f"{path}.tasks")
+        for expression, referenced, reference_path in result_references:
+            self._check_result_reference(expression, referenced, declared_results, reference_path)
+
+        for index, result in enumerate(self._list(spec.get('results'), f"{path}.results")):
+            result_path = f"{path}.results[{index}]"
+            if self._mapping(result, result_path) is None:
+                continue
+            if 'value' not in result:
+                self.error('schema', result_path, "pipeline result needs a value")
+            for expression in self._variables(result.get('value')):
+                if not expression.startswith('tasks.'):
+                    continue
+                parts = expression.split('.')
+                if parts[1] not in all_names:
+                    self.error('dangling-task-reference', result_path, f"$({expression}) refers to an unknown task")
+                elif len(parts) > 2 and parts[2] == 'results':
+                    self._check_result_reference(expression, parts[1], declared_results, result_path)
+
+    def _check_cycles(self, graph, path):
+        visiting, done = set(), set()
+
+        def visit(node, trail):
+            if node in done:
+                return
+            if node in visiting:
+                cycle = trail[trail.index(node):] + [node]
+                self.error('run-after-cycle', path, f"runAfter cycle: {' -> '.join(cycle)}")
+                return
+            visiting.add(node)
+            for dependency in sorted(graph.get(node, ())):
+                visit(dependency, trail + [node])
+            visiting.discard(node)
+            done.add(node)
+
+        for node in sorted(graph, key=str):
+            visit(node, [])
+
+    # --- Documents ---
+
+    def validate(self, documents):
+        resources = []
+        for index, document in enumerate(documents):
+            if document is None:
+                continue
+            path = f"document[{index}]"
+            if self._mapping(document, path) is None:
+                continue
+            api_version = document.get('apiVersion')
+            kind = document.get('kind')
+            metadata = document.get('metadata') if isinstance(document.get('metadata'), dict) else {}
+            name = metadata.get('name')
+            path = f"{kind or 'document'}/{name or index}"
+            if kind not in ('Pipeline', 'Task'):
+                # Other resources (a PersistentVolumeClaim, a Triggers resource) have their own API groups
+                self.warning('unchecked-kind', path, f"kind '{kind}' is not checked by the static validator")
+                continue
+            if api_version != TEKTON_API_VERSION:
+                self.error('api-version', f"{path}.apiVersion", f"apiVersion must be {TEKTON_API_VERSION}, got '{api_version}'")
+            if not metadata.get('name'):
+                self.error('missing-name', f"{path}.metadata", "metadata.name is required")
+            else:
+                self._check_name(name, f"{path}.metadata.name", f"{kind} name")
+            spec = self._mapping(document.get('spec'), f"{path}.spec")
+            if spec is not None:
+                resources.append((kind, path, spec, name))
+
+        # Tasks first, so pipelines in the same file can be checked against them
+        for kind, path, spec, name in resources:
+            if kind == 'Task':
+                self.tasks_by_name[name] = self._task_spec(spec, f"{path}.spec")
+        for kind, path, spec, name in resources:
+            if kind == 'Pipeline':
+                self._pipeline(spec, f"{path}.spec")
+        if not resources:
+            self.error('no-resources', 'document', "no Tekton Pipeline or Task found")
+        return self.findings
+
+
+def validate_tekton_yaml(content):
+    """
+    Statically validate Tekton YAML.
+
+    :param content: YAML text, possibly several documents separated by ---
+    :return: ValidationReport
+    """
+    try:
+        documents = list(yaml.safe_load_all(content or ''))
+    except yaml.YAMLError as e:
+        return ValidationReport([Finding(SEVERITY_ERROR, 'yaml-parse', 'document', str(e).replace('\n', ' '))])
+    findings = _Validator().validate(documents)
+    return ValidationReport(findings, documents=sum(1 for document in documents if document is not None))
@@ -0,0 +1,309 @@
+"""
+Shared work queue for running several converter processes on one run.
+
+Workers (`converter.py --worker`, on one host or on several hosts that share the queue
+database's filesystem) take files from a SQLite queue one lease at a time. A lease is
+renewed by a heartbeat while the worker is alive; when a worker crashes its leases
+expire and the files are handed to the next worker that asks. Every stage a worker
+finishes is checkpointed on the item, so the next lease resumes at the first unfinished
+stage, reading the earlier stages' outputs from the shared output directory.
+
+The first worker to start creates the run (taking the next run number) and queues the
+files; workers started while the run is unfinished join it, so restarting the workers
+resumes an interrupted run.
+"""
+import os
+import time
+import uuid
+import socket
+import sqlite3
+import logging
+import threading
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+STATUS_PENDING = 'pending'
+STATUS_LEASED = 'leased'
+STATUS_DONE = 'done'
+STATUS_FAILED = 'failed'
+DEFAULT_DATABASE = "work_queue.db"
+DEFAULT_LEASE_SECONDS = 300
+DEFAULT_HEARTBEAT_SECONDS = 30
+DEFAULT_MAX_ATTEMPTS = 3
+DEFAULT_POLL_INTERVAL_SECONDS = 5
+DEFAULT_FILES_IN_FLIGHT = 16
+# A lock file older than this was left behind by a crashed process
+LOCK_STALE_SECONDS = 60
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_number INTEGER PRIMARY KEY,
+    input_dir TEXT,
+    created REAL NOT NULL,
+    finished REAL
+);
+CREATE TABLE IF NOT EXISTS items (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    run_number INTEGER NOT NULL,
+    file TEXT NOT NULL,
+    status TEXT NOT NULL,
+    stages_done TEXT NOT NULL DEFAULT '',
+    worker TEXT,
+    lease_expires REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    updated REAL NOT NULL,
+    UNIQUE (run_number, file)
+);
+CREATE INDEX IF NOT EXISTS items_by_status ON items (run_number, status);
+"""
+
+
+@contextmanager
+def file_lock(path, timeout=30.0, stale_seconds=LOCK_STALE_SECONDS):
+    """
+    Hold an exclusive lock on a file between processes, also across hosts on a shared filesystem.
+
+    The lock is a '<path>.lock' file created with O_EXCL.
+
+    :param path: The file to lock
+    :param timeout: Seconds to wait for the lock
+    :param stale_seconds: A lock file older than this is removed as abandoned
+    :raises TimeoutError: If the lock could not be taken in time
+    """
+    lock_path = path + ".lock"
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            lock_fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            break
+        except FileExistsError:
+            try:
+                if time.time() - os.path.getmtime(lock_path) > stale_seconds:
+                    logger.warning(f"Removing stale lock file {lock_path}")
+                    os.remove(lock_path)
+                    continue
+            except OSError:
+                continue  # Released meanwhile
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"Timed out waiting for lock {lock_path}")
+            time.sleep(0.05)
+    try:
+        os.write(lock_fd, f"{socket.gethostname()} {os.getpid()}\n".encode())
+        os.close(lock_fd)
+        yield
+    finally:
+        try:
+            os.remove(lock_path)
+        except OSError:
+            pass
+
+
+class WorkItem:
+    """One leased file: its queue ID, path, the stages already finished and the attempt number."""
+
+    def __init__(self, item_id, file, stages_done, attempt):
+        self.id = item_id
+        self.file = file
+        self.stages_done = stages_done
+        self.attempt = attempt
+
+
+class WorkQueue:
+    """SQLite-backed queue of a run's files with leases, heartbeats and stage checkpoints."""
+
+    def __init__(self, path, lease_seconds=DEFAULT_LEASE_SECONDS, heartbeat_seconds=DEFAULT_HEARTBEAT_SECONDS,
+                 max_attempts=DEFAULT_MAX_ATTEMPTS, poll_interval=DEFAULT_POLL_INTERVAL_SECONDS,
+                 files_in_flight=DEFAULT_FILES_IN_FLIGHT, worker_id=None):
+        """
+        :param path: Path of the SQLite database; every worker of a run must use the same file
+        :param lease_seconds: How long a lease lasts without a heartbeat
+        :param heartbeat_seconds: How often a live worker renews its leases
+        :param max_attempts: Leases per file before it is marked failed (a crashing file does not loop forever)
+        :param poll_interval: Seconds to wait while other workers still hold the remaining files
+        :param files_in_flight: Files this worker converts at the same time
+        :param worker_id: Name of this worker in the queue; defaults to host, PID and a random suffix
+        """
+        self.path = path
+        self.lease_seconds = float(lease_seconds)
+        self.heartbeat_seconds = float(heartbeat_seconds)
+        self.max_attempts = max(1, int(max_attempts))
+        self.poll_interval = float(poll_interval)
+        self.files_in_flight = max(1, int(files_in_flight))
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self.run_number = None
+        self.created_run = False
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = self._connect()
+        self._conn.executescript(_SCHEMA)
+        self._stop = threading.Event()
+        self._heartbeat = None
+
+    @classmethod
+    def from_config(cls, queue_config, base_dir, path=None):
+        """
+        :param queue_config: The 'queue' section of config.yaml (may be None)
+        :param base_dir: Directory a relative database path is resolved against
+        :param path: Optional database path overriding the config
+        """
+        queue_config = queue_config or {}
+        path = path or queue_config.get('database') or DEFAULT_DATABASE
+        if not os.path.isabs(path):
+            path = os.path.join(base_dir, path)
+        return cls(
+            path,
+            lease_seconds=queue_config.get('lease_seconds', DEFAULT_LEASE_SECONDS),
+            heartbeat_seconds=queue_config.get('heartbeat_seconds', DEFAULT_HEARTBEAT_SECONDS),
+            max_attempts=queue_config.get('max_attempts', DEFAULT_MAX_ATTEMPTS),
+            poll_interval=queue_config.get('poll_interval_seconds', DEFAULT_POLL_INTERVAL_SECONDS),
+            files_in_flight=queue_config.get('files_in_flight', DEFAULT_FILES_IN_FLIGHT),
+        )
+
+    def _connect(self):
+        # Rollback journal rather than WAL: WAL needs shared memory, which network filesystems do not provide
+        connection = sqlite3.connect(self.path, timeout=60, isolation_level=None, check_same_thread=False)
+        connection.execute("PRAGMA busy_timeout = 60000")
+        return connection
+
+    @contextmanager
+    def _transaction(self):
+        """A write transaction; BEGIN IMMEDIATE serializes it with every other worker's."""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._conn
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def open_run(self, jenkins_files, new_run_number, input_dir=None):
+        """
+        Join the unfinished run, or create a new run with the given files.
+
+        :param jenkins_files: Files to queue if a new run is created
+        :param new_run_number: Callable returning the next run number; only called when a run is created
+        :param input_dir: Input directory, recorded with a new run
+        :return: The run number
+        """
+        with self._transaction() as conn:
+            row = conn.execute("SELECT run_number FROM runs WHERE finished IS NULL "
+                               "ORDER BY run_number DESC LIMIT 1").fetchone()
+            if row is not None:
+                self.run_number = row[0]
+                self.created_run = False
+            else:
+                self.run_number = new_run_number()
+                now = time.time()
+                conn.execute("INSERT INTO runs (run_number, input_dir, created) VALUES (?, ?, ?)",
+                             (self.run_number, input_dir, now))
+                conn.executemany("INSERT OR IGNORE INTO items (run_number, file, status, updated) VALUES (?, ?, ?, ?)",
+                                 [(self.run_number, os.path.abspath(path), STATUS_PENDING, now) for path in jenkins_files])
+                self.created_run = True
+        action = "Created" if self.created_run else "Joined"
+        logger.info(f"{action} run {self.run_number} in work queue {self.path} as worker {self.worker_id}")
+        return self.run_number
+
+    def _requeue_expired(self, conn, now):
+        expired = conn.execute("SELECT id, file, worker, attempts FROM items "
+                               "WHERE run_number = ? AND status = ? AND lease_expires < ?",
+                               (self.run_number, STATUS_LEASED, now)).fetchall()
+        for item_id, file, worker, attempts in expired:
+            status = STATUS_FAILED if attempts >= self.max_attempts else STATUS_PENDING
+            conn.execute("UPDATE items SET status = ?, worker = NULL, lease_expires = NULL, error = ?, updated = ? "
+                         "WHERE id = ?", (status, f"Lease of worker {worker} expired", now, item_id))
+            logger.warning(f"Lease of {file} by worker {worker} expired after attempt {attempts}; "
+                           f"{'giving up' if status == STATUS_FAILED else 're-queued'}")
+
+    def lease(self):
+        """
+        Lease the next pending file of the run, re-queuing files whose leases expired first.
+
+        :return: WorkItem, or None if no file is pending
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            self._requeue_expired(conn, now)
+            row = conn.execute("SELECT id, file, stages_done, attempts FROM items WHERE run_number = ? AND status = ? "
+                               "ORDER BY id LIMIT 1", (self.run_number, STATUS_PENDING)).fetchone()
+            if row is None:
+                return None
+            item_id, file, stages_done, attempts = row
+            conn.execute("UPDATE items SET status = ?, worker = ?, lease_expires = ?, attempts = ?, updated = ? "
+                         "WHERE id = ?", (STATUS_LEASED, self.worker_id, now + self.lease_seconds, attempts + 1, now, item_id))
+        return WorkItem(item_id, file, [stage for stage in stages_done.split(',') if stage], attempts + 1)
+
+    def checkpoint(self, item, stage):
+        """Record that a stage of a leased file is finished and renew the lease."""
+        if stage not in item.stages_done:
+            item.stages_done.append(stage)
+        now = time.time()
+        with self._transaction() as conn:
+            updated = conn.execute("UPDATE items SET stages_done = ?, lease_expires = ?, updated = ? "
+                                   "WHERE id = ? AND worker = ? AND status = ?",
+                                   (",".join(item.stages_done), now + self.lease_seconds, now, item.id,
+                                    self.worker_id, STATUS_LEASED)).rowcount
+        if not updated:
+            logger.warning(f"Lost the lease of {item.file}; another worker may be converting it too")
+
+    def complete(self, item, ok, error=None):
+        """Mark a leased file done, or failed if its chain did not complete."""
+        with self._transaction() as conn:
+            conn.execute("UPDATE items SET status = ?, worker = NULL, lease_expires = NULL, error = ?, updated = ? "
+                         "WHERE id = ? AND worker = ?",
+                         (STATUS_DONE if ok else STATUS_FAILED, error, time.time(), item.id, self.worker_id))
+
+    def finish_if_idle(self):
+        """
+        Mark the run finished once no file is pending or leased.
+
+        :return: True if the run is finished, False while other workers still hold files
+        """
+        with self._transaction() as conn:
+            self._requeue_expired(conn, time.time())
+            outstanding = conn.execute("SELECT COUNT(*) FROM items WHERE run_number = ? AND status IN (?, ?)",
+                                       (self.run_number, STATUS_PENDING, STATUS_LEASED)).fetchone()[0]
+            if outstanding:
+                return False
+            conn.execute("UPDATE runs SET finished = ? WHERE run_number = ? AND finished IS NULL",
+                         (time.time(), self.run_number))
+        return True
+
+    def counts(self):
+        """Number of the run's files per status."""
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) FROM items WHERE run_number = ? GROUP BY status",
+                                      (self.run_number,)).fetchall()
+        return dict(rows)
+
+    def start_heartbeat(self):
+        """Renew this worker's leases every heartbeat_seconds from a background thread."""
+        def beat():
+            connection = self._connect()
+            try:
+                while not self._stop.wait(self.heartbeat_seconds):
+                    now = time.time()
+                    try:
+                        connection.execute("UPDATE items SET lease_expires = ?, updated = ? WHERE worker = ? AND status = ?",
+                                           (now + self.lease_seconds, now, self.worker_id, STATUS_LEASED))
+                    except sqlite3.Error as e:
+                        logger.warning(f"Work queue heartbeat failed: {e}")
+            finally:
+                connection.close()
+
+        self._heartbeat = threading.Thread(target=beat, name="work-queue-heartbeat", daemon=True)
+        self._heartbeat.start()
+
+    def stop_heartbeat(self):
+        self._stop.set()
+        if self._heartbeat is not None:
+            self._heartbeat.join()
+            self._heartbeat = None
+
+    def close(self):
+        self.stop_heartbeat()
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,150 @@
+"""
+JSON Patch (RFC 6902) answers for the validation passes.
+
+Instead of regenerating the whole Tekton YAML, the validate and fix passes answer with
+a list of JSON Patch operations against the parsed YAML, which are applied here. The
+YAML's documents are addressed by their index, so "/0/spec/tasks/1/runAfter" is the
+runAfter of the second task in the first document. An empty patch means the pass found
+nothing to change, which is what the convergence loop stops on. YAML that does not
+parse cannot be patched; for it the answer carries the whole fixed YAML instead.
+"""
+import copy
+import json
+import yaml
+
+from tekton_renderer import dump_yaml_documents
+
+# Prompts asking for a patch instead of the full YAML
+VALIDATE_PATCH_PROMPT = "validate_tekton_patch.txt"
+FIX_PATCH_PROMPT = "fix_tekton_patch.txt"
+PATCH_OPERATIONS = ('add', 'remove', 'replace', 'move', 'copy', 'test')
+
+
+class PatchError(ValueError):
+    """Raised when a patch is malformed or does not apply to the YAML."""
+
+
+def _tokens(pointer):
+    if pointer == "":
+        return []
+    if not isinstance(pointer, str) or not pointer.startswith("/"):
+        raise PatchError(f"Invalid JSON pointer {pointer!r}")
+    return [token.replace("~1", "/").replace("~0", "~") for token in pointer[1:].split("/")]
+
+
+def _index(container, token, pointer, allow_end=False):
+    if token == "-" and allow_end:
+        return len(container)
+    if not token.isdigit() or (len(token) > 1 and token.startswith("0")):
+        raise PatchError(f"Invalid list index {token!r} in {pointer}")
+    index = int(token)
+    if index > len(container) or (index == len(container) and not allow_end):
+        raise PatchError(f"List index {index} out of range in {pointer}")
+    return index
+
+
+def _resolve(document, pointer):
+    """Return (parent, token) of the location a pointer names."""
+    tokens = _tokens(pointer)
+    if not tokens:
+        raise PatchError("Operations on the whole YAML are not supported")
+    parent = document
+    for token in tokens[:-1]:
+        if isinstance(parent, list):
+            parent = parent[_index(parent, token, pointer)]
+        elif isinstance(parent, dict) and token in parent:
+            parent = parent[token]
+        else:
+            raise PatchError(f"Path {pointer} does not exist")
+    return parent, tokens[-1]
+
+
+def _get(document, pointer):
+    parent, token = _resolve(document, pointer)
+    if isinstance(parent, list):
+        return parent[_index(parent, token, pointer)]
+    if isinstance(parent, dict) and token in parent:
+        return parent[token]
+    raise PatchError(f"Path {pointer} does not exist")
+
+
+def _add(document, pointer, value):
+    parent, token = _resolve(document, pointer)
+    if isinstance(parent, list):
+        parent.insert(_index(parent, token, pointer, allow_end=True), value)
+    elif isinstance(parent, dict):
+        parent[token] = value
+    else:
+        raise PatchError(f"Cannot add below a scalar at {pointer}")
+
+
+def _remove(document, pointer):
+    parent, token = _resolve(document, pointer)
+    if isinstance(parent, list):
+        return parent.pop(_index(parent, token, pointer))
+    if isinstance(parent, dict) and token in parent:
+        return parent.pop(token)
+    raise PatchError(f"Path {pointer} does not exist")
+
+
+def apply_patch(documents, operations):
+    """
+    Apply JSON Patch operations to a list of YAML documents.
+
+    :param documents: Parsed YAML documents (not modified)
+    :param operations: List of JSON Patch operations
+    :return: The patched documents
+    :raises PatchError: If an operation is malformed, does not apply or a test fails
+    """
+    documents = copy.deepcopy(documents)
+    for number, operation in enumerate(operations, 1):
+        if not isinstance(operation, dict) or operation.get('op') not in PATCH_OPERATIONS:
+            raise PatchError(f"Operation {number} is not a JSON Patch operation: {operation!r}")
+        op, path = operation['op'], operation.get('path')
+        if op in ('add', 'replace', 'test') and 'value' not in operation:
+            raise PatchError(f"Operation {number} ({op} {path}) has no value")
+        if op == 'add':
+            _add(documents, path, copy.deepcopy(operation['value']))
+        elif op == 'remove':
+            _remove(documents, path)
+        elif op == 'replace':
+            _get(documents, path)
+            parent, token = _resolve(documents, path)
+            if isinstance(parent, list):
+                parent[_index(parent, token, path)] = copy.deepcopy(operation['value'])
+            else:
+                parent[token] = copy.deepcopy(operation['value'])
+        elif op == 'move':
+            _add(documents, path, _remove(documents, operation.get('from')))
+        elif op == 'copy':
+            _add(documents, path, copy.deepcopy(_get(documents, operation.get('from'))))
+        elif _get(documents, path) != operation['value']:
+            raise PatchError(f"Operation {number}: test of {path} failed")
+    return documents
+
+
+def apply_patch_response(tekton_content, response_content):
+    """
+    Apply a validation pass's patch answer to the YAML it was asked about.
+
+    :param tekton_content: The Tekton YAML sent to the pass
+    :param response_content: JSON answer with 'validation_report' and 'patch' (or 'fixed_tekton_yaml')
+    :return: Tuple (validation_report, patched YAML); the YAML is returned unchanged for an empty patch
+    :raises ValueError: If the answer is not such a JSON object or the patch does not apply
+    """
+    result = json.loads(response_content)
+    if not isinstance(result, dict):
+        raise PatchError("Answer is not a JSON object")
+    validation_report = result.get('validation_report') or 'Validation report missing in response.'
+    replacement = result.get('fixed_tekton_yaml')
+    if isinstance(replacement, str) and replacement.strip() and not result.get('patch'):
+        return validation_report, replacement
+    if not isinstance(result.get('patch'), list):
+        raise PatchError("Answer has no 'patch' list")
+    if not result['patch']:
+        return validation_report, tekton_content
+    try:
+        documents = [document for document in yaml.safe_load_all(tekton_content) if document is not None]
+    except yaml.YAMLError as e:
+        raise PatchError(f"The YAML to patch does not parse: {e}")
+    return validation_report, dump_yaml_documents(apply_patch(documents, result['patch']))